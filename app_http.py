@@ -1,12 +1,25 @@
-from flask import Flask, render_template, jsonify, request
+from flask import Flask, Response, render_template, jsonify, request
 import threading
 import time
+import copy
 import logging
+import math
 import os
 import re
+import sys
 from datetime import datetime, timezone, timedelta
 from stock_filter import StockFilter
 from smart_analyzer import SmartAnalyzer
+from strategies import MultiStrategyRunner, STRATEGIES, build_indicator_panel, screen_chen_xiaoqun, format_chen_stats
+from job_manager import JobManager, JobCancelled, RunCoordinator
+from cancellation import OperationCancelled
+from continuous_scanner import ContinuousScanner
+from fan_out import fan_out, STEP_OK
+from quote_snapshot import QuoteSnapshot, QUOTE_FIELDS
+from symbol_index import SymbolIndex
+from trading_calendar import TradingCalendar
+from event_stream import ConsoleWriter, EventPublisher, diff_stocks
+from state_store import create_store, StoreLog, CancelSignals, LeaderTask, WorkerRegistry
 
 # 设置时区为北京时间（东八区）
 BEIJING_TZ = timezone(timedelta(hours=8))
@@ -42,10 +55,34 @@ from werkzeug.serving import WSGIRequestHandler
 # 直接将custom_log_request函数赋值给WSGIRequestHandler.log_request
 WSGIRequestHandler.log_request = custom_log_request
 
-console_output_buffer = []
+# 共享状态存储：任务状态、查询历史、控制台输出、SSE事件和后台任务记录保存在这里，
+# 多个worker进程看到同一份状态。默认使用 data_cache/app_state.db，可通过 STATE_STORE 改为 redis:// 或 memory://
+state_store = create_store()
+# 停止请求写入存储，由正在执行任务的worker取消本地令牌
+cancel_signals = CancelSignals(state_store)
+# worker进程心跳：识别已退出的worker，并定期检查只在一个worker中运行的后台任务（自动刷新、连续扫描）
+worker_registry = WorkerRegistry(state_store)
 
-# 历史查询记录
-query_history = []
+# 控制台输出：固定容量、带序号的日志，客户端按序号游标只取新行
+console_output_buffer = StoreLog(state_store, 'console', capacity=int(os.environ.get('CONSOLE_BUFFER_SIZE', 1000)))
+
+# SSE事件发布者：进度变化、日志行和结果差异推送给所有 /api/stream 连接，任一worker发布的事件所有连接都能收到
+event_publisher = EventPublisher(
+    buffer=StoreLog(state_store, 'events', capacity=int(os.environ.get('SSE_BUFFER_SIZE', 1000)))
+)
+# 控制台输出先进入内存缓冲区，由后台线程批量写入存储并发布 'log' 事件，print 不等待存储写入
+console_writer = ConsoleWriter(console_output_buffer, event_publisher)
+
+def append_console_output(line):
+    """
+    写入一行控制台输出，HTTP访问日志和空行在写入时过滤
+    :param line: 输出内容（以换行结尾）
+    """
+    if '"GET' in line or '"POST' in line:
+        return
+    if line.strip() == '':
+        return
+    console_writer.write(line)
 
 # 股票代码校验规则
 STOCK_CODE_PATTERNS = {
@@ -79,31 +116,28 @@ def validate_stock_code(stock_code):
     
     return True, None
 
+# 个股分析中每个数据源的超时（秒），超时的数据源使用默认值，不再等待
+ANALYZE_STEP_TIMEOUT = float(os.environ.get('ANALYZE_STEP_TIMEOUT', 8))
+
+# 批量行情接口一次最多查询的股票数
+MAX_QUOTE_CODES = int(os.environ.get('MAX_QUOTE_CODES', 500))
+
 def add_to_query_history(stock_code):
     """
     添加到历史查询记录
     :param stock_code: 股票代码
     """
-    global query_history
-    
-    # 检查是否已存在，存在则移除旧记录
-    for i, item in enumerate(query_history):
-        if item['code'] == stock_code:
-            query_history.pop(i)
-            break
-    
-    # 添加新记录
+    # 添加新记录，已存在的旧记录移除
     new_record = {
         'code': stock_code,
         'timestamp': time.strftime('%Y-%m-%d %H:%M:%S')
     }
-    query_history.insert(0, new_record)
-    
     # 保持最多20条记录
-    if len(query_history) > 20:
-        query_history = query_history[:20]
+    state_store.update('query_history',
+                       lambda history: ([new_record] + [item for item in history if item['code'] != stock_code])[:20],
+                       [])
 
-task_status = {
+DEFAULT_TASK_STATUS = {
     'manual_refresh': {
         'running': False,
         'status': 'idle',
@@ -116,16 +150,137 @@ task_status = {
         'running': False,
         'enabled': False,
         'interval': 300,
-        'last_run': None
+        'last_run': None,
+        'session': None,
+        'next_run': None
     },
-    'analyze_stock': {
-        'running': False,
-        'status': 'idle',
-        'result': None,
-        'error': None
-    }
+    # 手动刷新和自动刷新共用 manual_refresh，按worker记录进行中的刷新调用方数，
+    # 最后一个结束的刷新才把 running 置为False；worker退出后它的计数被清除
+    'active_refreshes': {}
 }
 
+def get_task_status():
+    """读取共享的任务状态"""
+    return state_store.get('task_status', copy.deepcopy(DEFAULT_TASK_STATUS))
+
+def update_task_status(func):
+    """
+    原子地修改共享的任务状态
+    :param func: 接收状态字典并就地修改
+    :return: 修改后的状态
+    """
+    def apply(status):
+        func(status)
+        return status
+    return state_store.update('task_status', apply, copy.deepcopy(DEFAULT_TASK_STATUS))
+
+def refresh_counts(status):
+    """各worker进程中进行的刷新调用方数 {worker标识: 数量}"""
+    counts = status.get('active_refreshes')
+    return dict(counts) if isinstance(counts, dict) else {}
+
+def reset_stale_status():
+    """
+    服务启动时（没有其他存活的worker）清除上次运行遗留的运行中状态（进程被终止时刷新来不及写入结束状态）
+    """
+    def apply(status):
+        status['active_refreshes'] = {}
+        status['manual_refresh']['running'] = False
+        status['auto_refresh']['running'] = False
+        status['auto_refresh']['enabled'] = False
+
+    update_task_status(apply)
+    # 连续扫描同样在重启后保持停止
+    state_store.delete('continuous_scan')
+
+def clear_dead_workers(workers):
+    """
+    去掉已退出的worker登记的刷新，其他worker继续运行时不影响它们进行中的刷新
+    :param workers: 已退出的worker标识
+    """
+    def apply(status):
+        counts = refresh_counts(status)
+        if any(worker in counts for worker in workers):
+            for worker in workers:
+                counts.pop(worker, None)
+            status['active_refreshes'] = counts
+            status['manual_refresh']['running'] = bool(counts)
+
+    publish_status(update_task_status(apply))
+
+def status_payload(status=None):
+    """
+    刷新状态（不含结果列表，结果通过 stocks 事件按差异推送）
+    :param status: 任务状态，默认读取共享状态
+    """
+    status = status or get_task_status()
+    manual = {key: value for key, value in status['manual_refresh'].items() if key != 'stocks'}
+    return {'manual_refresh': manual, 'auto_refresh': dict(status['auto_refresh'])}
+
+def publish_status(status=None, previous_stocks=None):
+    """
+    推送刷新状态
+    :param status: 任务状态，默认读取共享状态
+    :param previous_stocks: 修改前的结果列表，结果列表被替换时传入，推送差异
+    """
+    status = status or get_task_status()
+    event_publisher.publish('status', status_payload(status))
+    if previous_stocks is not None:
+        event_publisher.publish('stocks', diff_stocks(previous_stocks, status['manual_refresh']['stocks']))
+
+def apply_refresh_fields(fields, active_delta=0):
+    """
+    修改刷新状态并推送
+    :param fields: 写入 manual_refresh 的字段
+    :param active_delta: 刷新调用方计数的变化
+    """
+    previous = {}
+
+    def apply(status):
+        previous['stocks'] = status['manual_refresh']['stocks']
+        counts = refresh_counts(status)
+        count = max(counts.get(worker_registry.id, 0) + active_delta, 0)
+        if count:
+            counts[worker_registry.id] = count
+        else:
+            counts.pop(worker_registry.id, None)
+        status['active_refreshes'] = counts
+        status['manual_refresh'].update(fields)
+        if active_delta:
+            status['manual_refresh']['running'] = bool(counts)
+
+    status = update_task_status(apply)
+    publish_status(status, previous['stocks'] if 'stocks' in fields else None)
+
+def begin_refresh(message):
+    """
+    登记一个刷新调用方，并把共享状态置为运行中
+    :param message: 提示信息
+    """
+    apply_refresh_fields({
+        'status': 'started',
+        'message': message,
+        'progress': 0,
+        'error': None
+    }, active_delta=1)
+
+def update_refresh(**fields):
+    """
+    更新刷新的进度信息
+    """
+    apply_refresh_fields(fields)
+
+def end_refresh(**fields):
+    """
+    注销一个刷新调用方并写入它的结束状态
+    """
+    apply_refresh_fields(fields, active_delta=-1)
+
+# 登记本worker；没有其他存活的worker时说明服务刚启动，清除上次运行遗留的状态
+worker_registry.on_dead = clear_dead_workers
+if worker_registry.join():
+    reset_stale_status()
+
 class HTTPHandler(logging.Handler):
     def __init__(self):
         super().__init__()
@@ -134,9 +289,7 @@ class HTTPHandler(logging.Handler):
         try:
             log_entry = self.format(record)
             if record.levelno >= logging.INFO:
-                console_output_buffer.append(log_entry + '\n')
-                if len(console_output_buffer) > 100:
-                    console_output_buffer.pop(0)
+                append_console_output(log_entry + '\n')
         except Exception:
             pass
 
@@ -146,10 +299,12 @@ def redirect_stdout():
     
     def custom_print(*args, **kwargs):
         original_print(*args, **kwargs)
-        output = ' '.join(map(str, args)) + '\n'
-        console_output_buffer.append(output)
-        if len(console_output_buffer) > 100:
-            console_output_buffer.pop(0)
+        # 控制台输出只是附带的，任何错误都不能影响调用 print 的代码
+        try:
+            output = ' '.join(map(str, args)) + '\n'
+            append_console_output(output)
+        except Exception:
+            pass
     
     builtins.print = custom_print
 
@@ -174,6 +329,66 @@ setup_logging()
 
 stock_filter = StockFilter(default_source='tencent')
 smart_analyzer = SmartAnalyzer()
+strategy_runner = MultiStrategyRunner(fetcher=stock_filter.fetcher)
+# 选股、个股分析等耗时操作作为后台任务执行，按任务ID查询进度和结果
+job_manager = JobManager(
+    max_workers=int(os.environ.get('JOB_WORKERS', 4)),
+    ttl=int(os.environ.get('JOB_TTL', 3600)),
+    store=state_store,
+    signals=cancel_signals
+)
+# 批量行情接口使用的行情快照，全市场下载和连续扫描得到的行情也写入这里
+quote_snapshot = QuoteSnapshot(max_age=float(os.environ.get('QUOTE_MAX_AGE', 5)))
+# 代码索引：单只股票的名称、价格和调试查询按代码直接查找，不再下载全市场数据
+symbol_index = SymbolIndex()
+
+def on_market_snapshot(market_data):
+    """下载到行情快照后更新行情快照和代码索引"""
+    quote_snapshot.update_frame(market_data)
+    symbol_index.update_frame(market_data)
+
+stock_filter.fetcher.on_snapshot = on_market_snapshot
+# 手动刷新和自动刷新重叠时共享同一次全市场扫描；通过存储中的租约，所有worker中同一时间只扫描一次
+run_coordinator = RunCoordinator(store=state_store)
+# 交易日历：自动刷新和连续扫描在休市时段停止轮询
+trading_calendar = TradingCalendar()
+# 盘中连续扫描，只对行情变化的股票重新判断
+continuous_scanner = ContinuousScanner(interval=float(os.environ.get('SCAN_INTERVAL', 15)), calendar=trading_calendar,
+                                       quote_snapshot=quote_snapshot)
+# 连续扫描的进入/退出事件同时推送给SSE连接
+continuous_scanner.subscribe(lambda event: event_publisher.publish('scan', event))
+
+def continuous_scan_config():
+    """连续扫描的开关和间隔，保存在共享存储中，由持有租约的worker执行"""
+    return state_store.get('continuous_scan', {'enabled': False, 'interval': continuous_scanner.interval})
+
+def continuous_scan_wanted():
+    config = continuous_scan_config()
+    continuous_scanner.interval = config['interval']
+    return config['enabled']
+
+def save_continuous_scan_state(scanner):
+    """执行连续扫描的worker每次轮询后写入结果，其他worker的查询从存储读取"""
+    state_store.set('continuous_scan_state', {
+        'last_poll': scanner.last_poll,
+        'results': scanner.snapshot(),
+        'events': scanner.events_since(0)
+    })
+
+continuous_scanner.on_poll = save_continuous_scan_state
+# 连续扫描只在一个worker中运行；执行者退出后由其他worker在租约过期后接管
+scanner_leader = LeaderTask(state_store, 'continuous_scanner', continuous_scan_wanted,
+                            continuous_scanner.start, continuous_scanner.stop)
+worker_registry.add_task(scanner_leader.check)
+
+def start_auto_refresh():
+    token = cancel_signals.token('auto_refresh')
+    threading.Thread(target=auto_refresh_task, args=(token,), daemon=True).start()
+
+# 自动刷新循环只在一个worker中运行，同样由租约决定
+auto_refresh_leader = LeaderTask(state_store, 'auto_refresh', lambda: get_task_status()['auto_refresh']['enabled'],
+                                 start_auto_refresh, lambda: cancel_signals.cancel_local('auto_refresh'))
+worker_registry.add_task(auto_refresh_leader.check)
 
 @app.route('/')
 def index():
@@ -188,42 +403,107 @@ def api_manual_refresh():
     data = request.get_json()
     deep_analysis = data.get('deep_analysis', False)
     print(f'Manual refresh requested, deep_analysis: {deep_analysis}')
-    task_status['manual_refresh']['running'] = True
-    task_status['manual_refresh']['status'] = 'started'
-    task_status['manual_refresh']['message'] = '开始刷新数据...'
-    task_status['manual_refresh']['progress'] = 0
-    task_status['manual_refresh']['stocks'] = []
-    task_status['manual_refresh']['error'] = None
-    task_status['manual_refresh']['deep_analysis'] = deep_analysis
     
-    threading.Thread(target=manual_refresh_task, daemon=True).start()
-    return jsonify({'status': 'started', 'deep_analysis': deep_analysis})
+    # 已有刷新在进行时加入它，不再开始新的扫描
+    shared = run_coordinator.is_running('refresh')
+    begin_refresh('加入正在进行的刷新...' if shared else '开始刷新数据...')
+    
+    # 同时进行的手动刷新共用一个令牌，停止时一起停止
+    token = cancel_signals.token('manual_refresh')
+    threading.Thread(target=manual_refresh_task, args=(token, deep_analysis), daemon=True).start()
+    return jsonify({'status': 'started', 'deep_analysis': deep_analysis, 'shared': shared})
 
 @app.route('/api/manual_stop', methods=['POST'])
 def api_manual_stop():
     print('Manual stop requested')
-    task_status['manual_refresh']['running'] = False
-    task_status['manual_refresh']['status'] = 'stopped'
-    task_status['manual_refresh']['message'] = '已手动停止'
+    # 刷新任务在1秒内响应取消并写入停止状态；自动刷新仍在等待同一次扫描时扫描会继续
+    # 刷新在其他worker进程中执行时，由该进程在下一次检查停止请求时取消
+    cancel_signals.request('manual_refresh')
     return jsonify({'status': 'stopped'})
 
 @app.route('/api/toggle_auto_refresh', methods=['POST'])
 def api_toggle_auto_refresh():
     data = request.get_json()
     enabled = data.get('enabled', False)
-    task_status['auto_refresh']['enabled'] = enabled
     
-    if enabled and not task_status['auto_refresh']['running']:
-        task_status['auto_refresh']['running'] = True
-        print('Auto refresh started')
-        threading.Thread(target=auto_refresh_task, daemon=True).start()
-    else:
-        task_status['auto_refresh']['running'] = False
+    def apply(status):
+        status['auto_refresh']['enabled'] = enabled
+        status['auto_refresh']['running'] = enabled
+    
+    status = update_task_status(apply)
+    if not enabled:
+        # 自动刷新在其他worker中运行时，由该进程在下一次检查停止请求时取消
+        cancel_signals.request('auto_refresh')
         print('Auto refresh stopped')
+    else:
+        print('Auto refresh started')
+    # 自动刷新循环只在持有租约的worker中运行，本进程能获得租约时立即启动
+    auto_refresh_leader.check()
+    publish_status(status)
     
     return jsonify({
         'enabled': enabled,
-        'interval': task_status['auto_refresh']['interval']
+        'interval': status['auto_refresh']['interval']
+    })
+
+@app.route('/api/continuous_scan', methods=['POST'])
+def api_toggle_continuous_scan():
+    """
+    启动或停止盘中连续扫描
+    """
+    data = request.get_json() or {}
+    enabled = data.get('enabled', False)
+    if 'interval' in data:
+        try:
+            interval = float(data['interval'])
+        except (TypeError, ValueError):
+            return jsonify({'error': 'interval 必须是数字（秒）'}), 400
+        if not math.isfinite(interval):
+            return jsonify({'error': 'interval 必须是数字（秒）'}), 400
+        interval = max(1.0, interval)
+    else:
+        interval = None
+    
+    def apply(config):
+        config['enabled'] = enabled
+        if interval is not None:
+            config['interval'] = interval
+        return config
+    
+    config = state_store.update('continuous_scan', apply, continuous_scan_config())
+    # 连续扫描只在持有租约的worker中运行，本进程能获得租约时立即启动；
+    # 在其他worker中运行时，由该进程在下一次心跳（5秒内）启停
+    scanner_leader.check()
+    print('Continuous scan started' if enabled else 'Continuous scan stopped')
+    
+    return jsonify({'enabled': enabled, 'interval': config['interval']})
+
+@app.route('/api/continuous_scan', methods=['GET'])
+def api_continuous_scan():
+    """
+    查询连续扫描的当前结果集和进入/退出事件，since 为客户端已收到的最后一个事件序号，
+    top 为只需要的前N只（看板只展示前20名时不必对整个结果集排序）
+    """
+    since = request.args.get('since', 0, type=int)
+    top = request.args.get('top', type=int)
+    config = continuous_scan_config()
+    if continuous_scanner.running:
+        return jsonify({
+            'running': True,
+            'interval': continuous_scanner.interval,
+            'last_poll': continuous_scanner.last_poll,
+            'results': continuous_scanner.snapshot(k=top),
+            'events': continuous_scanner.events_since(since)
+        })
+    # 连续扫描在其他worker中运行（或已停止）时读取执行者最近一次写入的结果
+    state = state_store.get('continuous_scan_state', {})
+    return jsonify({
+        'running': config['enabled'] and scanner_leader.lease.holder() is not None,
+        'interval': config['interval'],
+        'last_poll': state.get('last_poll', {}),
+        # 存储中的结果已按得分排序
+        'results': state.get('results', [])[:top],
+        'events': [event for event in state.get('events', []) if event['seq'] > since]
     })
 
 @app.route('/api/analyze_stock', methods=['POST'])
@@ -237,39 +517,75 @@ def api_analyze_stock():
         return jsonify({'error': error_msg}), 400
     
     print(f'Analyze stock requested: {stock_code}')
-    task_status['analyze_stock']['running'] = True
-    task_status['analyze_stock']['status'] = 'analyzing'
-    task_status['analyze_stock']['result'] = None
-    task_status['analyze_stock']['error'] = None
     
     # 添加到历史查询记录
     add_to_query_history(stock_code)
     
-    threading.Thread(target=analyze_stock_task, args=(stock_code,), daemon=True).start()
-    return jsonify({'status': 'analyzing'})
+    # 每次分析是独立的任务，多个用户同时分析互不覆盖
+    job = job_manager.submit('analyze_stock', analyze_stock_task, stock_code, params={'code': stock_code})
+    return jsonify({'status': 'analyzing', 'job_id': job.id})
 
 @app.route('/api/status', methods=['GET'])
 def api_status():
-    return jsonify(task_status)
+    return jsonify(get_task_status())
+
+@app.route('/api/stream', methods=['GET'])
+def api_stream():
+    """
+    Server-Sent Events：连接时先发送当前状态和完整结果，之后推送 status（进度变化）、
+    stocks（结果差异）、log（控制台新行）和 scan（连续扫描事件）
+    """
+    last_event_id = request.headers.get('Last-Event-ID', type=int)
+    status = get_task_status()
+    initial = [
+        ('status', status_payload(status)),
+        ('stocks', {'full': True, 'stocks': status['manual_refresh']['stocks']})
+    ]
+    return Response(event_publisher.stream(last_event_id, initial), mimetype='text/event-stream',
+                    headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    """
+    列出保留中的后台任务（不含结果），包括其他worker进程执行的任务
+    """
+    kind = request.args.get('kind')
+    return jsonify({'jobs': job_manager.list_records(kind)})
+
+@app.route('/api/jobs/<job_id>', methods=['GET'])
+def api_job(job_id):
+    """
+    查询后台任务的进度和结果
+    """
+    record = job_manager.get_record(job_id)
+    if record is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    return jsonify(record)
+
+@app.route('/api/jobs/<job_id>/cancel', methods=['POST'])
+def api_cancel_job(job_id):
+    """
+    取消后台任务
+    """
+    record = job_manager.cancel_record(job_id)
+    if record is None:
+        return jsonify({'error': '任务不存在或已过期'}), 404
+    print(f'Cancel job requested: {job_id}')
+    return jsonify(record)
 
 @app.route('/api/console_output', methods=['GET'])
 def api_console_output():
-    # 过滤掉HTTP请求日志和空行
-    filtered_output = []
-    for line in console_output_buffer:
-        # 过滤掉HTTP请求日志
-        if '"GET' in line or '"POST' in line:
-            continue
-        # 过滤掉空行
-        if line.strip() == '':
-            continue
-        filtered_output.append(line)
-    
-    return jsonify({'output': filtered_output})
+    """
+    获取控制台输出，since 为客户端已收到的最后一个序号，只返回之后的新行；
+    reset 为True时客户端的游标已失效（行已被覆盖或服务已重启），应以返回内容替换已有输出
+    """
+    since = request.args.get('since', 0, type=int)
+    output, cursor, reset = console_output_buffer.since(since)
+    return jsonify({'output': output, 'cursor': cursor, 'reset': reset})
 
 @app.route('/api/query_history', methods=['GET'])
 def api_query_history():
-    return jsonify({'history': query_history})
+    return jsonify({'history': state_store.get('query_history', [])})
 
 @app.route('/api/refresh_stock', methods=['POST'])
 def api_refresh_stock():
@@ -282,10 +598,12 @@ def api_refresh_stock():
     print(f'Refresh stock requested: {stock_code}')
     
     try:
-        stock_name = get_stock_name_from_data(stock_code)
-        
         # 获取完整的股票数据，包含涨跌幅
         stock_data = stock_filter.fetcher.get_single_stock_data(stock_code)
+        if stock_data:
+            symbol_index.update_row(stock_data)
+        stock_name = get_stock_name_from_data(stock_code)
+        
         if stock_data:
             current_price = stock_data.get('最新价', 0)
             change = stock_data.get('涨跌幅', 0)
@@ -317,186 +635,288 @@ def api_refresh_stock():
         print(f"刷新股票数据失败: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
-def manual_refresh_task():
+@app.route('/api/quotes', methods=['GET', 'POST'])
+def api_quotes():
+    """
+    批量获取实时行情，一次请求最多 MAX_QUOTE_CODES 只股票，结果按列组织
+    GET  /api/quotes?codes=600036,000001&fields=price,change_percent
+    POST /api/quotes {"codes": ["600036", "000001"], "fields": ["price", "change_percent"]}
+    """
+    if request.method == 'POST':
+        data = request.get_json(silent=True) or {}
+        codes = data.get('codes') or []
+        fields = data.get('fields')
+    else:
+        codes = request.args.get('codes', '').split(',')
+        fields = request.args.get('fields')
+        fields = fields.split(',') if fields else None
+    
+    # 去重并保持顺序
+    codes = list(dict.fromkeys(str(code).strip() for code in codes if str(code).strip()))
+    if not codes:
+        return jsonify({'error': '股票代码不能为空'}), 400
+    if len(codes) > MAX_QUOTE_CODES:
+        return jsonify({'error': f'一次最多查询 {MAX_QUOTE_CODES} 只股票'}), 400
+    invalid = [code for code in codes if not validate_stock_code(code)[0]]
+    if invalid:
+        return jsonify({'error': '股票代码格式不正确', 'invalid': invalid}), 400
+    
+    # 代码列总是返回，用于对应各列的行
+    fields = ['code'] + [field for field in fields if field != 'code'] if fields else list(QUOTE_FIELDS)
+    unknown = [field for field in fields if field not in QUOTE_FIELDS]
+    if unknown:
+        return jsonify({'error': f"不支持的字段: {', '.join(unknown)}", 'fields': list(QUOTE_FIELDS)}), 400
+    
     try:
-        deep_analysis = task_status['manual_refresh'].get('deep_analysis', False)
-        task_status['manual_refresh']['message'] = '正在获取股票数据...'
-        task_status['manual_refresh']['progress'] = 10
-        
-        filtered_stocks = stock_filter.filter_all_markets()
-        
-        if not filtered_stocks:
-            fetcher = stock_filter.fetcher
-            market_status = {}
-            all_markets_empty = True
-            
-            for market in ['sh', 'sz', 'cyb', 'kcb']:
-                if not task_status['manual_refresh']['running']:
-                    task_status['manual_refresh']['status'] = 'stopped'
-                    task_status['manual_refresh']['message'] = '已手动停止'
-                    return
-                data = fetcher.get_stock_data(market)
-                market_status[market] = not data.empty
-                if not data.empty:
-                    all_markets_empty = False
-            
-            if all_markets_empty:
-                task_status['manual_refresh']['status'] = 'completed'
-                task_status['manual_refresh']['message'] = '所有数据源获取失败，无法筛选股票'
-                task_status['manual_refresh']['error'] = '所有数据源获取失败'
-            else:
-                task_status['manual_refresh']['status'] = 'completed'
-                task_status['manual_refresh']['message'] = '没有找到符合条件的股票'
-            
-            task_status['manual_refresh']['running'] = False
-            return
-        
-        if not task_status['manual_refresh']['running']:
-            task_status['manual_refresh']['status'] = 'stopped'
-            task_status['manual_refresh']['message'] = '已手动停止'
-            return
-        
-        task_status['manual_refresh']['message'] = f'正在分析 {len(filtered_stocks)} 只股票...'
-        task_status['manual_refresh']['progress'] = 30
-        
-        analyzed_stocks = smart_analyzer.analyze_stocks_batch(filtered_stocks)
-        
-        if not task_status['manual_refresh']['running']:
-            task_status['manual_refresh']['status'] = 'stopped'
-            task_status['manual_refresh']['message'] = '已手动停止'
-            return
-        
-        # 如果需要深度分析，这里可以添加通过deepseek进行深度分析的逻辑
-        if deep_analysis:
-            task_status['manual_refresh']['message'] = '正在进行深度分析...'
-            task_status['manual_refresh']['progress'] = 60
-            # 通过deepseek进行深度分析
-            deep_analyzed_stocks = deepseek_analyze(analyzed_stocks)
-            # 使用深度分析的结果
-            analyzed_stocks = deep_analyzed_stocks
-            print('Deep analysis completed')
-        
-        task_status['manual_refresh']['message'] = '正在计算买卖价格...'
-        task_status['manual_refresh']['progress'] = 70
-        
-        display_data = []
-        for stock in analyzed_stocks:
-            if not task_status['manual_refresh']['running']:
-                task_status['manual_refresh']['status'] = 'stopped'
-                task_status['manual_refresh']['message'] = '已手动停止'
-                return
-            display_item = {
-                'code': stock['code'],
-                'name': stock['name'],
-                'price': stock['price'],
-                'change': stock['change'],
-                'analysis': stock['analysis']['suggestion']
-            }
-            display_data.append(display_item)
+        quotes = quote_snapshot.get(codes)
+    except Exception as e:
+        print(f"批量获取行情失败: {str(e)}")
+        return jsonify({'error': str(e)}), 500
+    
+    result = QuoteSnapshot.to_columns(quotes, codes, fields)
+    result['count'] = len(result['columns']['code'])
+    result['timestamp'] = time.strftime('%Y-%m-%d %H:%M:%S')
+    return jsonify(result)
+
+def refresh_pipeline(token):
+    """
+    刷新流水线：获取全市场数据、筛选并分析
+    由 run_coordinator 保证同一时间只执行一次，重叠的手动刷新和自动刷新共享结果
+    :param token: 共享执行的取消令牌，所有调用方都停止后才会被取消
+    :return: {'stocks': 分析后的股票列表, 'message': 没有结果时的提示, 'error': 错误信息}
+    """
+    update_refresh(message='正在获取股票数据...', progress=10)
+    
+    filtered_stocks = stock_filter.filter_all_markets(token=token)
+    
+    if not filtered_stocks:
+        fetcher = stock_filter.fetcher
+        all_markets_empty = True
         
-        task_status['manual_refresh']['message'] = '数据处理完成，正在显示结果...'
-        task_status['manual_refresh']['progress'] = 100
-        task_status['manual_refresh']['stocks'] = display_data
-        task_status['manual_refresh']['status'] = 'completed'
-        task_status['manual_refresh']['running'] = False
+        for market in ['sh', 'sz', 'cyb', 'kcb']:
+            data = fetcher.get_stock_data(market, token=token)
+            if not data.empty:
+                all_markets_empty = False
+                break
         
+        if all_markets_empty:
+            return {'stocks': [], 'message': '所有数据源获取失败，无法筛选股票', 'error': '所有数据源获取失败'}
+        return {'stocks': [], 'message': '没有找到符合条件的股票', 'error': None}
+    
+    update_refresh(message=f'正在分析 {len(filtered_stocks)} 只股票...', progress=30)
+    
+    analyzed_stocks = smart_analyzer.analyze_stocks_batch(filtered_stocks, token=token)
+    return {'stocks': analyzed_stocks, 'message': None, 'error': None}
+
+def build_display_data(analyzed_stocks):
+    """
+    把分析结果转换为前端表格数据
+    :param analyzed_stocks: 分析后的股票列表
+    :return: 表格行列表
+    """
+    display_data = []
+    for stock in analyzed_stocks:
+        display_item = {
+            'code': stock['code'],
+            'name': stock['name'],
+            'price': stock['price'],
+            'change': stock['change'],
+            'indicator': ', '.join([k for k, v in stock.get('indicators', {}).items() if v]),
+            'analysis': stock['analysis']['suggestion']
+        }
+        display_data.append(display_item)
+    return display_data
+
+def run_refresh(token, deep_analysis=False):
+    """
+    执行或加入一次刷新，并把结果写入共享状态
+    :param token: 调用方的取消令牌
+    :param deep_analysis: 是否进行深度分析
+    """
+    outcome = run_coordinator.run('refresh', refresh_pipeline, token=token)
+    
+    if not outcome['stocks']:
+        end_refresh(status='completed', message=outcome['message'], error=outcome['error'], stocks=[])
+        return
+    
+    analyzed_stocks = outcome['stocks']
+    # 如果需要深度分析，这里可以添加通过deepseek进行深度分析的逻辑
+    if deep_analysis:
+        update_refresh(message='正在进行深度分析...', progress=60)
+        # 通过deepseek进行深度分析
+        analyzed_stocks = deepseek_analyze(analyzed_stocks)
+        print('Deep analysis completed')
+    
+    token.raise_if_cancelled()
+    update_refresh(message='正在计算买卖价格...', progress=70)
+    display_data = build_display_data(analyzed_stocks)
+    
+    end_refresh(status='completed', message='数据处理完成，正在显示结果...', progress=100, stocks=display_data)
+
+def manual_refresh_task(token, deep_analysis=False):
+    try:
+        run_refresh(token, deep_analysis)
+    except OperationCancelled:
+        print('Manual refresh cancelled')
+        end_refresh(status='stopped', message='已手动停止')
     except Exception as e:
         print(f"刷新数据失败: {str(e)}")
-        task_status['manual_refresh']['status'] = 'error'
-        task_status['manual_refresh']['error'] = str(e)
-        task_status['manual_refresh']['running'] = False
+        end_refresh(status='error', error=str(e))
 
-def auto_refresh_task():
-    while task_status['auto_refresh']['enabled'] and task_status['auto_refresh']['running']:
+def auto_refresh_task(token):
+    while not token.cancelled:
+        auto_status = get_task_status()['auto_refresh']
+        if not auto_status['enabled']:
+            break
         print('Auto refresh triggered')
         
-        task_status['manual_refresh']['message'] = '自动刷新数据...'
-        task_status['manual_refresh']['progress'] = 0
-        task_status['manual_refresh']['running'] = True
-        task_status['manual_refresh']['status'] = 'started'
-        
+        begin_refresh('自动刷新数据...')
         try:
-            task_status['manual_refresh']['message'] = '正在获取股票数据...'
-            task_status['manual_refresh']['progress'] = 10
+            run_refresh(token)
+            update_task_status(lambda status: status['auto_refresh'].update(last_run=time.time()))
+        except OperationCancelled:
+            print('Auto refresh cancelled')
+            end_refresh(status='stopped', message='自动刷新已停止')
+            break
+        except Exception as e:
+            print(f"自动刷新数据失败: {str(e)}")
+            end_refresh(status='error', error=str(e))
+        
+        # 交易时段内按间隔刷新，休市时等到下一个交易时段；关闭自动刷新时立即结束等待
+        interval = auto_status['interval']
+        delay = trading_calendar.poll_delay(interval)
+        status = update_task_status(lambda status: status['auto_refresh'].update(
+            session=trading_calendar.session(), next_run=time.time() + delay))
+        publish_status(status)
+        if delay > interval:
+            print(f"休市中，下次自动刷新: {datetime.fromtimestamp(time.time() + delay, tz=BEIJING_TZ).strftime('%Y-%m-%d %H:%M')}")
+        token.wait(delay)
+
+def default_indicators():
+    return {
+        'macd_bullish': False,
+        'wr_bullish': False,
+        'ma_bullish': False,
+        'volume_bullish': False,
+        'breakout_bullish': False,
+        'kdj_bullish': False,
+        'rsi_bullish': False
+    }
+
+def get_kline_indicators(stock_code):
+    """
+    获取K线数据并计算技术指标信号
+    :param stock_code: 股票代码
+    :return: 指标信号字典，没有K线数据时全部为False
+    """
+    indicators = default_indicators()
+    kline_data = stock_filter.fetcher.get_stock_kline(stock_code)
+    
+    if not kline_data.empty:
+        # 计算技术指标
+        kline_data = stock_filter.calculate_indicators(kline_data)
+        
+        if not kline_data.empty:
+            latest_data = kline_data.iloc[-1]
             
-            filtered_stocks = stock_filter.filter_all_markets()
+            # 尝试计算MACD指标
+            if all(col in latest_data.index for col in ['MACD_12_26_9', 'MACDs_12_26_9', 'MACDh_12_26_9']):
+                macd_val = latest_data['MACD_12_26_9']
+                macds_val = latest_data['MACDs_12_26_9']
+                macdh_val = latest_data['MACDh_12_26_9']
+                if (macd_val is not None and macds_val is not None and macdh_val is not None and
+                    macd_val > macds_val and macdh_val > 0):
+                    indicators['macd_bullish'] = True
             
-            if not filtered_stocks:
-                fetcher = stock_filter.fetcher
-                market_status = {}
-                all_markets_empty = True
-                
-                for market in ['sh', 'sz', 'cyb', 'kcb']:
-                    data = fetcher.get_stock_data(market)
-                    market_status[market] = not data.empty
-                    if not data.empty:
-                        all_markets_empty = False
-                
-                if all_markets_empty:
-                    task_status['manual_refresh']['status'] = 'completed'
-                    task_status['manual_refresh']['message'] = '所有数据源获取失败，无法筛选股票'
-                    task_status['manual_refresh']['error'] = '所有数据源获取失败'
-                else:
-                    task_status['manual_refresh']['status'] = 'completed'
-                    task_status['manual_refresh']['message'] = '没有找到符合条件的股票'
-            else:
-                task_status['manual_refresh']['message'] = f'正在分析 {len(filtered_stocks)} 只股票...'
-                task_status['manual_refresh']['progress'] = 30
-                
-                analyzed_stocks = smart_analyzer.analyze_stocks_batch(filtered_stocks)
-                
-                task_status['manual_refresh']['message'] = '正在计算买卖价格...'
-                task_status['manual_refresh']['progress'] = 70
-                
-                display_data = []
-                for stock in analyzed_stocks:
-                    display_item = {
-                        'code': stock['code'],
-                        'name': stock['name'],
-                        'price': stock['price'],
-                        'change': stock['change'],
-                        'indicator': ', '.join([k for k, v in stock['indicators'].items() if v]),
-                        'analysis': stock['analysis']['suggestion']
-                    }
-                    display_data.append(display_item)
-                
-                task_status['manual_refresh']['message'] = '数据处理完成，正在显示结果...'
-                task_status['manual_refresh']['progress'] = 100
-                task_status['manual_refresh']['stocks'] = display_data
-                task_status['manual_refresh']['status'] = 'completed'
+            # 尝试计算WR指标
+            if all(col in latest_data.index for col in ['WR14', 'WR21']):
+                wr14_val = latest_data['WR14']
+                wr21_val = latest_data['WR21']
+                if (wr14_val is not None and wr21_val is not None and
+                    wr14_val < -80 and wr21_val < -80):
+                    indicators['wr_bullish'] = True
             
-            task_status['auto_refresh']['last_run'] = time.time()
-            task_status['manual_refresh']['running'] = False
+            # 尝试计算移动平均线指标
+            if all(col in latest_data.index for col in ['MA5', 'MA10', 'MA20', 'MA60']):
+                ma5_val = latest_data['MA5']
+                ma10_val = latest_data['MA10']
+                ma20_val = latest_data['MA20']
+                ma60_val = latest_data['MA60']
+                if (ma5_val is not None and ma10_val is not None and 
+                    ma20_val is not None and ma60_val is not None and
+                    ma5_val > ma10_val > ma20_val > ma60_val):
+                    indicators['ma_bullish'] = True
             
-        except Exception as e:
-            print(f"自动刷新数据失败: {str(e)}")
-            task_status['manual_refresh']['status'] = 'error'
-            task_status['manual_refresh']['error'] = str(e)
-            task_status['manual_refresh']['running'] = False
-        
-        time.sleep(task_status['auto_refresh']['interval'])
+            # 尝试计算成交量指标
+            if all(col in latest_data.index for col in ['volume', 'MA_VOL5']):
+                volume_val = latest_data['volume']
+                ma_vol5_val = latest_data['MA_VOL5']
+                if (volume_val is not None and ma_vol5_val is not None and
+                    volume_val > ma_vol5_val * 1.2):
+                    indicators['volume_bullish'] = True
+            
+            # 尝试计算突破指标
+            if all(col in latest_data.index for col in ['close', 'BBU_5_2.0']):
+                close_val = latest_data['close']
+                bbu_val = latest_data['BBU_5_2.0']
+                if (close_val is not None and bbu_val is not None and
+                    close_val > bbu_val):
+                    indicators['breakout_bullish'] = True
+            
+            # 尝试计算KDJ指标
+            if all(col in latest_data.index for col in ['STOCHk_14_3_3', 'STOCHd_14_3_3']):
+                stochk_val = latest_data['STOCHk_14_3_3']
+                stochd_val = latest_data['STOCHd_14_3_3']
+                if (stochk_val is not None and stochd_val is not None and
+                    stochk_val > stochd_val):
+                    indicators['kdj_bullish'] = True
+            
+            # 尝试计算RSI指标
+            if 'RSI' in latest_data.index:
+                rsi_val = latest_data['RSI']
+                if rsi_val is not None and 30 < rsi_val < 70:
+                    indicators['rsi_bullish'] = True
+    
+    return indicators
 
-def analyze_stock_task(stock_code):
+def analyze_stock_task(job, stock_code):
+    """
+    分析单只股票：名称、价格、基本面、市场情绪和K线指标并发获取，
+    超过各自超时的数据源使用默认值（记录在 partial 中），各步骤耗时记录在 timings 中
+    :param job: 后台任务
+    :param stock_code: 股票代码
+    :return: 分析结果
+    """
     try:
         print(f"Analyze stock task started: {stock_code}")
+        started = time.time()
         
-        # 获取股票名称和实时价格
-        stock_name = get_stock_name_from_data(stock_code)
-        current_price = get_real_time_stock_price(stock_code)
+        # 并发获取互不依赖的数据
+        job.update(10, '正在获取价格、基本面、市场情绪和K线数据...')
+        data, timings = fan_out({
+            'quote': (lambda: get_stock_quote(stock_code), ANALYZE_STEP_TIMEOUT,
+                      {'name': symbol_index.name(stock_code) or f'股票{stock_code}', 'price': 0}),
+            'fundamental': (lambda: get_stock_fundamental_data(stock_code), ANALYZE_STEP_TIMEOUT, None),
+            'sentiment': (lambda: get_market_sentiment(stock_code), ANALYZE_STEP_TIMEOUT, None),
+            'kline': (lambda: get_kline_indicators(stock_code), ANALYZE_STEP_TIMEOUT, default_indicators())
+        }, token=job.token)
+        partial = [step for step, timing in timings.items() if timing['status'] != STEP_OK]
+        if partial:
+            print(f"分析股票 {stock_code} 部分数据缺失: {', '.join(partial)}")
         
-        # 获取基本面和市场情绪数据
-        fundamental_data = get_stock_fundamental_data(stock_code)
-        market_sentiment = get_market_sentiment(stock_code)
+        stock_name = data['quote']['name']
+        current_price = data['quote']['price']
+        fundamental_data = data['fundamental']
+        market_sentiment = data['sentiment']
+        
+        # 检查是否有有效的价格数据，没有价格时不再进行智能分析
+        if current_price <= 0:
+            raise ValueError('无法获取股票价格数据')
         
         # 计算买入、止盈、止损价格
-        if current_price > 0:
-            buy_price = round(current_price, 2)
-            take_profit_price = round(current_price * 1.05, 2)
-            stop_loss_price = round(current_price * 0.95, 2)
-        else:
-            buy_price = 0
-            take_profit_price = 0
-            stop_loss_price = 0
+        buy_price = round(current_price, 2)
+        take_profit_price = round(current_price * 1.05, 2)
+        stop_loss_price = round(current_price * 0.95, 2)
         
         # 构建股票信息
         stock_info = {
@@ -506,88 +926,16 @@ def analyze_stock_task(stock_code):
             'change': 0,
             'fundamental': fundamental_data,
             'market_sentiment': market_sentiment,
-            'indicators': {
-                'macd_bullish': False,
-                'wr_bullish': False,
-                'ma_bullish': False,
-                'volume_bullish': False,
-                'breakout_bullish': False,
-                'kdj_bullish': False,
-                'rsi_bullish': False
-            }
+            'indicators': data['kline']
         }
         
-        # 尝试获取K线数据进行技术指标分析
-        fetcher = stock_filter.fetcher
-        kline_data = fetcher.get_stock_kline(stock_code)
-        
-        if not kline_data.empty:
-            # 计算技术指标
-            kline_data = stock_filter.calculate_indicators(kline_data)
-            
-            if not kline_data.empty:
-                latest_data = kline_data.iloc[-1]
-                
-                # 尝试计算MACD指标
-                if all(col in latest_data.index for col in ['MACD_12_26_9', 'MACDs_12_26_9', 'MACDh_12_26_9']):
-                    macd_val = latest_data['MACD_12_26_9']
-                    macds_val = latest_data['MACDs_12_26_9']
-                    macdh_val = latest_data['MACDh_12_26_9']
-                    if (macd_val is not None and macds_val is not None and macdh_val is not None and
-                        macd_val > macds_val and macdh_val > 0):
-                        stock_info['indicators']['macd_bullish'] = True
-                
-                # 尝试计算WR指标
-                if all(col in latest_data.index for col in ['WR14', 'WR21']):
-                    wr14_val = latest_data['WR14']
-                    wr21_val = latest_data['WR21']
-                    if (wr14_val is not None and wr21_val is not None and
-                        wr14_val < -80 and wr21_val < -80):
-                        stock_info['indicators']['wr_bullish'] = True
-                
-                # 尝试计算移动平均线指标
-                if all(col in latest_data.index for col in ['MA5', 'MA10', 'MA20', 'MA60']):
-                    ma5_val = latest_data['MA5']
-                    ma10_val = latest_data['MA10']
-                    ma20_val = latest_data['MA20']
-                    ma60_val = latest_data['MA60']
-                    if (ma5_val is not None and ma10_val is not None and 
-                        ma20_val is not None and ma60_val is not None and
-                        ma5_val > ma10_val > ma20_val > ma60_val):
-                        stock_info['indicators']['ma_bullish'] = True
-                
-                # 尝试计算成交量指标
-                if all(col in latest_data.index for col in ['volume', 'MA_VOL5']):
-                    volume_val = latest_data['volume']
-                    ma_vol5_val = latest_data['MA_VOL5']
-                    if (volume_val is not None and ma_vol5_val is not None and
-                        volume_val > ma_vol5_val * 1.2):
-                        stock_info['indicators']['volume_bullish'] = True
-                
-                # 尝试计算突破指标
-                if all(col in latest_data.index for col in ['close', 'BBU_5_2.0']):
-                    close_val = latest_data['close']
-                    bbu_val = latest_data['BBU_5_2.0']
-                    if (close_val is not None and bbu_val is not None and
-                        close_val > bbu_val):
-                        stock_info['indicators']['breakout_bullish'] = True
-                
-                # 尝试计算KDJ指标
-                if all(col in latest_data.index for col in ['STOCHk_14_3_3', 'STOCHd_14_3_3']):
-                    stochk_val = latest_data['STOCHk_14_3_3']
-                    stochd_val = latest_data['STOCHd_14_3_3']
-                    if (stochk_val is not None and stochd_val is not None and
-                        stochk_val > stochd_val):
-                        stock_info['indicators']['kdj_bullish'] = True
-                
-                # 尝试计算RSI指标
-                if 'RSI' in latest_data.index:
-                    rsi_val = latest_data['RSI']
-                    if rsi_val is not None and 30 < rsi_val < 70:
-                        stock_info['indicators']['rsi_bullish'] = True
-        
         # 进行股票分析
-        analysis_result = smart_analyzer.analyze_stock(stock_info)
+        job.check_cancelled()
+        job.update(60, '正在进行智能分析...')
+        analysis_started = time.time()
+        analysis_result = smart_analyzer.analyze_stock(stock_info, token=job.token)
+        timings['analysis'] = {'status': STEP_OK, 'elapsed': round(time.time() - analysis_started, 3)}
+        timings['total'] = {'status': STEP_OK, 'elapsed': round(time.time() - started, 3)}
         
         # 构建分析结果
         result = {
@@ -603,45 +951,33 @@ def analyze_stock_task(stock_code):
             'stop_loss_price': stop_loss_price,
             'indicators': stock_info['indicators'],
             'fundamental': fundamental_data,
-            'market_sentiment': market_sentiment
+            'market_sentiment': market_sentiment,
+            'partial': partial,
+            'timings': timings
         }
         
-        # 检查是否有有效的价格数据
-        if current_price <= 0:
-            task_status['analyze_stock']['status'] = 'error'
-            task_status['analyze_stock']['error'] = '无法获取股票价格数据'
-            task_status['analyze_stock']['running'] = False
-            return
-        
-        # 设置分析结果
-        task_status['analyze_stock']['result'] = result
-        task_status['analyze_stock']['status'] = 'completed'
-        task_status['analyze_stock']['running'] = False
+        return result
         
+    except JobCancelled:
+        print(f"分析股票已取消: {stock_code}")
+        raise
     except Exception as e:
         print(f"分析股票失败: {str(e)}")
-        task_status['analyze_stock']['status'] = 'error'
-        task_status['analyze_stock']['error'] = str(e)
-        task_status['analyze_stock']['running'] = False
+        raise
 
 def get_stock_name_from_data(stock_code):
     try:
-        fetcher = stock_filter.fetcher
+        # 名称基本不变，优先从代码索引查找
+        name = symbol_index.name(stock_code)
+        if name:
+            return name
         
         # 直接调用新的get_single_stock_data方法获取单只股票数据
-        stock_data = fetcher.get_single_stock_data(stock_code)
+        stock_data = stock_filter.fetcher.get_single_stock_data(stock_code)
         if stock_data:
+            symbol_index.update_row(stock_data)
             return stock_data.get('名称', f'股票{stock_code}')
         
-        # 备用方案：遍历市场
-        markets = ['sh', 'sz', 'cyb', 'kcb']
-        for market in markets:
-            market_data = fetcher.get_stock_data(market)
-            if not market_data.empty:
-                stock_row = market_data[market_data['代码'] == stock_code]
-                if not stock_row.empty:
-                    return stock_row.iloc[0].get('名称', f'股票{stock_code}')
-        
         return f'股票{stock_code}'
     except Exception as e:
         print(f"获取股票名称失败: {str(e)}")
@@ -654,29 +990,53 @@ def get_real_time_stock_price(stock_code):
         # 直接调用新的get_single_stock_data方法获取单只股票数据
         stock_data = fetcher.get_single_stock_data(stock_code)
         if stock_data:
+            symbol_index.update_row(stock_data)
             return stock_data.get('最新价', 0)
         
-        # 备用方案：使用K线数据
-        kline_data = fetcher.get_stock_kline(stock_code)
+        return get_fallback_stock_price(stock_code)
+    except Exception as e:
+        print(f"获取股票实时价格失败: {str(e)}")
+        return 0
+
+def get_fallback_stock_price(stock_code):
+    """
+    实时行情获取失败时的价格：代码索引中最近一次行情的价格，其次是最近一根K线的收盘价
+    """
+    try:
+        price = symbol_index.price(stock_code)
+        if price > 0:
+            return price
+        
+        kline_data = stock_filter.fetcher.get_stock_kline(stock_code)
         if not kline_data.empty:
             latest_data = kline_data.iloc[-1]
-            current_price = latest_data.get('close', 0)
-            return current_price
-        
-        # 备用方案：遍历市场
-        markets = ['sh', 'sz', 'cyb', 'kcb']
-        for market in markets:
-            market_data = fetcher.get_stock_data(market)
-            if not market_data.empty:
-                stock_row = market_data[market_data['代码'] == stock_code]
-                if not stock_row.empty:
-                    return stock_row.iloc[0].get('最新价', 0)
+            return latest_data.get('close', 0)
         
         return 0
     except Exception as e:
-        print(f"获取股票实时价格失败: {str(e)}")
+        print(f"获取股票备用价格失败: {str(e)}")
         return 0
 
+def get_stock_quote(stock_code):
+    """
+    获取单只股票的名称和价格，只请求一次行情，名称和价格都取自这一行
+    :param stock_code: 股票代码
+    :return: {'name': 名称, 'price': 价格}
+    """
+    try:
+        stock_data = stock_filter.fetcher.get_single_stock_data(stock_code)
+    except Exception as e:
+        print(f"获取股票行情失败: {str(e)}")
+        stock_data = None
+    
+    if stock_data:
+        symbol_index.update_row(stock_data)
+        price = stock_data.get('最新价', 0)
+    else:
+        price = get_fallback_stock_price(stock_code)
+    name = (stock_data or {}).get('名称') or symbol_index.name(stock_code) or f'股票{stock_code}'
+    return {'name': name, 'price': price}
+
 def get_stock_fundamental_data(stock_code):
     try:
         print(f"获取股票{stock_code}基本面数据")
@@ -748,9 +1108,9 @@ def deepseek_analyze(stocks):
                 }
                 
                 # 将深度分析结果添加到股票信息中
+                # 同时加入同一次刷新的调用方共享原结果，复制 analysis 后再写入，不修改共享的字典
                 stock_with_deep_analysis = stock.copy()
-                if 'analysis' not in stock_with_deep_analysis:
-                    stock_with_deep_analysis['analysis'] = {}
+                stock_with_deep_analysis['analysis'] = dict(stock.get('analysis') or {})
                 stock_with_deep_analysis['analysis']['deep_analysis'] = deep_analysis
                 
                 deep_analyzed_stocks.append(stock_with_deep_analysis)
@@ -771,230 +1131,209 @@ def deepseek_analyze(stocks):
 @app.route('/api/run_stock_selector', methods=['POST'])
 def api_run_stock_selector():
     """
-    手动执行选股任务
+    手动执行选股任务：提交后台任务后立即返回任务ID，通过 /api/jobs/<job_id> 查询结果
     """
-    try:
-        print("开始执行选股任务...")
-        
-        from stock_selector import ScheduledStockSelector
-        
-        # 获取飞书webhook地址
-        feishu_webhook = "https://open.feishu.cn/open-apis/bot/v2/hook/d6930274-cf9f-48d9-80d9-b1f735c43fc2"
-        
-        print("创建选股器实例...")
-        # 创建选股任务
-        selector = ScheduledStockSelector(feishu_webhook)
-        
-        print("获取股票代码列表...")
-        # 获取所有股票代码
-        from data_fetcher import DataFetcher
-        fetcher = DataFetcher()
-        
-        all_codes = []
-        markets = ['sh', 'sz', 'cyb']
-        
-        for market in markets:
-            print(f"获取{market}市场股票数据...")
-            data = fetcher.get_stock_data(market)
-            if not data.empty:
-                codes = data['代码'].tolist()
-                all_codes.extend(codes)
-                print(f"  - {market}市场获取到 {len(codes)} 只股票")
-        
-        print(f"共获取到 {len(all_codes)} 只股票")
-        
-        print("开始执行选股...")
-        # 执行选股
-        result = selector.run_selection(all_codes)
-        
-        print(f"选股完成，共筛选出 {len(result)} 只股票")
-        
-        return jsonify({
-            'status': 'success',
-            'message': f'选股任务执行完成，共筛选出 {len(result)} 只股票',
-            'selected_stocks': result,  # 返回所有股票
-            'total_count': len(result)
-        })
-        
-    except Exception as e:
-        print(f"执行选股任务失败: {str(e)}")
-        return jsonify({'error': str(e)}), 500
+    job = job_manager.submit('run_stock_selector', stock_selector_job)
+    print(f"已提交选股任务: {job.id}")
+    return jsonify({'status': 'submitted', 'job_id': job.id}), 202
+
+def stock_selector_job(job):
+    """
+    执行"买阴不买阳"选股：同时提交的选股任务（包括其他worker中的）共享同一次执行
+    :param job: 后台任务
+    :return: 选股结果
+    """
+    return run_coordinator.run('stock_selector', run_stock_selection, job, token=job.token)
+
+def run_stock_selection(token, job):
+    """
+    :param token: 共享执行的取消令牌
+    :param job: 发起执行的任务，用于报告进度
+    """
+    print("开始执行选股任务...")
+    
+    from stock_selector import ScheduledStockSelector
+    
+    # 获取飞书webhook地址
+    feishu_webhook = "https://open.feishu.cn/open-apis/bot/v2/hook/d6930274-cf9f-48d9-80d9-b1f735c43fc2"
+    
+    print("创建选股器实例...")
+    # 创建选股任务
+    selector = ScheduledStockSelector(feishu_webhook)
+    
+    print("获取行情快照...")
+    job.update(5, '正在获取行情快照...')
+    # 只下载一次全市场行情，选股直接使用快照，不再按代码重新请求
+    from data_fetcher import DataFetcher
+    fetcher = DataFetcher()
+    fetcher.on_snapshot = on_market_snapshot
+    
+    snapshot = {}
+    markets = ['sh', 'sz', 'cyb']
+    
+    for market in markets:
+        token.raise_if_cancelled()
+        print(f"获取{market}市场股票数据...")
+        snapshot[market] = fetcher.get_stock_data(market, token=token)
+        print(f"  - {market}市场获取到 {len(snapshot[market])} 只股票")
+    
+    total = sum(len(data) for data in snapshot.values())
+    print(f"共获取到 {total} 只股票")
+    
+    token.raise_if_cancelled()
+    print("开始执行选股...")
+    job.update(20, f'正在筛选 {total} 只股票...')
+    # 执行选股
+    result = selector.run_selection(snapshot=snapshot, token=token)
+    
+    print(f"选股完成，共筛选出 {len(result)} 只股票")
+    
+    return {
+        'status': 'success',
+        'message': f'选股任务执行完成，共筛选出 {len(result)} 只股票',
+        'selected_stocks': result,  # 返回所有股票
+        'total_count': len(result)
+    }
 
 @app.route('/api/run_stock_selector_chen', methods=['POST'])
 def api_run_stock_selector_chen():
     """
-    陈小群选股策略
+    陈小群选股策略：提交后台任务后立即返回任务ID，通过 /api/jobs/<job_id> 查询结果
+    """
+    job = job_manager.submit('run_stock_selector_chen', stock_selector_chen_job)
+    print(f"已提交陈小群选股任务: {job.id}")
+    return jsonify({'status': 'submitted', 'job_id': job.id}), 202
+
+def stock_selector_chen_job(job):
+    """
+    执行陈小群选股：同时提交的陈小群选股任务（包括其他worker中的）共享同一次执行
+    :param job: 后台任务
+    :return: 选股结果
+    """
+    return run_coordinator.run('stock_selector_chen', run_chen_selection, job, token=job.token)
+
+def run_chen_selection(token, job):
+    """
+    :param token: 共享执行的取消令牌
+    :param job: 发起执行的任务，用于报告进度
     """
     try:
         print("=" * 60)
         print("开始执行陈小群选股任务...")
         print("=" * 60)
         
-        from data_fetcher import DataFetcher
-        # 禁用模拟数据，使用腾讯财经API获取实时数据
-        fetcher = DataFetcher(use_mock_data=False, default_source='tencent')
-        
-        all_stocks = []
         markets = ['sh', 'sz', 'cyb']
-        
+        print(f"\n【步骤1】获取{'、'.join(markets)}市场股票数据...")
+        job.update(10, '正在获取行情数据...')
+        snapshot = strategy_runner.fetch_snapshot(markets, token=token)
         for market in markets:
-            print(f"\n【步骤1】获取{market}市场股票数据...")
-            data = fetcher.get_stock_data(market)
-            if not data.empty:
-                all_stocks.append(data)
-                print(f"✓ {market}市场获取到 {len(data)} 只股票")
-            else:
+            if snapshot[market].empty:
                 print(f"✗ {market}市场未获取到数据")
+            else:
+                print(f"✓ {market}市场获取到 {len(snapshot[market])} 只股票")
         
-        if all_stocks:
-            import pandas as pd
-            all_data = pd.concat(all_stocks, ignore_index=True)
-            print(f"\n【步骤2】数据汇总")
-            print(f"✓ 共获取到 {len(all_data)} 只股票")
-            
-            # 统计变量
-            filtered_by_pattern1 = 0  # 先涨后落破开盘价
-            filtered_by_pattern2 = 0  # 先跌反弹未过开盘价
-            filtered_by_change = 0
-            filtered_by_volume_ratio = 0
-            filtered_by_turnover = 0
-            filtered_by_market_cap = 0
-            
-            # 陈小群选股策略筛选
-            result = []
-            print(f"\n【步骤3】开始筛选...")
-            print(f"筛选条件：")
-            print(f"  排除条件：")
-            print(f"    1. 先涨后落破开盘价：最高价 > 开盘价，现价 < 开盘价")
-            print(f"    2. 先跌反弹未过开盘价：最低价 < 开盘价，现价 < 开盘价")
-            print(f"  筛选条件：")
-            print(f"    3. 涨幅：3%-5%")
-            print(f"    4. 量比：≥1")
-            print(f"    5. 换手率：5%-10%")
-            print(f"    6. 市值：30-300亿")
-            print()
-            
-            for _, stock in all_data.iterrows():
-                try:
-                    code = stock['代码']
-                    name = stock.get('名称', '')
-                    
-                    # 获取分时数据
-                    price = float(stock.get('最新价', 0))
-                    open_price = float(stock.get('开盘价', price))
-                    high_price = float(stock.get('最高价', price))
-                    low_price = float(stock.get('最低价', price))
-                    
-                    # 排除条件1：先涨后落破开盘价（最高价 > 开盘价，现价 < 开盘价）
-                    pattern1 = (high_price > open_price and price < open_price)
-                    
-                    # 排除条件2：先跌反弹未过开盘价（最低价 < 开盘价，现价 < 开盘价）
-                    pattern2 = (low_price < open_price and price < open_price)
-                    
-                    # 满足任一排除条件则过滤掉
-                    if pattern1:
-                        filtered_by_pattern1 += 1
-                        continue
-                    
-                    if pattern2:
-                        filtered_by_pattern2 += 1
-                        continue
-                    
-                    # 涨幅筛选：3%-5%
-                    change_percent = float(stock.get('涨跌幅', 0))
-                    if change_percent < 3 or change_percent > 5:
-                        filtered_by_change += 1
-                        continue
-                    
-                    # 量比筛选：≥1
-                    volume_ratio = float(stock.get('量比', 0))
-                    if volume_ratio < 1:
-                        filtered_by_volume_ratio += 1
-                        continue
-                    
-                    # 换手率筛选：5%-10%
-                    turnover_rate = float(stock.get('换手率', 0))
-                    if turnover_rate < 5 or turnover_rate > 10:
-                        filtered_by_turnover += 1
-                        continue
-                    
-                    # 市值筛选：30-300亿
-                    market_cap = float(stock.get('总市值', 0))
-                    if market_cap < 30 or market_cap > 300:
-                        filtered_by_market_cap += 1
-                        continue
-                    
-                    # 获取成交量
-                    volume = float(stock.get('成交量', 0))
-                    
-                    # 添加到结果
-                    result.append({
-                        'code': code,
-                        'name': name,
-                        'price': price,
-                        'change_percent': change_percent,
-                        'volume_ratio': volume_ratio,
-                        'turnover_rate': turnover_rate,
-                        'order_ratio': float(stock.get('委比', 0)),
-                        'volume': volume,
-                        'market_cap': market_cap,
-                        'priority': 3
-                    })
-                    
-                    print(f"✓ 筛选通过: {code} {name} - 涨幅:{change_percent:.2f}% 量比:{volume_ratio:.2f} 换手:{turnover_rate:.2f}% 市值:{market_cap:.0f}亿 成交量:{volume:.0f}手")
-                    
-                except Exception as e:
-                    print(f"✗ 处理股票 {stock.get('代码', 'unknown')} 时出错: {str(e)}")
-                    continue
-            
-            print(f"\n【步骤4】筛选统计")
-            print(f"  - 总股票数: {len(all_data)}")
-            print(f"  - 分时条件不符: {filtered_by_pattern1 + filtered_by_pattern2} 只 (通过率: {(len(all_data) - filtered_by_pattern1 - filtered_by_pattern2) / len(all_data) * 100:.1f}%)")
-            print(f"  - 涨幅不符: {filtered_by_change} 只 (通过率: {(len(all_data) - filtered_by_pattern1 - filtered_by_pattern2 - filtered_by_change) / len(all_data) * 100:.1f}%)")
-            print(f"  - 量比不符: {filtered_by_volume_ratio} 只 (通过率: {(len(all_data) - filtered_by_pattern1 - filtered_by_pattern2 - filtered_by_change - filtered_by_volume_ratio) / len(all_data) * 100:.1f}%)")
-            print(f"  - 换手率不符: {filtered_by_turnover} 只 (通过率: {(len(all_data) - filtered_by_pattern1 - filtered_by_pattern2 - filtered_by_change - filtered_by_volume_ratio - filtered_by_turnover) / len(all_data) * 100:.1f}%)")
-            print(f"  - 市值不符: {filtered_by_market_cap} 只 (通过率: {(len(all_data) - filtered_by_pattern1 - filtered_by_pattern2 - filtered_by_change - filtered_by_volume_ratio - filtered_by_turnover - filtered_by_market_cap) / len(all_data) * 100:.1f}%)")
-            print(f"  - 最终通过: {len(result)} 只 (总通过率: {len(result) / len(all_data) * 100:.2f}%)")
-            
-            # 找出最苛刻的条件（已禁用）
-            # max_filtered = max(filtered_by_pattern1 + filtered_by_pattern2, filtered_by_change, filtered_by_volume_ratio, filtered_by_turnover, filtered_by_market_cap)
-            # if max_filtered == filtered_by_pattern1 + filtered_by_pattern2:
-            #     print(f"\n⚠️  最苛刻条件: 分时条件（先涨后落破开盘价/先跌反弹未过开盘价）- 过滤掉 {filtered_by_pattern1 + filtered_by_pattern2} 只股票")
-            # elif max_filtered == filtered_by_change:
-            #     print(f"\n⚠️  最苛刻条件: 涨幅筛选（3%-5%）- 过滤掉 {filtered_by_change} 只股票")
-            # elif max_filtered == filtered_by_turnover:
-            #     print(f"\n⚠️  最苛刻条件: 换手率筛选（5%-10%）- 过滤掉 {filtered_by_turnover} 只股票")
-            # elif max_filtered == filtered_by_market_cap:
-            #     print(f"\n⚠️  最苛刻条件: 市值筛选（30-300亿）- 过滤掉 {filtered_by_market_cap} 只股票")
-            # else:
-            #     print(f"\n⚠️  最苛刻条件: 量比筛选（≥1）- 过滤掉 {filtered_by_volume_ratio} 只股票")
-            
-            print(f"\n【步骤5】选股完成")
-            print(f"✓ 陈小群选股完成，共筛选出 {len(result)} 只股票")
-            print(f"✓ 执行完成时间: {time.strftime('%Y-%m-%d %H:%M:%S')}")
-            print("=" * 60)
-            
-            return jsonify({
-                'status': 'success',
-                'message': f'陈小群选股任务执行完成，共筛选出 {len(result)} 只股票',
-                'selected_stocks': result,
-                'total_count': len(result),
-                'completed_at': time.strftime('%Y-%m-%d %H:%M:%S')
-            })
-        else:
+        all_data = build_indicator_panel(snapshot)
+        if all_data.empty:
             print("✗ 未获取到股票数据")
-            return jsonify({
+            return {
                 'status': 'success',
                 'message': '未获取到股票数据',
                 'selected_stocks': [],
                 'total_count': 0
-            })
+            }
+        
+        print(f"\n【步骤2】数据汇总")
+        print(f"✓ 共获取到 {len(all_data)} 只股票")
         
+        print(f"\n【步骤3】开始筛选...")
+        print(f"筛选条件：")
+        print(f"  排除条件：")
+        print(f"    1. 先涨后落破开盘价：最高价 > 开盘价，现价 < 开盘价")
+        print(f"    2. 先跌反弹未过开盘价：最低价 < 开盘价，现价 < 开盘价")
+        print(f"  筛选条件：")
+        print(f"    3. 涨幅：3%-5%")
+        print(f"    4. 量比：≥1")
+        print(f"    5. 换手率：5%-10%")
+        print(f"    6. 市值：30-300亿")
+        print()
+        
+        token.raise_if_cancelled()
+        job.update(60, f'正在筛选 {len(all_data)} 只股票...')
+        result, stats = screen_chen_xiaoqun(all_data)
+        
+        # 只输出前20只通过的股票，避免大量日志
+        for stock in result[:20]:
+            print(f"✓ 筛选通过: {stock['code']} {stock['name']} - 涨幅:{stock['change_percent']:.2f}% 量比:{stock['volume_ratio']:.2f} 换手:{stock['turnover_rate']:.2f}% 市值:{stock['market_cap']:.0f}亿 成交量:{stock['volume']:.0f}手")
+        if len(result) > 20:
+            print(f"... 还有 {len(result) - 20} 只股票未显示")
+        
+        print(f"\n【步骤4】筛选统计")
+        for line in format_chen_stats(stats):
+            print(line)
+        
+        print(f"\n【步骤5】选股完成")
+        print(f"✓ 陈小群选股完成，共筛选出 {len(result)} 只股票")
+        print(f"✓ 执行完成时间: {time.strftime('%Y-%m-%d %H:%M:%S')}")
+        print("=" * 60)
+        
+        return {
+            'status': 'success',
+            'message': f'陈小群选股任务执行完成，共筛选出 {len(result)} 只股票',
+            'selected_stocks': result,
+            'total_count': len(result),
+            'stage_stats': stats,
+            'completed_at': time.strftime('%Y-%m-%d %H:%M:%S')
+        }
+        
+    except JobCancelled:
+        print("\n✗ 陈小群选股任务已取消")
+        raise
     except Exception as e:
         print(f"\n✗ 执行陈小群选股任务失败: {str(e)}")
         import traceback
         traceback.print_exc()
-        return jsonify({'error': str(e)}), 500
+        raise
+
+@app.route('/api/run_strategies', methods=['POST'])
+def api_run_strategies():
+    """
+    在同一份行情快照上执行多个选股策略：提交后台任务后立即返回任务ID
+    """
+    data = request.get_json(silent=True) or {}
+    strategy_names = data.get('strategies') or list(STRATEGIES)
+    
+    unknown = [name for name in strategy_names if name not in STRATEGIES]
+    if unknown:
+        return jsonify({'error': f"未注册的策略: {', '.join(unknown)}"}), 400
+    
+    job = job_manager.submit('run_strategies', run_strategies_job, strategy_names,
+                             params={'strategies': strategy_names})
+    print(f"已提交多策略选股任务: {job.id}")
+    return jsonify({'status': 'submitted', 'job_id': job.id}), 202
+
+def run_strategies_job(job, strategy_names):
+    """
+    执行多策略选股
+    :param job: 后台任务
+    :param strategy_names: 策略名列表
+    :return: 各策略的选股结果
+    """
+    print(f"开始执行多策略选股: {', '.join(strategy_names)}")
+    job.update(10, '正在获取行情数据并执行策略...')
+    results = strategy_runner.run(strategy_names, token=job.token)
+    
+    return {
+        'status': 'success',
+        'results': {
+            name: {
+                'label': STRATEGIES[name].label,
+                'selected_stocks': stocks,
+                'total_count': len(stocks)
+            }
+            for name, stocks in results.items()
+        },
+        'completed_at': time.strftime('%Y-%m-%d %H:%M:%S')
+    }
 
 @app.route('/api/debug_stock/<stock_code>', methods=['GET'])
 def api_debug_stock(stock_code):
@@ -1006,88 +1345,70 @@ def api_debug_stock(stock_code):
         print(f"调试股票: {stock_code}")
         print(f"{'='*60}")
         
-        from data_fetcher import DataFetcher
-        fetcher = DataFetcher()
-        
-        # 获取所有市场数据
-        all_stocks = []
-        markets = ['sh', 'sz', 'cyb']
-        
-        for market in markets:
-            data = fetcher.get_stock_data(market)
-            if not data.empty:
-                all_stocks.append(data)
+        # 只请求这一只股票的行情（同时写入代码索引），请求失败时使用索引中最近一次的行情
+        stock_filter.fetcher.get_stocks_data([stock_code])
+        entry = symbol_index.lookup(stock_code)
         
-        if all_stocks:
-            import pandas as pd
-            all_data = pd.concat(all_stocks, ignore_index=True)
-            
-            # 查找特定股票
-            stock = all_data[all_data['代码'] == stock_code]
-            
-            if stock.empty:
-                print(f"✗ 未找到股票 {stock_code}")
-                return jsonify({
-                    'error': f'未找到股票 {stock_code}',
-                    'stock_code': stock_code
-                })
-            
-            stock = stock.iloc[0]
-            
-            # 获取股票数据
-            code = stock['代码']
-            name = stock.get('名称', '')
-            change_percent = float(stock.get('涨跌幅', 0))
-            volume_ratio = float(stock.get('量比', 0))
-            turnover_rate = float(stock.get('换手率', 0))
-            market_cap = float(stock.get('总市值', 0))
-            price = float(stock.get('最新价', 0))
-            
-            print(f"\n股票信息:")
-            print(f"  代码: {code}")
-            print(f"  名称: {name}")
-            print(f"  价格: {price:.2f}")
-            print(f"  涨幅: {change_percent:.2f}%")
-            print(f"  量比: {volume_ratio:.2f}")
-            print(f"  换手率: {turnover_rate:.2f}%")
-            print(f"  市值: {market_cap:.0f}亿")
-            
-            print(f"\n陈小群策略筛选条件:")
-            print(f"  涨幅要求: 2%-6% | 实际: {change_percent:.2f}% | {'✓ 通过' if 2 <= change_percent <= 6 else '✗ 不通过'}")
-            print(f"  量比要求: ≥1 | 实际: {volume_ratio:.2f} | {'✓ 通过' if volume_ratio >= 1 else '✗ 不通过'}")
-            print(f"  换手率要求: 3%-12% | 实际: {turnover_rate:.2f}% | {'✓ 通过' if 3 <= turnover_rate <= 12 else '✗ 不通过'}")
-            print(f"  市值要求: 30-300亿 | 实际: {market_cap:.0f}亿 | {'✓ 通过' if 30 <= market_cap <= 300 else '✗ 不通过'}")
-            
-            # 判断是否符合所有条件
-            all_pass = (
-                2 <= change_percent <= 6 and
-                volume_ratio >= 1 and
-                3 <= turnover_rate <= 12 and
-                30 <= market_cap <= 300
-            )
-            
-            print(f"\n综合判断: {'✓ 符合所有条件' if all_pass else '✗ 不符合所有条件'}")
-            print(f"{'='*60}\n")
-            
+        if entry is None:
+            print(f"✗ 未找到股票 {stock_code}")
             return jsonify({
-                'stock_code': code,
-                'stock_name': name,
-                'price': price,
-                'change_percent': change_percent,
-                'volume_ratio': volume_ratio,
-                'turnover_rate': turnover_rate,
-                'market_cap': market_cap,
-                'conditions': {
-                    'change_percent_pass': 2 <= change_percent <= 6,
-                    'volume_ratio_pass': volume_ratio >= 1,
-                    'turnover_rate_pass': 3 <= turnover_rate <= 12,
-                    'market_cap_pass': 30 <= market_cap <= 300
-                },
-                'all_pass': all_pass
+                'error': f'未找到股票 {stock_code}',
+                'stock_code': stock_code
             })
-        else:
-            return jsonify({'error': '未获取到股票数据'})
-            
+        
+        stock = entry['row']
+        
+        # 获取股票数据
+        code = stock['代码']
+        name = stock.get('名称', '')
+        change_percent = float(stock.get('涨跌幅', 0))
+        volume_ratio = float(stock.get('量比', 0))
+        turnover_rate = float(stock.get('换手率', 0))
+        market_cap = float(stock.get('总市值', 0))
+        price = float(stock.get('最新价', 0))
+        
+        print(f"\n股票信息:")
+        print(f"  代码: {code}")
+        print(f"  名称: {name}")
+        print(f"  价格: {price:.2f}")
+        print(f"  涨幅: {change_percent:.2f}%")
+        print(f"  量比: {volume_ratio:.2f}")
+        print(f"  换手率: {turnover_rate:.2f}%")
+        print(f"  市值: {market_cap:.0f}亿")
+        
+        print(f"\n陈小群策略筛选条件:")
+        print(f"  涨幅要求: 2%-6% | 实际: {change_percent:.2f}% | {'✓ 通过' if 2 <= change_percent <= 6 else '✗ 不通过'}")
+        print(f"  量比要求: ≥1 | 实际: {volume_ratio:.2f} | {'✓ 通过' if volume_ratio >= 1 else '✗ 不通过'}")
+        print(f"  换手率要求: 3%-12% | 实际: {turnover_rate:.2f}% | {'✓ 通过' if 3 <= turnover_rate <= 12 else '✗ 不通过'}")
+        print(f"  市值要求: 30-300亿 | 实际: {market_cap:.0f}亿 | {'✓ 通过' if 30 <= market_cap <= 300 else '✗ 不通过'}")
+        
+        # 判断是否符合所有条件
+        all_pass = (
+            2 <= change_percent <= 6 and
+            volume_ratio >= 1 and
+            3 <= turnover_rate <= 12 and
+            30 <= market_cap <= 300
+        )
+        
+        print(f"\n综合判断: {'✓ 符合所有条件' if all_pass else '✗ 不符合所有条件'}")
+        print(f"{'='*60}\n")
+        
+        return jsonify({
+            'stock_code': code,
+            'stock_name': name,
+            'price': price,
+            'change_percent': change_percent,
+            'volume_ratio': volume_ratio,
+            'turnover_rate': turnover_rate,
+            'market_cap': market_cap,
+            'conditions': {
+                'change_percent_pass': 2 <= change_percent <= 6,
+                'volume_ratio_pass': volume_ratio >= 1,
+                'turnover_rate_pass': 3 <= turnover_rate <= 12,
+                'market_cap_pass': 30 <= market_cap <= 300
+            },
+            'all_pass': all_pass
+        })
     except Exception as e:
         print(f"调试股票失败: {str(e)}")
         import traceback
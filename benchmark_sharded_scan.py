@@ -0,0 +1,52 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+分片扫描基准测试：用合成的腾讯行情响应和K线替代网络请求，
+测量行情解析和指标判断在 1 ~ N 个进程下的耗时
+
+用法: python benchmark_sharded_scan.py --stocks 5000 --processes 1 2 4
+"""
+
+import argparse
+import logging
+import os
+import tempfile
+import time
+from typing import Dict, List
+
+from screening import PredicateStats
+from sharded_scan import ShardedScanner
+from stock_selector import StockSelector
+from synthetic_market import synthetic_codes, synthetic_scan_shard
+
+
+def run_benchmark(stocks: int, process_counts: List[int], kline_workers: int) -> List[Dict]:
+    codes = synthetic_codes(stocks)
+    results = []
+    baseline = None
+    for processes in process_counts:
+        scanner = ShardedScanner(processes=processes, selector=StockSelector(stats=PredicateStats(path=None)),
+                                 kline_workers=kline_workers, shard_func=synthetic_scan_shard)
+        started = time.perf_counter()
+        selected = scanner.scan(codes)
+        elapsed = time.perf_counter() - started
+        baseline = baseline or elapsed
+        results.append({'processes': processes, 'seconds': elapsed, 'speedup': baseline / elapsed,
+                        'selected': len(selected)})
+        print(f"进程数 {processes:>2}: 耗时 {elapsed:7.2f}s  加速比 {baseline / elapsed:5.2f}x  选中 {len(selected)} 只")
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="分片扫描基准测试")
+    parser.add_argument('--stocks', type=int, default=5000, help="合成股票数")
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4], help="要测试的进程数")
+    parser.add_argument('--kline-workers', type=int, default=4, help="每个进程获取K线的线程数")
+    args = parser.parse_args()
+
+    logging.disable(logging.INFO)
+    print(f"CPU核数: {os.cpu_count()}，合成股票数: {args.stocks}")
+    # K线缓存目录建在临时目录中，避免污染工作目录
+    with tempfile.TemporaryDirectory() as workdir:
+        os.chdir(workdir)
+        run_benchmark(args.stocks, args.processes, args.kline_workers)
@@ -0,0 +1,133 @@
+import concurrent.futures
+import threading
+from typing import Callable, List, Optional
+
+
+class OperationCancelled(BaseException):
+    """
+    操作被取消
+    继承 BaseException 而不是 Exception：数据获取代码中大量 except Exception 用于跳过单个失败的批次，
+    取消信号不能被这些处理吞掉，必须一路传递到任务入口
+    """
+
+
+class CancellationToken:
+    def __init__(self):
+        """
+        协作式取消令牌：由发起方调用 cancel()，执行方在检查点调用 raise_if_cancelled()，
+        阻塞等待的一方可以注册回调以便立即被唤醒
+        """
+        self._event = threading.Event()
+        self._lock = threading.Lock()
+        self._callbacks: List[Callable[[], None]] = []
+
+    @property
+    def cancelled(self) -> bool:
+        return self._event.is_set()
+
+    def cancel(self):
+        """请求取消，并执行已注册的回调"""
+        with self._lock:
+            if self._event.is_set():
+                return
+            self._event.set()
+            callbacks = list(self._callbacks)
+            self._callbacks.clear()
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                pass
+
+    def raise_if_cancelled(self):
+        if self._event.is_set():
+            raise OperationCancelled()
+
+    def wait(self, timeout: Optional[float] = None) -> bool:
+        """
+        可被取消打断的等待，用于替代 time.sleep
+        :return: 等待期间是否被取消
+        """
+        return self._event.wait(timeout)
+
+    def add_callback(self, callback: Callable[[], None]):
+        """注册取消回调，已取消时立即执行"""
+        with self._lock:
+            if not self._event.is_set():
+                self._callbacks.append(callback)
+                return
+        callback()
+
+    def remove_callback(self, callback: Callable[[], None]):
+        with self._lock:
+            if callback in self._callbacks:
+                self._callbacks.remove(callback)
+
+
+def raise_if_cancelled(token: Optional[CancellationToken]):
+    """令牌可以为None（不可取消的调用方）"""
+    if token is not None:
+        token.raise_if_cancelled()
+
+
+def _close_result(future: concurrent.futures.Future):
+    """被放弃的调用结束后关闭其结果（如HTTP响应），归还连接"""
+    if future.cancelled() or future.exception() is not None:
+        return
+    close = getattr(future.result(), 'close', None)
+    if callable(close):
+        try:
+            close()
+        except Exception:
+            pass
+
+
+def _start_thread(func: Callable, *args, **kwargs) -> concurrent.futures.Future:
+    """在单独的守护线程中执行一次调用，被放弃的调用只占用自己的线程"""
+    future = concurrent.futures.Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args, **kwargs))
+        except BaseException as e:
+            future.set_exception(e)
+
+    threading.Thread(target=run, name='cancellable', daemon=True).start()
+    return future
+
+
+def call_cancellable(func: Callable, *args, token: Optional[CancellationToken] = None,
+                     executor: Optional[concurrent.futures.Executor] = None, **kwargs):
+    """
+    执行阻塞调用，令牌被取消时立即抛出 OperationCancelled，不再等待尚未返回的请求；
+    被放弃的请求在后台自然结束，返回的响应随即被关闭
+    :param func: 阻塞函数，如 requests.get
+    :param token: 取消令牌，为None时直接在当前线程调用
+    :param executor: 执行调用的线程池，由调用方按自己的并发数创建；为None时每次调用使用单独的线程，
+                     被放弃的调用不会占用其他调用方的名额
+    :return: func 的返回值
+    """
+    if token is None:
+        return func(*args, **kwargs)
+
+    token.raise_if_cancelled()
+    if executor is not None:
+        future = executor.submit(func, *args, **kwargs)
+    else:
+        future = _start_thread(func, *args, **kwargs)
+    wake = threading.Event()
+    future.add_done_callback(lambda f: wake.set())
+    token.add_callback(wake.set)
+    try:
+        wake.wait()
+    finally:
+        token.remove_callback(wake.set)
+
+    if token.cancelled and not future.done():
+        # 还在排队的调用直接丢弃，已开始的调用结束后关闭响应
+        if not future.cancel():
+            future.add_done_callback(_close_result)
+        raise OperationCancelled()
+    return future.result()
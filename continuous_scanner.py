@@ -0,0 +1,238 @@
+import collections
+import copy
+import logging
+import threading
+import time
+from typing import Callable, Deque, Dict, List, Optional
+
+from cancellation import CancellationToken, OperationCancelled
+from data_fetcher import DataFetcher
+from ranking import rank_stocks
+from screening import STAGE_KLINE, STAGE_REALTIME, PredicateStats, ScreeningExecutor
+from stock_selector import StockSelector
+from trading_calendar import TradingCalendar
+
+logger = logging.getLogger(__name__)
+
+# 结果集变化事件
+EVENT_ENTER = 'enter'
+EVENT_EXIT = 'exit'
+
+# 这些行情字段不变时，实时条件的结果也不会变，不需要重新判断
+WATCHED_FIELDS = ('price', 'open', 'change_percent', 'volume', 'volume_ratio', 'turnover_rate', 'order_ratio')
+
+
+class ContinuousScanner:
+    def __init__(self, selector: Optional[StockSelector] = None, stock_codes: Optional[List[str]] = None,
+                 interval: float = 15.0, markets=('sh', 'sz', 'cyb'), max_events: int = 1000,
+                 calendar: Optional[TradingCalendar] = None, quote_snapshot=None):
+        """
+        盘中连续扫描：内存中保存最新行情和每只股票的K线条件结果，按较短周期轮询行情，
+        只对行情字段有变化的股票重新判断，结果集的进出以事件发布
+        :param selector: 提供条件、行情和K线获取的选股器
+        :param stock_codes: 扫描的股票代码，为None时使用代码表中的全部股票（每个交易日重新读取）
+        :param interval: 两次轮询开始之间的间隔（秒）
+        :param markets: 未指定股票代码时扫描的市场
+        :param max_events: 内存中保留的最近事件数
+        :param calendar: 交易日历，休市时暂停轮询
+        :param quote_snapshot: 共享的行情快照（quote_snapshot.QuoteSnapshot），轮询到的行情同时写入
+        """
+        self.selector = selector or StockSelector()
+        # 独立的执行器和内存中的统计：以选股器的历史统计为起点排序条件，
+        # 每15秒一次的轮询只包含行情变化的股票，不能并入持久化的统计，否则衰减会冲掉整场选股的数据
+        history = self.selector.executor.stats
+        stats = PredicateStats(path=None, decay=history.decay)
+        with history.lock:
+            stats.stats = copy.deepcopy(history.stats)
+        self.executor = ScreeningExecutor(self.selector.executor.predicates, stats=stats)
+        self.calendar = calendar or TradingCalendar()
+        self.stock_codes = stock_codes
+        self.listed_codes: Optional[List[str]] = None
+        self.interval = interval
+        self.markets = markets
+        self.quote_snapshot = quote_snapshot
+        self.lock = threading.Lock()
+        self.quotes: Dict[str, Dict] = {}
+        # K线条件只依赖日K线，盘中不会变化：每只股票每天只获取并判断一次
+        self.kline_verdicts: Dict[str, bool] = {}
+        self.trading_day = self.calendar.now().date()
+        self.results: Dict[str, Dict] = {}
+        self.events: Deque[Dict] = collections.deque(maxlen=max_events)
+        self.seq = 0
+        self.subscribers: List[Callable[[Dict], None]] = []
+        self.last_poll: Dict = {}
+        # 每次轮询结束后的回调 on_poll(scanner)，用于把结果写入共享存储
+        self.on_poll: Optional[Callable[['ContinuousScanner'], None]] = None
+        self.token: Optional[CancellationToken] = None
+        self.thread: Optional[threading.Thread] = None
+
+    @property
+    def running(self) -> bool:
+        return self.thread is not None and self.thread.is_alive()
+
+    def subscribe(self, callback: Callable[[Dict], None]):
+        """注册事件回调，每个进入/退出事件调用一次"""
+        with self.lock:
+            self.subscribers.append(callback)
+
+    def unsubscribe(self, callback: Callable[[Dict], None]):
+        with self.lock:
+            if callback in self.subscribers:
+                self.subscribers.remove(callback)
+
+    def _codes(self, token: Optional[CancellationToken] = None) -> List[str]:
+        if self.stock_codes is not None:
+            return self.stock_codes
+        if self.listed_codes is None:
+            self.listed_codes = DataFetcher().get_listed_codes(self.markets, token=token)
+        return self.listed_codes
+
+    def _roll_day(self):
+        """跨日后清空行情和K线条件结果，重新读取代码表，新的交易日重新判断"""
+        # 按北京时间的日期切换，服务器不在东八区时也与交易日一致
+        today = self.calendar.now().date()
+        if today != self.trading_day:
+            logger.info(f"交易日切换到 {today}，清空连续扫描状态")
+            self.trading_day = today
+            self.quotes.clear()
+            self.kline_verdicts.clear()
+            self.listed_codes = None
+
+    def poll(self, token: Optional[CancellationToken] = None) -> List[Dict]:
+        """
+        轮询一次行情并增量更新结果集
+        :param token: 取消令牌
+        :return: 本次产生的事件
+        """
+        started = time.time()
+        self._roll_day()
+        codes = self._codes(token)
+
+        changed = []
+        total = 0
+        for batch in self.selector.iter_realtime_batches(codes, token=token):
+            total += len(batch)
+            if self.quote_snapshot is not None:
+                self.quote_snapshot.update(batch)
+            for quote in batch:
+                previous = self.quotes.get(quote['code'])
+                if previous is None or any(previous.get(field) != quote.get(field) for field in WATCHED_FIELDS):
+                    changed.append(quote)
+                self.quotes[quote['code']] = quote
+
+        events = self._reevaluate(changed, token)
+        self.last_poll = {
+            'time': started,
+            'quotes': total,
+            'changed': len(changed),
+            'events': len(events),
+            'results': len(self.results),
+            'elapsed': round(time.time() - started, 2)
+        }
+        logger.info(f"连续扫描: 行情 {total} 只，变化 {len(changed)} 只，"
+                    f"进入/退出 {len(events)} 次，结果集 {len(self.results)} 只，耗时 {self.last_poll['elapsed']}s")
+        if self.on_poll is not None:
+            try:
+                self.on_poll(self)
+            except Exception as e:
+                logger.error(f"轮询回调执行失败: {str(e)}")
+        return events
+
+    def _reevaluate(self, changed: List[Dict], token: Optional[CancellationToken] = None) -> List[Dict]:
+        """对行情有变化的股票重新判断实时条件，K线条件使用当天缓存的结果"""
+        executor = self.executor
+        executor.start_run()
+        realtime_passed = {}
+        for quote in changed:
+            realtime_passed[quote['code']], _ = executor.evaluate(STAGE_REALTIME, quote)
+
+        missing = [code for code, passed in realtime_passed.items() if passed and code not in self.kline_verdicts]
+        if missing:
+            fetcher = self.selector.kline_fetcher
+            for code, kline_data in fetcher.iter_kline_data_batch(missing, days=60, token=token):
+                if kline_data is None or len(kline_data) < 30:
+                    # 获取失败不记录结果，下次行情变化时重试
+                    continue
+                self.kline_verdicts[code], _ = executor.evaluate(STAGE_KLINE, self.quotes[code], kline_data)
+        if changed:
+            # 没有重新判断的轮询不并入统计，避免只做衰减
+            executor.finish_run()
+
+        events = []
+        with self.lock:
+            for quote in changed:
+                code = quote['code']
+                selected = realtime_passed[code] and self.kline_verdicts.get(code, False)
+                if selected:
+                    info = StockSelector.stock_info(quote)
+                    if code not in self.results:
+                        events.append(self._event(EVENT_ENTER, info))
+                    self.results[code] = info
+                elif code in self.results:
+                    events.append(self._event(EVENT_EXIT, StockSelector.stock_info(quote)))
+                    del self.results[code]
+
+        self._publish(events)
+        return events
+
+    def _event(self, kind: str, info: Dict) -> Dict:
+        self.seq += 1
+        return dict(info, seq=self.seq, type=kind, time=time.strftime('%Y-%m-%d %H:%M:%S'))
+
+    def _publish(self, events: List[Dict]):
+        with self.lock:
+            self.events.extend(events)
+            subscribers = list(self.subscribers)
+        for event in events:
+            for callback in subscribers:
+                try:
+                    callback(event)
+                except Exception as e:
+                    logger.error(f"事件回调执行失败: {str(e)}")
+
+    def events_since(self, seq: int = 0) -> List[Dict]:
+        """返回序号大于seq的事件"""
+        with self.lock:
+            return [event for event in self.events if event['seq'] > seq]
+
+    def snapshot(self, k: Optional[int] = None) -> List[Dict]:
+        """
+        按加权因子得分排序的当前结果集
+        :param k: 只返回前K只，为None时返回全部
+        """
+        with self.lock:
+            stocks = list(self.results.values())
+        return rank_stocks(stocks, weights=self.selector.rank_weights, k=k)
+
+    def run(self, token: CancellationToken):
+        """轮询直到令牌被取消"""
+        logger.info(f"连续扫描启动，轮询间隔 {self.interval}s")
+        while not token.cancelled:
+            idle = self.calendar.seconds_until_active()
+            if idle > 0:
+                # 休市时不轮询，等到下一个交易时段开始
+                logger.info(f"{self.calendar.session()} 休市中，{idle / 60:.0f} 分钟后恢复连续扫描")
+                token.wait(idle)
+                continue
+            started = time.time()
+            try:
+                self.poll(token)
+            except OperationCancelled:
+                break
+            except Exception as e:
+                logger.error(f"连续扫描轮询失败: {str(e)}", exc_info=True)
+            token.wait(max(0.0, self.interval - (time.time() - started)))
+        logger.info("连续扫描已停止")
+
+    def start(self) -> bool:
+        """在后台线程中启动轮询，已在运行时返回False"""
+        if self.running:
+            return False
+        self.token = CancellationToken()
+        self.thread = threading.Thread(target=self.run, args=(self.token,), name='continuous-scan', daemon=True)
+        self.thread.start()
+        return True
+
+    def stop(self):
+        if self.token is not None:
+            self.token.cancel()
@@ -5,6 +5,7 @@ import json
 import os
 import pickle
 from datetime import datetime, timezone, timedelta
+from cancellation import call_cancellable, raise_if_cancelled
 
 # 设置时区为北京时间（东八区）
 BEIJING_TZ = timezone(timedelta(hours=8))
@@ -28,6 +29,72 @@ logger.addHandler(handler)
 # 允许日志传播到根日志记录器，以便被HTTPHandler捕获
 # logger.propagate = False
 
+def market_of(stock_code):
+    """
+    根据股票代码判断市场
+    :param stock_code: 股票代码
+    :return: 'sh'、'sz'、'cyb'、'kcb'，无法识别时返回None
+    """
+    if stock_code.startswith('688'):
+        return 'kcb'
+    if stock_code.startswith('6'):
+        return 'sh'
+    if stock_code.startswith('30'):
+        return 'cyb'
+    if stock_code.startswith('0'):
+        return 'sz'
+    return None
+
+def _tencent_float(fields, index, default=0.0):
+    if len(fields) <= index or not fields[index]:
+        return default
+    try:
+        return float(fields[index])
+    except ValueError:
+        return default
+
+BID_VOLUME_FIELDS = (10, 12, 14, 16, 18)
+ASK_VOLUME_FIELDS = (20, 22, 24, 26, 28)
+
+def tencent_order_ratio(fields):
+    """
+    由五档盘口计算委比：(委买手数 - 委卖手数) / (委买手数 + 委卖手数) * 100
+    腾讯行情没有直接给出委比，盘口缺失或全为0时返回0.0
+    :param fields: 行情按"~"拆分后的字段列表
+    :return: 委比（%）
+    """
+    bids = sum(_tencent_float(fields, index) for index in BID_VOLUME_FIELDS)
+    asks = sum(_tencent_float(fields, index) for index in ASK_VOLUME_FIELDS)
+    total = bids + asks
+    if total <= 0:
+        return 0.0
+    return round((bids - asks) / total * 100, 2)
+
+def parse_tencent_quote(fields):
+    """
+    按腾讯财经行情字段的下标解析一只股票，全市场快照和选股的实时行情共用，保证同一行情得到相同的数值
+    字段：3 最新价，4 昨收，5 今开，6 成交量（手），10-18 买一至买五手数，20-28 卖一至卖五手数，
+    32 涨跌幅，33 最高，34 最低，37 成交额（万元），38 换手率，44 总市值，49 量比
+    :param fields: 行情按"~"拆分后的字段列表
+    :return: 实时行情字典（英文字段名）
+    """
+    price = float(fields[3]) if fields[3] else 0
+    return {
+        'name': fields[1],
+        'price': price,
+        'yesterday_close': float(fields[4]) if fields[4] else 0,
+        'open': float(fields[5]) if fields[5] else 0,
+        'high': _tencent_float(fields, 33),
+        'low': _tencent_float(fields, 34),
+        'change_percent': _tencent_float(fields, 32),
+        'volume': int(float(fields[6])) if fields[6] else 0,
+        'amount': _tencent_float(fields, 37),
+        'volume_ratio': _tencent_float(fields, 49),
+        'order_ratio': tencent_order_ratio(fields),
+        'turnover_rate': _tencent_float(fields, 38),
+        'market_cap': _tencent_float(fields, 44)
+    }
+
 class DataFetcher:
     def __init__(self, use_mock_data=False, default_source='tencent'):
         self.use_mock_data = False  # 强制禁用模拟数据
@@ -42,6 +109,9 @@ class DataFetcher:
         self.stock_list_cache_expiry = 86400  # 股票列表缓存24小时
         self.realtime_data_cache_expiry = 0  # 实时数据不缓存
         
+        # 下载到全市场行情后的回调 on_snapshot(DataFrame)，用于把行情写入共享的行情快照
+        self.on_snapshot = None
+        
         # 创建缓存目录
         if not os.path.exists(self.cache_dir):
             os.makedirs(self.cache_dir)
@@ -179,10 +249,12 @@ class DataFetcher:
             logger.error(f"生成模拟股票数据失败: {str(e)}")
             return pd.DataFrame()
     
-    def get_stock_data_from_tencent(self, market):
+    def get_stock_data_from_tencent(self, market, token=None, stock_codes=None):
         """
         使用腾讯财经API获取指定市场的股票数据
         :param market: 市场类型，可选值：'sh'（上证）、'sz'（深证）、'cyb'（创业板）、'kcb'（科创板）
+        :param token: 取消令牌，取消时放弃剩余批次和进行中的请求，抛出 OperationCancelled
+        :param stock_codes: 只获取这些股票（须属于该市场），为None时获取整个市场
         :return: 股票数据DataFrame
         """
         try:
@@ -207,9 +279,12 @@ class DataFetcher:
                 logger.error(f"不支持的市场类型: {market}")
                 return pd.DataFrame()
             
-            # 尝试从缓存加载股票代码列表
+            # 优先使用预热任务刷新的已上市代码表，其次使用缓存的候选代码段
             stock_list_cache_key = f"stock_list_{market}"
-            stock_codes = self._load_cache(stock_list_cache_key)
+            if stock_codes is None:
+                stock_codes = self.get_symbol_registry(market)
+            if stock_codes is None:
+                stock_codes = self._load_cache(stock_list_cache_key)
             
             if stock_codes is None:
                 # 定义市场对应的股票代码前缀
@@ -260,6 +335,8 @@ class DataFetcher:
                 '开盘价': [],
                 '最高价': [],
                 '最低价': [],
+                '今开': [],
+                '昨收': [],
                 '涨跌幅': [],
                 '成交量': [],
                 '成交额': [],
@@ -277,6 +354,7 @@ class DataFetcher:
             logger.info(f"开始分批获取{market}市场股票数据，共{total_batches}批")
             
             for i in range(0, len(stock_symbols), batch_size):
+                raise_if_cancelled(token)
                 batch_symbols = stock_symbols[i:i+batch_size]
                 symbols_str = ",".join(batch_symbols)
                 url = f"http://qt.gtimg.cn/q={symbols_str}"
@@ -285,7 +363,7 @@ class DataFetcher:
                 
                 try:
                     # 发送HTTP请求
-                    response = requests.get(url, timeout=10)
+                    response = call_cancellable(requests.get, url, timeout=10, token=token)
                     response.encoding = 'gbk'  # 腾讯财经返回GBK编码
                     
                     if response.status_code != 200:
@@ -320,75 +398,26 @@ class DataFetcher:
                                 
 
                                 
-                                name = fields[1]      # 股票名称
-                                price = float(fields[3])  # 最新价
-                                open_price = float(fields[4]) if len(fields) > 4 else price  # 开盘价
-                                high_price = float(fields[5]) if len(fields) > 5 else price  # 最高价
-                                low_price = float(fields[6]) if len(fields) > 6 else price  # 最低价
-                                change = float(fields[32])  # 涨跌幅
-                                volume = int(float(fields[8]))  # 成交量
-                                amount = float(fields[9])  # 成交额
-                                
-                                # 解析额外字段
-                                try:
-                                    # 量比 - 字段49
-                                    if len(fields) > 49:
-                                        try:
-                                            volume_ratio = float(fields[49])
-                                        except:
-                                            volume_ratio = 0.0
-                                    else:
-                                        # 量比数据缺失，使用默认值
-                                        volume_ratio = 0.0
-                                    
-                                    # 委比 - 字段12
-                                    order_ratio = 0.0
-                                    if len(fields) > 12:
-                                        try:
-                                            order_ratio = float(fields[12])
-                                        except:
-                                            pass
-                                    
-                                    # 换手率 - 字段38
-                                    turnover_rate = 0.0
-                                    if len(fields) > 38:
-                                        try:
-                                            turnover_rate = float(fields[38])
-                                        except:
-                                            pass
-                                    
-                                    # 总市值 - 字段44
-                                    market_cap = 0.0
-                                    if len(fields) > 44:
-                                        try:
-                                            market_cap = float(fields[44])
-                                        except:
-                                            pass
-                                    
-                                    # 板块涨幅（使用行业涨跌幅作为替代）
-                                    sector_change = float(fields[32]) * 0.8 if len(fields) > 32 else 0.0
-                                except (ValueError, IndexError):
-                                    # 解析失败，使用默认值
-                                    volume_ratio = 0.0
-                                    order_ratio = 0.0
-                                    turnover_rate = 0.0
-                                    market_cap = 0.0
-                                    sector_change = 0.0
+                                quote = parse_tencent_quote(fields)
+                                # 板块涨幅（使用行业涨跌幅作为替代）
+                                sector_change = quote['change_percent'] * 0.8
                                 
                                 # 添加到数据中
                                 data['代码'].append(stock_code)
-                                data['名称'].append(name)
-                                data['最新价'].append(price)
-                                data['开盘价'].append(open_price)
-                                data['最高价'].append(high_price)
-                                data['最低价'].append(low_price)
-                                data['涨跌幅'].append(change)
-                                data['成交量'].append(volume)
-                                data['成交额'].append(amount)
-                                data['量比'].append(volume_ratio)
-                                data['委比'].append(order_ratio)
-                                data['换手率'].append(turnover_rate)
-                                data['总市值'].append(market_cap)
+                                data['名称'].append(quote['name'])
+                                data['最新价'].append(quote['price'])
+                                data['开盘价'].append(quote['open'])
+                                data['最高价'].append(quote['high'])
+                                data['最低价'].append(quote['low'])
+                                data['今开'].append(quote['open'])
+                                data['昨收'].append(quote['yesterday_close'])
+                                data['涨跌幅'].append(quote['change_percent'])
+                                data['成交量'].append(quote['volume'])
+                                data['成交额'].append(quote['amount'])
+                                data['量比'].append(quote['volume_ratio'])
+                                data['委比'].append(quote['order_ratio'])
+                                data['换手率'].append(quote['turnover_rate'])
+                                data['总市值'].append(quote['market_cap'])
                                 data['板块涨幅'].append(sector_change)
                         
                         except Exception as e:
@@ -418,22 +447,25 @@ class DataFetcher:
             logger.error(f"使用腾讯财经API获取股票数据失败: {str(e)}")
             return pd.DataFrame()
     
-    def get_stock_data(self, market):
+    def get_stock_data(self, market, token=None):
         """
         获取指定市场的股票数据，仅使用腾讯财经API获取实时数据
         :param market: 市场类型，可选值：'sh'（上证）、'sz'（深证）、'cyb'（创业板）、'kcb'（科创板）
+        :param token: 取消令牌
         :return: 股票数据DataFrame
         """
         try:
             logger.info(f"开始获取{market}市场的股票数据")
             
             # 仅使用腾讯财经API获取实时数据
-            data = self.get_stock_data_from_tencent(market)
+            data = self.get_stock_data_from_tencent(market, token=token)
             
             if not data.empty:
                 # 检查是否有有效的价格数据
                 if '最新价' in data.columns and not (data['最新价'] == 0).all():
                     logger.info(f"腾讯财经API获取{market}市场数据成功")
+                    if self.on_snapshot is not None:
+                        self.on_snapshot(data)
                     return data
                 else:
                     logger.warning(f"腾讯财经数据价格无效")
@@ -518,19 +550,17 @@ class DataFetcher:
                             if len(fields) < 34:
                                 continue
                             
-                            name = fields[1]      # 股票名称
-                            price = float(fields[3])  # 最新价
-                            change = float(fields[32])  # 涨跌幅
-                            volume = int(float(fields[8]))  # 成交量
-                            amount = float(fields[9])  # 成交额
+                            quote = parse_tencent_quote(fields)
+                            name = quote['name']
+                            price = quote['price']
                             
                             stock_data = {
                                 '代码': stock_code,
                                 '名称': name,
                                 '最新价': price,
-                                '涨跌幅': change,
-                                '成交量': volume,
-                                '成交额': amount
+                                '涨跌幅': quote['change_percent'],
+                                '成交量': quote['volume'],
+                                '成交额': quote['amount']
                             }
                             
                             # 缓存单只股票数据
@@ -550,20 +580,108 @@ class DataFetcher:
             logger.error(f"获取单只股票数据失败: {str(e)}")
             return None
     
-    def get_all_markets_data(self):
+    def get_stocks_data(self, stock_codes, token=None):
+        """
+        只获取指定股票的实时行情，不下载整个市场，列与 get_stock_data 一致
+        :param stock_codes: 股票代码列表，每个市场每100只一次请求
+        :param token: 取消令牌
+        :return: 股票数据DataFrame，没有行情的代码不在结果中
+        """
+        groups = {}
+        for code in stock_codes:
+            market = market_of(code)
+            if market is None:
+                logger.error(f"未知的股票代码格式: {code}")
+                continue
+            groups.setdefault(market, []).append(code)
+        
+        frames = []
+        for market, codes in groups.items():
+            raise_if_cancelled(token)
+            data = self.get_stock_data_from_tencent(market, token=token, stock_codes=codes)
+            if not data.empty:
+                frames.append(data)
+        
+        if not frames:
+            return pd.DataFrame()
+        data = pd.concat(frames, ignore_index=True)
+        if self.on_snapshot is not None:
+            self.on_snapshot(data)
+        return data
+    
+    def get_all_markets_data(self, token=None, markets=None):
         """
         获取所有市场的股票数据
+        :param token: 取消令牌
+        :param markets: 市场类型列表，默认为全部市场
         :return: 包含所有市场股票数据的字典
         """
-        markets = ['sh', 'sz', 'cyb', 'kcb']
+        markets = markets or ['sh', 'sz', 'cyb', 'kcb']
         all_data = {}
         
         for market in markets:
-            data = self.get_stock_data(market)
+            raise_if_cancelled(token)
+            data = self.get_stock_data(market, token=token)
             all_data[market] = data
         
         return all_data
     
+    def get_symbol_registry(self, market):
+        """
+        获取已上市股票代码表（由 refresh_symbol_registry 生成，缓存24小时）
+        :param market: 市场类型
+        :return: 股票代码列表，未刷新或已过期时返回None
+        """
+        return self._load_cache(f"stock_list_registry_{market}")
+    
+    def refresh_symbol_registry(self, market, token=None):
+        """
+        刷新已上市股票代码表：完整探测一遍候选代码段，只保留有行情返回的代码
+        之后的行情请求只查询这些代码，请求批次从上百批降到二三十批
+        :param market: 市场类型
+        :param token: 取消令牌
+        :return: 股票代码列表，获取失败时返回空列表且保留原代码表
+        """
+        registry_path = self._get_cache_path(f"stock_list_registry_{market}")
+        previous = self.get_symbol_registry(market)
+        if os.path.exists(registry_path):
+            # 删除旧代码表，使本次请求探测完整的候选代码段以发现新上市的股票
+            os.remove(registry_path)
+        
+        data = self.get_stock_data(market, token=token)
+        if data.empty:
+            logger.warning(f"{market}市场代码表刷新失败")
+            if previous is not None:
+                self._save_cache(f"stock_list_registry_{market}", previous)
+            return []
+        
+        codes = data['代码'].tolist()
+        self._save_cache(f"stock_list_registry_{market}", codes)
+        logger.info(f"{market}市场代码表已刷新，共{len(codes)}只股票")
+        return codes
+    
+    def get_listed_codes(self, markets=('sh', 'sz', 'cyb'), token=None):
+        """
+        获取多个市场的股票代码，优先使用代码表，代码表不存在时下载全市场行情
+        :param markets: 市场类型列表
+        :param token: 取消令牌
+        :return: 股票代码列表
+        """
+        all_codes = []
+        for market in markets:
+            raise_if_cancelled(token)
+            codes = self.get_symbol_registry(market)
+            if codes is None:
+                logger.info(f"{market}市场没有可用的代码表，下载全市场行情获取代码")
+                data = self.get_stock_data(market, token=token)
+                codes = data['代码'].tolist() if not data.empty else []
+            if codes:
+                logger.info(f"{market} 市场获取到 {len(codes)} 只股票")
+            else:
+                logger.warning(f"{market} 市场未获取到股票代码")
+            all_codes.extend(codes)
+        return all_codes
+    
     def get_stock_kline(self, symbol, period='1d', start_date=None, end_date=None):
         """
         获取单个股票的K线数据
@@ -0,0 +1,207 @@
+import collections
+import json
+import sys
+import threading
+import time
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from ring_buffer import RingBuffer
+
+
+def format_sse(event: str, payload: str, seq: Optional[int] = None) -> str:
+    """
+    格式化一条 Server-Sent Events 消息
+    :param event: 事件类型
+    :param payload: 已序列化的JSON数据
+    :param seq: 事件序号，作为 id 发送，浏览器断线重连时通过 Last-Event-ID 带回
+    """
+    lines = []
+    if seq is not None:
+        lines.append(f"id: {seq}")
+    lines.append(f"event: {event}")
+    lines.append(f"data: {payload}")
+    return "\n".join(lines) + "\n\n"
+
+
+def diff_stocks(previous: List[Dict], current: List[Dict], key: str = 'code') -> Dict:
+    """
+    计算两次结果之间的差异
+    :return: {'added': [...], 'updated': [...], 'removed': [代码...], 'order': [代码...]}
+    """
+    before = {stock[key]: stock for stock in previous}
+    after = {stock[key]: stock for stock in current}
+    return {
+        'added': [stock for code, stock in after.items() if code not in before],
+        'updated': [stock for code, stock in after.items() if code in before and before[code] != stock],
+        'removed': [code for code in before if code not in after],
+        'order': list(after)
+    }
+
+
+class EventPublisher:
+    def __init__(self, capacity: int = 1000, heartbeat: float = 15.0, buffer=None, poll_interval: float = 0.5):
+        """
+        一个发布者服务所有SSE连接：每个事件只序列化一次写入环形缓冲区，
+        各连接按自己的游标读取，慢连接不会拖慢发布方
+        :param capacity: 保留的最近事件数，断线重连时可以补发这些事件
+        :param heartbeat: 没有事件时发送保活注释的间隔（秒）
+        :param buffer: 事件缓冲区，默认为进程内的 RingBuffer；传入 state_store.StoreLog 时多个worker共享事件
+        :param poll_interval: 共享缓冲区的轮询间隔（秒）；其他进程发布的事件由本进程的一个轮询线程发现后唤醒所有连接
+        """
+        self.buffer = buffer if buffer is not None else RingBuffer(capacity)
+        self.heartbeat = heartbeat
+        self.poll_interval = poll_interval
+        self.condition = threading.Condition()
+        self.clients = 0
+        self.poller: Optional[threading.Thread] = None
+
+    def publish(self, event: str, data: Any) -> int:
+        """
+        发布事件
+        :param event: 事件类型
+        :param data: 可JSON序列化的数据
+        :return: 事件序号
+        """
+        payload = json.dumps(data, ensure_ascii=False, default=str)
+        seq = self.buffer.append((event, payload))
+        with self.condition:
+            self.condition.notify_all()
+        return seq
+
+    def publish_many(self, events: List[Tuple[str, Any]]) -> List[int]:
+        """
+        批量发布事件，共享缓冲区只写入一次
+        :param events: [(事件类型, 数据)]
+        :return: 各事件的序号
+        """
+        if not events:
+            return []
+        seqs = self.buffer.extend([(event, json.dumps(data, ensure_ascii=False, default=str))
+                                   for event, data in events])
+        with self.condition:
+            self.condition.notify_all()
+        return seqs
+
+    def stream(self, last_event_id: Optional[int] = None,
+               initial: Iterable[Tuple[str, Any]] = ()) -> Iterator[str]:
+        """
+        生成一个连接的SSE消息
+        :param last_event_id: 客户端重连时带回的最后一个事件序号，为None时只接收之后的新事件
+        :param initial: 连接建立时先发送的快照事件 [(事件类型, 数据)]
+        """
+        with self.condition:
+            self.clients += 1
+            if getattr(self.buffer, 'shared', False) and (self.poller is None or not self.poller.is_alive()):
+                self.poller = threading.Thread(target=self._poll_shared, args=(self.buffer.last_seq,),
+                                               name='event-poller', daemon=True)
+                self.poller.start()
+        try:
+            cursor = self.buffer.last_seq if last_event_id is None else last_event_id
+            # 告诉浏览器断线后1秒重连
+            yield "retry: 1000\n\n"
+            for event, data in initial:
+                yield format_sse(event, json.dumps(data, ensure_ascii=False, default=str))
+
+            while True:
+                items, last, reset = self.buffer.since(cursor)
+                if reset:
+                    # 需要的事件已被覆盖（重连间隔太长或连接太慢），由客户端重新加载完整状态
+                    yield format_sse('reset', '{}')
+                first = last - len(items) + 1
+                for offset, (event, payload) in enumerate(items):
+                    yield format_sse(event, payload, first + offset)
+                cursor = last
+
+                with self.condition:
+                    if self.buffer.last_seq == cursor:
+                        self.condition.wait(self.heartbeat)
+                if self.buffer.last_seq == cursor:
+                    yield ": keepalive\n\n"
+        finally:
+            with self.condition:
+                self.clients -= 1
+
+    def _poll_shared(self, seen: int):
+        """
+        共享缓冲区的轮询线程：每个进程一个，发现其他进程发布的事件后唤醒本进程的所有连接，没有连接时退出
+        :param seen: 启动时的最新序号
+        """
+        while True:
+            with self.condition:
+                if self.clients == 0:
+                    self.poller = None
+                    return
+            time.sleep(self.poll_interval)
+            try:
+                seq = self.buffer.last_seq
+            except Exception:
+                continue
+            if seq != seen:
+                with self.condition:
+                    self.condition.notify_all()
+            seen = seq
+
+
+class ConsoleWriter:
+    def __init__(self, log, publisher: Optional[EventPublisher] = None, interval: float = 0.2,
+                 max_pending: int = 10000):
+        """
+        控制台输出的批量写入：调用方只把行放入内存缓冲区，由一个后台线程定期批量写入日志并发布 'log' 事件，
+        共享存储每批只写入一次，print 和日志不会等待存储
+        :param log: 控制台日志（RingBuffer 或 state_store.StoreLog）
+        :param publisher: 发布 'log' 事件的SSE发布者
+        :param interval: 批量写入的间隔（秒）
+        :param max_pending: 最多缓冲的行数，存储写入跟不上时丢弃最早的行
+        """
+        self.log = log
+        self.publisher = publisher
+        self.interval = interval
+        self.pending = collections.deque(maxlen=max_pending)
+        self.condition = threading.Condition()
+        self.writing = 0
+        self.worker: Optional[threading.Thread] = None
+
+    def write(self, line: str):
+        """缓冲一行输出，立即返回，不会抛出异常"""
+        try:
+            with self.condition:
+                self.pending.append(line)
+                if self.worker is None or not self.worker.is_alive():
+                    self.worker = threading.Thread(target=self._run, name='console-writer', daemon=True)
+                    self.worker.start()
+        except Exception:
+            pass
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待已缓冲的行全部写入
+        :return: 超时前是否写完
+        """
+        with self.condition:
+            self.condition.notify_all()
+            return self.condition.wait_for(lambda: not self.pending and not self.writing, timeout)
+
+    def _run(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(lambda: self.pending, self.interval)
+                lines = list(self.pending)
+                self.pending.clear()
+                self.writing = len(lines)
+            try:
+                if lines:
+                    cursors = self.log.extend(lines)
+                    if self.publisher is not None:
+                        self.publisher.publish_many([('log', {'line': line, 'cursor': cursor})
+                                                     for line, cursor in zip(lines, cursors)])
+            except Exception as e:
+                # 不能写日志：日志输出会再次进入本缓冲区
+                if sys.__stderr__ is not None:
+                    sys.__stderr__.write(f"控制台输出写入失败，丢弃 {len(lines)} 行: {str(e)}\n")
+            finally:
+                with self.condition:
+                    self.writing = 0
+                    self.condition.notify_all()
+            if lines:
+                # 等待一个间隔让更多行进入同一批
+                time.sleep(self.interval)
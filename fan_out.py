@@ -0,0 +1,82 @@
+import concurrent.futures
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional, Tuple
+
+from cancellation import CancellationToken, raise_if_cancelled
+
+logger = logging.getLogger(__name__)
+
+# 步骤状态
+STEP_OK = 'ok'
+STEP_TIMEOUT = 'timeout'
+STEP_ERROR = 'error'
+
+# 执行并发步骤的线程池；超时的步骤在后台自然结束，结果直接丢弃
+_fan_out_pool = concurrent.futures.ThreadPoolExecutor(max_workers=32, thread_name_prefix='fan-out')
+
+
+def _timed(func: Callable[[], Any]) -> Tuple[Any, float, Optional[Exception]]:
+    started = time.time()
+    try:
+        return func(), time.time() - started, None
+    except Exception as e:
+        return None, time.time() - started, e
+
+
+def fan_out(steps: Dict[str, Tuple[Callable[[], Any], float, Any]],
+            token: Optional[CancellationToken] = None,
+            pool: Optional[concurrent.futures.Executor] = None) -> Tuple[Dict[str, Any], Dict[str, Dict]]:
+    """
+    并发执行互不依赖的步骤，每个步骤有自己的超时，超时或失败的步骤使用默认值
+    总耗时约等于最慢的一个步骤（不超过最长的超时）
+    :param steps: {步骤名: (无参函数, 超时秒数, 默认值)}
+    :param token: 取消令牌，取消时立即抛出 OperationCancelled
+    :param pool: 执行步骤的线程池，默认使用模块内的线程池
+    :return: ({步骤名: 结果}, {步骤名: {'status': ok|timeout|error, 'elapsed': 秒, 'error': 错误信息}})
+    """
+    pool = pool or _fan_out_pool
+    raise_if_cancelled(token)
+    started = time.time()
+    wake = threading.Event()
+    futures = {}
+    for name, (func, _, _) in steps.items():
+        future = pool.submit(_timed, func)
+        future.add_done_callback(lambda f: wake.set())
+        futures[name] = future
+
+    if token is not None:
+        token.add_callback(wake.set)
+    try:
+        while True:
+            wake.clear()
+            raise_if_cancelled(token)
+            now = time.time()
+            deadlines = [started + steps[name][1] for name, future in futures.items()
+                         if not future.done() and now < started + steps[name][1]]
+            if not deadlines:
+                break
+            wake.wait(min(deadlines) - now)
+    finally:
+        if token is not None:
+            token.remove_callback(wake.set)
+
+    results = {}
+    timings = {}
+    for name, (_, timeout, default) in steps.items():
+        future = futures[name]
+        if not future.done():
+            logger.warning(f"步骤 {name} 超过 {timeout}s 未完成，使用默认值")
+            results[name] = default
+            timings[name] = {'status': STEP_TIMEOUT, 'elapsed': round(timeout, 3)}
+            continue
+        value, elapsed, error = future.result()
+        if error is None:
+            results[name] = value
+            timings[name] = {'status': STEP_OK, 'elapsed': round(elapsed, 3)}
+        else:
+            logger.error(f"步骤 {name} 执行失败: {str(error)}")
+            results[name] = default
+            timings[name] = {'status': STEP_ERROR, 'elapsed': round(elapsed, 3), 'error': str(error)}
+    return results, timings
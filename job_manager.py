@@ -0,0 +1,418 @@
+import concurrent.futures
+import logging
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional
+
+from cancellation import CancellationToken, OperationCancelled
+from state_store import Lease
+
+logger = logging.getLogger(__name__)
+
+# 任务状态
+JOB_QUEUED = 'queued'
+JOB_RUNNING = 'running'
+JOB_COMPLETED = 'completed'
+JOB_ERROR = 'error'
+JOB_CANCELLED = 'cancelled'
+FINISHED_STATES = (JOB_COMPLETED, JOB_ERROR, JOB_CANCELLED)
+
+
+def _format_time(timestamp: Optional[float]) -> Optional[str]:
+    if timestamp is None:
+        return None
+    return time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(timestamp))
+
+
+# 任务在执行过程中检测到取消请求时抛出，与数据获取层使用同一个异常
+JobCancelled = OperationCancelled
+
+
+class Job:
+    def __init__(self, kind: str, params: Optional[Dict] = None):
+        """
+        后台任务记录
+        :param kind: 任务类型，如 run_stock_selector、analyze_stock
+        :param params: 任务参数，原样返回给查询方
+        """
+        self.id = uuid.uuid4().hex[:12]
+        self.kind = kind
+        self.params = params or {}
+        self.status = JOB_QUEUED
+        self.progress = 0
+        self.message = '等待执行...'
+        self.result: Any = None
+        self.error: Optional[str] = None
+        self.created_at = time.time()
+        self.started_at: Optional[float] = None
+        self.finished_at: Optional[float] = None
+        # 取消令牌会传给数据获取和分析代码，取消时放弃排队和进行中的请求
+        self.token = CancellationToken()
+        self.future: Optional[concurrent.futures.Future] = None
+        # 进度变化时的回调，JobManager 用它把任务记录写入共享存储
+        self.on_change: Optional[Callable[['Job'], None]] = None
+
+    @property
+    def finished(self) -> bool:
+        return self.status in FINISHED_STATES
+
+    def update(self, progress: Optional[int] = None, message: Optional[str] = None):
+        """更新进度和提示信息"""
+        if progress is not None:
+            self.progress = progress
+        if message is not None:
+            self.message = message
+        if self.on_change is not None:
+            self.on_change(self)
+
+    def cancelled(self) -> bool:
+        return self.token.cancelled
+
+    def check_cancelled(self):
+        """在阶段之间调用，已请求取消时抛出 JobCancelled"""
+        self.token.raise_if_cancelled()
+
+    def to_dict(self, include_result: bool = True) -> Dict:
+        data = {
+            'job_id': self.id,
+            'kind': self.kind,
+            'params': self.params,
+            'status': self.status,
+            'progress': self.progress,
+            'message': self.message,
+            'error': self.error,
+            'created_at': _format_time(self.created_at),
+            'started_at': _format_time(self.started_at),
+            'finished_at': _format_time(self.finished_at),
+            'elapsed': round((self.finished_at or time.time()) - (self.started_at or self.created_at), 2)
+        }
+        if include_result:
+            data['result'] = self.result
+        return data
+
+
+class JobManager:
+    def __init__(self, max_workers: int = 4, ttl: int = 3600, max_jobs: int = 200,
+                 store=None, signals=None):
+        """
+        后台任务管理：有界线程池执行任务，按ID查询进度和结果，结束的任务保留ttl秒
+        :param max_workers: 同时执行的任务数，超出的任务排队等待
+        :param ttl: 已结束任务的保留时间（秒）
+        :param max_jobs: 最多保留的任务数，超出时先清理最早结束的任务
+        :param store: 共享状态存储（state_store.StateStore），提供时任务记录对其他worker进程可见
+        :param signals: 跨worker的取消信号（state_store.CancelSignals），其他worker可以取消本进程的任务
+        """
+        self.max_workers = max_workers
+        self.ttl = ttl
+        self.max_jobs = max_jobs
+        self.store = store
+        self.signals = signals
+        self.jobs: Dict[str, Job] = {}
+        self.lock = threading.Lock()
+        self.pool = concurrent.futures.ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix='job')
+
+    def submit(self, kind: str, func: Callable[..., Any], *args, params: Optional[Dict] = None, **kwargs) -> Job:
+        """
+        提交任务
+        :param kind: 任务类型
+        :param func: 任务函数 func(job, *args, **kwargs)，返回值作为任务结果
+        :param params: 任务参数
+        :return: Job
+        """
+        job = Job(kind, params)
+        with self.lock:
+            self.jobs[job.id] = job
+        if self.store is not None:
+            job.on_change = self._save
+            self.store.update('jobs', lambda ids: [job.id] + [i for i in ids if i != job.id][:self.max_jobs - 1], [])
+            self._save(job)
+        if self.signals is not None:
+            self.signals.register(f"job:{job.id}", job.token)
+        self.purge()
+        job.future = self.pool.submit(self._run, job, func, args, kwargs)
+        logger.info(f"已提交任务 {kind} [{job.id}]")
+        return job
+
+    def _save(self, job: Job):
+        """把任务记录写入共享存储"""
+        if self.store is None:
+            return
+        try:
+            self.store.set(f"job:{job.id}", job.to_dict())
+        except Exception as e:
+            logger.error(f"保存任务记录失败 [{job.id}]: {str(e)}")
+
+    def _finish(self, job: Job):
+        if self.signals is not None:
+            self.signals.unregister(f"job:{job.id}", job.token)
+        self._save(job)
+
+    def _run(self, job: Job, func: Callable[..., Any], args, kwargs):
+        if job.cancelled():
+            job.status = JOB_CANCELLED
+            job.message = '已取消'
+            job.finished_at = time.time()
+            self._finish(job)
+            return
+        job.status = JOB_RUNNING
+        job.started_at = time.time()
+        job.message = '正在执行...'
+        self._save(job)
+        try:
+            job.result = func(job, *args, **kwargs)
+            job.status = JOB_COMPLETED
+            job.progress = 100
+            job.message = '执行完成'
+        except JobCancelled:
+            job.status = JOB_CANCELLED
+            job.message = '已取消'
+        except Exception as e:
+            logger.error(f"任务 {job.kind} [{job.id}] 执行失败: {str(e)}", exc_info=True)
+            job.status = JOB_ERROR
+            job.error = str(e)
+            job.message = '执行失败'
+        finally:
+            job.finished_at = time.time()
+            self._finish(job)
+
+    def get(self, job_id: str) -> Optional[Job]:
+        self.purge()
+        with self.lock:
+            return self.jobs.get(job_id)
+
+    def list_jobs(self, kind: Optional[str] = None) -> List[Job]:
+        """按提交时间倒序返回任务"""
+        self.purge()
+        with self.lock:
+            jobs = [job for job in self.jobs.values() if kind is None or job.kind == kind]
+        return sorted(jobs, key=lambda job: job.created_at, reverse=True)
+
+    def get_record(self, job_id: str, include_result: bool = True) -> Optional[Dict]:
+        """
+        查询任务记录：本进程的任务直接返回，其他worker进程的任务从共享存储读取
+        :return: 任务不存在或已过期时返回None
+        """
+        job = self.get(job_id)
+        if job is not None:
+            return job.to_dict(include_result)
+        if self.store is None:
+            return None
+        record = self.store.get(f"job:{job_id}")
+        if record is not None and not include_result:
+            record.pop('result', None)
+        return record
+
+    def list_records(self, kind: Optional[str] = None) -> List[Dict]:
+        """
+        按提交时间倒序返回所有worker进程的任务记录（不含结果）
+        """
+        if self.store is None:
+            return [job.to_dict(include_result=False) for job in self.list_jobs(kind)]
+        records = []
+        for job_id in self.store.get('jobs', []):
+            record = self.get_record(job_id, include_result=False)
+            if record is not None and (kind is None or record['kind'] == kind):
+                records.append(record)
+        return records
+
+    def cancel_record(self, job_id: str) -> Optional[Dict]:
+        """
+        取消任意worker进程中的任务，其他进程的任务通过取消信号在下一次检查时取消
+        :return: 任务记录，任务不存在时返回None
+        """
+        job = self.cancel(job_id)
+        if job is not None:
+            return job.to_dict(include_result=False)
+        record = self.get_record(job_id, include_result=False)
+        if record is None:
+            return None
+        if record['status'] not in FINISHED_STATES and self.signals is not None:
+            self.signals.request(f"job:{job_id}")
+        return record
+
+    def cancel(self, job_id: str) -> Optional[Job]:
+        """
+        请求取消任务：排队中的任务直接取消，执行中的任务在下一个检查点结束
+        :return: 任务不存在时返回None
+        """
+        job = self.get(job_id)
+        if job is None:
+            return None
+        if not job.finished:
+            job.token.cancel()
+            if job.future is not None and job.future.cancel():
+                job.status = JOB_CANCELLED
+                job.message = '已取消'
+                job.finished_at = time.time()
+                self._finish(job)
+        return job
+
+    def purge(self):
+        """清理超过保留时间的已结束任务，并把任务数控制在max_jobs以内"""
+        now = time.time()
+        with self.lock:
+            expired = [job_id for job_id, job in self.jobs.items()
+                       if job.finished and job.finished_at is not None and now - job.finished_at > self.ttl]
+            overflow = len(self.jobs) - len(expired) - self.max_jobs
+            if overflow > 0:
+                finished = sorted((job for job_id, job in self.jobs.items() if job.finished and job_id not in expired),
+                                  key=lambda job: job.finished_at)
+                expired.extend(job.id for job in finished[:overflow])
+            for job_id in expired:
+                del self.jobs[job_id]
+
+        if self.store is not None and expired:
+            removed = set(expired)
+            for job_id in expired:
+                self.store.delete(f"job:{job_id}")
+            self.store.update('jobs', lambda ids: [i for i in ids if i not in removed], [])
+
+    def shutdown(self, wait: bool = False):
+        for job in self.list_jobs():
+            job.token.cancel()
+        self.pool.shutdown(wait=wait, cancel_futures=True)
+
+
+class SharedRun:
+    def __init__(self, key: str):
+        """
+        一次被多个调用方共享的执行
+        :param key: 执行的类型，同类型同一时间只执行一次
+        """
+        self.key = key
+        self.future: concurrent.futures.Future = concurrent.futures.Future()
+        self.token = CancellationToken()
+        self.callers = 0
+        self.cancelled_callers = 0
+        self.started_at = time.time()
+
+
+class RunCoordinator:
+    def __init__(self, store=None, lease_ttl: float = 15.0, poll_interval: float = 0.5):
+        """
+        合并重叠的执行：同类型的执行正在进行时，新的调用方直接等待并共享它的结果，不再重复执行
+        只有所有调用方都取消后，共享的执行才会被取消
+        :param store: 共享状态存储（state_store.StateStore），提供时用租约保证所有worker进程中同类型只执行一次，
+                      其他进程等待执行者写入存储的结果（结果需可JSON序列化）
+        :param lease_ttl: 执行租约的有效期（秒），执行者崩溃后其他进程最多等待这么久再重新执行
+        :param poll_interval: 等待其他进程的执行结果时的检查间隔（秒）
+        """
+        self.store = store
+        self.lease_ttl = lease_ttl
+        self.poll_interval = poll_interval
+        self.lock = threading.Lock()
+        self.runs: Dict[str, SharedRun] = {}
+
+    def is_running(self, key: str) -> bool:
+        """本进程或（使用共享存储时）其他worker进程中是否正在执行"""
+        with self.lock:
+            if key in self.runs:
+                return True
+        return self.store is not None and Lease(self.store, f"run:{key}").holder() is not None
+
+    def callers(self, key: str) -> int:
+        """当前等待该类型执行结果的调用方数量"""
+        with self.lock:
+            run = self.runs.get(key)
+            return run.callers if run else 0
+
+    def run(self, key: str, func: Callable[..., Any], *args,
+            token: Optional[CancellationToken] = None, **kwargs) -> Any:
+        """
+        执行或加入同类型的执行，阻塞直到得到结果
+        :param key: 执行的类型
+        :param func: 执行函数 func(token, *args, **kwargs)，token 为共享执行的取消令牌
+        :param token: 调用方自己的取消令牌，取消时当前调用方立即抛出 OperationCancelled
+        :return: func 的返回值（所有共享的调用方得到同一个对象）
+        """
+        with self.lock:
+            run = self.runs.get(key)
+            leader = run is None
+            if leader:
+                run = SharedRun(key)
+                self.runs[key] = run
+            run.callers += 1
+
+        if leader:
+            threading.Thread(target=self._execute, args=(run, func, args, kwargs),
+                             name=f'shared-{key}', daemon=True).start()
+        else:
+            logger.info(f"{key} 正在执行，加入已有的执行（共 {run.callers} 个调用方）")
+
+        wake = threading.Event()
+        run.future.add_done_callback(lambda f: wake.set())
+        if token is not None:
+            token.add_callback(wake.set)
+        try:
+            wake.wait()
+        finally:
+            if token is not None:
+                token.remove_callback(wake.set)
+
+        if token is not None and token.cancelled and not run.future.done():
+            self._detach(run)
+            raise OperationCancelled()
+        return run.future.result()
+
+    def _execute(self, run: SharedRun, func: Callable[..., Any], args, kwargs):
+        try:
+            if self.store is None:
+                run.future.set_result(func(run.token, *args, **kwargs))
+            else:
+                run.future.set_result(self._execute_leased(run, func, args, kwargs))
+        except BaseException as e:
+            run.future.set_exception(e)
+        finally:
+            with self.lock:
+                if self.runs.get(run.key) is run:
+                    del self.runs[run.key]
+
+    def _execute_leased(self, run: SharedRun, func: Callable[..., Any], args, kwargs) -> Any:
+        """
+        获得租约的进程执行并把结果写入存储；租约被其他进程持有时等待它的结果，
+        持有者崩溃或取消（没有写入结果就释放了租约）时重新竞争租约
+        """
+        lease = Lease(self.store, f"run:{run.key}", self.lease_ttl)
+        result_key = f"run:{run.key}:result"
+        while True:
+            run.token.raise_if_cancelled()
+            if lease.acquire():
+                try:
+                    with lease.keep_alive():
+                        try:
+                            result = func(run.token, *args, **kwargs)
+                        except Exception as e:
+                            self.store.set(result_key, {'owner': lease.owner, 'finished': time.time(), 'error': str(e)})
+                            raise
+                        self.store.set(result_key, {'owner': lease.owner, 'finished': time.time(), 'result': result})
+                        return result
+                finally:
+                    lease.release()
+
+            holder = lease.holder()
+            if holder is not None:
+                logger.info(f"{run.key} 正在其他worker进程中执行，等待结果")
+                while lease.holder() == holder:
+                    if run.token.wait(self.poll_interval):
+                        raise OperationCancelled()
+            record = self.store.get(result_key)
+            # 等待的执行已结束，或在本次调用开始之后刚好结束（获取租约失败后持有者已释放）
+            if record and (record.get('owner') == holder or record.get('finished', 0) >= run.started_at):
+                if 'error' in record:
+                    raise RuntimeError(record['error'])
+                return record['result']
+            if holder is not None:
+                logger.info(f"{run.key} 在其他worker进程中没有完成，重新执行")
+
+    def _detach(self, run: SharedRun):
+        """调用方取消等待；所有调用方都取消后取消共享的执行"""
+        with self.lock:
+            run.cancelled_callers += 1
+            abandoned = run.cancelled_callers >= run.callers
+            if abandoned and self.runs.get(run.key) is run:
+                # 之后的调用方开始新的执行，不再加入即将取消的执行
+                del self.runs[run.key]
+        if abandoned:
+            logger.info(f"{run.key} 的所有调用方都已取消，停止执行")
+            run.token.cancel()
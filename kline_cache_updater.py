@@ -4,6 +4,7 @@ import time
 from datetime import datetime, timezone, timedelta
 from stock_selector import KLineDataFetcher, StockSelector
 from data_fetcher import DataFetcher
+from trading_calendar import TradingCalendar
 
 # 设置时区为北京时间（东八区）
 BEIJING_TZ = timezone(timedelta(hours=8))
@@ -29,36 +30,54 @@ class KLineCacheUpdater:
     def __init__(self):
         self.kline_fetcher = KLineDataFetcher()
         self.data_fetcher = DataFetcher()
+        self.calendar = TradingCalendar()
     
-    def update_all_stocks_cache(self):
-        """更新所有股票的K线缓存"""
+    def update_all_stocks_cache(self, stock_codes=None, token=None):
+        """
+        更新所有股票的K线缓存
+        :param stock_codes: 要更新的股票代码，为None时使用代码表中的全部股票
+        :param token: 取消令牌
+        :return: 成功获取K线的股票数
+        """
         try:
             logger.info("开始更新所有股票的K线缓存")
             
-            # 获取所有股票列表
-            all_stocks = self.data_fetcher.get_all_stocks()
+            if stock_codes is None:
+                stock_codes = self.data_fetcher.get_listed_codes(token=token)
             
-            if not all_stocks:
+            if not stock_codes:
                 logger.warning("未获取到股票列表")
-                return
+                return 0
             
-            stock_codes = [stock['code'] for stock in all_stocks]
             logger.info(f"共 {len(stock_codes)} 只股票需要更新缓存")
             
-            # 批量获取K线数据（会自动更新缓存）
-            self.kline_fetcher.get_kline_data_batch(stock_codes, days=60)
+            # 流式获取K线数据（会自动更新缓存），数据写入缓存后即丢弃，不在内存中累积
+            updated = 0
+            for _, kline_data in self.kline_fetcher.iter_kline_data_batch(stock_codes, days=60, token=token):
+                if kline_data is not None:
+                    updated += 1
             
-            logger.info("K线缓存更新完成")
+            logger.info(f"K线缓存更新完成，成功 {updated}/{len(stock_codes)} 只")
+            return updated
             
         except Exception as e:
             logger.error(f"更新K线缓存时发生错误: {str(e)}")
+            return 0
+    
+    def update_after_trading_day(self):
+        """前一天是交易日时才更新：周末和节假日之后没有新的K线"""
+        yesterday = self.calendar.now().date() - timedelta(days=1)
+        if not self.calendar.is_trading_day(yesterday):
+            logger.info(f"{yesterday} 休市，没有新的K线，跳过缓存更新")
+            return 0
+        return self.update_all_stocks_cache()
     
     def start(self):
         """启动定时任务"""
         logger.info("K线缓存更新器启动")
         
         # 每天凌晨2点更新一次缓存
-        schedule.every().day.at("02:00").do(self.update_all_stocks_cache)
+        schedule.every().day.at("02:00").do(self.update_after_trading_day)
         
         # 启动时立即执行一次
         self.update_all_stocks_cache()
@@ -66,7 +85,8 @@ class KLineCacheUpdater:
         # 运行定时任务
         while True:
             schedule.run_pending()
-            time.sleep(60)  # 每分钟检查一次
+            # 直接睡到下一次更新时间，最长一小时
+            time.sleep(min(max(schedule.idle_seconds() or 60, 1), 3600))
 
 if __name__ == "__main__":
     updater = KLineCacheUpdater()
@@ -0,0 +1,94 @@
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_prompt(text: str) -> str:
+    """去掉行首尾空白和多余空行，只有空白不同的提示词得到同一个键"""
+    lines = [re.sub(r'[ \t]+', ' ', line).strip() for line in text.strip().splitlines()]
+    return '\n'.join(line for line in lines if line)
+
+
+def cache_key(request: Dict) -> str:
+    """
+    根据请求内容计算缓存键：规范化后的消息和模型参数的SHA-256
+    :param request: 对话补全请求体 {'model', 'messages', 'temperature', 'max_tokens', ...}
+    """
+    normalized = dict(request)
+    normalized['messages'] = [dict(message, content=normalize_prompt(message.get('content', '')))
+                              for message in request.get('messages', [])]
+    payload = json.dumps(normalized, ensure_ascii=False, sort_keys=True, separators=(',', ':'))
+    return hashlib.sha256(payload.encode('utf-8')).hexdigest()
+
+
+class LLMCache:
+    def __init__(self, path: str = os.path.join('data_cache', 'llm_cache.db'),
+                 ttl: float = 4 * 3600, max_entries: int = 10000):
+        """
+        大模型回复缓存：提示词和模型参数相同的请求直接返回之前的回复，保存在SQLite中，服务重启后仍然有效
+        :param path: 数据库文件路径
+        :param ttl: 回复的有效期（秒）
+        :param max_entries: 最多保存的回复数，超出时淘汰最久未使用的
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self.local = threading.local()
+        self.hits = 0
+        self.misses = 0
+        self._conn().execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, content TEXT NOT NULL, "
+                             "created_at REAL NOT NULL, accessed_at REAL NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        # sqlite3连接不能跨线程使用，每个线程一个连接
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            self.local.conn = conn
+        return conn
+
+    def __len__(self) -> int:
+        return self._conn().execute("SELECT COUNT(*) FROM responses").fetchone()[0]
+
+    def get(self, key: str) -> Optional[str]:
+        """
+        :return: 缓存的回复，不存在或已过期时返回None
+        """
+        now = time.time()
+        conn = self._conn()
+        row = conn.execute("SELECT content, created_at FROM responses WHERE key = ?", (key,)).fetchone()
+        if row is None or now - row[1] > self.ttl:
+            self.misses += 1
+            return None
+        conn.execute("UPDATE responses SET accessed_at = ? WHERE key = ?", (now, key))
+        self.hits += 1
+        return row[0]
+
+    def set(self, key: str, content: str):
+        now = time.time()
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO responses (key, content, created_at, accessed_at) VALUES (?, ?, ?, ?)",
+                     (key, content, now, now))
+        self.prune(now)
+
+    def prune(self, now: Optional[float] = None):
+        """删除过期的回复，并淘汰最久未使用的回复直到不超过 max_entries"""
+        now = now or time.time()
+        conn = self._conn()
+        conn.execute("DELETE FROM responses WHERE created_at < ?", (now - self.ttl,))
+        overflow = len(self) - self.max_entries
+        if overflow > 0:
+            conn.execute("DELETE FROM responses WHERE key IN "
+                         "(SELECT key FROM responses ORDER BY accessed_at LIMIT ?)", (overflow,))
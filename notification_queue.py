@@ -0,0 +1,114 @@
+import hashlib
+import json
+import logging
+import queue
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+logger = logging.getLogger(__name__)
+
+
+class NotificationQueue:
+    def __init__(self, max_retries: int = 3, backoff: float = 2.0, dedup_window: float = 600,
+                 max_pending: int = 100):
+        """
+        后台通知队列：调用方只负责入队，由一个后台线程按顺序发送，失败时按指数退避重试
+        :param max_retries: 每条通知的最大重试次数
+        :param backoff: 第一次重试前的等待（秒），之后每次翻倍
+        :param dedup_window: 去重时间窗口（秒），窗口内相同的通知只发送一次
+        :param max_pending: 最多排队的通知数，队列满时丢弃新通知
+        """
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.dedup_window = dedup_window
+        self.queue = queue.Queue(maxsize=max_pending)
+        self.lock = threading.Lock()
+        self.idle = threading.Condition(self.lock)
+        # 去重键 -> 入队时间，包括排队中和已发送的通知
+        self.recent: Dict[str, float] = {}
+        self.pending = 0
+        self.sent = 0
+        self.failed = 0
+        self.worker = None
+
+    @staticmethod
+    def key_of(payload: Any) -> str:
+        return hashlib.sha256(json.dumps(payload, ensure_ascii=False, sort_keys=True).encode('utf-8')).hexdigest()
+
+    def submit(self, send: Callable[[Any], None], payload: Any, key: Optional[str] = None) -> bool:
+        """
+        通知入队，立即返回
+        :param send: 发送函数，失败时抛出异常
+        :param payload: 通知内容
+        :param key: 去重键，默认使用通知内容的哈希
+        :return: 是否入队；重复或队列已满时返回False
+        """
+        key = key or self.key_of(payload)
+        with self.lock:
+            now = time.time()
+            self.recent = {k: t for k, t in self.recent.items() if now - t < self.dedup_window}
+            if key in self.recent:
+                logger.info("相同的通知已在发送或已发送，跳过")
+                return False
+            try:
+                self.queue.put_nowait((send, payload, key))
+            except queue.Full:
+                logger.warning("通知队列已满，丢弃通知")
+                return False
+            self.recent[key] = now
+            self.pending += 1
+            if self.worker is None or not self.worker.is_alive():
+                self.worker = threading.Thread(target=self._run, name='notification-queue', daemon=True)
+                self.worker.start()
+        return True
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        等待队列中的通知全部处理完（发送成功或放弃）
+        :return: 超时前是否处理完
+        """
+        with self.idle:
+            return self.idle.wait_for(lambda: self.pending == 0, timeout)
+
+    def _run(self):
+        while True:
+            send, payload, key = self.queue.get()
+            delivered = self._deliver(send, payload)
+            with self.idle:
+                if delivered:
+                    self.sent += 1
+                else:
+                    self.failed += 1
+                    # 放弃的通知不占用去重记录，之后可以重新发送
+                    self.recent.pop(key, None)
+                self.pending -= 1
+                self.idle.notify_all()
+
+    def _deliver(self, send: Callable[[Any], None], payload: Any) -> bool:
+        attempt = 0
+        while True:
+            try:
+                send(payload)
+                return True
+            except Exception as e:
+                if attempt >= self.max_retries:
+                    logger.error(f"通知发送失败，已重试{attempt}次，放弃: {str(e)}")
+                    return False
+                delay = self.backoff * (2 ** attempt)
+                logger.warning(f"通知发送失败（{str(e)}），{delay:.1f}秒后第{attempt + 1}次重试")
+                attempt += 1
+                time.sleep(delay)
+
+
+_default_queue = None
+_default_queue_lock = threading.Lock()
+
+
+def default_queue() -> NotificationQueue:
+    """进程内共享的通知队列，所有通知按提交顺序由同一个后台线程发送"""
+    global _default_queue
+    with _default_queue_lock:
+        if _default_queue is None:
+            _default_queue = NotificationQueue()
+        return _default_queue
@@ -0,0 +1,119 @@
+import logging
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Sequence, Set, Tuple
+
+import pandas as pd
+
+from cancellation import CancellationToken, raise_if_cancelled
+from stock_selector import StockSelector, records_from_snapshot
+
+logger = logging.getLogger(__name__)
+
+# 批量行情接口可以返回的字段，顺序即默认的列顺序
+QUOTE_FIELDS = ('code', 'name', 'price', 'open', 'high', 'low', 'yesterday_close', 'change_percent',
+                'volume', 'amount', 'volume_ratio', 'order_ratio', 'turnover_rate')
+
+
+class QuoteSnapshot:
+    def __init__(self, selector: Optional[StockSelector] = None, max_age: float = 5.0):
+        """
+        进程内共享的实时行情快照：全市场下载、连续扫描和批量行情查询写入同一份快照，
+        查询只为缺失或过期的代码请求行情，同时查询同一代码的请求共用一次上游请求，不同代码的请求并行进行
+        :param selector: 提供分批实时行情请求的选股器
+        :param max_age: 行情的有效期（秒），超过后重新请求
+        """
+        self.selector = selector or StockSelector()
+        self.max_age = max_age
+        self.lock = threading.Lock()
+        # 正在请求的代码 -> 请求完成事件；查询同一代码的其他查询等待它，而不是重复请求
+        self.inflight: Dict[str, threading.Event] = {}
+        self.quotes: Dict[str, Dict] = {}
+        self.updated: Dict[str, float] = {}
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.quotes)
+
+    def update(self, records: Iterable[Dict], at: Optional[float] = None):
+        """
+        写入实时行情（get_realtime_data 或 records_from_snapshot 的格式）
+        :param at: 行情时间，默认为当前时间
+        """
+        at = at or time.time()
+        with self.lock:
+            for record in records:
+                self.quotes[record['code']] = record
+                self.updated[record['code']] = at
+
+    def update_frame(self, market_data: pd.DataFrame):
+        """写入 DataFetcher 下载的全市场行情快照"""
+        self.update(records_from_snapshot(market_data))
+
+    def _claim(self, codes: Sequence[str], now: float) -> Tuple[List[str], threading.Event, Set[threading.Event]]:
+        """
+        在锁内划分缺失或过期的代码
+        :return: (由本查询请求的代码, 本查询请求完成的事件, 需要等待的其他查询的事件)
+        """
+        done = threading.Event()
+        own = []
+        waiting = set()
+        with self.lock:
+            for code in codes:
+                if now - self.updated.get(code, 0) <= self.max_age:
+                    continue
+                event = self.inflight.get(code)
+                if event is None:
+                    self.inflight[code] = done
+                    own.append(code)
+                elif event is not done:
+                    waiting.add(event)
+        return own, done, waiting
+
+    def get(self, codes: Sequence[str], token: Optional[CancellationToken] = None) -> Dict[str, Dict]:
+        """
+        获取股票的实时行情
+        :param codes: 股票代码列表
+        :param token: 取消令牌
+        :return: {代码: 行情}，停牌或不存在的代码不在结果中
+        """
+        requested = time.time()
+        own, done, waiting = self._claim(codes, requested)
+        if own:
+            try:
+                logger.info(f"批量行情: 请求 {len(own)} 只股票的最新行情")
+                for batch in self.selector.iter_realtime_batches(own, token=token):
+                    self.update(batch, requested)
+                # 没有返回行情的代码（停牌或不存在）也记录请求时间，有效期内不再重复请求
+                with self.lock:
+                    for code in own:
+                        self.updated[code] = requested
+            finally:
+                with self.lock:
+                    for code in own:
+                        self.inflight.pop(code, None)
+                done.set()
+
+        # 其他查询正在请求的代码，等它们写入快照（请求失败时返回快照中已有的行情）
+        for event in waiting:
+            while not event.wait(0.2):
+                raise_if_cancelled(token)
+
+        with self.lock:
+            return {code: self.quotes[code] for code in codes if code in self.quotes}
+
+    @staticmethod
+    def to_columns(quotes: Dict[str, Dict], codes: Sequence[str], fields: Sequence[str] = QUOTE_FIELDS) -> Dict:
+        """
+        转换为按列组织的结果，字段名只出现一次
+        :param quotes: get 返回的行情
+        :param codes: 股票代码列表，决定行的顺序
+        :param fields: 返回的字段
+        :return: {'fields': [...], 'columns': {字段: [...]}, 'missing': [没有行情的代码]}
+        """
+        found = [code for code in codes if code in quotes]
+        return {
+            'fields': list(fields),
+            'columns': {field: [quotes[code].get(field) for code in found] for field in fields},
+            'missing': [code for code in codes if code not in quotes]
+        }
@@ -0,0 +1,110 @@
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+def _band(values: np.ndarray, low: float, high: float) -> np.ndarray:
+    """落在[low, high]区间内为1，否则为0"""
+    return ((values >= low) & (values <= high)).astype(float)
+
+
+def _closeness(values: np.ndarray, center: float, width: float) -> np.ndarray:
+    """越接近center得分越高，距离超过width为0"""
+    return np.clip(1 - np.abs(values - center) / width, 0, 1)
+
+
+# 因子：从候选股票的字段数组计算 0~1 的得分
+FACTORS: Dict[str, Callable[[Dict[str, np.ndarray]], np.ndarray]] = {
+    # 缩量程度：量比 < 0.5 为满分，< 0.8 为 2/3
+    'volume_shrink': lambda c: np.where(c['volume_ratio'] < 0.5, 1.0, np.where(c['volume_ratio'] < 0.8, 2 / 3, 0.0)),
+    # 换手率在 3% - 8% 之间
+    'turnover_band': lambda c: _band(c['turnover_rate'], 3, 8),
+    # 跌幅在 2% - 5% 之间
+    'pullback_band': lambda c: _band(c['change_percent'], -5, -2),
+    # 委比为正
+    'order_positive': lambda c: (c['order_ratio'] > 0).astype(float),
+    # 量比越大越活跃，5倍封顶
+    'volume_active': lambda c: np.clip(c['volume_ratio'], 0, 5) / 5,
+    # 涨幅越接近 4% 越好
+    'change_mid': lambda c: _closeness(c['change_percent'], 4, 1),
+    # 换手率越接近 7.5% 越好
+    'turnover_mid': lambda c: _closeness(c['turnover_rate'], 7.5, 2.5)
+}
+
+# 因子使用的字段
+FACTOR_FIELDS = ('volume_ratio', 'turnover_rate', 'change_percent', 'order_ratio')
+
+# "买阴不买阳"的默认权重，得分与原有的优先级分档一致（满分8分）
+YIN_LINE_WEIGHTS = {'volume_shrink': 3, 'turnover_band': 2, 'pullback_band': 2, 'order_positive': 1}
+
+# 陈小群策略的默认权重
+CHEN_WEIGHTS = {'volume_active': 2, 'change_mid': 1, 'turnover_mid': 1}
+
+# 得分相同时依次比较的字段和方向
+DEFAULT_TIE_BREAKERS: Tuple[Tuple[str, str], ...] = (('volume_ratio', 'asc'), ('code', 'asc'))
+
+
+def score_stocks(stocks: List[Dict], weights: Optional[Dict[str, float]] = None) -> np.ndarray:
+    """
+    计算候选股票的加权因子得分
+    :param stocks: 股票列表
+    :param weights: {因子名: 权重}，默认使用 YIN_LINE_WEIGHTS
+    :return: 与stocks等长的得分数组
+    """
+    weights = weights or YIN_LINE_WEIGHTS
+    unknown = [name for name in weights if name not in FACTORS]
+    if unknown:
+        raise ValueError(f"未知的排序因子: {', '.join(unknown)}")
+
+    columns = {
+        field: np.array([stock.get(field) or 0 for stock in stocks], dtype=float)
+        for field in FACTOR_FIELDS
+    }
+    scores = np.zeros(len(stocks))
+    for name, weight in weights.items():
+        if weight:
+            scores += weight * FACTORS[name](columns)
+    return scores
+
+
+def _sort_key(stocks: List[Dict], indices: np.ndarray, field: str, direction: str) -> np.ndarray:
+    """把排序字段转换为lexsort可用的升序键"""
+    values = np.array([stocks[i].get(field) for i in indices])
+    if values.dtype.kind not in 'biuf':
+        # 非数值字段先转换为排名，便于降序
+        _, values = np.unique(values.astype(str), return_inverse=True)
+    return -values if direction == 'desc' else values
+
+
+def rank_stocks(stocks: List[Dict], weights: Optional[Dict[str, float]] = None, k: Optional[int] = None,
+                tie_breakers: Sequence[Tuple[str, str]] = DEFAULT_TIE_BREAKERS) -> List[Dict]:
+    """
+    按加权因子得分排序，只对前K名做完整排序
+    :param stocks: 候选股票列表
+    :param weights: {因子名: 权重}
+    :param k: 返回前K只，为None时返回全部
+    :param tie_breakers: 得分相同时的比较字段 [(字段, 'asc'|'desc')]
+    :return: 排序后的股票列表（新字典，带 score 字段）
+    """
+    n = len(stocks)
+    if n == 0 or k == 0:
+        return []
+
+    scores = score_stocks(stocks, weights)
+
+    if k is None or k >= n:
+        candidates = np.arange(n)
+    else:
+        # argpartition 找出第K名的得分，再把与其同分的股票一起纳入，保证并列时按规则取舍
+        top = np.argpartition(-scores, k - 1)[:k]
+        threshold = scores[top].min()
+        candidates = np.flatnonzero(scores >= threshold)
+
+    # lexsort 以最后一个键为主键
+    keys = [_sort_key(stocks, candidates, field, direction) for field, direction in reversed(tie_breakers)]
+    keys.append(-scores[candidates])
+    ordered = candidates[np.lexsort(keys)]
+    if k is not None:
+        ordered = ordered[:k]
+
+    return [dict(stocks[i], score=round(float(scores[i]), 4)) for i in ordered]
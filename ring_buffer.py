@@ -0,0 +1,63 @@
+import threading
+from typing import Any, List, Tuple
+
+
+class RingBuffer:
+    def __init__(self, capacity: int = 1000):
+        """
+        固定容量的环形缓冲区，每个元素带递增序号，写满后覆盖最早的元素
+        读取方保存上次收到的序号作为游标，只取之后的新元素
+        :param capacity: 保留的元素数
+        """
+        if capacity <= 0:
+            raise ValueError("容量必须大于0")
+        self.capacity = capacity
+        self.items: List[Any] = [None] * capacity
+        # 下一个元素的序号，序号从1开始，0表示尚未收到任何元素
+        self.next_seq = 1
+        self.lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return min(self.next_seq - 1, self.capacity)
+
+    @property
+    def last_seq(self) -> int:
+        return self.next_seq - 1
+
+    def append(self, item: Any) -> int:
+        """
+        写入元素，O(1)
+        :return: 元素的序号
+        """
+        with self.lock:
+            seq = self.next_seq
+            self.items[seq % self.capacity] = item
+            self.next_seq += 1
+            return seq
+
+    def extend(self, items: List[Any]) -> List[int]:
+        """
+        批量写入元素
+        :return: 各元素的序号
+        """
+        with self.lock:
+            first = self.next_seq
+            for item in items:
+                self.items[self.next_seq % self.capacity] = item
+                self.next_seq += 1
+            return list(range(first, self.next_seq))
+
+    def since(self, cursor: int = 0) -> Tuple[List[Any], int, bool]:
+        """
+        读取序号大于cursor的元素
+        :param cursor: 读取方已收到的最后一个序号
+        :return: (元素列表, 新游标, 是否需要重置：元素已被覆盖而丢失，或游标无效)
+        """
+        with self.lock:
+            last = self.next_seq - 1
+            oldest = max(1, self.next_seq - self.capacity)
+            # 游标超过最新序号说明服务已重启，从头读取
+            reset = cursor + 1 < oldest or cursor > last
+            start = oldest if reset else cursor + 1
+            items = [self.items[seq % self.capacity] for seq in range(start, last + 1)]
+            return items, last, reset
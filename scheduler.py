@@ -4,6 +4,9 @@ import logging
 from datetime import datetime
 from stock_selector import ScheduledStockSelector
 from data_fetcher import DataFetcher
+from kline_cache_updater import KLineCacheUpdater
+from notification_queue import default_queue
+from trading_calendar import TradingCalendar
 
 logging.basicConfig(
     level=logging.INFO,
@@ -17,59 +20,105 @@ logger = logging.getLogger(__name__)
 
 FEISHU_WEBHOOK = "https://open.feishu.cn/open-apis/bot/v2/hook/d6930274-cf9f-48d9-80d9-b1f735c43fc2"
 
+MARKETS = ['sh', 'sz', 'cyb']
+
+# 预热时间：开盘前和午间休市，14:30 选股时代码表和K线缓存都已就绪，只需下载实时行情
+# K线缓存只保存已收盘的日K线，开盘前的预热取到上一交易日收盘为止，午间预热只补齐开盘前失败的股票
+WARMUP_TIMES = ["09:00", "12:00"]
+
 def get_all_stock_codes():
     logger.info("开始获取所有股票代码")
     fetcher = DataFetcher()
     
-    all_codes = []
-    markets = ['sh', 'sz', 'cyb']
-    
-    for market in markets:
-        logger.info(f"获取 {market} 市场股票数据")
-        data = fetcher.get_stock_data(market)
-        
-        if not data.empty:
-            codes = data['代码'].tolist()
-            all_codes.extend(codes)
-            logger.info(f"{market} 市场获取到 {len(codes)} 只股票")
-        else:
-            logger.warning(f"{market} 市场未获取到数据")
+    # 预热后直接读取代码表，不再为了拿代码下载一遍全市场行情
+    all_codes = fetcher.get_listed_codes(MARKETS)
     
     logger.info(f"总共获取到 {len(all_codes)} 只股票代码")
     return all_codes
 
+def warm_up():
+    """
+    预热任务：刷新股票代码表，再按代码表把K线缓存补齐
+    上一交易日收盘前写入的缓存视为过期，会重新获取；盘中获取时丢弃当天未收盘的K线
+    """
+    logger.info("=" * 60)
+    logger.info(f"开始执行预热任务 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
+    logger.info("=" * 60)
+    
+    try:
+        fetcher = DataFetcher()
+        stock_codes = []
+        for market in MARKETS:
+            codes = fetcher.refresh_symbol_registry(market)
+            if not codes:
+                # 刷新失败时沿用旧代码表（可能也不存在）
+                codes = fetcher.get_symbol_registry(market) or []
+            stock_codes.extend(codes)
+        
+        if not stock_codes:
+            logger.error("未获取到股票代码，跳过K线预热")
+            return
+        
+        updater = KLineCacheUpdater()
+        updated = updater.update_all_stocks_cache(stock_codes)
+        logger.info(f"预热任务完成，代码表 {len(stock_codes)} 只，K线缓存 {updated} 只")
+        
+    except Exception as e:
+        logger.error(f"预热任务执行失败: {str(e)}", exc_info=True)
+
 def job():
     logger.info("=" * 60)
     logger.info(f"开始执行定时选股任务 - {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}")
     logger.info("=" * 60)
     
     try:
-        stock_codes = get_all_stock_codes()
+        # 只下载一次全市场行情，直接用快照选股（有代码表时只请求已上市的代码）
+        fetcher = DataFetcher()
+        snapshot = fetcher.get_all_markets_data(markets=MARKETS)
+        total = sum(len(data) for data in snapshot.values())
         
-        if not stock_codes:
-            logger.error("未获取到股票代码，任务终止")
+        if total == 0:
+            logger.error("未获取到行情数据，任务终止")
             return
         
+        logger.info(f"总共获取到 {total} 只股票的行情")
         scheduler = ScheduledStockSelector(FEISHU_WEBHOOK)
-        result = scheduler.run_selection(stock_codes)
+        result = scheduler.run_selection(snapshot=snapshot)
         
         logger.info(f"选股任务完成，共筛选出 {len(result)} 只股票")
         
     except Exception as e:
         logger.error(f"定时任务执行失败: {str(e)}", exc_info=True)
 
+def run_on_trading_day(task, calendar=None):
+    """
+    只在交易日执行定时任务，周末和节假日不请求行情
+    :param task: 任务函数
+    :param calendar: 交易日历
+    """
+    calendar = calendar or TradingCalendar()
+    if not calendar.is_trading_day():
+        logger.info(f"今天休市，跳过 {task.__name__}")
+        return
+    task()
+
 def run_scheduler():
     logger.info("启动股票筛选定时任务")
     logger.info("执行时间: 每天下午 14:30")
+    logger.info(f"预热时间: 每天 {', '.join(WARMUP_TIMES)}")
     
-    schedule.every().day.at("14:30").do(job)
+    calendar = TradingCalendar()
+    for warmup_time in WARMUP_TIMES:
+        schedule.every().day.at(warmup_time).do(run_on_trading_day, warm_up, calendar)
+    schedule.every().day.at("14:30").do(run_on_trading_day, job, calendar)
     
     logger.info("定时任务已启动，等待执行...")
     logger.info("按 Ctrl+C 停止程序")
     
     while True:
         schedule.run_pending()
-        time.sleep(60)
+        # 直接睡到下一个任务的执行时间，最长一小时
+        time.sleep(min(max(schedule.idle_seconds() or 60, 1), 3600))
 
 if __name__ == "__main__":
     import sys
@@ -77,5 +126,10 @@ if __name__ == "__main__":
     if len(sys.argv) > 1 and sys.argv[1] == '--test':
         logger.info("测试模式：立即执行一次选股任务")
         job()
+        # 通知由后台守护线程发送，退出前等待队列发完
+        default_queue().flush(timeout=60)
+    elif len(sys.argv) > 1 and sys.argv[1] == '--warmup':
+        logger.info("立即执行一次预热任务")
+        warm_up()
     else:
         run_scheduler()
@@ -0,0 +1,203 @@
+import json
+import logging
+import os
+import tempfile
+import threading
+import time
+from typing import Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# 条件所属阶段：实时行情即可判断的条件，以及需要先获取K线数据的条件
+STAGE_REALTIME = 'realtime'
+STAGE_KLINE = 'kline'
+STAGE_ORDER = (STAGE_REALTIME, STAGE_KLINE)
+
+
+class Predicate:
+    def __init__(self, name: str, label: str, stage: str, func: Callable[..., bool]):
+        """
+        选股条件
+        :param name: 条件标识，用于统计
+        :param label: 条件说明，用于日志
+        :param stage: 所属阶段，STAGE_REALTIME 或 STAGE_KLINE
+        :param func: 判断函数 func(stock, kline_data) -> bool
+        """
+        if stage not in STAGE_ORDER:
+            raise ValueError(f"未知的条件阶段: {stage}")
+        self.name = name
+        self.label = label
+        self.stage = stage
+        self.func = func
+
+
+class PredicateStats:
+    def __init__(self, path: Optional[str] = os.path.join('data_cache', 'predicate_stats.json'), decay: float = 0.7):
+        """
+        跨运行累计各条件的评估次数、通过次数和耗时
+        :param path: 持久化文件路径，为None时只保存在内存中
+        :param decay: 每次运行结束时历史统计的衰减系数，使排序跟随当天的选择性变化
+        """
+        self.path = path
+        self.decay = decay
+        self.lock = threading.Lock()
+        self.stats: Dict[str, Dict[str, float]] = {}
+        self._load()
+
+    def _load(self):
+        if not self.path or not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r', encoding='utf-8') as f:
+                self.stats = json.load(f)
+        except Exception as e:
+            logger.error(f"加载条件统计失败: {str(e)}")
+            self.stats = {}
+
+    def save(self):
+        if not self.path:
+            return
+        try:
+            directory = os.path.dirname(self.path)
+            if directory and not os.path.exists(directory):
+                os.makedirs(directory)
+            with self.lock:
+                snapshot = json.dumps(self.stats, ensure_ascii=False, indent=2)
+            # 先写临时文件再替换：并发保存或写入中途退出时，其他进程读到的都是完整的文件
+            fd, temp_path = tempfile.mkstemp(dir=directory or '.', prefix='.predicate_stats.', suffix='.tmp')
+            try:
+                with os.fdopen(fd, 'w', encoding='utf-8') as f:
+                    f.write(snapshot)
+                os.replace(temp_path, self.path)
+            except BaseException:
+                os.remove(temp_path)
+                raise
+        except Exception as e:
+            logger.error(f"保存条件统计失败: {str(e)}")
+
+    def merge_run(self, run_counts: Dict[str, Dict[str, float]]):
+        """
+        将一次运行的统计并入历史统计
+        :param run_counts: {条件名: {'evaluated', 'passed', 'cost'}}
+        """
+        with self.lock:
+            for item in self.stats.values():
+                for key in ('evaluated', 'passed', 'cost'):
+                    item[key] = item.get(key, 0) * self.decay
+            for name, counts in run_counts.items():
+                item = self.stats.setdefault(name, {'evaluated': 0, 'passed': 0, 'cost': 0})
+                for key in ('evaluated', 'passed', 'cost'):
+                    item[key] = item.get(key, 0) + counts.get(key, 0)
+
+    def pass_rate(self, name: str) -> float:
+        """平滑后的通过率，没有历史数据时为0.5"""
+        item = self.stats.get(name, {})
+        return (item.get('passed', 0) + 1) / (item.get('evaluated', 0) + 2)
+
+    def avg_cost(self, name: str, default: float = 1e-4) -> float:
+        """平均单次耗时（秒），没有历史数据时使用默认值"""
+        item = self.stats.get(name, {})
+        evaluated = item.get('evaluated', 0)
+        if evaluated <= 0:
+            return default
+        return item.get('cost', 0) / evaluated
+
+    def rank(self, name: str) -> float:
+        """
+        合取条件的最优执行顺序按 cost / (1 - pass_rate) 升序排列：
+        越便宜、越能淘汰股票的条件越靠前
+        """
+        return self.avg_cost(name) / max(1 - self.pass_rate(name), 1e-6)
+
+
+class ScreeningExecutor:
+    def __init__(self, predicates: List[Predicate], stats: Optional[PredicateStats] = None):
+        """
+        按代价和选择性排序执行选股条件
+        :param predicates: 条件列表，列表顺序作为没有统计数据时的默认顺序
+        :param stats: 跨运行的条件统计
+        """
+        self.predicates = predicates
+        self.stats = stats if stats is not None else PredicateStats()
+        self.plan: Dict[str, List[Predicate]] = {}
+        self.run_counts: Dict[str, Dict[str, float]] = {}
+        self.start_run()
+
+    def start_run(self):
+        """根据历史统计确定本次运行的条件顺序，并清空本次运行的漏斗统计"""
+        self.plan = {}
+        for stage in STAGE_ORDER:
+            stage_predicates = [p for p in self.predicates if p.stage == stage]
+            # sorted是稳定排序，统计相同时保持默认顺序
+            self.plan[stage] = sorted(stage_predicates, key=lambda p: self.stats.rank(p.name))
+        self.run_counts = {p.name: {'evaluated': 0, 'passed': 0, 'cost': 0.0} for p in self.predicates}
+
+    def merge_counts(self, run_counts: Dict[str, Dict[str, float]]):
+        """
+        把其他执行器（如分片扫描的子进程）的本次运行统计累加到当前运行
+        :param run_counts: {条件名: {'evaluated', 'passed', 'cost'}}
+        """
+        for name, counts in run_counts.items():
+            item = self.run_counts.setdefault(name, {'evaluated': 0, 'passed': 0, 'cost': 0.0})
+            for key in ('evaluated', 'passed', 'cost'):
+                item[key] += counts.get(key, 0)
+
+    def ordered(self, stage: str) -> List[Predicate]:
+        return self.plan.get(stage, [])
+
+    def evaluate(self, stage: str, stock: Dict, kline_data=None) -> Tuple[bool, Optional[str]]:
+        """
+        依次执行某阶段的条件，遇到第一个不通过的条件即停止
+        :return: (是否全部通过, 未通过的条件名)
+        """
+        for predicate in self.plan.get(stage, []):
+            started = time.perf_counter()
+            try:
+                passed = bool(predicate.func(stock, kline_data))
+            except Exception as e:
+                logger.error(f"执行条件 {predicate.name} 失败 {stock.get('code', '未知')}: {str(e)}")
+                passed = False
+            counts = self.run_counts[predicate.name]
+            counts['cost'] += time.perf_counter() - started
+            counts['evaluated'] += 1
+            if not passed:
+                return False, predicate.name
+            counts['passed'] += 1
+        return True, None
+
+    def funnel(self) -> List[Dict]:
+        """按执行顺序返回本次运行每个条件的漏斗统计"""
+        funnel = []
+        for stage in STAGE_ORDER:
+            for predicate in self.plan.get(stage, []):
+                counts = self.run_counts[predicate.name]
+                evaluated = counts['evaluated']
+                funnel.append({
+                    'name': predicate.name,
+                    'label': predicate.label,
+                    'stage': stage,
+                    'evaluated': int(evaluated),
+                    'passed': int(counts['passed']),
+                    'rejected': int(evaluated - counts['passed']),
+                    'pass_rate': counts['passed'] / evaluated if evaluated else None,
+                    'avg_cost_ms': counts['cost'] / evaluated * 1000 if evaluated else None
+                })
+        return funnel
+
+    def log_funnel(self, run_logger: logging.Logger):
+        """把本次运行的漏斗统计写入运行日志"""
+        run_logger.info("  条件漏斗（按执行顺序）:")
+        for item in self.funnel():
+            if item['evaluated']:
+                run_logger.info(
+                    f"    [{item['stage']}] {item['label']}: 评估 {item['evaluated']} 只，"
+                    f"通过 {item['passed']} 只 (通过率: {item['pass_rate'] * 100:.1f}%)，"
+                    f"平均耗时 {item['avg_cost_ms']:.3f}ms"
+                )
+            else:
+                run_logger.info(f"    [{item['stage']}] {item['label']}: 未评估")
+
+    def finish_run(self):
+        """把本次运行的统计并入历史统计并持久化，供下次运行排序"""
+        self.stats.merge_run(self.run_counts)
+        self.stats.save()
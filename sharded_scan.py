@@ -0,0 +1,191 @@
+import concurrent.futures
+import logging
+import multiprocessing
+import os
+import time
+from typing import Callable, Dict, List, Optional
+
+from cancellation import CancellationToken, OperationCancelled, raise_if_cancelled
+from screening import PredicateStats
+from stock_selector import StockSelector
+
+logger = logging.getLogger(__name__)
+
+COUNTER_KEYS = ('total', 'filtered_by_yin', 'filtered_by_kline', 'kline_failed')
+
+
+def split_shards(stock_codes: List[str], shards: int) -> List[List[str]]:
+    """
+    把股票代码切分为连续的若干片，相邻代码（同一市场）尽量落在同一片，保持每批行情请求的市场一致
+    :param stock_codes: 股票代码列表
+    :param shards: 分片数
+    :return: 非空分片列表
+    """
+    shards = max(1, min(shards, len(stock_codes)))
+    size, extra = divmod(len(stock_codes), shards)
+    result = []
+    start = 0
+    for i in range(shards):
+        end = start + size + (1 if i < extra else 0)
+        if end > start:
+            result.append(stock_codes[start:end])
+        start = end
+    return result
+
+
+def make_shard_selector(stats_snapshot: Dict, kline_workers: Optional[int] = None) -> StockSelector:
+    """
+    创建子进程使用的选股器：条件顺序与主进程一致，统计只保存在内存中，由主进程合并后持久化
+    :param stats_snapshot: 主进程的条件历史统计
+    :param kline_workers: 每个进程获取K线的线程数
+    :return: StockSelector
+    """
+    stats = PredicateStats(path=None)
+    stats.stats = stats_snapshot
+    selector = StockSelector(stats=stats)
+    if kline_workers:
+        selector.kline_fetcher.max_workers = kline_workers
+    return selector
+
+
+def shard_result(selector: StockSelector, selected_stocks: List[Dict]) -> Dict:
+    """把一个分片的选股结果和统计打包为可跨进程传递的字典"""
+    return {
+        'pid': os.getpid(),
+        'selected': selected_stocks,
+        'counters': selector.last_counters,
+        'run_counts': selector.last_run_counts
+    }
+
+
+def scan_shard(stock_codes: List[str], stats_snapshot: Dict, kline_workers: Optional[int] = None) -> Dict:
+    """
+    子进程入口：获取并筛选一个分片的股票
+    :param stock_codes: 分片内的股票代码
+    :param stats_snapshot: 主进程的条件历史统计
+    :param kline_workers: 每个进程获取K线的线程数
+    :return: shard_result 的结果
+    """
+    selector = make_shard_selector(stats_snapshot, kline_workers)
+    selected_stocks = selector.select_stocks(stock_codes)
+    return shard_result(selector, selected_stocks)
+
+
+def scan_record_shard(records: List[Dict], stats_snapshot: Dict, kline_workers: Optional[int] = None) -> Dict:
+    """
+    子进程入口：筛选一个分片的已下载行情（records_from_snapshot 的格式），只在子进程中获取K线
+    :param records: 分片内的实时行情
+    :param stats_snapshot: 主进程的条件历史统计
+    :param kline_workers: 每个进程获取K线的线程数
+    :return: shard_result 的结果
+    """
+    selector = make_shard_selector(stats_snapshot, kline_workers)
+    selected_stocks = selector.select_from_records(records)
+    return shard_result(selector, selected_stocks)
+
+
+def scan_processes() -> int:
+    """分片扫描的进程数，读取环境变量 SCAN_PROCESSES，默认1（单进程扫描）"""
+    try:
+        return max(1, int(os.environ.get('SCAN_PROCESSES', 1)))
+    except ValueError:
+        logger.warning(f"SCAN_PROCESSES 不是整数: {os.environ.get('SCAN_PROCESSES')}，使用单进程扫描")
+        return 1
+
+
+class ShardedScanner:
+    def __init__(self, processes: Optional[int] = None, selector: Optional[StockSelector] = None,
+                 kline_workers: Optional[int] = None, shard_func: Callable[..., Dict] = scan_shard,
+                 record_shard_func: Callable[..., Dict] = scan_record_shard):
+        """
+        分片扫描：把股票池切分到多个进程，每个进程独立获取行情和K线并执行筛选，
+        行情解析、DataFrame构造和指标判断等CPU密集部分不再受单个进程GIL的限制
+        :param processes: 进程数，默认为CPU核数
+        :param selector: 主进程选股器，负责合并统计、排序和持久化条件统计
+        :param kline_workers: 每个进程获取K线的线程数，默认使用 KLineDataFetcher 的设置
+        :param shard_func: 子进程执行的函数 shard_func(codes, stats_snapshot, kline_workers)，需为模块级函数
+        :param record_shard_func: 按已下载行情分片时子进程执行的函数，参数为 (records, stats_snapshot, kline_workers)
+        """
+        self.processes = processes or os.cpu_count() or 1
+        self.selector = selector or StockSelector()
+        self.kline_workers = kline_workers
+        self.shard_func = shard_func
+        self.record_shard_func = record_shard_func
+        self.last_shards: List[Dict] = []
+
+    def scan(self, stock_codes: List[str], token: Optional[CancellationToken] = None) -> List[Dict]:
+        """
+        分片执行"买阴不买阳"选股，结果和统计与单进程 select_stocks 一致
+        :param stock_codes: 股票代码列表
+        :param token: 取消令牌，取消时不再等待分片结果，抛出 OperationCancelled
+        :return: 排序后的选中股票列表
+        """
+        return self._run(stock_codes, self.shard_func, token)
+
+    def scan_records(self, records: List[Dict], token: Optional[CancellationToken] = None) -> List[Dict]:
+        """
+        对已下载的行情分片选股，结果和统计与单进程 select_from_records 一致
+        :param records: 实时行情列表（records_from_snapshot 的格式）
+        :param token: 取消令牌
+        :return: 排序后的选中股票列表
+        """
+        return self._run(records, self.record_shard_func, token)
+
+    def _run(self, items: List, shard_func: Callable[..., Dict],
+             token: Optional[CancellationToken] = None) -> List[Dict]:
+        started = time.time()
+        shards = split_shards(items, self.processes)
+        logger.info("=" * 60)
+        logger.info(f"开始分片扫描: {len(items)} 只股票，{len(shards)} 个分片，{self.processes} 个进程")
+        logger.info("=" * 60)
+
+        raise_if_cancelled(token)
+        executor = self.selector.new_run()
+        stats_snapshot = executor.stats.stats
+
+        if len(shards) <= 1 or self.processes == 1:
+            results = [shard_func(shard, stats_snapshot, self.kline_workers) for shard in shards]
+        else:
+            results = self._run_processes(shards, shard_func, stats_snapshot, token)
+
+        counters = dict.fromkeys(COUNTER_KEYS, 0)
+        selected_stocks = []
+        for result in results:
+            for key in COUNTER_KEYS:
+                counters[key] += result['counters'].get(key, 0)
+            executor.merge_counts(result['run_counts'])
+            selected_stocks.extend(result['selected'])
+        self.last_shards = [
+            {'pid': result['pid'], 'total': result['counters'].get('total', 0), 'selected': len(result['selected'])}
+            for result in results
+        ]
+
+        logger.info(f"\n分片扫描完成，{len(results)}/{len(shards)} 个分片成功，合并统计：")
+        return self.selector._finish_selection(executor, selected_stocks, counters, started)
+
+    def _run_processes(self, shards: List[List], shard_func: Callable[..., Dict], stats_snapshot: Dict,
+                       token: Optional[CancellationToken] = None) -> List[Dict]:
+        # 主进程已经有线程池、取消回调和日志线程，fork 可能复制被其他线程持有的锁导致子进程死锁；
+        # 使用 forkserver（不支持时为 spawn）从干净的进程启动子进程
+        methods = multiprocessing.get_all_start_methods()
+        context = multiprocessing.get_context('forkserver' if 'forkserver' in methods else 'spawn')
+        pool = concurrent.futures.ProcessPoolExecutor(max_workers=self.processes, mp_context=context)
+        futures = [pool.submit(shard_func, shard, stats_snapshot, self.kline_workers) for shard in shards]
+        try:
+            pending = set(futures)
+            while pending:
+                raise_if_cancelled(token)
+                _, pending = concurrent.futures.wait(pending, timeout=0.2)
+        except OperationCancelled:
+            logger.warning("分片扫描已取消，不再等待剩余分片")
+            pool.shutdown(wait=False, cancel_futures=True)
+            raise
+        pool.shutdown()
+
+        results = []
+        for index, future in enumerate(futures):
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"分片 {index + 1} 扫描失败: {str(e)}")
+        return results
@@ -1,21 +1,69 @@
 import requests
 import json
 import logging
+import os
+import re
+import threading
+import time
+import concurrent.futures
+from cancellation import OperationCancelled, call_cancellable, raise_if_cancelled
+from llm_cache import LLMCache, cache_key
 
 # 配置日志
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+# 这些HTTP状态码表示服务暂时不可用或限流，重试可能成功
+RETRYABLE_STATUS = (429, 500, 502, 503, 504)
+
+# 分析结果包含的字段
+ANALYSIS_FIELDS = ('short_term', 'medium_term', 'suggestion', 'risk')
+
 class SmartAnalyzer:
-    def __init__(self, api_key=None, api_url=None):
+    def __init__(self, api_key=None, api_url=None, max_concurrency=None, timeout=30, max_retries=3,
+                 backoff=1.0, rate_limit=None, cache=None, batch_size=None):
+        """
+        :param api_key: API密钥
+        :param api_url: 对话补全接口地址
+        :param max_concurrency: 同时进行的API请求数，默认读取环境变量 LLM_CONCURRENCY（4）
+        :param timeout: 单次请求的超时（秒）
+        :param max_retries: 超时、连接失败、限流和5xx错误的最大重试次数
+        :param backoff: 第一次重试前的等待（秒），之后每次翻倍；限流响应带 Retry-After 时按它等待
+        :param rate_limit: 每秒最多发起的请求数，默认读取环境变量 LLM_RATE_LIMIT，未设置时不限制
+        :param cache: 回复缓存（LLMCache），默认使用 data_cache/llm_cache.db，
+                      有效期读取环境变量 LLM_CACHE_TTL（秒，默认4小时）；为False时不使用缓存
+        :param batch_size: 批量分析时一次请求包含的股票数，默认读取环境变量 LLM_BATCH_SIZE（10），为1时逐只请求
+        """
         # 使用用户提供的DeepSeek API密钥
         self.api_key = api_key or "sk-5434f6dad2f544df9bcaf67f1d13142d"
         self.api_url = api_url or "https://api.deepseek.com/v1/chat/completions"
+        self.max_concurrency = max_concurrency or int(os.environ.get('LLM_CONCURRENCY', 4))
+        self.timeout = timeout
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.batch_size = max(1, batch_size or int(os.environ.get('LLM_BATCH_SIZE', 10)))
+        rate_limit = rate_limit if rate_limit is not None else float(os.environ.get('LLM_RATE_LIMIT', 0))
+        self.min_interval = 1.0 / rate_limit if rate_limit else 0.0
+        
+        # 所有调用方（批量分析和单只股票分析）共用并发上限
+        self.slots = threading.BoundedSemaphore(self.max_concurrency)
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=1, pool_maxsize=self.max_concurrency)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        # 限流：下一次允许发起请求的时间；收到429后所有线程一起暂停
+        self.throttle_lock = threading.Lock()
+        self.next_request_at = 0.0
+        
+        if cache is None:
+            cache = LLMCache(ttl=float(os.environ.get('LLM_CACHE_TTL', 4 * 3600)))
+        self.cache = cache if cache is not False else None
     
-    def analyze_stock(self, stock_info):
+    def analyze_stock(self, stock_info, token=None):
         """
         分析单个股票
         :param stock_info: 股票信息字典
+        :param token: 取消令牌，取消时不再等待API响应，抛出 OperationCancelled
         :return: 分析结果
         """
         try:
@@ -35,10 +83,10 @@ class SmartAnalyzer:
             for indicator, value in stock_info['indicators'].items():
                 prompt += f"- {indicator}: {'是' if value else '否'}\n"
             
-            prompt += "\n请给出：\n1. 短期走势判断\n2. 中期走势判断\n3. 投资建议\n4. 风险提示"
+            prompt += ("\n只返回一个JSON对象，不要输出其他内容。对象包含以下字符串字段："
+                       "short_term（短期走势判断）、medium_term（中期走势判断）、"
+                       "suggestion（投资建议）、risk（风险提示）")
             
-            # 由于是示例，我们模拟DeepSeek的分析结果
-            # 在实际应用中，这里应该调用DeepSeek的API
             logger.info(f"分析股票 {stock_info['code']} - {stock_info['name']}")
             
             # 实际API调用代码
@@ -59,70 +107,298 @@ class SmartAnalyzer:
                 "max_tokens": 500
             }
             
-            response = requests.post(self.api_url, headers=headers, json=data)
-            response.raise_for_status()
-            
-            result = response.json()
-            analysis_content = result['choices'][0]['message']['content']
-            
-            # 解析分析结果
-            analysis_result = self._parse_analysis(analysis_content)
-            return analysis_result
-            
-            # 模拟分析结果（备用）
-            """
-            analysis_result = {
-                'short_term': '看涨',
-                'medium_term': '看涨',
-                'suggestion': '建议适量买入',
-                'risk': '市场波动风险，注意止损'
-            }
-            
-            return analysis_result
-            """
+            # 解析失败的回复不写入缓存，下次重新请求
+            return self._complete(headers, data, token=token, parse=self._parse_analysis)
             
         except Exception as e:
             logger.error(f"分析股票 {stock_info['code']} 失败: {str(e)}")
             # 返回默认分析结果
-            return {
-                'short_term': '中性',
-                'medium_term': '中性',
-                'suggestion': '建议观望',
-                'risk': '分析失败，数据不足'
-            }
+            return self._default_analysis()
+    
+    @staticmethod
+    def _default_analysis():
+        return {
+            'short_term': '中性',
+            'medium_term': '中性',
+            'suggestion': '建议观望',
+            'risk': '分析失败，数据不足'
+        }
     
-    def _parse_analysis(self, analysis_content):
+    def analyze_chunk(self, stocks_info, token=None):
         """
-        解析DeepSeek的分析结果
-        :param analysis_content: 分析内容文本
-        :return: 解析后的分析结果字典
+        在一次请求中分析多只股票，要求模型返回JSON数组
+        :param stocks_info: 股票信息列表
+        :param token: 取消令牌
+        :return: 与输入顺序一致的分析结果列表；回复中缺少或无法解析的股票为None，由调用方逐只分析
         """
-        # 这里需要根据DeepSeek的实际输出格式进行解析
-        # 由于是示例，返回模拟结果
-        return {
-            'short_term': '看涨',
-            'medium_term': '看涨',
-            'suggestion': '建议适量买入',
-            'risk': '市场波动风险，注意止损'
+        prompt = "请对以下股票逐一进行分析，基于技术指标给出投资建议：\n"
+        for stock_info in stocks_info:
+            prompt += self._stock_line(stock_info) + "\n"
+        prompt += ("\n只返回一个JSON数组，每只股票一个对象，不要输出其他内容。对象包含以下字符串字段："
+                   "code（股票代码）、short_term（短期走势判断）、medium_term（中期走势判断）、"
+                   "suggestion（投资建议）、risk（风险提示）")
+        
+        logger.info(f"批量分析 {len(stocks_info)} 只股票: {', '.join(stock['code'] for stock in stocks_info)}")
+        headers = {
+            "Content-Type": "application/json",
+            "Authorization": f"Bearer {self.api_key}"
         }
+        data = {
+            "model": "deepseek-chat",
+            "messages": [
+                {
+                    "role": "user",
+                    "content": prompt
+                }
+            ],
+            "temperature": 0.7,
+            "max_tokens": 100 + 200 * len(stocks_info)
+        }
+        
+        codes = [str(stock_info['code']) for stock_info in stocks_info]
+        try:
+            result = self._request_completion(headers, data, token=token)
+            analyses = self._parse_batch(result['choices'][0]['message']['content'], codes)
+        except ValueError as e:
+            logger.warning(f"批量分析结果无法解析，改为逐只分析: {str(e)}")
+            return [None] * len(stocks_info)
+        except Exception as e:
+            # 请求已经按 max_retries 重试过，逐只再请求一遍也很可能失败
+            logger.error(f"批量分析请求失败: {str(e)}")
+            return [self._default_analysis() for _ in stocks_info]
+        
+        # 每只股票的结果单独缓存，候选列表变化时其他股票仍然命中
+        for stock_info, code in zip(stocks_info, codes):
+            if code in analyses:
+                self._cache_set(self._item_key(stock_info), json.dumps(analyses[code], ensure_ascii=False))
+        return [analyses.get(code) for code in codes]
     
-    def analyze_stocks_batch(self, stocks_info):
+    @staticmethod
+    def _stock_line(stock_info):
+        """批量提示词中一只股票的描述"""
+        price = stock_info.get('price') if stock_info.get('price') is not None else 0
+        change = stock_info.get('change') if stock_info.get('change') is not None else 0
+        indicators = '，'.join(f"{indicator}: {'是' if value else '否'}"
+                              for indicator, value in stock_info.get('indicators', {}).items())
+        return (f"- 股票代码：{stock_info['code']}；股票名称：{stock_info['name']}；当前价格：{price}；"
+                f"涨跌幅：{change}；技术指标：{indicators or '无'}")
+    
+    def _item_key(self, stock_info):
+        """批量分析中一只股票结果的缓存键，只取决于这只股票的输入"""
+        return cache_key({"model": "deepseek-chat", "temperature": 0.7, "batch_item": self._stock_line(stock_info)})
+    
+    def _cached_analysis(self, stock_info):
+        """:return: 缓存的批量分析结果，没有时返回None"""
+        content = self._cache_get(self._item_key(stock_info))
+        if content is None:
+            return None
+        try:
+            return json.loads(content)
+        except ValueError:
+            return None
+    
+    @staticmethod
+    def _parse_batch(content, codes):
+        """
+        解析批量分析回复中的JSON数组
+        :param content: 回复文本，允许带有```json代码块标记
+        :param codes: 请求中的股票代码
+        :return: {股票代码: 分析结果}，只包含字段完整的股票
+        :raises ValueError: 回复不是JSON数组或没有一只股票的结果可用
         """
-        批量分析股票
+        match = re.search(r'\[.*\]', content, re.S)
+        if match is None:
+            raise ValueError('回复中没有JSON数组')
+        items = json.loads(match.group(0))
+        if not isinstance(items, list):
+            raise ValueError('回复不是JSON数组')
+        
+        analyses = {}
+        for item in items:
+            if not isinstance(item, dict) or str(item.get('code')) not in codes:
+                continue
+            if all(isinstance(item.get(field), str) and item[field] for field in ANALYSIS_FIELDS):
+                analyses[str(item['code'])] = {field: item[field] for field in ANALYSIS_FIELDS}
+        if not analyses:
+            raise ValueError('回复中没有可用的分析结果')
+        return analyses
+    
+    def _wait(self, seconds, token=None):
+        """等待，令牌被取消时立即抛出 OperationCancelled"""
+        if seconds <= 0:
+            return
+        if token is None:
+            time.sleep(seconds)
+        elif token.wait(seconds):
+            raise OperationCancelled()
+    
+    def _throttle(self, token=None):
+        """按限流间隔和429暂停时间排队，返回前占用一个请求时间点"""
+        with self.throttle_lock:
+            now = time.time()
+            start = max(now, self.next_request_at)
+            self.next_request_at = start + self.min_interval
+        self._wait(start - now, token)
+    
+    def _pause_all(self, seconds):
+        """收到限流响应后推迟所有线程的下一次请求"""
+        with self.throttle_lock:
+            self.next_request_at = max(self.next_request_at, time.time() + seconds)
+    
+    def _acquire_slot(self, token=None):
+        while not self.slots.acquire(timeout=0.2):
+            raise_if_cancelled(token)
+    
+    def _request_completion(self, headers, data, token=None):
+        """
+        调用对话补全接口：占用一个并发名额，超时、连接失败、限流和5xx错误按指数退避重试
+        :return: 接口返回的JSON
+        """
+        attempt = 0
+        while True:
+            raise_if_cancelled(token)
+            self._acquire_slot(token)
+            try:
+                self._throttle(token)
+                response = call_cancellable(self.session.post, self.api_url, headers=headers, json=data,
+                                            timeout=self.timeout, token=token)
+                error = None
+            except (requests.Timeout, requests.ConnectionError) as e:
+                response, error = None, e
+            finally:
+                self.slots.release()
+            
+            if response is not None and response.status_code not in RETRYABLE_STATUS:
+                response.raise_for_status()
+                return response.json()
+            if attempt >= self.max_retries:
+                if response is not None:
+                    response.raise_for_status()
+                raise error
+            
+            delay = self.backoff * (2 ** attempt)
+            if response is not None and response.status_code == 429:
+                try:
+                    delay = float(response.headers.get('Retry-After', delay))
+                except ValueError:
+                    pass
+                self._pause_all(delay)
+            reason = f"HTTP {response.status_code}" if response is not None else str(error)
+            logger.warning(f"API请求失败（{reason}），{delay:.1f}秒后第{attempt + 1}次重试")
+            attempt += 1
+            self._wait(delay, token)
+    
+    def _complete(self, headers, data, token=None, parse=None):
+        """
+        获取回复内容：提示词和模型参数与缓存中的请求相同时直接返回缓存的回复
+        :param parse: 解析回复的函数，解析失败时抛出异常，回复不会写入缓存
+        :return: 回复文本，指定 parse 时返回解析结果
+        """
+        parse = parse or (lambda content: content)
+        key = cache_key(data)
+        content = self._cache_get(key)
+        if content is not None:
+            logger.info("输入未变化，使用缓存的分析结果")
+            return parse(content)
+        
+        result = self._request_completion(headers, data, token=token)
+        content = result['choices'][0]['message']['content']
+        parsed = parse(content)
+        self._cache_set(key, content)
+        return parsed
+    
+    def _cache_get(self, key):
+        """读取缓存，未启用缓存或读取失败时返回None"""
+        if self.cache is None:
+            return None
+        try:
+            return self.cache.get(key)
+        except Exception as e:
+            logger.error(f"读取分析缓存失败: {str(e)}")
+            return None
+    
+    def _cache_set(self, key, content):
+        if self.cache is None:
+            return
+        try:
+            self.cache.set(key, content)
+        except Exception as e:
+            logger.error(f"保存分析缓存失败: {str(e)}")
+    
+    @staticmethod
+    def _parse_analysis(content):
+        """
+        解析单只股票分析回复中的JSON对象
+        :param content: 回复文本，允许带有```json代码块标记
+        :return: 分析结果字典
+        :raises ValueError: 回复中没有字段完整的JSON对象
+        """
+        match = re.search(r'\{.*\}', content, re.S)
+        if match is None:
+            raise ValueError('回复中没有JSON对象')
+        item = json.loads(match.group(0))
+        if not isinstance(item, dict) or not all(isinstance(item.get(field), str) and item[field]
+                                                 for field in ANALYSIS_FIELDS):
+            raise ValueError('回复中缺少分析字段')
+        return {field: item[field] for field in ANALYSIS_FIELDS}
+    
+    def analyze_stocks_batch(self, stocks_info, token=None, batch_size=None):
+        """
+        批量分析股票：先逐只查缓存，未命中的股票每 batch_size 只合并为一次请求，
+        最多 max_concurrency 个请求同时进行，批量回复无法解析的股票再逐只请求，结果按输入顺序返回
         :param stocks_info: 股票信息列表
+        :param token: 取消令牌，取消时放弃剩余股票
+        :param batch_size: 一次请求包含的股票数，默认使用构造时的 batch_size
         :return: 包含分析结果的股票信息列表
         """
         try:
-            analyzed_stocks = []
+            if not stocks_info:
+                return []
             
-            for stock_info in stocks_info:
-                analysis_result = self.analyze_stock(stock_info)
-                stock_info['analysis'] = analysis_result
-                analyzed_stocks.append(stock_info)
+            started = time.time()
+            batch_size = batch_size or self.batch_size
+            with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_concurrency,
+                                                       thread_name_prefix='analyze') as pool:
+                futures = []
+                try:
+                    analyses = [None] * len(stocks_info)
+                    if batch_size > 1:
+                        analyses = [self._cached_analysis(stock_info) for stock_info in stocks_info]
+                        misses = [i for i, analysis in enumerate(analyses) if analysis is None]
+                        if len(misses) < len(stocks_info):
+                            logger.info(f"{len(stocks_info) - len(misses)} 只股票输入未变化，使用缓存的分析结果")
+                        chunks = [misses[offset:offset + batch_size] for offset in range(0, len(misses), batch_size)]
+                        futures = [pool.submit(self.analyze_chunk, [stocks_info[i] for i in chunk], token)
+                                   for chunk in chunks]
+                        for chunk, future in zip(chunks, futures):
+                            for i, analysis in zip(chunk, self._result(future, token)):
+                                analyses[i] = analysis
+                    
+                    pending = [i for i, analysis in enumerate(analyses) if analysis is None]
+                    futures = [pool.submit(self.analyze_stock, stocks_info[i], token) for i in pending]
+                    for i, future in zip(pending, futures):
+                        analyses[i] = self._result(future, token)
+                except OperationCancelled:
+                    for future in futures:
+                        future.cancel()
+                    raise
+            for stock_info, analysis in zip(stocks_info, analyses):
+                stock_info['analysis'] = analysis
+            analyzed_stocks = list(stocks_info)
             
-            logger.info(f"批量分析完成，共分析 {len(analyzed_stocks)} 只股票")
+            logger.info(f"批量分析完成，共分析 {len(analyzed_stocks)} 只股票，耗时 {time.time() - started:.1f}秒")
             return analyzed_stocks
             
         except Exception as e:
             logger.error(f"批量分析股票失败: {str(e)}")
-            return stocks_info
\ No newline at end of file
+            return stocks_info
+    
+    @staticmethod
+    def _result(future, token=None):
+        """等待一只股票的分析结果，令牌被取消时立即抛出 OperationCancelled"""
+        while True:
+            raise_if_cancelled(token)
+            try:
+                return future.result(timeout=0.2)
+            except concurrent.futures.TimeoutError:
+                continue
@@ -0,0 +1,616 @@
+import abc
+import contextlib
+import json
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from cancellation import CancellationToken
+
+logger = logging.getLogger(__name__)
+
+
+class StateStore(abc.ABC):
+    """
+    多个worker进程共享的状态存储：键值（JSON）和带序号的追加日志
+    """
+
+    @abc.abstractmethod
+    def get(self, key: str, default: Any = None) -> Any:
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def set(self, key: str, value: Any):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def delete(self, key: str):
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def update(self, key: str, func: Callable[[Any], Any], default: Any = None) -> Any:
+        """
+        原子地读取、修改并写回一个值，多个进程同时修改同一个键时不会丢失更新
+        :param func: 接收当前值（不存在时为default）并返回新值
+        :return: 新值
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def append(self, stream: str, item: Any, capacity: int) -> int:
+        """
+        向日志追加一条记录，只保留最近capacity条
+        :return: 记录的序号，从1开始递增
+        """
+        raise NotImplementedError
+
+    def extend(self, stream: str, items: List[Any], capacity: int) -> List[int]:
+        """
+        向日志批量追加记录，支持时在一次写入中完成
+        :return: 各条记录的序号
+        """
+        return [self.append(stream, item, capacity) for item in items]
+
+    @abc.abstractmethod
+    def since(self, stream: str, cursor: int, capacity: int) -> Tuple[List[Any], int, bool]:
+        """
+        读取序号大于cursor的记录，返回值与 RingBuffer.since 一致
+        :return: (记录列表, 新游标, 是否需要重置)
+        """
+        raise NotImplementedError
+
+    @abc.abstractmethod
+    def last_seq(self, stream: str) -> int:
+        raise NotImplementedError
+
+
+def _since_result(rows: List[Tuple[int, Any]], cursor: int, last: int, capacity: int) -> Tuple[List[Any], int, bool]:
+    """根据保留的记录（按序号升序）计算 since 的返回值，规则与 RingBuffer.since 一致"""
+    oldest = max(1, last + 1 - capacity)
+    reset = cursor + 1 < oldest or cursor > last
+    start = oldest if reset else cursor + 1
+    return [item for seq, item in rows if seq >= start], last, reset
+
+
+class MemoryStore(StateStore):
+    def __init__(self):
+        """
+        进程内存储，只适用于单个worker
+        """
+        self.lock = threading.RLock()
+        self.values: Dict[str, str] = {}
+        self.logs: Dict[str, List[Tuple[int, Any]]] = {}
+        self.seqs: Dict[str, int] = {}
+
+    def get(self, key, default=None):
+        with self.lock:
+            value = self.values.get(key)
+        return default if value is None else json.loads(value)
+
+    def set(self, key, value):
+        with self.lock:
+            self.values[key] = json.dumps(value, ensure_ascii=False, default=str)
+
+    def delete(self, key):
+        with self.lock:
+            self.values.pop(key, None)
+
+    def update(self, key, func, default=None):
+        with self.lock:
+            value = func(self.get(key, default))
+            self.set(key, value)
+            return value
+
+    def append(self, stream, item, capacity):
+        with self.lock:
+            seq = self.seqs.get(stream, 0) + 1
+            self.seqs[stream] = seq
+            rows = self.logs.setdefault(stream, [])
+            rows.append((seq, json.loads(json.dumps(item, ensure_ascii=False, default=str))))
+            if len(rows) > capacity:
+                del rows[:len(rows) - capacity]
+            return seq
+
+    def extend(self, stream, items, capacity):
+        with self.lock:
+            return super().extend(stream, items, capacity)
+
+    def since(self, stream, cursor, capacity):
+        with self.lock:
+            return _since_result(list(self.logs.get(stream, [])), cursor, self.seqs.get(stream, 0), capacity)
+
+    def last_seq(self, stream):
+        with self.lock:
+            return self.seqs.get(stream, 0)
+
+
+# fork之前打开、由子进程继承的SQLite连接
+_inherited_connections: List[Any] = []
+
+
+class SQLiteStore(StateStore):
+    def __init__(self, path: str = os.path.join('data_cache', 'app_state.db')):
+        """
+        SQLite存储：同一台机器上的多个worker进程共享一个数据库文件，使用WAL模式支持并发读写
+        :param path: 数据库文件路径
+        """
+        directory = os.path.dirname(path)
+        if directory and not os.path.exists(directory):
+            os.makedirs(directory)
+        self.path = path
+        self.local = threading.local()
+        self.pid = os.getpid()
+        with self._transaction() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS kv (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+            conn.execute("CREATE TABLE IF NOT EXISTS logs (stream TEXT NOT NULL, seq INTEGER NOT NULL, "
+                         "item TEXT NOT NULL, PRIMARY KEY (stream, seq))")
+
+    def _conn(self) -> sqlite3.Connection:
+        if self.pid != os.getpid():
+            # fork出的子进程不能使用父进程的连接，也不能关闭它（关闭会释放本进程持有的文件锁），保留到进程退出
+            _inherited_connections.append(self.local)
+            self.local = threading.local()
+            self.pid = os.getpid()
+        # sqlite3连接不能跨线程使用，每个线程一个连接
+        conn = getattr(self.local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self.local.conn = conn
+        return conn
+
+    @contextlib.contextmanager
+    def _transaction(self):
+        conn = self._conn()
+        # 立即获取写锁，读-改-写期间其他进程不能写入
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            yield conn
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        conn.execute("COMMIT")
+
+    def get(self, key, default=None):
+        row = self._conn().execute("SELECT value FROM kv WHERE key = ?", (key,)).fetchone()
+        return default if row is None else json.loads(row[0])
+
+    def set(self, key, value):
+        self._conn().execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)",
+                             (key, json.dumps(value, ensure_ascii=False, default=str)))
+
+    def delete(self, key):
+        self._conn().execute("DELETE FROM kv WHERE key = ?", (key,))
+
+    def update(self, key, func, default=None):
+        with self._transaction():
+            value = func(self.get(key, default))
+            self.set(key, value)
+        return value
+
+    def append(self, stream, item, capacity):
+        with self._transaction() as conn:
+            seq = self._last_seq(conn, stream) + 1
+            conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (f"seq:{stream}", str(seq)))
+            conn.execute("INSERT INTO logs (stream, seq, item) VALUES (?, ?, ?)",
+                         (stream, seq, json.dumps(item, ensure_ascii=False, default=str)))
+            conn.execute("DELETE FROM logs WHERE stream = ? AND seq <= ?", (stream, seq - capacity))
+        return seq
+
+    def extend(self, stream, items, capacity):
+        if not items:
+            return []
+        # 一批记录只占用一次写事务
+        with self._transaction() as conn:
+            first = self._last_seq(conn, stream) + 1
+            last = first + len(items) - 1
+            conn.execute("INSERT OR REPLACE INTO kv (key, value) VALUES (?, ?)", (f"seq:{stream}", str(last)))
+            conn.executemany("INSERT INTO logs (stream, seq, item) VALUES (?, ?, ?)",
+                             [(stream, first + i, json.dumps(item, ensure_ascii=False, default=str))
+                              for i, item in enumerate(items)])
+            conn.execute("DELETE FROM logs WHERE stream = ? AND seq <= ?", (stream, last - capacity))
+        return list(range(first, last + 1))
+
+    def since(self, stream, cursor, capacity):
+        conn = self._conn()
+        conn.execute("BEGIN")
+        try:
+            last = self._last_seq(conn, stream)
+            rows = conn.execute("SELECT seq, item FROM logs WHERE stream = ? AND seq > ? ORDER BY seq",
+                                (stream, cursor if cursor <= last else 0)).fetchall()
+        finally:
+            conn.execute("COMMIT")
+        return _since_result([(seq, json.loads(item)) for seq, item in rows], cursor, last, capacity)
+
+    def _last_seq(self, conn, stream) -> int:
+        # 序号保存在kv表中，日志被裁剪后序号仍然递增
+        row = conn.execute("SELECT value FROM kv WHERE key = ?", (f"seq:{stream}",)).fetchone()
+        return int(row[0]) if row else 0
+
+    def last_seq(self, stream):
+        return self._last_seq(self._conn(), stream)
+
+
+class RedisStore(StateStore):
+    def __init__(self, url: str = 'redis://localhost:6379/0', client=None, prefix: str = 'stockany:'):
+        """
+        Redis存储：多台机器上的worker共享状态
+        只使用 GET/SET(NX, PX)/DEL/INCRBY/RPUSH/LTRIM/LRANGE 命令和 MULTI/EXEC 事务，
+        兼容Redis协议的本地替代服务或客户端都可以使用
+        :param url: Redis地址
+        :param client: 已创建的客户端（redis.Redis 或接口兼容的对象），提供时忽略url
+        :param prefix: 键前缀
+        """
+        if client is None:
+            try:
+                import redis
+            except ImportError:
+                raise ImportError("使用Redis存储需要安装redis: pip install redis")
+            client = redis.Redis.from_url(url, decode_responses=True)
+        self.client = client
+        self.prefix = prefix
+
+    def _key(self, key: str) -> str:
+        return f"{self.prefix}{key}"
+
+    def get(self, key, default=None):
+        value = self.client.get(self._key(key))
+        return default if value is None else json.loads(value)
+
+    def set(self, key, value):
+        self.client.set(self._key(key), json.dumps(value, ensure_ascii=False, default=str))
+
+    def delete(self, key):
+        self.client.delete(self._key(key))
+
+    def _lock(self, key: str, timeout: float = 10.0) -> str:
+        """SET NX 实现的简单互斥锁，持有者崩溃时锁在5秒后自动过期"""
+        owner = uuid.uuid4().hex
+        deadline = time.time() + timeout
+        while not self.client.set(self._key(f"lock:{key}"), owner, nx=True, px=5000):
+            if time.time() > deadline:
+                raise TimeoutError(f"获取状态锁超时: {key}")
+            time.sleep(0.01)
+        return owner
+
+    def _unlock(self, key: str, owner: str):
+        lock_key = self._key(f"lock:{key}")
+        if self.client.get(lock_key) == owner:
+            self.client.delete(lock_key)
+
+    def update(self, key, func, default=None):
+        owner = self._lock(key)
+        try:
+            value = func(self.get(key, default))
+            self.set(key, value)
+            return value
+        finally:
+            self._unlock(key, owner)
+
+    def append(self, stream, item, capacity):
+        return self.extend(stream, [item], capacity)[0]
+
+    def extend(self, stream, items, capacity):
+        if not items:
+            return []
+        # 序号递增和写入列表在同一个事务中执行：列表末尾的记录序号总是等于当前序号，
+        # 读取方不会看到序号已经递增、记录还没写入的中间状态
+        list_key = self._key(f"log:{stream}")
+        pipe = self.client.pipeline(transaction=True)
+        pipe.incrby(self._key(f"seq:{stream}"), len(items))
+        pipe.rpush(list_key, *[json.dumps(item, ensure_ascii=False, default=str) for item in items])
+        pipe.ltrim(list_key, -capacity, -1)
+        last = int(pipe.execute()[0])
+        return list(range(last - len(items) + 1, last + 1))
+
+    def since(self, stream, cursor, capacity):
+        pipe = self.client.pipeline(transaction=True)
+        pipe.get(self._key(f"seq:{stream}"))
+        pipe.lrange(self._key(f"log:{stream}"), 0, -1)
+        value, rows = pipe.execute()
+        last = int(value) if value else 0
+        first = last - len(rows) + 1
+        return _since_result([(first + i, json.loads(row)) for i, row in enumerate(rows)], cursor, last, capacity)
+
+    def last_seq(self, stream):
+        value = self.client.get(self._key(f"seq:{stream}"))
+        return int(value) if value else 0
+
+
+class StoreLog:
+    def __init__(self, store: StateStore, stream: str, capacity: int = 1000):
+        """
+        存储中的追加日志，接口与 RingBuffer 一致，多个worker写入的记录对所有worker可见
+        :param store: 状态存储
+        :param stream: 日志名
+        :param capacity: 保留的记录数
+        """
+        self.store = store
+        self.stream = stream
+        self.capacity = capacity
+        # 共享日志需要轮询才能看到其他进程写入的记录
+        self.shared = not isinstance(store, MemoryStore)
+
+    def __len__(self) -> int:
+        return min(self.last_seq, self.capacity)
+
+    @property
+    def last_seq(self) -> int:
+        return self.store.last_seq(self.stream)
+
+    def append(self, item: Any) -> int:
+        return self.store.append(self.stream, item, self.capacity)
+
+    def extend(self, items: List[Any]) -> List[int]:
+        return self.store.extend(self.stream, items, self.capacity)
+
+    def since(self, cursor: int = 0) -> Tuple[List[Any], int, bool]:
+        return self.store.since(self.stream, cursor, self.capacity)
+
+
+def worker_id() -> str:
+    """本进程在共享存储中的标识：主机名、进程ID和随机后缀（进程ID在重启后可能被复用）"""
+    return f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:6]}"
+
+
+class Lease:
+    def __init__(self, store: StateStore, name: str, ttl: float = 15.0, owner: Optional[str] = None):
+        """
+        存储中的租约：同一时间只有一个持有者，持有者需要在ttl秒内续约，崩溃后租约过期由其他进程获得
+        :param store: 状态存储
+        :param name: 租约名
+        :param ttl: 租约有效期（秒）
+        :param owner: 持有者标识，默认每个租约对象不同
+        """
+        self.store = store
+        self.key = f"lease:{name}"
+        self.ttl = ttl
+        self.owner = owner or worker_id()
+
+    def acquire(self) -> bool:
+        """
+        获得或续约租约
+        :return: 调用后是否持有租约
+        """
+        result = {}
+
+        def apply(lease):
+            now = time.time()
+            if not lease or lease.get('expires', 0) <= now or lease.get('owner') == self.owner:
+                lease = {'owner': self.owner, 'expires': now + self.ttl}
+            result['held'] = lease['owner'] == self.owner
+            return lease
+
+        self.store.update(self.key, apply, None)
+        return result['held']
+
+    def release(self):
+        """释放租约，只在仍由自己持有时生效"""
+        self.store.update(self.key, lambda lease: None if lease and lease.get('owner') == self.owner else lease, None)
+
+    def holder(self) -> Optional[str]:
+        """当前持有者，租约不存在或已过期时返回None"""
+        lease = self.store.get(self.key)
+        if not lease or lease.get('expires', 0) <= time.time():
+            return None
+        return lease.get('owner')
+
+    @contextlib.contextmanager
+    def keep_alive(self):
+        """持有期间在后台线程中按 ttl/3 的间隔续约"""
+        stopped = threading.Event()
+
+        def renew():
+            while not stopped.wait(self.ttl / 3):
+                try:
+                    if not self.acquire():
+                        logger.warning(f"租约 {self.key} 已被其他进程获得")
+                except Exception as e:
+                    logger.error(f"续约 {self.key} 失败: {str(e)}")
+
+        thread = threading.Thread(target=renew, name=f'{self.key}-renew', daemon=True)
+        thread.start()
+        try:
+            yield self
+        finally:
+            stopped.set()
+
+
+class LeaderTask:
+    def __init__(self, store: StateStore, name: str, wanted: Callable[[], bool],
+                 start: Callable[[], None], stop: Callable[[], None], ttl: float = 15.0):
+        """
+        只在一个worker进程中运行的后台任务：需要运行时各进程竞争租约，持有租约的进程启动任务，
+        不再需要或失去租约时停止；持有者崩溃后租约过期，由下一次检查的其他进程接管
+        :param store: 状态存储
+        :param name: 任务名，同时作为租约名
+        :param wanted: 返回任务当前是否需要运行（通常读取存储中的开关）
+        :param start: 在本进程中启动任务
+        :param stop: 在本进程中停止任务
+        :param ttl: 租约有效期（秒），检查间隔应小于它
+        """
+        self.name = name
+        self.lease = Lease(store, name, ttl)
+        self.wanted = wanted
+        self.start = start
+        self.stop = stop
+        self.lock = threading.Lock()
+        self.active = False
+
+    def check(self):
+        """检查一次：按需获得、续约或释放租约，并启动或停止本进程中的任务"""
+        with self.lock:
+            wanted = self.wanted()
+            if wanted and self.lease.acquire():
+                if not self.active:
+                    logger.info(f"本进程成为 {self.name} 的执行者")
+                    self.active = True
+                    self.start()
+                return
+            if self.active:
+                logger.info(f"{self.name} 不再由本进程执行")
+                self.active = False
+                self.stop()
+            if not wanted:
+                self.lease.release()
+
+
+class WorkerRegistry:
+    def __init__(self, store: StateStore, ttl: float = 15.0):
+        """
+        worker进程登记：每个进程定期写入心跳，超过ttl没有心跳的进程视为已退出；
+        心跳线程同时执行登记的周期任务（如 LeaderTask.check）
+        :param store: 状态存储
+        :param ttl: 心跳有效期（秒），心跳间隔为 ttl/3
+        """
+        self.store = store
+        self.ttl = ttl
+        self.id = worker_id()
+        self.tasks: List[Callable[[], None]] = []
+        # 发现已退出的进程时调用，参数为这些进程的标识
+        self.on_dead: Optional[Callable[[List[str]], None]] = None
+        self.thread: Optional[threading.Thread] = None
+
+    def join(self) -> bool:
+        """
+        登记本进程并启动心跳线程
+        :return: 本进程是否是当前唯一存活的进程（服务刚启动，之前的运行状态都已失效）
+        """
+        first = self._heartbeat()
+        if self.thread is None:
+            self.thread = threading.Thread(target=self._run, name='worker-registry', daemon=True)
+            self.thread.start()
+        return first
+
+    def alive(self) -> List[str]:
+        now = time.time()
+        return [worker for worker, expires in self.store.get('workers', {}).items() if expires > now]
+
+    def add_task(self, task: Callable[[], None]):
+        """登记周期任务，每次心跳后执行"""
+        self.tasks.append(task)
+
+    def _heartbeat(self) -> bool:
+        result = {}
+
+        def apply(workers):
+            now = time.time()
+            result['dead'] = [worker for worker, expires in workers.items() if expires <= now]
+            workers = {worker: expires for worker, expires in workers.items() if expires > now}
+            result['first'] = not any(worker != self.id for worker in workers)
+            workers[self.id] = now + self.ttl
+            return workers
+
+        self.store.update('workers', apply, {})
+        if result['dead'] and self.on_dead is not None:
+            self.on_dead(result['dead'])
+        return result['first']
+
+    def _run(self):
+        while True:
+            time.sleep(self.ttl / 3)
+            try:
+                self._heartbeat()
+            except Exception as e:
+                logger.error(f"写入worker心跳失败: {str(e)}")
+            for task in list(self.tasks):
+                try:
+                    task()
+                except Exception as e:
+                    logger.error(f"周期任务执行失败: {str(e)}")
+
+
+class CancelSignals:
+    def __init__(self, store: StateStore, interval: float = 1.0):
+        """
+        跨worker的取消信号：停止请求写入存储，运行任务的worker定期检查并取消本地的取消令牌
+        :param store: 状态存储
+        :param interval: 检查间隔（秒）
+        """
+        self.store = store
+        self.interval = interval
+        self.lock = threading.Lock()
+        self.tokens: Dict[str, Tuple[Any, float]] = {}
+        self.thread: Optional[threading.Thread] = None
+
+    def register(self, name: str, token):
+        """登记本进程中正在运行的任务的取消令牌，登记之前发出的停止请求不会影响它"""
+        with self.lock:
+            self.tokens[name] = (token, time.time())
+            if self.thread is None and not isinstance(self.store, MemoryStore):
+                self.thread = threading.Thread(target=self._watch, name='cancel-signals', daemon=True)
+                self.thread.start()
+
+    def token(self, name: str) -> CancellationToken:
+        """
+        本进程中该名称的取消令牌：已有未取消的令牌时直接返回（同时进行的调用方共用，停止时一起停止），
+        否则创建并登记新的令牌
+        """
+        with self.lock:
+            entry = self.tokens.get(name)
+            if entry is not None and not entry[0].cancelled:
+                return entry[0]
+        token = CancellationToken()
+        self.register(name, token)
+        return token
+
+    def unregister(self, name: str, token=None):
+        with self.lock:
+            entry = self.tokens.get(name)
+            if entry is not None and (token is None or entry[0] is token):
+                del self.tokens[name]
+
+    def cancel_local(self, name: str):
+        """只取消本进程中的令牌，不写入停止请求（其他进程之后登记的同名令牌不受影响）"""
+        with self.lock:
+            entry = self.tokens.get(name)
+        if entry is not None:
+            entry[0].cancel()
+
+    def request(self, name: str):
+        """请求取消：本进程中的任务立即取消，其他进程中的任务在下一次检查时取消"""
+        self.store.set(f"cancel:{name}", time.time())
+        with self.lock:
+            entry = self.tokens.get(name)
+        if entry is not None:
+            entry[0].cancel()
+
+    def check(self):
+        """检查一次存储中的停止请求"""
+        with self.lock:
+            entries = list(self.tokens.items())
+        for name, (token, registered_at) in entries:
+            requested_at = self.store.get(f"cancel:{name}")
+            if requested_at is not None and requested_at >= registered_at and not token.cancelled:
+                logger.info(f"收到停止请求: {name}")
+                token.cancel()
+
+    def _watch(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.check()
+            except Exception as e:
+                logger.error(f"检查停止请求失败: {str(e)}")
+
+
+def create_store(url: Optional[str] = None) -> StateStore:
+    """
+    根据地址创建状态存储
+    :param url: memory:// | sqlite:///路径 | redis://主机:端口/库，默认读取环境变量 STATE_STORE，
+                未设置时使用 data_cache/app_state.db
+    """
+    url = url or os.environ.get('STATE_STORE') or 'sqlite:///' + os.path.join('data_cache', 'app_state.db')
+    if url.startswith('memory://'):
+        return MemoryStore()
+    if url.startswith('sqlite:///'):
+        return SQLiteStore(url[len('sqlite:///'):])
+    if url.startswith('redis://') or url.startswith('rediss://'):
+        return RedisStore(url)
+    raise ValueError(f"不支持的状态存储: {url}")
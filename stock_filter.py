@@ -6,6 +6,120 @@ from data_fetcher import DataFetcher
 logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
 logger = logging.getLogger(__name__)
 
+def _numeric_column(data, column, default):
+    """
+    取出数值列，缺失的列或无法解析的值使用默认值/NaN
+    :param data: 行情DataFrame
+    :param column: 列名
+    :param default: 列不存在时的默认值
+    :return: float类型的Series
+    """
+    if column not in data.columns:
+        return pd.Series(default, index=data.index, dtype='float64')
+    return pd.to_numeric(data[column], errors='coerce').astype('float64')
+
+def compute_substitute_flags(market_data):
+    """
+    向量化计算"平替"策略的各项条件
+    :param market_data: 市场股票数据DataFrame（腾讯财经行情列）
+    :return: 每行一只股票的DataFrame，包含行情字段、各条件通过标志和最终是否入选(selected)
+    """
+    price = _numeric_column(market_data, '最新价', 0)
+    change = _numeric_column(market_data, '涨跌幅', 0)
+    volume_ratio = _numeric_column(market_data, '量比', 1.0)
+    order_ratio = _numeric_column(market_data, '委比', 0.0)
+    turnover_rate = _numeric_column(market_data, '换手率', 0.0)
+    sector_change = _numeric_column(market_data, '板块涨幅', 0.0)
+    
+    # 基本面条件：价格大于10元，且近期没有大幅下跌（NaN视为不通过）
+    basic_qualified = (price >= 10) & (change >= -8)
+    
+    # 1) 异动平替：量比 > 1.8
+    volume_ratio_qualified = volume_ratio > 1.8
+    # 2) 强度平替：委比为正数（最好 > 30%）
+    order_ratio_qualified = order_ratio > 30
+    # 3) 活跃平替：换手率在 3% - 10% 之间
+    turnover_rate_qualified = (turnover_rate >= 3) & (turnover_rate <= 10)
+    # 4) 空间平替：个股涨幅 > 板块平均涨幅
+    sector_qualified = change > sector_change
+    
+    short_term_qualified = volume_ratio_qualified & order_ratio_qualified & turnover_rate_qualified & sector_qualified
+    
+    return pd.DataFrame({
+        'code': market_data['代码'] if '代码' in market_data.columns else pd.Series('', index=market_data.index),
+        'name': market_data['名称'] if '名称' in market_data.columns else pd.Series('', index=market_data.index),
+        'price': price,
+        'change': change,
+        'volume': market_data['成交量'] if '成交量' in market_data.columns else pd.Series(0, index=market_data.index),
+        'volume_ratio': volume_ratio,
+        'order_ratio': order_ratio,
+        'turnover_rate': turnover_rate,
+        'sector_change': sector_change,
+        'basic_qualified': basic_qualified,
+        'volume_ratio_qualified': volume_ratio_qualified,
+        'order_ratio_qualified': order_ratio_qualified,
+        'turnover_rate_qualified': turnover_rate_qualified,
+        'sector_qualified': sector_qualified,
+        'short_term_qualified': short_term_qualified,
+        'selected': basic_qualified & short_term_qualified
+    }, index=market_data.index)
+
+def filter_substitute_stocks(market_data):
+    """
+    筛选"平替"策略的股票
+    :param market_data: 市场股票数据DataFrame
+    :return: 筛选后的股票列表
+    """
+    try:
+        if market_data is None or market_data.empty:
+            return []
+        
+        flags = compute_substitute_flags(market_data)
+        selected = flags[flags['selected']]
+        
+        filtered_stocks = []
+        for row in zip(
+            selected['code'].tolist(),
+            selected['name'].tolist(),
+            selected['price'].tolist(),
+            selected['change'].tolist(),
+            selected['volume'].tolist(),
+            selected['volume_ratio'].round(2).tolist(),
+            selected['order_ratio'].round(2).tolist(),
+            selected['turnover_rate'].round(2).tolist(),
+            selected['sector_change'].round(2).tolist(),
+            selected['volume_ratio_qualified'].tolist(),
+            selected['order_ratio_qualified'].tolist(),
+            selected['turnover_rate_qualified'].tolist(),
+            selected['sector_qualified'].tolist(),
+            selected['short_term_qualified'].tolist()
+        ):
+            filtered_stocks.append({
+                'code': row[0],
+                'name': row[1],
+                'price': row[2],
+                'change': row[3],
+                'volume': row[4],
+                'volume_ratio': row[5],
+                'order_ratio': row[6],
+                'turnover_rate': row[7],
+                'sector_change': row[8],
+                'indicators': {
+                    'volume_ratio_qualified': row[9],
+                    'order_ratio_qualified': row[10],
+                    'turnover_rate_qualified': row[11],
+                    'sector_qualified': row[12],
+                    'short_term_qualified': row[13]
+                }
+            })
+        
+        logger.info(f"共评估 {len(flags)} 只股票，筛选出 {len(filtered_stocks)} 只符合'平替'策略条件的股票")
+        return filtered_stocks
+        
+    except Exception as e:
+        logger.error(f"筛选股票失败: {str(e)}")
+        return []
+
 class StockFilter:
     def __init__(self, default_source='tencent'):
         # 禁用模拟数据模式，使用指定的数据源
@@ -111,110 +225,21 @@ class StockFilter:
     def filter_stocks(self, market_data):
         """
         筛选股票（基于基础行情的"平替"策略）
+        对全市场逐列向量化计算，评估每一行，不再限制处理数量
         :param market_data: 市场股票数据DataFrame
         :return: 筛选后的股票列表
         """
-        try:
-            filtered_stocks = []
-            
-            # 限制处理的股票数量，避免处理时间过长
-            max_stocks = 100
-            processed_count = 0
-            
-            for idx, row in market_data.iterrows():
-                if processed_count >= max_stocks:
-                    break
-                
-                try:
-                    stock_code = row['代码']
-                    stock_name = row['名称']
-                    
-                    # 1. 筛选所有市场的股票（上证、深证、创业板）
-                    # 移除创业板的限制，让所有市场的股票都能进入筛选流程
-                    
-                    # 2. 基本面筛选
-                    # 基于股票价格和涨跌幅来判断是否退市风险较低
-                    price = row.get('最新价', 0)
-                    change = row.get('涨跌幅', 0)
-                    volume = row.get('成交量', 0)
-                    
-                    # 基本面条件：价格大于10元，且近期没有大幅下跌
-                    if price < 10 or change < -8:
-                        continue
-                    
-                    # 3. 获取基础行情指标
-                    volume_ratio = row.get('量比', 1.0)
-                    order_ratio = row.get('委比', 0.0)
-                    turnover_rate = row.get('换手率', 0.0)
-                    sector_change = row.get('板块涨幅', 0.0)
-                    
-                    # 4. "平替"筛选策略
-                    # 1) 异动平替：量比 > 1.8
-                    volume_ratio_qualified = volume_ratio > 1.8
-                    
-                    # 2) 强度平替：委比为正数（最好 > 30%）
-                    order_ratio_qualified = order_ratio > 30
-                    
-                    # 3) 活跃平替：换手率在 3% - 10% 之间
-                    turnover_rate_qualified = 3 <= turnover_rate <= 10
-                    
-                    # 4) 空间平替：个股涨幅 > 板块平均涨幅
-                    sector_qualified = change > sector_change
-                    
-                    # 综合筛选条件
-                    short_term_qualified = volume_ratio_qualified and order_ratio_qualified and turnover_rate_qualified and sector_qualified
-                    
-                    if not short_term_qualified:
-                        continue
-                    
-                    # 5. 确保数据不为None
-                    if price is None:
-                        price = 0
-                    
-                    if change is None:
-                        change = 0
-                    
-                    stock_info = {
-                        'code': stock_code,
-                        'name': stock_name,
-                        'price': price,
-                        'change': change,
-                        'volume': volume,
-                        'volume_ratio': round(volume_ratio, 2),
-                        'order_ratio': round(order_ratio, 2),
-                        'turnover_rate': round(turnover_rate, 2),
-                        'sector_change': round(sector_change, 2),
-                        'indicators': {
-                            'volume_ratio_qualified': volume_ratio_qualified,
-                            'order_ratio_qualified': order_ratio_qualified,
-                            'turnover_rate_qualified': turnover_rate_qualified,
-                            'sector_qualified': sector_qualified,
-                            'short_term_qualified': short_term_qualified
-                        }
-                    }
-                    filtered_stocks.append(stock_info)
-                    
-                    processed_count += 1
-                    
-                except Exception as e:
-                    logger.error(f"处理股票 {row.get('代码', '未知')} 失败: {str(e)}")
-                    continue
-            
-            logger.info(f"筛选出 {len(filtered_stocks)} 只符合'平替'策略条件的股票")
-            return filtered_stocks
-            
-        except Exception as e:
-            logger.error(f"筛选股票失败: {str(e)}")
-            return []
+        return filter_substitute_stocks(market_data)
     
-    def filter_all_markets(self):
+    def filter_all_markets(self, token=None):
         """
         筛选所有市场的股票
+        :param token: 取消令牌，取消时抛出 OperationCancelled
         :return: 筛选后的股票列表
         """
         try:
             # 获取所有市场数据
-            all_markets_data = self.fetcher.get_all_markets_data()
+            all_markets_data = self.fetcher.get_all_markets_data(token=token)
             
             all_filtered_stocks = []
             
@@ -4,11 +4,19 @@ import logging
 import requests
 import json
 import concurrent.futures
+import queue
+import threading
 from datetime import datetime, timedelta, timezone
-from typing import List, Dict, Optional
+from typing import Callable, List, Dict, Iterable, Iterator, Optional, Tuple, Union
 import time
 import os
 import pickle
+from cancellation import CancellationToken, OperationCancelled, call_cancellable, raise_if_cancelled
+from data_fetcher import parse_tencent_quote
+from ranking import rank_stocks, YIN_LINE_WEIGHTS
+from screening import Predicate, PredicateStats, ScreeningExecutor, STAGE_REALTIME, STAGE_KLINE, STAGE_ORDER
+from notification_queue import NotificationQueue, default_queue
+from trading_calendar import TradingCalendar
 
 # 设置时区为北京时间（东八区）
 BEIJING_TZ = timezone(timedelta(hours=8))
@@ -54,9 +62,9 @@ class KLineDataFetcher:
         self.max_retries = 3  # 最大重试次数
         self.max_workers = 20  # 增加并行度，提高速度
         
-        # K线数据缓存配置
+        # K线数据缓存配置：缓存只保存已收盘的日K线，最近一次收盘之后写入的缓存才有效
         self.cache_dir = 'kline_cache'
-        self.cache_expiry_hours = 24  # 缓存有效期24小时
+        self.calendar = TradingCalendar()
         self._ensure_cache_dir()
     
     def _ensure_cache_dir(self):
@@ -73,10 +81,9 @@ class KLineDataFetcher:
         if not os.path.exists(cache_file):
             return False
         
-        file_time = datetime.fromtimestamp(os.path.getmtime(cache_file))
-        expiry_time = datetime.now() - timedelta(hours=self.cache_expiry_hours)
-        
-        return file_time > expiry_time
+        # 收盘前写入的缓存缺少最近一根日K线，需要重新获取
+        file_time = datetime.fromtimestamp(os.path.getmtime(cache_file), tz=BEIJING_TZ)
+        return file_time >= self.calendar.last_close()
     
     def _load_from_cache(self, stock_code: str) -> Optional[pd.DataFrame]:
         """从缓存加载K线数据"""
@@ -111,7 +118,7 @@ class KLineDataFetcher:
         
         # 缓存不存在或已过期，从腾讯API获取
         try:
-            kline_data = self._get_kline_from_qq(stock_code, days)
+            kline_data = self._drop_unfinished_bar(self._get_kline_from_qq(stock_code, days))
             if kline_data is not None:
                 # 保存到缓存
                 self._save_to_cache(stock_code, kline_data)
@@ -123,6 +130,18 @@ class KLineDataFetcher:
         logger.error(f"无法获取 {stock_code} 的K线数据")
         return None
 
+    def _drop_unfinished_bar(self, kline_data: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+        """
+        去掉盘中获取时当天尚未收盘的K线，否则缩量等条件会拿半天的成交量和20日均量比较
+        :param kline_data: K线数据
+        :return: 只包含已收盘日K线的数据
+        """
+        if kline_data is None or kline_data.empty or 'date' not in kline_data:
+            return kline_data
+        last_close = self.calendar.last_close()
+        finished = kline_data[kline_data['date'] <= pd.Timestamp(last_close.date())]
+        return finished.reset_index(drop=True)
+
     def _get_kline_from_qq(self, stock_code: str, days: int = 60) -> Optional[pd.DataFrame]:
         """从腾讯财经获取K线数据"""
         for retry in range(self.max_retries):
@@ -166,32 +185,76 @@ class KLineDataFetcher:
                 logger.error(f"腾讯财经API错误: {str(e)}")
         return None
     
-    def get_kline_data_batch(self, stock_codes: List[str], days: int = 60) -> Dict[str, Optional[pd.DataFrame]]:
-        """批量获取K线数据，使用并行处理"""
-        logger.info(f"开始批量获取 {len(stock_codes)} 只股票的K线数据")
-        
-        results = {}
+    def iter_kline_data_batch(self, stock_codes: Iterable[str], days: int = 60,
+                              max_in_flight: Optional[int] = None,
+                              token: Optional[CancellationToken] = None) -> Iterator[Tuple[str, Optional[pd.DataFrame]]]:
+        """
+        流式批量获取K线数据，每获取完一只股票就返回 (代码, K线数据)
+        同时在途的请求数有上限，调用方处理完即可丢弃数据，内存占用与股票总数无关
+        :param stock_codes: 股票代码列表
+        :param days: K线天数
+        :param max_in_flight: 同时提交的最大任务数，默认为并行度的2倍
+        :param token: 取消令牌，取消后丢弃未开始的任务、不再等待进行中的请求，抛出 OperationCancelled
+        :return: (股票代码, K线数据或None) 的迭代器
+        """
+        max_in_flight = max_in_flight or self.max_workers * 2
+        codes = iter(stock_codes)
+        in_flight = {}
+        success = 0
+        failed = 0
+        
+        logger.info("开始流式批量获取K线数据")
+        
+        executor = concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers)
+        
+        def submit_next() -> bool:
+            stock_code = next(codes, None)
+            if stock_code is None:
+                return False
+            in_flight[executor.submit(self.get_kline_data, stock_code, days)] = stock_code
+            return True
         
-        # 使用线程池并行处理
-        with concurrent.futures.ThreadPoolExecutor(max_workers=self.max_workers) as executor:
-            # 提交所有任务
-            future_to_stock = {executor.submit(self.get_kline_data, stock_code, days): stock_code for stock_code in stock_codes}
+        try:
+            for _ in range(max_in_flight):
+                if not submit_next():
+                    break
             
-            # 收集结果
-            for future in concurrent.futures.as_completed(future_to_stock):
-                stock_code = future_to_stock[future]
-                try:
-                    kline_data = future.result()
-                    results[stock_code] = kline_data
+            while in_flight:
+                # 有取消令牌时定期醒来检查，保证取消后0.2秒内返回
+                done, _ = concurrent.futures.wait(in_flight, timeout=0.2 if token is not None else None,
+                                                  return_when=concurrent.futures.FIRST_COMPLETED)
+                raise_if_cancelled(token)
+                for future in done:
+                    stock_code = in_flight.pop(future)
+                    try:
+                        kline_data = future.result()
+                    except Exception as e:
+                        logger.error(f"获取 {stock_code} K线数据时发生错误: {str(e)}")
+                        kline_data = None
+                    
                     if kline_data is not None:
+                        success += 1
                         logger.info(f"成功获取 {stock_code} K线数据，共 {len(kline_data)} 条")
                     else:
+                        failed += 1
                         logger.warning(f"无法获取 {stock_code} K线数据")
-                except Exception as e:
-                    logger.error(f"获取 {stock_code} K线数据时发生错误: {str(e)}")
-                    results[stock_code] = None
+                    
+                    submit_next()
+                    yield stock_code, kline_data
+        finally:
+            # 调用方提前结束迭代时丢弃尚未开始的任务
+            executor.shutdown(wait=False, cancel_futures=True)
+        
+        logger.info(f"批量获取K线数据完成，成功 {success} 只，失败 {failed} 只")
+    
+    def get_kline_data_batch(self, stock_codes: List[str], days: int = 60,
+                             token: Optional[CancellationToken] = None) -> Dict[str, Optional[pd.DataFrame]]:
+        """批量获取K线数据，使用并行处理；股票较多时优先使用 iter_kline_data_batch"""
+        logger.info(f"开始批量获取 {len(stock_codes)} 只股票的K线数据")
         
-        logger.info(f"批量获取K线数据完成，成功 {sum(1 for v in results.values() if v is not None)} 只，失败 {sum(1 for v in results.values() if v is None)} 只")
+        results = {}
+        for stock_code, kline_data in self.iter_kline_data_batch(stock_codes, days, token=token):
+            results[stock_code] = kline_data
         return results
     
     def has_big_yang_line_or_limit_up(self, kline_data: pd.DataFrame, lookback_days: int = 30) -> bool:
@@ -274,116 +337,199 @@ class KLineDataFetcher:
         
         return volume_ratio <= threshold
 
+def records_from_snapshot(market_data: pd.DataFrame) -> List[Dict]:
+    """
+    把 DataFetcher 的全市场行情快照转换为 get_realtime_data 的实时行情格式
+    :param market_data: 行情快照DataFrame（需包含"今开"列）
+    :return: 实时行情列表，过滤掉停牌（价格或开盘价为0）的股票
+    """
+    if market_data is None or market_data.empty or '今开' not in market_data.columns:
+        return []
+    
+    def column(name, default=0.0):
+        if name not in market_data.columns:
+            return pd.Series(default, index=market_data.index, dtype='float64')
+        return pd.to_numeric(market_data[name], errors='coerce').fillna(default)
+    
+    price = column('最新价')
+    open_price = column('今开')
+    valid = (price > 0) & (open_price > 0)
+    
+    frame = pd.DataFrame({
+        'code': market_data['代码'],
+        'name': market_data['名称'],
+        'price': price,
+        'open': open_price,
+        'high': column('最高价'),
+        'low': column('最低价'),
+        'yesterday_close': column('昨收'),
+        'change_percent': column('涨跌幅'),
+        'volume': column('成交量').astype('int64'),
+        'amount': column('成交额'),
+        'volume_ratio': column('量比'),
+        'order_ratio': column('委比'),
+        'turnover_rate': column('换手率'),
+        'is_yin_line': price < open_price
+    })[valid]
+    return frame.to_dict('records')
+
 class StockSelector:
-    def __init__(self):
+    # 流水线中预取的实时行情批次数
+    PREFETCH_BATCHES = 4
+    
+    def __init__(self, stats: Optional[PredicateStats] = None):
+        """
+        :param stats: 条件统计，默认从 data_cache/predicate_stats.json 加载
+        """
         self.session = requests.Session()
         self.session.headers.update({
             'User-Agent': 'Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36'
         })
         self.kline_fetcher = KLineDataFetcher()
+        # 条件和跨运行的历史统计；每次选股由 new_run() 创建独立的执行器，并发的选股互不干扰
+        self.executor = ScreeningExecutor(self._build_predicates(), stats=stats)
+        self.last_funnel = []
+        self.last_counters = {}
+        self.last_run_counts = {}
+        self.rank_weights = dict(YIN_LINE_WEIGHTS)
     
-    def get_realtime_data(self, stock_codes: List[str]) -> List[Dict]:
-        try:
-            logger.info(f"开始获取 {len(stock_codes)} 只股票的实时数据")
-            
-            market_prefix_map = {}
-            for code in stock_codes:
-                if code.startswith('60') or code.startswith('688'):
-                    market_prefix_map[code] = 'sh'
-                elif code.startswith('00') or code.startswith('300'):
-                    market_prefix_map[code] = 'sz'
-                else:
-                    market_prefix_map[code] = 'sh'
-            
-            symbols = [f"{market_prefix_map[code]}{code}" for code in stock_codes]
-            
-            batch_size = 100
-            all_data = []
+    def new_run(self) -> ScreeningExecutor:
+        """
+        为一次选股创建执行器：共用条件和历史统计，本次运行的条件顺序和漏斗统计只属于这次运行
+        """
+        return ScreeningExecutor(self.executor.predicates, stats=self.executor.stats)
+    
+    def _build_predicates(self) -> List[Predicate]:
+        """
+        "买阴不买阳"策略的各项条件，列表顺序为没有历史统计时的默认执行顺序
+        """
+        fetcher = self.kline_fetcher
+        return [
+            Predicate('yin_line', '买阴不买阳', STAGE_REALTIME,
+                      lambda stock, kline_data: stock['is_yin_line']),
+            Predicate('volume_shrink', '缩量（量能萎缩80%以内）', STAGE_KLINE,
+                      lambda stock, kline_data: fetcher.is_volume_shrink(kline_data, threshold=0.8)),
+            Predicate('price_near_ma10', '股价紧贴10日线', STAGE_KLINE,
+                      lambda stock, kline_data: fetcher.is_price_near_ma10(kline_data, threshold=0.03)),
+            Predicate('ma10_upward', '10日线向上', STAGE_KLINE,
+                      lambda stock, kline_data: fetcher.is_ma10_upward(kline_data, days=3)),
+            Predicate('ma10_near_ma20', '10日线贴近20日线', STAGE_KLINE,
+                      lambda stock, kline_data: fetcher.is_ma10_near_ma20(kline_data, threshold=0.03)),
+            Predicate('big_yang', '前期有涨停/大阳线', STAGE_KLINE,
+                      lambda stock, kline_data: fetcher.has_big_yang_line_or_limit_up(kline_data, lookback_days=30))
+        ]
+    
+    def _parse_realtime_response(self, text: str) -> List[Dict]:
+        """
+        解析腾讯财经实时行情响应
+        :param text: 响应文本
+        :return: 实时行情列表
+        """
+        records = []
+        lines = text.strip().split(';')
+        
+        for line in lines:
+            if not line:
+                continue
             
-            for i in range(0, len(symbols), batch_size):
-                batch_symbols = symbols[i:i+batch_size]
-                symbols_str = ",".join(batch_symbols)
-                url = f"http://qt.gtimg.cn/q={symbols_str}"
+            try:
+                parts = line.split('=')
+                if len(parts) != 2:
+                    continue
                 
-                logger.info(f"获取批次 {i//batch_size + 1}/{(len(symbols) + batch_size - 1) // batch_size}")
+                symbol_part = parts[0].strip()
+                data_part = parts[1].strip().strip('"')
                 
-                try:
-                    response = self.session.get(url, timeout=10)
-                    response.encoding = 'gbk'
+                if symbol_part.startswith('v_'):
+                    symbol = symbol_part[2:]
+                    stock_code = symbol[2:]
                     
-                    if response.status_code != 200:
-                        logger.error(f"API请求失败: {response.status_code}")
+                    fields = data_part.split('~')
+                    if len(fields) < 40:
                         continue
                     
-                    lines = response.text.strip().split(';')
+                    quote = parse_tencent_quote(fields)
+                    price = quote['price']
+                    open_price = quote['open']
                     
-                    for line in lines:
-                        if not line:
-                            continue
-                        
-                        try:
-                            parts = line.split('=')
-                            if len(parts) != 2:
-                                continue
-                            
-                            symbol_part = parts[0].strip()
-                            data_part = parts[1].strip().strip('"')
-                            
-                            if symbol_part.startswith('v_'):
-                                symbol = symbol_part[2:]
-                                stock_code = symbol[2:]
-                                
-                                fields = data_part.split('~')
-                                if len(fields) < 40:
-                                    continue
-                                
-                                name = fields[1]
-                                price = float(fields[3]) if fields[3] else 0
-                                yesterday_close = float(fields[4]) if fields[4] else 0
-                                open_price = float(fields[5]) if fields[5] else 0
-                                volume = int(float(fields[6])) if fields[6] else 0
-                                amount = float(fields[37]) if len(fields) > 37 and fields[37] else 0
-                                high = float(fields[33]) if len(fields) > 33 and fields[33] else 0
-                                low = float(fields[34]) if len(fields) > 34 and fields[34] else 0
-                                
-                                change_percent = float(fields[32]) if len(fields) > 32 and fields[32] else 0
-                                volume_ratio = float(fields[49]) if len(fields) > 49 and fields[49] else 1.0
-                                turnover_rate = float(fields[38]) if len(fields) > 38 and fields[38] else 0.0
-                                
-                                try:
-                                    order_data = fields[35].split('/') if len(fields) > 35 and fields[35] else []
-                                    order_ratio = float(order_data[0]) if len(order_data) > 0 else 0.0
-                                except:
-                                    order_ratio = 0.0
-                                
-                                if price > 0 and open_price > 0:
-                                    stock_data = {
-                                        'code': stock_code,
-                                        'name': name,
-                                        'price': price,
-                                        'open': open_price,
-                                        'high': high,
-                                        'low': low,
-                                        'yesterday_close': yesterday_close,
-                                        'change_percent': change_percent,
-                                        'volume': volume,
-                                        'amount': amount,
-                                        'volume_ratio': volume_ratio,
-                                        'order_ratio': order_ratio,
-                                        'turnover_rate': turnover_rate,
-                                        'is_yin_line': price < open_price
-                                    }
-                                    all_data.append(stock_data)
-                        
-                        except Exception as e:
-                            logger.error(f"解析股票数据失败: {str(e)}")
-                            continue
+                    if price > 0 and open_price > 0:
+                        stock_data = {
+                            'code': stock_code,
+                            'name': quote['name'],
+                            'price': price,
+                            'open': open_price,
+                            'high': quote['high'],
+                            'low': quote['low'],
+                            'yesterday_close': quote['yesterday_close'],
+                            'change_percent': quote['change_percent'],
+                            'volume': quote['volume'],
+                            'amount': quote['amount'],
+                            'volume_ratio': quote['volume_ratio'],
+                            'order_ratio': quote['order_ratio'],
+                            'turnover_rate': quote['turnover_rate'],
+                            'is_yin_line': price < open_price
+                        }
+                        records.append(stock_data)
+            
+            except Exception as e:
+                logger.error(f"解析股票数据失败: {str(e)}")
+                continue
+        
+        return records
+    
+    def iter_realtime_batches(self, stock_codes: List[str], batch_size: int = 100,
+                              token: Optional[CancellationToken] = None) -> Iterator[List[Dict]]:
+        """
+        分批获取实时数据，每获取一批就返回一批
+        :param stock_codes: 股票代码列表
+        :param batch_size: 每批股票数
+        :param token: 取消令牌
+        :return: 每批实时行情列表的迭代器
+        """
+        market_prefix_map = {}
+        for code in stock_codes:
+            if code.startswith('60') or code.startswith('688'):
+                market_prefix_map[code] = 'sh'
+            elif code.startswith('00') or code.startswith('300'):
+                market_prefix_map[code] = 'sz'
+            else:
+                market_prefix_map[code] = 'sh'
+        
+        symbols = [f"{market_prefix_map[code]}{code}" for code in stock_codes]
+        total_batches = (len(symbols) + batch_size - 1) // batch_size
+        
+        for i in range(0, len(symbols), batch_size):
+            raise_if_cancelled(token)
+            batch_symbols = symbols[i:i+batch_size]
+            symbols_str = ",".join(batch_symbols)
+            url = f"http://qt.gtimg.cn/q={symbols_str}"
+            
+            logger.info(f"获取批次 {i//batch_size + 1}/{total_batches}")
+            
+            try:
+                response = call_cancellable(self.session.get, url, timeout=10, token=token)
+                response.encoding = 'gbk'
                 
-                except Exception as e:
-                    logger.error(f"请求API失败: {str(e)}")
+                if response.status_code != 200:
+                    logger.error(f"API请求失败: {response.status_code}")
                     continue
                 
+                yield self._parse_realtime_response(response.text)
+            
+            except Exception as e:
+                logger.error(f"请求API失败: {str(e)}")
+                continue
+            
+            finally:
                 time.sleep(0.1)
+    
+    def get_realtime_data(self, stock_codes: List[str]) -> List[Dict]:
+        try:
+            logger.info(f"开始获取 {len(stock_codes)} 只股票的实时数据")
+            
+            all_data = []
+            for batch in self.iter_realtime_batches(stock_codes):
+                all_data.extend(batch)
             
             logger.info(f"成功获取 {len(all_data)} 只股票的实时数据")
             return all_data
@@ -392,26 +538,62 @@ class StockSelector:
             logger.error(f"获取实时数据失败: {str(e)}")
             return []
     
-    def select_stocks(self, stock_codes: List[str]) -> List[Dict]:
+    def select_stocks(self, stock_codes: List[str], token: Optional[CancellationToken] = None) -> List[Dict]:
+        """
+        流水线选股：每获取一批实时数据就执行实时条件，通过的股票立即提交K线获取，
+        每只股票的K线一到就执行K线条件
+        :param stock_codes: 股票代码列表
+        :param token: 取消令牌，取消时抛出 OperationCancelled
+        :return: 选中的股票列表
+        """
         logger.info("=" * 60)
         logger.info("开始筛选股票")
         logger.info("=" * 60)
         logger.info(f"待筛选股票数: {len(stock_codes)}")
         
-        logger.info("\n【步骤1】获取实时数据...")
-        realtime_data = self.get_realtime_data(stock_codes)
-        
+        logger.info("\n【步骤1】流水线获取实时数据和K线数据...")
+        return self._run_pipeline(self.iter_realtime_batches(stock_codes, token=token), token=token)
+    
+    def select_from_records(self, realtime_data: List[Dict],
+                            token: Optional[CancellationToken] = None) -> List[Dict]:
+        """
+        对已获取的实时行情执行"买阴不买阳"筛选
+        :param realtime_data: get_realtime_data 或 records_from_snapshot 返回的实时行情列表
+        :param token: 取消令牌
+        :return: 选中的股票列表
+        """
         if not realtime_data:
-            logger.warning("✗ 未获取到实时数据")
             return []
         
-        logger.info(f"✓ 成功获取 {len(realtime_data)} 只股票的实时数据")
-        
-        # 统计变量
-        filtered_by_yin = 0
-        filtered_by_kline = 0
+        return self._run_pipeline([realtime_data], token=token)
+    
+    def select_from_snapshot(self, market_data: Union[pd.DataFrame, Dict[str, pd.DataFrame]],
+                             token: Optional[CancellationToken] = None) -> List[Dict]:
+        """
+        直接使用 DataFetcher 下载的行情快照选股，不再按代码重新请求实时行情
+        :param market_data: 行情快照DataFrame，或 get_all_markets_data 返回的 {市场: DataFrame}
+        :param token: 取消令牌
+        :return: 选中的股票列表
+        """
+        frames = list(market_data.values()) if isinstance(market_data, dict) else [market_data]
+        logger.info("=" * 60)
+        logger.info("使用行情快照筛选股票")
+        logger.info("=" * 60)
+        logger.info(f"待筛选股票数: {sum(len(frame) for frame in frames if frame is not None)}")
         
-        selected_stocks = []
+        # 每个市场的快照作为一批进入流水线，前一个市场的K线获取与后一个市场的实时条件重叠
+        return self._run_pipeline((records_from_snapshot(frame) for frame in frames), token=token)
+    
+    def _run_pipeline(self, batches: Iterable[List[Dict]], token: Optional[CancellationToken] = None) -> List[Dict]:
+        """
+        流水线执行筛选：实时行情批次在后台线程预取，通过实时条件的股票交给 iter_kline_data_batch 获取K线，
+        同时在途的K线请求有上限；条件判断统一在当前线程执行
+        :param batches: 实时行情批次的可迭代对象
+        :param token: 取消令牌，取消时丢弃未开始的K线任务并立即返回
+        :return: 选中的股票列表
+        """
+        # 根据历史通过率和耗时确定本次条件执行顺序
+        executor = self.new_run()
         
         logger.info("\n【步骤2】开始筛选...")
         logger.info("筛选条件：")
@@ -419,213 +601,327 @@ class StockSelector:
         logger.info("  - 缩量回调10日线：量能萎缩80%以内 + 股价紧贴10日线")
         logger.info("  - 10日线向上、贴近20日线：10日均线多头 + 两线距离＜3%")
         logger.info("  - 前期有涨停/大阳线：30天内出现过7%以上大阳/涨停")
+        logger.info("执行顺序：" + " → ".join(p.label for stage in STAGE_ORDER for p in executor.ordered(stage)))
         logger.info("")
         
-        # 先进行基础筛选，收集需要进行K线分析的股票
-        stocks_to_analyze = []
-        for stock in realtime_data:
-            try:
-                code = stock['code']
-                name = stock['name']
-                
-                # 1. 买阴不买阳：收盘价 < 开盘价，收纯阴线
-                if not stock['is_yin_line']:
-                    filtered_by_yin += 1
+        # 统计变量
+        counters = {'total': 0, 'filtered_by_yin': 0, 'filtered_by_kline': 0, 'kline_failed': 0}
+        selected_stocks = []
+        candidates: Dict[str, Dict] = {}
+        # 后台线程最多预取几批实时行情，K线获取跟不上时暂停，内存占用与股票总数无关
+        batch_queue = queue.Queue(maxsize=self.PREFETCH_BATCHES)
+        stopped = threading.Event()
+        started = time.time()
+        
+        def offer(item) -> bool:
+            while not stopped.is_set():
+                try:
+                    batch_queue.put(item, timeout=0.2)
+                    return True
+                except queue.Full:
                     continue
-                
-                # 通过基础筛选，加入待分析列表
-                stocks_to_analyze.append(stock)
-            except Exception as e:
-                logger.error(f"处理股票 {stock.get('code', '未知')} 时出错: {str(e)}")
-                continue
-        
-        logger.info(f"基础筛选完成，共 {len(stocks_to_analyze)} 只股票需要进行K线分析")
-        
-        # 批量获取K线数据
-        kline_data_dict = {}
-        if stocks_to_analyze:
-            stock_codes = [stock['code'] for stock in stocks_to_analyze]
-            kline_data_dict = self.kline_fetcher.get_kline_data_batch(stock_codes, days=60)
+            return False
         
-        # 对每个股票进行K线分析
-        for stock in stocks_to_analyze:
+        def produce():
             try:
-                code = stock['code']
-                name = stock['name']
-                
-                # 获取K线数据
-                kline_data = kline_data_dict.get(code)
-                
-                if kline_data is not None and len(kline_data) >= 30:
-                    # 2. 缩量回调10日线：量能萎缩80%以内 + 股价紧贴10日线
-                    is_volume_shrink = self.kline_fetcher.is_volume_shrink(kline_data, threshold=0.8)
-                    is_price_near_ma10 = self.kline_fetcher.is_price_near_ma10(kline_data, threshold=0.03)
-                    
-                    if not (is_volume_shrink and is_price_near_ma10):
-                        filtered_by_kline += 1
-                        continue
-                    
-                    # 3. 10日线向上、贴近20日线：10日均线多头 + 两线距离＜3%
-                    ma10_upward = self.kline_fetcher.is_ma10_upward(kline_data, days=3)
-                    ma_near = self.kline_fetcher.is_ma10_near_ma20(kline_data, threshold=0.03)
-                    
-                    if not (ma10_upward and ma_near):
-                        filtered_by_kline += 1
+                for batch in batches:
+                    raise_if_cancelled(token)
+                    if not offer(batch):
+                        return
+            except OperationCancelled:
+                pass
+            except Exception as e:
+                logger.error(f"获取实时数据失败: {str(e)}")
+            offer(None)
+        
+        def candidate_codes() -> Iterator[str]:
+            """执行实时条件，逐只返回需要获取K线的股票代码"""
+            while True:
+                try:
+                    batch = batch_queue.get(timeout=0.2)
+                except queue.Empty:
+                    raise_if_cancelled(token)
+                    continue
+                if batch is None:
+                    logger.info(f"实时数据获取完成，共 {counters['total']} 只股票")
+                    return
+                counters['total'] += len(batch)
+                for stock in batch:
+                    passed, _ = executor.evaluate(STAGE_REALTIME, stock)
+                    if not passed:
+                        counters['filtered_by_yin'] += 1
                         continue
-                    
-                    # 4. 前期有涨停/大阳线：30天内出现过7%以上大阳/涨停
-                    has_big_yang = self.kline_fetcher.has_big_yang_line_or_limit_up(kline_data, lookback_days=30)
-                    
-                    if not has_big_yang:
-                        filtered_by_kline += 1
+                    if stock['code'] in candidates:
                         continue
-                else:
-                    # K线数据获取失败，跳过该股票
-                    filtered_by_kline += 1
-                    continue
-                
-                # 计算优先级
-                priority = 0
-                
-                if stock['volume_ratio'] < 0.5:
-                    priority += 3
-                elif stock['volume_ratio'] < 0.8:
-                    priority += 2
-                
-                if stock['turnover_rate'] >= 3 and stock['turnover_rate'] <= 8:
-                    priority += 2
-                
-                if stock['change_percent'] >= -5 and stock['change_percent'] <= -2:
-                    priority += 2
-                
-                if stock['order_ratio'] > 0:
-                    priority += 1
-                
-                stock_info = {
-                    'code': code,
-                    'name': name,
-                    'price': stock['price'],
-                    'change_percent': stock['change_percent'],
-                    'volume_ratio': stock['volume_ratio'],
-                    'turnover_rate': stock['turnover_rate'],
-                    'order_ratio': stock['order_ratio'],
-                    'volume': stock['volume'],
-                    'priority': priority
-                }
-                
-                selected_stocks.append(stock_info)
-                logger.info(f"✓ 筛选通过: {code} {name} - 价格:{stock['price']:.2f} 跌幅:{stock['change_percent']:.2f}% 量比:{stock['volume_ratio']:.2f} 优先级:{priority}")
-                
-            except Exception as e:
-                logger.error(f"✗ 处理股票 {stock.get('code', '未知')} 失败: {str(e)}")
-                continue
+                    candidates[stock['code']] = stock
+                    yield stock['code']
+        
+        producer = threading.Thread(target=produce, daemon=True)
+        producer.start()
+        try:
+            # 通过实时条件的股票交给有在途上限的K线流，每只股票的K线一到就执行K线条件
+            for code, kline_data in self.kline_fetcher.iter_kline_data_batch(candidate_codes(), days=60, token=token):
+                stock_info = self._evaluate_kline(executor, candidates.pop(code), kline_data, counters)
+                if stock_info is not None:
+                    selected_stocks.append(stock_info)
+        except OperationCancelled:
+            logger.warning(f"✗ 选股已取消，丢弃 {len(candidates)} 只股票的K线任务")
+            raise
+        finally:
+            stopped.set()
+        
+        return self._finish_selection(executor, selected_stocks, counters, started)
+    
+    def _finish_selection(self, executor: ScreeningExecutor, selected_stocks: List[Dict], counters: Dict,
+                          started: float) -> List[Dict]:
+        """
+        排序选中的股票，输出筛选统计并把本次条件统计并入历史统计
+        :param executor: 本次运行的执行器
+        :param selected_stocks: 通过全部条件的股票
+        :param counters: 统计变量
+        :param started: 开始时间
+        :return: 排序后的选中股票列表
+        """
+        self.last_counters = dict(counters)
+        self.last_run_counts = executor.run_counts
+        if counters['total'] == 0:
+            logger.warning("✗ 未获取到实时数据")
+            self.last_funnel = executor.funnel()
+            return []
         
-        selected_stocks.sort(key=lambda x: x['priority'], reverse=True)
+        # 按加权因子得分排序，优先级取得分的整数部分
+        selected_stocks = rank_stocks(selected_stocks, weights=self.rank_weights)
+        for stock_info in selected_stocks:
+            stock_info['priority'] = int(round(stock_info['score']))
+            logger.info(f"✓ 筛选通过: {stock_info['code']} {stock_info['name']} - 价格:{stock_info['price']:.2f} 跌幅:{stock_info['change_percent']:.2f}% 量比:{stock_info['volume_ratio']:.2f} 优先级:{stock_info['priority']}")
         
+        total = counters['total']
+        filtered_by_yin = counters['filtered_by_yin']
+        filtered_by_kline = counters['filtered_by_kline']
         logger.info("\n【步骤3】筛选统计")
-        logger.info(f"  - 总股票数: {len(realtime_data)}")
-        logger.info(f"  - 非阴线: {filtered_by_yin} 只 (通过率: {(len(realtime_data) - filtered_by_yin) / len(realtime_data) * 100:.1f}%)")
-        logger.info(f"  - K线形态不符: {filtered_by_kline} 只 (通过率: {(len(realtime_data) - filtered_by_yin - filtered_by_kline) / len(realtime_data) * 100:.1f}%)")
-        logger.info(f"  - 最终通过: {len(selected_stocks)} 只 (总通过率: {len(selected_stocks) / len(realtime_data) * 100:.2f}%)")
-        
-
+        logger.info(f"  - 总股票数: {total}")
+        logger.info(f"  - 非阴线: {filtered_by_yin} 只 (通过率: {(total - filtered_by_yin) / total * 100:.1f}%)")
+        logger.info(f"  - K线形态不符: {filtered_by_kline} 只 (通过率: {(total - filtered_by_yin - filtered_by_kline) / total * 100:.1f}%)，其中K线获取失败 {counters['kline_failed']} 只")
+        logger.info(f"  - 最终通过: {len(selected_stocks)} 只 (总通过率: {len(selected_stocks) / total * 100:.2f}%)")
+        logger.info(f"  - 总耗时: {time.time() - started:.1f}s")
+        executor.log_funnel(logger)
+        self.last_funnel = executor.funnel()
+        executor.finish_run()
         
         logger.info("\n【步骤4】选股完成")
         logger.info(f"✓ 筛选完成，共选中 {len(selected_stocks)} 只股票")
         logger.info("=" * 60)
         
         return selected_stocks
+    
+    @staticmethod
+    def stock_info(stock: Dict) -> Dict:
+        """从实时行情中提取选中股票的输出字段"""
+        return {
+            'code': stock['code'],
+            'name': stock['name'],
+            'price': stock['price'],
+            'change_percent': stock['change_percent'],
+            'volume_ratio': stock['volume_ratio'],
+            'turnover_rate': stock['turnover_rate'],
+            'order_ratio': stock['order_ratio'],
+            'volume': stock['volume']
+        }
+    
+    def _evaluate_kline(self, executor: ScreeningExecutor, stock: Dict, kline_data: Optional[pd.DataFrame],
+                        counters: Dict) -> Optional[Dict]:
+        """
+        对一只股票执行K线条件
+        :param executor: 本次运行的执行器
+        :param stock: 实时行情
+        :param kline_data: K线数据
+        :param counters: 统计变量
+        :return: 通过时返回选中股票信息，否则返回None
+        """
+        try:
+            if kline_data is None or len(kline_data) < 30:
+                # K线数据获取失败，跳过该股票
+                counters['filtered_by_kline'] += 1
+                counters['kline_failed'] += 1
+                return None
+            
+            passed, _ = executor.evaluate(STAGE_KLINE, stock, kline_data)
+            if not passed:
+                counters['filtered_by_kline'] += 1
+                return None
+            
+            return self.stock_info(stock)
+            
+        except Exception as e:
+            logger.error(f"✗ 处理股票 {stock.get('code', '未知')} 失败: {str(e)}")
+            counters['filtered_by_kline'] += 1
+            return None
 
 class FeishuNotifier:
-    def __init__(self, webhook_url: str):
+    # 飞书自定义机器人的请求体不能超过20KB，按JSON编码后的长度计算，留出余量
+    MAX_MESSAGE_BYTES = 18 * 1024
+    
+    def __init__(self, webhook_url: str, notification_queue: Optional[NotificationQueue] = None):
+        """
+        :param webhook_url: 飞书机器人webhook地址
+        :param notification_queue: 后台发送队列，默认使用进程内共享的队列
+        """
         self.webhook_url = webhook_url
+        self.queue = notification_queue or default_queue()
+    
+    def build_messages(self, selected_stocks: List[Dict], time_line: str) -> List[str]:
+        """
+        生成选股结果消息，股票较多时拆分为多条，每条不超过 MAX_MESSAGE_BYTES
+        :param selected_stocks: 选股结果，按调用方给出的顺序（各策略已按自己的权重排序）编号
+        :param time_line: 筛选时间行
+        :return: 消息文本列表
+        """
+        if not selected_stocks:
+            return [f"股票筛选结果\n\n{time_line}\n\n今日未筛选出符合条件的股票。"]
+        
+        header_lines = [
+            time_line,
+            f"筛选条件:",
+            f"• 阴线（收盘价 < 开盘价）",
+            f"• 缩量回调（量比 < 2.0）",
+            f"• 跌幅适中（跌幅 <= 0%）",
+            f"• 价格区间（5元 ~ 60元）",
+            f"• 前30天有大阳线或涨停板",
+            f"• 10日线倾斜向上（多头排列）",
+            f"• 10日线与20日线距离较近",
+            f"",
+            f"共筛选出 {len(selected_stocks)} 只股票:",
+            f""
+        ]
+        stock_lines = []
+        for idx, stock in enumerate(selected_stocks, 1):
+            stock_lines.append(
+                f"{idx}. {stock['code']} {stock['name']} | "
+                f"价格: {stock['price']} | "
+                f"跌幅: {stock['change_percent']}% | "
+                f"量比: {stock['volume_ratio']} | "
+                f"换手率: {stock['turnover_rate']}% | "
+                f"优先级: {stock.get('priority', int(round(stock.get('score', 0))))}"
+            )
+        
+        # 按JSON编码后的长度装箱（中文字符编码为\uXXXX），标题行预留64字节
+        budget = self.MAX_MESSAGE_BYTES - 64
+        parts = [header_lines]
+        size = sum(len(json.dumps(line)) for line in header_lines)
+        for line in stock_lines:
+            cost = len(json.dumps(line))
+            if size + cost > budget and len(parts[-1]) > 0:
+                parts.append([])
+                size = 0
+            parts[-1].append(line)
+            size += cost
+        
+        if len(parts) == 1:
+            return ["\n".join(["股票筛选结果", ""] + parts[0])]
+        return ["\n".join([f"股票筛选结果（{i}/{len(parts)}）", ""] + part) for i, part in enumerate(parts, 1)]
     
     def send_message(self, selected_stocks: List[Dict]) -> bool:
+        """
+        把选股结果放入后台队列发送，立即返回
+        :param selected_stocks: 选股结果
+        :return: 是否有消息入队；与最近发送过的结果相同时返回False
+        """
         try:
-            if not selected_stocks:
-                message = {
-                    "msg_type": "text",
-                    "content": {
-                        "text": f"股票筛选结果\n\n筛选时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n\n今日未筛选出符合条件的股票。"
-                    }
-                }
-            else:
-                content_lines = [
-                    f"股票筛选结果",
-                    f"",
-                    f"筛选时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}",
-                    f"筛选条件:",
-                    f"• 阴线（收盘价 < 开盘价）",
-                    f"• 缩量回调（量比 < 2.0）",
-                    f"• 跌幅适中（跌幅 <= 0%）",
-                    f"• 价格区间（5元 ~ 60元）",
-                    f"• 前30天有大阳线或涨停板",
-                    f"• 10日线倾斜向上（多头排列）",
-                    f"• 10日线与20日线距离较近",
-                    f"",
-                    f"共筛选出 {len(selected_stocks)} 只股票:",
-                    f""
-                ]
-                
-                for idx, stock in enumerate(selected_stocks[:20], 1):
-                    content_lines.append(
-                        f"{idx}. {stock['code']} {stock['name']} | "
-                        f"价格: {stock['price']} | "
-                        f"跌幅: {stock['change_percent']}% | "
-                        f"量比: {stock['volume_ratio']} | "
-                        f"换手率: {stock['turnover_rate']}% | "
-                        f"优先级: {stock['priority']}"
-                    )
-                
-                if len(selected_stocks) > 20:
-                    content_lines.append(f"\n... 还有 {len(selected_stocks) - 20} 只股票未显示")
-                
-                message = {
-                    "msg_type": "text",
-                    "content": {
-                        "text": "\n".join(content_lines)
-                    }
-                }
+            time_line = f"筛选时间: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}"
+            texts = self.build_messages(selected_stocks, time_line)
+            messages = [{"msg_type": "text", "content": {"text": text}} for text in texts]
+            # 整个结果一个去重键（不考虑筛选时间），拆分后的各条消息作为一个通知一起发送或一起跳过
+            key = NotificationQueue.key_of([self.webhook_url] + [text.replace(time_line, '') for text in texts])
+            queued = self.queue.submit(self._post_parts(), messages, key=key)
+            if queued:
+                logger.info(f"飞书消息已加入发送队列: {len(messages)} 条")
+            return queued
             
-            response = requests.post(
-                self.webhook_url,
-                headers={'Content-Type': 'application/json'},
-                data=json.dumps(message),
-                timeout=10
-            )
-            
-            if response.status_code == 200:
-                result = response.json()
-                if result.get('code') == 0:
-                    logger.info("飞书消息发送成功")
-                    return True
-                else:
-                    logger.error(f"飞书消息发送失败: {result}")
-                    return False
-            else:
-                logger.error(f"飞书消息发送失败: HTTP {response.status_code}")
-                return False
-                
         except Exception as e:
             logger.error(f"发送飞书消息失败: {str(e)}")
             return False
+    
+    def _post_parts(self) -> Callable[[List[Dict]], None]:
+        """
+        按顺序发送拆分后的各条消息；重试时从失败的那条继续，已发送的不再重复发送
+        """
+        sent = [0]
+        
+        def post_all(messages: List[Dict]):
+            while sent[0] < len(messages):
+                self.post(messages[sent[0]])
+                sent[0] += 1
+        
+        return post_all
+    
+    def post(self, message: Dict):
+        """
+        发送一条消息，失败时抛出异常（由发送队列重试）
+        :param message: 飞书消息体
+        """
+        response = requests.post(
+            self.webhook_url,
+            headers={'Content-Type': 'application/json'},
+            data=json.dumps(message),
+            timeout=10
+        )
+        
+        if response.status_code != 200:
+            raise RuntimeError(f"HTTP {response.status_code}")
+        result = response.json()
+        if result.get('code') != 0:
+            raise RuntimeError(f"飞书返回错误: {result}")
+        logger.info("飞书消息发送成功")
 
 class ScheduledStockSelector:
-    def __init__(self, feishu_webhook: str):
+    def __init__(self, feishu_webhook: str, processes: Optional[int] = None):
+        """
+        :param feishu_webhook: 飞书webhook地址
+        :param processes: 选股进程数，默认读取环境变量 SCAN_PROCESSES（默认1）；大于1时按分片多进程扫描
+        """
+        # 延迟导入：sharded_scan 依赖本模块
+        from sharded_scan import scan_processes
+        
         self.feishu_webhook = feishu_webhook
         self.selector = StockSelector()
         self.notifier = FeishuNotifier(feishu_webhook)
+        self.processes = processes or scan_processes()
     
-    def run_selection(self, stock_codes: List[str]):
+    def run_selection(self, stock_codes: Optional[List[str]] = None, token: Optional[CancellationToken] = None,
+                      snapshot: Union[pd.DataFrame, Dict[str, pd.DataFrame], None] = None, notify: bool = False):
+        """
+        :param stock_codes: 股票代码列表，按代码请求实时行情
+        :param token: 取消令牌
+        :param snapshot: 已下载的行情快照，提供时直接使用，不再重复下载
+        :param notify: 是否发送飞书消息；消息由后台队列发送，不等待webhook响应
+        """
         logger.info("开始执行定时选股任务")
         
-        selected_stocks = self.selector.select_stocks(stock_codes)
+        if self.processes > 1:
+            selected_stocks = self._run_sharded(stock_codes, token, snapshot)
+        elif snapshot is not None:
+            selected_stocks = self.selector.select_from_snapshot(snapshot, token=token)
+        else:
+            selected_stocks = self.selector.select_stocks(stock_codes or [], token=token)
         
-        # 禁用自动发送飞书消息，改为手动发送
-        # self.notifier.send_message(selected_stocks)
+        # 默认不自动发送飞书消息，改为手动发送
+        if notify:
+            self.notifier.send_message(selected_stocks)
         
         logger.info("定时选股任务执行完成")
         return selected_stocks
+    
+    def _run_sharded(self, stock_codes: Optional[List[str]], token: Optional[CancellationToken],
+                     snapshot: Union[pd.DataFrame, Dict[str, pd.DataFrame], None]) -> List[Dict]:
+        """多进程分片选股，各分片的统计合并到 self.selector 的 last_counters/last_funnel 和条件统计中"""
+        from sharded_scan import ShardedScanner
+        
+        scanner = ShardedScanner(processes=self.processes, selector=self.selector)
+        if snapshot is None:
+            return scanner.scan(stock_codes or [], token=token)
+        frames = list(snapshot.values()) if isinstance(snapshot, dict) else [snapshot]
+        records = [record for frame in frames for record in records_from_snapshot(frame)]
+        return scanner.scan_records(records, token=token)
 
 if __name__ == "__main__":
     FEISHU_WEBHOOK = "https://open.feishu.cn/open-apis/bot/v2/hook/d6930274-cf9f-48d9-80d9-b1f735c43fc2"
@@ -639,6 +935,8 @@ if __name__ == "__main__":
     
     scheduler = ScheduledStockSelector(FEISHU_WEBHOOK)
     result = scheduler.run_selection(test_stocks)
+    # 通知由后台守护线程发送，退出前等待队列发完
+    scheduler.notifier.queue.flush(timeout=60)
     
     print(f"\n筛选结果: {len(result)} 只股票")
     for stock in result:
@@ -0,0 +1,286 @@
+import logging
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+import pandas as pd
+
+from cancellation import CancellationToken, raise_if_cancelled
+from data_fetcher import DataFetcher
+from ranking import rank_stocks, CHEN_WEIGHTS
+from stock_filter import filter_substitute_stocks
+from stock_selector import StockSelector, records_from_snapshot
+
+logger = logging.getLogger(__name__)
+
+# 行情快照中需要转换为数值的列
+NUMERIC_COLUMNS = ['最新价', '开盘价', '最高价', '最低价', '今开', '昨收', '涨跌幅', '成交量', '成交额',
+                   '量比', '委比', '换手率', '总市值', '板块涨幅']
+
+
+class Strategy:
+    def __init__(self, name: str, label: str, func: Callable, markets: Iterable[str], needs_kline: bool = False):
+        """
+        选股策略
+        :param name: 策略标识
+        :param label: 策略名称
+        :param func: 策略函数 func(panel, runner, token) -> 选中的股票列表
+        :param markets: 策略使用的市场
+        :param needs_kline: 是否需要获取K线数据
+        """
+        self.name = name
+        self.label = label
+        self.func = func
+        self.markets = tuple(markets)
+        self.needs_kline = needs_kline
+
+
+# 已注册的策略
+STRATEGIES: Dict[str, Strategy] = {}
+
+
+def register_strategy(name: str, label: str, markets: Iterable[str] = ('sh', 'sz', 'cyb'), needs_kline: bool = False):
+    """
+    注册选股策略的装饰器
+    :param name: 策略标识
+    :param label: 策略名称
+    :param markets: 策略使用的市场
+    :param needs_kline: 是否需要获取K线数据
+    """
+    def decorator(func):
+        STRATEGIES[name] = Strategy(name, label, func, markets, needs_kline)
+        return func
+    return decorator
+
+
+def build_indicator_panel(snapshot: Dict[str, pd.DataFrame]) -> pd.DataFrame:
+    """
+    把各市场的行情快照合并为一张共享的指标面板，数值列只转换一次
+    :param snapshot: {市场: 行情DataFrame}
+    :return: 带"市场"列的行情DataFrame
+    """
+    frames = []
+    for market, data in snapshot.items():
+        if data is None or data.empty:
+            continue
+        frame = data.copy()
+        frame['市场'] = market
+        frames.append(frame)
+
+    if not frames:
+        return pd.DataFrame()
+
+    panel = pd.concat(frames, ignore_index=True)
+    for column in NUMERIC_COLUMNS:
+        if column in panel.columns:
+            panel[column] = pd.to_numeric(panel[column], errors='coerce')
+    return panel
+
+
+class MultiStrategyRunner:
+    def __init__(self, fetcher: Optional[DataFetcher] = None, selector: Optional[StockSelector] = None):
+        """
+        在同一份行情快照和指标面板上一次执行多个选股策略
+        :param fetcher: 行情数据获取器
+        :param selector: "买阴不买阳"等需要K线的策略使用的选股器，按需创建
+        """
+        self.fetcher = fetcher or DataFetcher(use_mock_data=False, default_source='tencent')
+        self._selector = selector
+
+    @property
+    def selector(self) -> StockSelector:
+        if self._selector is None:
+            self._selector = StockSelector()
+        return self._selector
+
+    def fetch_snapshot(self, markets: Iterable[str],
+                       token: Optional[CancellationToken] = None) -> Dict[str, pd.DataFrame]:
+        """
+        获取各市场的行情快照，每个市场只下载一次
+        :param markets: 市场列表
+        :param token: 取消令牌
+        :return: {市场: 行情DataFrame}
+        """
+        snapshot = {}
+        for market in markets:
+            raise_if_cancelled(token)
+            data = self.fetcher.get_stock_data(market, token=token)
+            snapshot[market] = data
+            logger.info(f"{market}市场获取到 {len(data)} 只股票")
+        return snapshot
+
+    def run(self, strategy_names: Optional[List[str]] = None,
+            snapshot: Optional[Dict[str, pd.DataFrame]] = None,
+            token: Optional[CancellationToken] = None) -> Dict[str, List[Dict]]:
+        """
+        执行多个策略
+        :param strategy_names: 策略标识列表，为None时执行所有已注册的策略
+        :param snapshot: 已获取的行情快照，为None时按策略所需的市场获取一次
+        :param token: 取消令牌，传给行情获取和各策略
+        :return: {策略标识: 选中的股票列表}
+        """
+        names = strategy_names or list(STRATEGIES)
+        unknown = [name for name in names if name not in STRATEGIES]
+        if unknown:
+            raise ValueError(f"未注册的策略: {', '.join(unknown)}")
+
+        if snapshot is None:
+            markets = []
+            for name in names:
+                for market in STRATEGIES[name].markets:
+                    if market not in markets:
+                        markets.append(market)
+            snapshot = self.fetch_snapshot(markets, token=token)
+
+        panel = build_indicator_panel(snapshot)
+        logger.info(f"指标面板共 {len(panel)} 只股票，执行策略: {', '.join(names)}")
+
+        results = {}
+        for name in names:
+            raise_if_cancelled(token)
+            strategy = STRATEGIES[name]
+            started = time.perf_counter()
+            if panel.empty:
+                results[name] = []
+                continue
+            market_panel = panel[panel['市场'].isin(strategy.markets)]
+            try:
+                results[name] = strategy.func(market_panel, self, token)
+            except Exception as e:
+                logger.error(f"执行策略 {strategy.label} 失败: {str(e)}")
+                results[name] = []
+            logger.info(f"策略 {strategy.label} 选出 {len(results[name])} 只股票，耗时 {time.perf_counter() - started:.2f}s")
+        return results
+
+
+@register_strategy('substitute', '平替', markets=('sh', 'sz', 'cyb', 'kcb'))
+def substitute_strategy(panel: pd.DataFrame, runner: MultiStrategyRunner,
+                        token: Optional[CancellationToken] = None) -> List[Dict]:
+    """基于基础行情的"平替"策略"""
+    return filter_substitute_stocks(panel)
+
+
+@register_strategy('yin_line', '买阴不买阳', needs_kline=True)
+def yin_line_strategy(panel: pd.DataFrame, runner: MultiStrategyRunner,
+                      token: Optional[CancellationToken] = None) -> List[Dict]:
+    """"买阴不买阳"策略，实时条件在快照上判断，通过的股票再获取K线"""
+    return runner.selector.select_from_records(records_from_snapshot(panel), token=token)
+
+
+# 陈小群策略的筛选阶段，按原有顺序统计每个阶段淘汰的股票数
+CHEN_STAGES = [
+    ('pattern1', '先涨后落破开盘价'),
+    ('pattern2', '先跌反弹未过开盘价'),
+    ('change', '涨幅不符'),
+    ('volume_ratio', '量比不符'),
+    ('turnover', '换手率不符'),
+    ('market_cap', '市值不符')
+]
+
+
+def screen_chen_xiaoqun(panel: pd.DataFrame):
+    """
+    陈小群选股策略，按列计算所有条件
+    排除条件：先涨后落破开盘价、先跌反弹未过开盘价
+    筛选条件：涨幅3%-5%、量比≥1、换手率5%-10%、市值30-300亿
+    :param panel: 行情面板DataFrame
+    :return: (按得分排序的选中股票列表, 各阶段统计 {'total', 'rejected': {阶段: 淘汰数}, 'passed'})
+    """
+    def column(name, default=0.0):
+        # 缺失的列或值使用默认值，与逐行筛选时的 stock.get(列名, 默认值) 一致
+        if name not in panel.columns:
+            return pd.Series(default, index=panel.index, dtype='float64')
+        return pd.to_numeric(panel[name], errors='coerce').fillna(default)
+
+    price = column('最新价')
+    open_price = column('开盘价', price)
+    high_price = column('最高价', price)
+    low_price = column('最低价', price)
+    change_percent = column('涨跌幅')
+    volume_ratio = column('量比')
+    turnover_rate = column('换手率')
+    market_cap = column('总市值')
+    order_ratio = column('委比')
+    volume = column('成交量')
+    names = panel['名称'].fillna('') if '名称' in panel.columns else pd.Series('', index=panel.index)
+
+    failures = {
+        'pattern1': (high_price > open_price) & (price < open_price),
+        'pattern2': (low_price < open_price) & (price < open_price),
+        'change': (change_percent < 3) | (change_percent > 5),
+        'volume_ratio': volume_ratio < 1,
+        'turnover': (turnover_rate < 5) | (turnover_rate > 10),
+        'market_cap': (market_cap < 30) | (market_cap > 300)
+    }
+
+    # 与逐行筛选一致：每只股票只计入第一个不满足的阶段
+    remaining = pd.Series(True, index=panel.index)
+    rejected = {}
+    for stage, _ in CHEN_STAGES:
+        hit = remaining & failures[stage]
+        rejected[stage] = int(hit.sum())
+        remaining &= ~hit
+
+    selected = panel[remaining]
+    stocks = [
+        {
+            'code': code,
+            'name': name,
+            'price': price_value,
+            'change_percent': change_value,
+            'volume_ratio': ratio_value,
+            'turnover_rate': turnover_value,
+            'order_ratio': order_value,
+            'volume': volume_value,
+            'market_cap': cap_value
+        }
+        for code, name, price_value, change_value, ratio_value, turnover_value, order_value, volume_value, cap_value in zip(
+            selected['代码'].tolist(),
+            names[remaining].tolist(),
+            price[remaining].tolist(),
+            change_percent[remaining].tolist(),
+            volume_ratio[remaining].tolist(),
+            turnover_rate[remaining].tolist(),
+            order_ratio[remaining].tolist(),
+            volume[remaining].tolist(),
+            market_cap[remaining].tolist()
+        )
+    ]
+    stats = {'total': len(panel), 'rejected': rejected, 'passed': len(stocks)}
+    # 按加权因子得分排序，优先级取得分的整数部分（与"买阴不买阳"一致）
+    ranked = rank_stocks(stocks, weights=CHEN_WEIGHTS)
+    for stock in ranked:
+        stock['priority'] = int(round(stock['score']))
+    return ranked, stats
+
+
+def format_chen_stats(stats: Dict) -> List[str]:
+    """
+    生成陈小群策略的筛选统计日志行
+    :param stats: screen_chen_xiaoqun 返回的统计
+    :return: 日志行列表
+    """
+    total = stats['total']
+    if total == 0:
+        return ["  - 总股票数: 0"]
+
+    rejected = stats['rejected']
+    lines = [f"  - 总股票数: {total}"]
+    remaining = total
+    pattern_rejected = rejected['pattern1'] + rejected['pattern2']
+    remaining -= pattern_rejected
+    lines.append(f"  - 分时条件不符: {pattern_rejected} 只 (通过率: {remaining / total * 100:.1f}%)")
+    for stage, label in CHEN_STAGES[2:]:
+        remaining -= rejected[stage]
+        lines.append(f"  - {label}: {rejected[stage]} 只 (通过率: {remaining / total * 100:.1f}%)")
+    lines.append(f"  - 最终通过: {stats['passed']} 只 (总通过率: {stats['passed'] / total * 100:.2f}%)")
+    return lines
+
+
+@register_strategy('chen', '陈小群')
+def chen_xiaoqun_strategy(panel: pd.DataFrame, runner: MultiStrategyRunner,
+                          token: Optional[CancellationToken] = None) -> List[Dict]:
+    """陈小群选股策略"""
+    stocks, stats = screen_chen_xiaoqun(panel)
+    for line in format_chen_stats(stats):
+        logger.info(line)
+    return stocks
@@ -0,0 +1,74 @@
+import threading
+import time
+from typing import Dict, Optional
+
+import pandas as pd
+
+from data_fetcher import market_of
+
+
+class SymbolIndex:
+    def __init__(self):
+        """
+        股票代码索引：代码 → 名称、市场、最近一次行情（DataFetcher 快照中的一行）
+        每次下载行情快照时更新，按代码查询为O(1)，单只股票的查询不再需要下载和扫描全市场数据
+        """
+        self.lock = threading.Lock()
+        self.entries: Dict[str, Dict] = {}
+
+    def __len__(self) -> int:
+        with self.lock:
+            return len(self.entries)
+
+    def __contains__(self, stock_code: str) -> bool:
+        with self.lock:
+            return stock_code in self.entries
+
+    def update_row(self, row: Dict, at: Optional[float] = None):
+        """
+        写入一只股票的行情
+        :param row: 中文列名的行情字典，至少包含"代码"，如 get_single_stock_data 的返回值
+        :param at: 行情时间，默认为当前时间
+        """
+        code = str(row['代码'])
+        entry = {
+            'code': code,
+            'name': row.get('名称') or f'股票{code}',
+            'market': market_of(code),
+            'row': dict(row),
+            'updated': at or time.time()
+        }
+        with self.lock:
+            previous = self.entries.get(code)
+            if previous is not None:
+                # 单只股票接口返回的列较少，保留快照中其他列的最近值
+                entry['row'] = dict(previous['row'], **entry['row'])
+            self.entries[code] = entry
+
+    def update_frame(self, market_data: pd.DataFrame):
+        """写入 DataFetcher 下载的行情快照"""
+        if market_data is None or market_data.empty or '代码' not in market_data.columns:
+            return
+        at = time.time()
+        for row in market_data.to_dict('records'):
+            self.update_row(row, at)
+
+    def lookup(self, stock_code: str) -> Optional[Dict]:
+        """
+        查询股票
+        :return: {'code', 'name', 'market', 'row', 'updated'}，不在索引中时返回None
+        """
+        with self.lock:
+            entry = self.entries.get(stock_code)
+            return dict(entry, row=dict(entry['row'])) if entry is not None else None
+
+    def name(self, stock_code: str) -> Optional[str]:
+        with self.lock:
+            entry = self.entries.get(stock_code)
+            return entry['name'] if entry is not None else None
+
+    def price(self, stock_code: str) -> float:
+        """最近一次行情的最新价，不在索引中时返回0"""
+        with self.lock:
+            entry = self.entries.get(stock_code)
+            return float(entry['row'].get('最新价') or 0) if entry is not None else 0
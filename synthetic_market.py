@@ -0,0 +1,86 @@
+"""
+合成行情数据：用确定性的腾讯行情响应和K线替代网络请求，供分片扫描的测试和基准测试共用
+"""
+
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+
+from sharded_scan import make_shard_selector, shard_result
+from stock_selector import StockSelector
+
+
+def synthetic_codes(n: int) -> List[str]:
+    """生成沪深两市的合成股票代码"""
+    half = n // 2
+    return [f"{600000 + i:06d}" for i in range(half)] + [f"{i + 1:06d}" for i in range(n - half)]
+
+
+def synthetic_quote_line(code: str) -> str:
+    """生成一行腾讯行情响应，字段位置与 qt.gtimg.cn 一致"""
+    rng = np.random.default_rng(int(code))
+    price = round(float(rng.uniform(5, 60)), 2)
+    open_price = round(price * float(rng.uniform(0.97, 1.03)), 2)
+    fields = ['1', f"股票{code}", code, str(price), str(open_price), str(open_price),
+              str(int(rng.integers(1000, 100000)))] + ['0'] * 43
+    fields[32] = f"{(price / open_price - 1) * 100:.2f}"
+    fields[33] = str(round(max(price, open_price) * 1.01, 2))
+    fields[34] = str(round(min(price, open_price) * 0.99, 2))
+    # 委买/委卖各一档，委比落在 -50% 到 50% 之间
+    order_ratio = float(rng.uniform(-50, 50))
+    fields[10] = str(round(1000 * (1 + order_ratio / 100)))
+    fields[20] = str(round(1000 * (1 - order_ratio / 100)))
+    fields[35] = f"{price}/{fields[6]}/0"
+    fields[38] = f"{rng.uniform(0, 12):.2f}"
+    fields[49] = f"{rng.uniform(0.2, 2):.2f}"
+    prefix = 'sh' if code.startswith('6') else 'sz'
+    return f'v_{prefix}{code}="{"~".join(fields)}"'
+
+
+def synthetic_kline(code: str, days: int = 60) -> pd.DataFrame:
+    """生成确定性的合成K线，约有一部分股票满足全部K线条件"""
+    rng = np.random.default_rng(int(code) + 1)
+    trend = float(rng.uniform(-0.02, 0.04))
+    close = 10 + np.arange(days) * trend + rng.normal(0, 0.05, days)
+    open_price = close * (1 - rng.uniform(-0.01, 0.01, days))
+    if rng.random() < 0.5:
+        open_price[days - 20] = close[days - 20] / 1.08
+    volume = rng.uniform(800, 1200, days)
+    volume[-1] *= float(rng.uniform(0.3, 1.2))
+    return pd.DataFrame({
+        'date': pd.date_range('2026-01-01', periods=days),
+        'open': open_price,
+        'close': close,
+        'high': np.maximum(open_price, close) * 1.01,
+        'low': np.minimum(open_price, close) * 0.99,
+        'volume': volume,
+        'amount': 0
+    })
+
+
+def patch_synthetic_sources(selector: StockSelector):
+    """把选股器的行情和K线来源替换为合成数据，保留解析和条件判断的全部CPU开销"""
+    def iter_realtime_batches(stock_codes, batch_size=100, token=None):
+        for i in range(0, len(stock_codes), batch_size):
+            text = ";".join(synthetic_quote_line(code) for code in stock_codes[i:i + batch_size])
+            yield selector._parse_realtime_response(text)
+
+    selector.iter_realtime_batches = iter_realtime_batches
+    selector.kline_fetcher.get_kline_data = lambda stock_code, days=60: synthetic_kline(stock_code, days)
+
+
+def synthetic_scan_shard(stock_codes: List[str], stats_snapshot: Dict, kline_workers: Optional[int] = None) -> Dict:
+    """使用合成数据的分片入口，与 sharded_scan.scan_shard 接口一致"""
+    selector = make_shard_selector(stats_snapshot, kline_workers)
+    patch_synthetic_sources(selector)
+    selected_stocks = selector.select_stocks(stock_codes)
+    return shard_result(selector, selected_stocks)
+
+
+def synthetic_scan_record_shard(records: List[Dict], stats_snapshot: Dict, kline_workers: Optional[int] = None) -> Dict:
+    """使用合成K线的已下载行情分片入口，与 sharded_scan.scan_record_shard 接口一致"""
+    selector = make_shard_selector(stats_snapshot, kline_workers)
+    patch_synthetic_sources(selector)
+    selected_stocks = selector.select_from_records(records)
+    return shard_result(selector, selected_stocks)
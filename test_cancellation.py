@@ -0,0 +1,156 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试取消令牌能否在约1秒内中断数据获取、K线批量获取和批量分析（离线数据）
+"""
+
+import concurrent.futures
+import threading
+import time
+
+import pytest
+
+import data_fetcher
+import smart_analyzer
+from cancellation import CancellationToken, OperationCancelled, call_cancellable
+
+
+def cancel_later(token, delay=0.2):
+    timer = threading.Timer(delay, token.cancel)
+    timer.start()
+    return timer
+
+
+def slow_request(*args, **kwargs):
+    time.sleep(5)
+    raise AssertionError("请求不应该被等待到结束")
+
+
+def assert_cancelled_quickly(func, *args, **kwargs):
+    token = CancellationToken()
+    cancel_later(token)
+    started = time.perf_counter()
+    with pytest.raises(OperationCancelled):
+        func(*args, token=token, **kwargs)
+    assert time.perf_counter() - started < 1.0
+
+
+def test_call_cancellable_abandons_blocking_call():
+    assert call_cancellable(lambda x: x + 1, 1, token=CancellationToken()) == 2
+    assert_cancelled_quickly(call_cancellable, slow_request)
+
+
+def test_abandoned_calls_do_not_block_other_callers():
+    release = threading.Event()
+    closed = []
+
+    class Response:
+        def close(self):
+            closed.append(True)
+
+    def blocked_request():
+        release.wait(5)
+        return Response()
+
+    # 比原来的共享线程池（32个线程）更多的调用被放弃，其他调用方不受影响
+    for _ in range(40):
+        token = CancellationToken()
+        cancel_later(token, 0.01)
+        with pytest.raises(OperationCancelled):
+            call_cancellable(blocked_request, token=token)
+    started = time.perf_counter()
+    assert call_cancellable(lambda: 'ok', token=CancellationToken()) == 'ok'
+    assert time.perf_counter() - started < 0.5
+
+    # 被放弃的请求返回后响应被关闭
+    release.set()
+    deadline = time.time() + 2
+    while len(closed) < 40 and time.time() < deadline:
+        time.sleep(0.01)
+    assert len(closed) == 40
+
+
+def test_call_cancellable_uses_caller_executor():
+    executor = concurrent.futures.ThreadPoolExecutor(max_workers=1, thread_name_prefix='caller')
+    assert call_cancellable(lambda: threading.current_thread().name, token=CancellationToken(),
+                            executor=executor).startswith('caller')
+    executor.shutdown()
+
+
+def test_token_callbacks_and_wait():
+    token = CancellationToken()
+    calls = []
+    token.add_callback(lambda: calls.append('first'))
+    cancel_later(token, 0.05)
+    assert token.wait(2) is True
+    token.add_callback(lambda: calls.append('late'))
+    assert calls == ['first', 'late']
+
+
+def test_data_fetcher_stops_between_and_during_batches(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(data_fetcher.requests, 'get', slow_request)
+    fetcher = data_fetcher.DataFetcher()
+    assert_cancelled_quickly(fetcher.get_all_markets_data)
+
+
+def test_kline_batch_drops_pending_futures(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    from stock_selector import KLineDataFetcher
+
+    fetcher = KLineDataFetcher()
+    started_calls = []
+
+    def get_kline_data(stock_code, days=60):
+        started_calls.append(stock_code)
+        time.sleep(2)
+        return None
+
+    monkeypatch.setattr(fetcher, 'get_kline_data', get_kline_data)
+    codes = [f"{600000 + i:06d}" for i in range(500)]
+    assert_cancelled_quickly(fetcher.get_kline_data_batch, codes)
+    time.sleep(0.1)
+    # 未开始的任务被丢弃，只有第一轮提交的任务被执行
+    assert len(started_calls) <= fetcher.max_workers
+
+
+def test_select_stocks_cancelled_mid_pipeline(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    from stock_selector import StockSelector
+
+    selector = StockSelector()
+
+    def batches(codes, token=None):
+        for i in range(100):
+            yield [{'code': f"{600000 + i:06d}", 'name': '', 'price': 10.0, 'change_percent': -3.0,
+                    'volume_ratio': 0.4, 'turnover_rate': 5.0, 'order_ratio': 1.0, 'volume': 100,
+                    'is_yin_line': True}]
+            time.sleep(0.05)
+
+    monkeypatch.setattr(selector, 'iter_realtime_batches', batches)
+    monkeypatch.setattr(selector.kline_fetcher, 'get_kline_data', lambda code, days=60: time.sleep(2))
+    assert_cancelled_quickly(selector.select_stocks, [])
+
+
+def test_analyze_stocks_batch_stops(monkeypatch):
+    analyzer = smart_analyzer.SmartAnalyzer(api_key='test', api_url='http://127.0.0.1:9/v1',
+                                            cache=False)
+    requests_started = []
+
+    def slow_post(*args, **kwargs):
+        requests_started.append(time.time())
+        slow_request()
+
+    # 所有API请求都通过 analyzer.session 发出
+    monkeypatch.setattr(analyzer.session, 'post', slow_post)
+    stocks = [{'code': f"{600000 + i:06d}", 'name': '', 'price': 10, 'change': 1, 'indicators': {}}
+              for i in range(10)]
+    assert_cancelled_quickly(analyzer.analyze_stocks_batch, stocks)
+    # 取消的是进行中的慢请求，而不是连接失败后的重试
+    assert requests_started
+
+
+if __name__ == "__main__":
+    test_call_cancellable_abandons_blocking_call()
+    test_token_callbacks_and_wait()
+    print("测试完成")
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试continuous_scanner.py中的增量连续扫描（离线数据）
+"""
+
+from datetime import date, datetime
+
+import pandas as pd
+
+from continuous_scanner import EVENT_ENTER, EVENT_EXIT, ContinuousScanner
+from screening import STAGE_KLINE, STAGE_REALTIME, Predicate, PredicateStats, ScreeningExecutor
+from stock_selector import StockSelector
+from trading_calendar import BEIJING_TZ
+
+KLINE_OK = {'600036': True, '600519': True, '000001': False}
+
+
+def quote(code, price, open_price=10.0):
+    return {'code': code, 'name': f"股票{code}", 'price': price, 'open': open_price, 'change_percent': -1.0,
+            'volume': 1000, 'volume_ratio': 0.6, 'turnover_rate': 4.0, 'order_ratio': 1.0,
+            'is_yin_line': price < open_price}
+
+
+def make_scanner(monkeypatch, tmp_path, rounds):
+    monkeypatch.chdir(tmp_path)
+    selector = StockSelector(stats=PredicateStats(path=None))
+    selector.executor = ScreeningExecutor([
+        Predicate('yin_line', '买阴不买阳', STAGE_REALTIME, lambda stock, kline_data: stock['is_yin_line']),
+        Predicate('kline_ok', 'K线形态', STAGE_KLINE, lambda stock, kline_data: bool(kline_data['ok'].iloc[-1]))
+    ], stats=PredicateStats(path=None))
+
+    fetched = []
+
+    def get_kline_data(code, days=60):
+        fetched.append(code)
+        return pd.DataFrame({'ok': [KLINE_OK[code]] * 30})
+
+    monkeypatch.setattr(selector.kline_fetcher, 'get_kline_data', get_kline_data)
+    monkeypatch.setattr(selector, 'iter_realtime_batches', lambda codes, token=None: iter([rounds.pop(0)]))
+    return ContinuousScanner(selector=selector, stock_codes=list(KLINE_OK)), fetched
+
+
+def test_only_changed_symbols_are_reevaluated(monkeypatch, tmp_path):
+    rounds = [
+        [quote('600036', 9.5), quote('600519', 10.5), quote('000001', 9.0)],
+        [quote('600036', 9.5), quote('600519', 10.5), quote('000001', 9.0)],
+        [quote('600036', 10.2), quote('600519', 9.8), quote('000001', 9.0)],
+        [quote('600036', 9.6), quote('600519', 9.8), quote('000001', 9.0)]
+    ]
+    scanner, fetched = make_scanner(monkeypatch, tmp_path, rounds)
+    received = []
+    scanner.subscribe(received.append)
+
+    events = scanner.poll()
+    assert [(e['type'], e['code']) for e in events] == [(EVENT_ENTER, '600036')]
+    assert sorted(fetched) == ['000001', '600036']
+
+    # 行情没有变化时不重新判断
+    assert scanner.poll() == []
+    assert scanner.last_poll['changed'] == 0
+
+    events = scanner.poll()
+    assert [(e['type'], e['code']) for e in events] == [(EVENT_EXIT, '600036'), (EVENT_ENTER, '600519')]
+    assert scanner.last_poll['changed'] == 2
+
+    # K线条件结果当天复用，不重复获取K线
+    events = scanner.poll()
+    assert [(e['type'], e['code']) for e in events] == [(EVENT_ENTER, '600036')]
+    assert sorted(fetched) == ['000001', '600036', '600519']
+
+    assert [e['seq'] for e in received] == [1, 2, 3, 4]
+    assert [e['seq'] for e in scanner.events_since(2)] == [3, 4]
+    assert sorted(stock['code'] for stock in scanner.snapshot()) == ['600036', '600519']
+    assert scanner.snapshot(k=1) == scanner.snapshot()[:1]
+
+
+def test_failed_kline_is_retried(monkeypatch, tmp_path):
+    rounds = [[quote('600036', 9.5)], [quote('600036', 9.4)]]
+    scanner, fetched = make_scanner(monkeypatch, tmp_path, rounds)
+    fetcher = scanner.selector.kline_fetcher
+    ok_fetch = fetcher.get_kline_data
+    monkeypatch.setattr(fetcher, 'get_kline_data', lambda code, days=60: None)
+
+    assert scanner.poll() == []
+    monkeypatch.setattr(fetcher, 'get_kline_data', ok_fetch)
+    assert [e['code'] for e in scanner.poll()] == ['600036']
+
+
+def test_each_poll_is_one_screening_run(monkeypatch, tmp_path):
+    rounds = [[quote('600036', 9.5), quote('000001', 10.5)], [quote('600036', 9.5), quote('000001', 10.6)]]
+    scanner, _ = make_scanner(monkeypatch, tmp_path, rounds)
+    history = scanner.selector.executor.stats
+    stats = scanner.executor.stats
+
+    scanner.poll()
+    assert scanner.executor.run_counts['yin_line']['evaluated'] == 2
+    assert stats.stats['yin_line']['evaluated'] == 2 and stats.stats['kline_ok']['evaluated'] == 1
+    # 轮询统计只保存在扫描器的内存中，不衰减、不改写选股器的历史统计
+    assert stats is not history and stats.path is None
+    assert history.stats == {}
+    # 选股器自己的运行统计不受连续扫描影响
+    assert scanner.selector.executor.run_counts['yin_line']['evaluated'] == 0
+
+    # 下一次轮询重新计数，只统计行情变化的股票
+    scanner.poll()
+    assert scanner.executor.run_counts['yin_line']['evaluated'] == 1
+
+
+def test_listed_codes_are_reread_on_new_day(monkeypatch, tmp_path):
+    scanner, _ = make_scanner(monkeypatch, tmp_path, [])
+    scanner.stock_codes = None
+    registries = [['600036'], ['600036', '600519']]
+    monkeypatch.setattr('continuous_scanner.DataFetcher.get_listed_codes',
+                        lambda self, markets, token=None: registries.pop(0))
+
+    assert scanner._codes() == ['600036']
+    assert scanner._codes() == ['600036']
+    scanner.trading_day = date(2000, 1, 3)
+    scanner._roll_day()
+    assert scanner._codes() == ['600036', '600519']
+
+
+def test_day_rolls_over_on_beijing_date(monkeypatch, tmp_path):
+    scanner, _ = make_scanner(monkeypatch, tmp_path, [])
+    scanner.kline_verdicts['600036'] = True
+    # 北京时间10月20日00:30，UTC仍是10月19日
+    monkeypatch.setattr(scanner.calendar, 'now', lambda: datetime(2026, 10, 20, 0, 30, tzinfo=BEIJING_TZ))
+    scanner.trading_day = date(2026, 10, 19)
+    scanner._roll_day()
+    assert scanner.trading_day == date(2026, 10, 20)
+    assert scanner.kline_verdicts == {}
+
+
+if __name__ == "__main__":
+    print("请使用 pytest 运行: python -m pytest -q test_continuous_scanner.py")
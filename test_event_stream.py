@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试event_stream.py中的SSE发布者和结果差异
+"""
+
+import json
+import threading
+import time
+
+from event_stream import ConsoleWriter, EventPublisher, diff_stocks, format_sse
+from ring_buffer import RingBuffer
+
+
+def parse(message):
+    fields = {}
+    for line in message.strip().split('\n'):
+        if line.startswith(':'):
+            continue
+        key, _, value = line.partition(': ')
+        fields[key] = value
+    return fields
+
+
+def collect(stream, count):
+    messages = []
+    for message in stream:
+        fields = parse(message)
+        if 'event' in fields:
+            messages.append(fields)
+        if len(messages) >= count:
+            break
+    return messages
+
+
+def test_one_publisher_serves_many_clients():
+    publisher = EventPublisher(heartbeat=0.05)
+    results = [None] * 3
+
+    def client(index):
+        results[index] = collect(publisher.stream(initial=[('status', {'running': False})]), 3)
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(3)]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 2
+    while publisher.clients < 3 and time.time() < deadline:
+        time.sleep(0.01)
+
+    publisher.publish('status', {'running': True})
+    publisher.publish('log', {'line': '开始刷新\n', 'cursor': 1})
+    for thread in threads:
+        thread.join(timeout=2)
+
+    for messages in results:
+        assert [m['event'] for m in messages] == ['status', 'status', 'log']
+        # 快照事件没有序号，之后的事件带递增序号
+        assert 'id' not in messages[0]
+        assert [m['id'] for m in messages[1:]] == ['1', '2']
+        assert json.loads(messages[2]['data'])['line'] == '开始刷新\n'
+
+
+def test_reconnect_replays_missed_events():
+    publisher = EventPublisher(capacity=3, heartbeat=0.05)
+    for i in range(5):
+        publisher.publish('log', {'cursor': i + 1})
+
+    messages = collect(publisher.stream(last_event_id=3), 2)
+    assert [m['id'] for m in messages] == ['4', '5']
+
+    # 需要的事件已被覆盖时先通知客户端重置
+    messages = collect(publisher.stream(last_event_id=1), 2)
+    assert [m['event'] for m in messages] == ['reset', 'log']
+
+
+class CountingLog(RingBuffer):
+    """记录批量写入次数的控制台日志"""
+
+    def __init__(self, fail=False):
+        super().__init__(100)
+        self.batches = []
+        self.fail = fail
+
+    def extend(self, items):
+        if self.fail:
+            raise IOError('database is locked')
+        self.batches.append(len(items))
+        return super().extend(items)
+
+
+def test_console_writer_batches_lines():
+    log = CountingLog()
+    publisher = EventPublisher(heartbeat=0.05)
+    writer = ConsoleWriter(log, publisher, interval=0.1)
+    for i in range(50):
+        writer.write(f"line{i}\n")
+    assert writer.flush(timeout=2)
+
+    assert log.since(0)[0] == [f"line{i}\n" for i in range(50)]
+    assert len(log.batches) < 50 and sum(log.batches) == 50
+    events = [json.loads(payload) for _, payload in publisher.buffer.since(0)[0]]
+    assert events[-1] == {'line': 'line49\n', 'cursor': 50}
+
+
+def test_console_writer_never_raises():
+    writer = ConsoleWriter(CountingLog(fail=True), interval=0.01)
+    writer.write('line\n')
+    assert writer.flush(timeout=2)
+    # 写入失败后仍然可以继续缓冲
+    writer.log.fail = False
+    writer.write('line2\n')
+    assert writer.flush(timeout=2)
+    assert writer.log.since(0)[0] == ['line2\n']
+
+
+def test_diff_stocks():
+    before = [{'code': '600036', 'price': 40.0}, {'code': '600519', 'price': 1500.0}]
+    after = [{'code': '600519', 'price': 1510.0}, {'code': '000001', 'price': 11.0}]
+    diff = diff_stocks(before, after)
+    assert diff == {
+        'added': [{'code': '000001', 'price': 11.0}],
+        'updated': [{'code': '600519', 'price': 1510.0}],
+        'removed': ['600036'],
+        'order': ['600519', '000001']
+    }
+    assert format_sse('log', '{}', 7) == 'id: 7\nevent: log\ndata: {}\n\n'
+
+
+if __name__ == "__main__":
+    test_one_publisher_serves_many_clients()
+    test_reconnect_replays_missed_events()
+    test_diff_stocks()
+    print("测试完成")
@@ -0,0 +1,57 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试fan_out.py中带超时的并发步骤
+"""
+
+import threading
+import time
+
+import pytest
+
+from cancellation import CancellationToken, OperationCancelled
+from fan_out import STEP_ERROR, STEP_OK, STEP_TIMEOUT, fan_out
+
+
+def slow(value, seconds):
+    def step():
+        time.sleep(seconds)
+        return value
+    return step
+
+
+def fail():
+    raise ValueError('数据源不可用')
+
+
+def test_steps_run_concurrently_with_partial_results():
+    started = time.time()
+    results, timings = fan_out({
+        'name': (slow('招商银行', 0.2), 1.0, '股票600036'),
+        'price': (slow(40.0, 0.2), 1.0, 0),
+        'kline': (slow({'ma_bullish': True}, 2.0), 0.4, {}),
+        'sentiment': (fail, 1.0, None)
+    })
+    elapsed = time.time() - started
+
+    # 总耗时取决于最慢的步骤（这里是超时的K线），而不是各步骤之和
+    assert elapsed < 0.9
+    assert results == {'name': '招商银行', 'price': 40.0, 'kline': {}, 'sentiment': None}
+    assert timings['name']['status'] == STEP_OK and 0.15 < timings['name']['elapsed'] < 0.5
+    assert timings['kline'] == {'status': STEP_TIMEOUT, 'elapsed': 0.4}
+    assert timings['sentiment']['status'] == STEP_ERROR and timings['sentiment']['error'] == '数据源不可用'
+
+
+def test_cancel_stops_waiting():
+    token = CancellationToken()
+    threading.Timer(0.1, token.cancel).start()
+    started = time.time()
+    with pytest.raises(OperationCancelled):
+        fan_out({'kline': (slow(None, 2.0), 5.0, None)}, token=token)
+    assert time.time() - started < 1.0
+
+
+if __name__ == "__main__":
+    test_steps_run_concurrently_with_partial_results()
+    test_cancel_stops_waiting()
+    print("测试完成")
@@ -0,0 +1,247 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试job_manager.py中的后台任务管理
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from cancellation import CancellationToken, OperationCancelled
+from job_manager import JobManager, RunCoordinator, JOB_CANCELLED, JOB_COMPLETED, JOB_ERROR
+from state_store import Lease, MemoryStore, SQLiteStore, StoreLog
+
+# 和 gunicorn 的worker一样从干净的进程启动：fork 会复制父进程已打开的SQLite连接状态，子进程之间的文件锁失效
+workers = multiprocessing.get_context('spawn')
+
+
+def wait_finished(job, timeout=5):
+    deadline = time.time() + timeout
+    while not job.finished and time.time() < deadline:
+        time.sleep(0.01)
+    assert job.finished
+
+
+def test_jobs_have_independent_results():
+    manager = JobManager(max_workers=2)
+
+    def task(job, value):
+        job.update(50, '处理中')
+        time.sleep(0.05)
+        return value * 2
+
+    jobs = [manager.submit('double', task, i, params={'value': i}) for i in range(4)]
+    for job in jobs:
+        wait_finished(job)
+
+    assert [manager.get(job.id).result for job in jobs] == [0, 2, 4, 6]
+    data = jobs[1].to_dict()
+    assert data['status'] == JOB_COMPLETED
+    assert data['progress'] == 100
+    assert data['params'] == {'value': 1}
+    assert 'result' not in jobs[1].to_dict(include_result=False)
+    manager.shutdown()
+
+
+def test_worker_pool_is_bounded():
+    manager = JobManager(max_workers=2)
+    lock = threading.Lock()
+    state = {'running': 0, 'peak': 0}
+
+    def task(job):
+        with lock:
+            state['running'] += 1
+            state['peak'] = max(state['peak'], state['running'])
+        time.sleep(0.05)
+        with lock:
+            state['running'] -= 1
+
+    jobs = [manager.submit('sleep', task) for _ in range(6)]
+    for job in jobs:
+        wait_finished(job)
+    assert state['peak'] == 2
+    manager.shutdown()
+
+
+def test_error_and_cancel():
+    manager = JobManager(max_workers=1)
+    release = threading.Event()
+
+    def failing(job):
+        raise RuntimeError('数据源不可用')
+
+    def blocking(job):
+        while not release.is_set():
+            job.check_cancelled()
+            time.sleep(0.01)
+        return 'done'
+
+    failed = manager.submit('fail', failing)
+    wait_finished(failed)
+    assert failed.status == JOB_ERROR
+    assert failed.error == '数据源不可用'
+
+    running = manager.submit('block', blocking)
+    queued = manager.submit('block', blocking)
+    time.sleep(0.05)
+    # 排队中的任务立即取消，执行中的任务在检查点结束
+    manager.cancel(queued.id)
+    assert queued.status == JOB_CANCELLED
+    manager.cancel(running.id)
+    wait_finished(running)
+    assert running.status == JOB_CANCELLED
+    assert manager.cancel('missing') is None
+    manager.shutdown()
+
+
+def test_finished_jobs_expire():
+    manager = JobManager(max_workers=1, ttl=0.05, max_jobs=3)
+    jobs = [manager.submit('noop', lambda job: None) for _ in range(5)]
+    for job in jobs:
+        wait_finished(job)
+    assert len(manager.list_jobs()) <= 3
+    time.sleep(0.1)
+    assert manager.get(jobs[-1].id) is None
+    assert manager.list_jobs() == []
+    manager.shutdown()
+
+
+def run_callers(coordinator, func, tokens):
+    results = [None] * len(tokens)
+
+    def call(index):
+        try:
+            results[index] = coordinator.run('refresh', func, token=tokens[index])
+        except OperationCancelled:
+            results[index] = 'cancelled'
+
+    threads = [threading.Thread(target=call, args=(i,)) for i in range(len(tokens))]
+    for thread in threads:
+        thread.start()
+        time.sleep(0.02)
+    return threads, results
+
+
+def test_overlapping_runs_share_one_execution():
+    coordinator = RunCoordinator()
+    calls = []
+
+    def scan(token):
+        calls.append(1)
+        time.sleep(0.2)
+        return {'stocks': ['600000']}
+
+    threads, results = run_callers(coordinator, scan, [None, CancellationToken(), CancellationToken()])
+    assert coordinator.callers('refresh') == 3
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert results[0] is results[1] is results[2]
+    assert not coordinator.is_running('refresh')
+
+    # 执行结束后的调用重新执行
+    assert coordinator.run('refresh', scan) == {'stocks': ['600000']}
+    assert len(calls) == 2
+
+
+def test_shared_run_cancelled_only_when_all_callers_cancel():
+    coordinator = RunCoordinator()
+    observed = {}
+
+    def scan(token):
+        observed['token'] = token
+        for _ in range(100):
+            token.raise_if_cancelled()
+            time.sleep(0.01)
+        return 'done'
+
+    first, second = CancellationToken(), CancellationToken()
+    threads, results = run_callers(coordinator, scan, [first, second])
+    first.cancel()
+    time.sleep(0.05)
+    assert not observed['token'].cancelled
+    for thread in threads:
+        thread.join()
+    assert results == ['cancelled', 'done']
+
+    first, second = CancellationToken(), CancellationToken()
+    threads, results = run_callers(coordinator, scan, [first, second])
+    first.cancel()
+    second.cancel()
+    for thread in threads:
+        thread.join(timeout=1)
+    assert results == ['cancelled', 'cancelled']
+    assert observed['token'].cancelled
+
+    # 已取消的调用方立即返回
+    cancelled = CancellationToken()
+    cancelled.cancel()
+    with pytest.raises(OperationCancelled):
+        coordinator.run('refresh', scan, token=cancelled)
+
+
+
+def _worker_refresh(path, start, results):
+    store = SQLiteStore(path)
+    coordinator = RunCoordinator(store=store, poll_interval=0.05)
+
+    def scan(token):
+        StoreLog(store, 'runs').append(os.getpid())
+        time.sleep(0.5)
+        return {'scanned_by': os.getpid()}
+
+    start.wait(5)
+    results.put(coordinator.run('refresh', scan))
+
+
+def test_two_worker_processes_share_one_execution(tmp_path):
+    path = str(tmp_path / 'state.db')
+    SQLiteStore(path)
+    start, results = workers.Event(), workers.Queue()
+    processes = [workers.Process(target=_worker_refresh, args=(path, start, results)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    start.set()
+    outcomes = [results.get(timeout=10) for _ in processes]
+    for process in processes:
+        process.join(timeout=10)
+        assert process.exitcode == 0
+
+    runs, _, _ = StoreLog(SQLiteStore(path), 'runs').since(0)
+    assert len(runs) == 1
+    # 没有执行的进程得到执行者写入存储的结果
+    assert outcomes[0] == outcomes[1] == {'scanned_by': runs[0]}
+
+
+def test_run_taken_over_when_holder_crashes():
+    store = MemoryStore()
+    # 另一个进程获得租约后崩溃，没有写入结果也没有续约
+    Lease(store, 'run:refresh', ttl=0.3, owner='crashed').acquire()
+    coordinator = RunCoordinator(store=store, poll_interval=0.05)
+    calls = []
+
+    def scan(token):
+        calls.append(1)
+        return 'done'
+
+    assert coordinator.is_running('refresh')
+    started = time.time()
+    assert coordinator.run('refresh', scan) == 'done'
+    assert calls == [1] and time.time() - started >= 0.25
+    assert not coordinator.is_running('refresh')
+
+
+if __name__ == "__main__":
+    test_jobs_have_independent_results()
+    test_worker_pool_is_bounded()
+    test_error_and_cancel()
+    test_finished_jobs_expire()
+    test_overlapping_runs_share_one_execution()
+    test_shared_run_cancelled_only_when_all_callers_cancel()
+    test_run_taken_over_when_holder_crashes()
+    print("测试完成")
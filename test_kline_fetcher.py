@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试stock_selector.py中KLineDataFetcher的流式批量获取（离线数据）
+"""
+
+import os
+import threading
+import time
+from datetime import datetime
+
+import pandas as pd
+
+from stock_selector import KLineDataFetcher
+from trading_calendar import BEIJING_TZ
+
+
+def make_fetcher(monkeypatch, tmp_path, delay=0.01):
+    monkeypatch.chdir(tmp_path)
+    fetcher = KLineDataFetcher()
+    state = {'started': 0, 'lock': threading.Lock()}
+
+    def get_kline_data(stock_code, days=60):
+        with state['lock']:
+            state['started'] += 1
+        time.sleep(delay)
+        if stock_code.endswith('9'):
+            return None
+        return pd.DataFrame({'close': [1.0] * days})
+
+    monkeypatch.setattr(fetcher, 'get_kline_data', get_kline_data)
+    return fetcher, state
+
+
+def test_iter_kline_data_batch_yields_every_code(monkeypatch, tmp_path):
+    fetcher, _ = make_fetcher(monkeypatch, tmp_path)
+    codes = [f"{600000 + i:06d}" for i in range(100)]
+
+    results = dict(fetcher.iter_kline_data_batch(codes, days=30))
+
+    assert set(results) == set(codes)
+    assert sum(1 for data in results.values() if data is None) == 10
+    assert all(len(data) == 30 for data in results.values() if data is not None)
+
+
+def test_iter_kline_data_batch_bounds_in_flight_work(monkeypatch, tmp_path):
+    fetcher, state = make_fetcher(monkeypatch, tmp_path)
+    codes = [f"{600000 + i:06d}" for i in range(200)]
+
+    stream = fetcher.iter_kline_data_batch(codes, max_in_flight=8)
+    next(stream)
+    time.sleep(0.1)
+    # 调用方没有继续消费时，最多只有 max_in_flight + 1 个任务被提交
+    assert state['started'] <= 9
+    stream.close()
+
+
+def test_get_kline_data_batch_keeps_dict_interface(monkeypatch, tmp_path):
+    fetcher, _ = make_fetcher(monkeypatch, tmp_path)
+    results = fetcher.get_kline_data_batch(['600000', '600009'])
+    assert results['600009'] is None
+    assert len(results['600000']) == 60
+
+
+def test_cache_written_before_last_close_is_refreshed(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    fetcher = KLineDataFetcher()
+    # 2026-10-19（周一）14:30，最近一次收盘是10月16日（周五）15:00
+    monkeypatch.setattr(fetcher.calendar, 'now', lambda: datetime(2026, 10, 19, 14, 30, tzinfo=BEIJING_TZ))
+    downloads = []
+
+    def get_kline_from_qq(stock_code, days=60):
+        downloads.append(stock_code)
+        return pd.DataFrame({'date': pd.to_datetime(['2026-10-15', '2026-10-16', '2026-10-19']),
+                             'close': [1.0, 1.1, 1.2], 'volume': [1000.0, 1000.0, 300.0]})
+
+    monkeypatch.setattr(fetcher, '_get_kline_from_qq', get_kline_from_qq)
+    fetcher._save_to_cache('600000', pd.DataFrame({'close': [1.0]}))
+    stale = datetime(2026, 10, 16, 9, tzinfo=BEIJING_TZ).timestamp()
+    os.utime(fetcher._get_cache_file_path('600000'), (stale, stale))
+
+    kline = fetcher.get_kline_data('600000')
+    # 收盘前写入的缓存不可用，重新获取后丢掉10月19日盘中未收盘的K线
+    assert downloads == ['600000']
+    assert list(kline['date'].dt.strftime('%Y-%m-%d')) == ['2026-10-15', '2026-10-16']
+
+    fresh = datetime(2026, 10, 19, 9, tzinfo=BEIJING_TZ).timestamp()
+    os.utime(fetcher._get_cache_file_path('600000'), (fresh, fresh))
+    assert len(fetcher.get_kline_data('600000')) == 2
+    assert downloads == ['600000']
+
+
+if __name__ == "__main__":
+    print("请使用 pytest 运行本测试")
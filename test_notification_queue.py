@@ -0,0 +1,173 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试notification_queue.py中的后台通知队列，以及飞书消息的异步发送和拆分（本地模拟的webhook）
+"""
+
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from notification_queue import NotificationQueue
+from stock_selector import FeishuNotifier
+
+
+class MockWebhook:
+    """本地飞书webhook：记录收到的消息，可按顺序返回预设的失败（HTTP状态码或飞书错误码）"""
+
+    def __init__(self, delay=0.0, failures=()):
+        self.delay = delay
+        self.failures = list(failures)
+        self.lock = threading.Lock()
+        self.bodies = []
+        self.attempts = 0
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers['Content-Length']))
+                time.sleep(mock.delay)
+                with mock.lock:
+                    mock.attempts += 1
+                    failure = mock.failures.pop(0) if mock.failures else None
+                    if failure is None:
+                        mock.bodies.append(body)
+                status, code = (failure, 0) if isinstance(failure, int) and failure >= 400 else (200, failure or 0)
+                payload = json.dumps({'code': code, 'msg': 'ok' if code == 0 else 'error'}).encode()
+                self.send_response(status)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(payload)))
+                self.end_headers()
+                self.wfile.write(payload)
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/open-apis/bot/v2/hook/test"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def texts(self):
+        return [json.loads(body)['content']['text'] for body in self.bodies]
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def webhook():
+    servers = []
+
+    def start(**kwargs):
+        server = MockWebhook(**kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def stocks(count):
+    return [{'code': f'{600000 + i}', 'name': f'股票{i}', 'price': 10.0, 'change_percent': -1.2,
+             'volume_ratio': 0.8, 'turnover_rate': 1.5} for i in range(count)]
+
+
+def test_send_returns_immediately_and_retries(webhook):
+    # HTTP 500 和飞书限流错误码都会重试
+    server = webhook(delay=0.3, failures=[500, 9499])
+    notifier = FeishuNotifier(server.url, NotificationQueue(backoff=0.05))
+
+    started = time.time()
+    assert notifier.send_message(stocks(3))
+    assert time.time() - started < 0.1
+
+    assert notifier.queue.flush(timeout=5)
+    assert server.attempts == 3 and notifier.queue.sent == 1
+    text = server.texts()[0]
+    assert text.startswith('股票筛选结果\n') and '共筛选出 3 只股票' in text and '600002 股票2' in text
+
+
+def test_duplicate_results_are_sent_once(webhook):
+    server = webhook()
+    notifier = FeishuNotifier(server.url, NotificationQueue(backoff=0.05))
+    assert notifier.send_message(stocks(2))
+    # 筛选时间不同但结果相同，不再发送
+    time.sleep(1.1)
+    assert not notifier.send_message(stocks(2))
+    assert notifier.send_message(stocks(3))
+    assert notifier.queue.flush(timeout=5)
+    assert len(server.bodies) == 2
+
+
+def test_give_up_after_retries_allows_resend(webhook):
+    server = webhook(failures=[503, 503])
+    notifier = FeishuNotifier(server.url, NotificationQueue(max_retries=1, backoff=0.05))
+    notifier.send_message([])
+    assert notifier.queue.flush(timeout=5)
+    assert notifier.queue.failed == 1 and server.bodies == []
+
+    assert notifier.send_message([])
+    assert notifier.queue.flush(timeout=5)
+    assert '今日未筛选出符合条件的股票' in server.texts()[0]
+
+
+def test_long_selection_is_split_within_size_limit(webhook):
+    server = webhook()
+    notifier = FeishuNotifier(server.url, NotificationQueue())
+    assert notifier.send_message(stocks(600))
+    assert notifier.queue.flush(timeout=10)
+
+    texts = server.texts()
+    assert len(texts) > 1
+    assert all(len(body) <= 20 * 1024 for body in server.bodies)
+    # 按顺序发送，每只股票恰好出现一次
+    assert [text.split('\n', 1)[0] for text in texts] == [f'股票筛选结果（{i}/{len(texts)}）' for i in range(1, len(texts) + 1)]
+    lines = [line for text in texts for line in text.split('\n') if ' | 价格' in line]
+    assert [int(line.split('.', 1)[0]) for line in lines] == list(range(1, 601))
+
+
+
+def test_split_selection_is_deduplicated_as_a_whole(webhook):
+    server = webhook()
+    notifier = FeishuNotifier(server.url, NotificationQueue(backoff=0.05))
+    selection = stocks(600)
+    assert notifier.send_message(selection)
+    assert notifier.queue.flush(timeout=10)
+    parts = len(server.texts())
+    assert parts > 1
+
+    # 只有最后一只股票变化：整个结果重新发送，不会只发出变化的那一条
+    changed = selection[:-1] + [dict(selection[-1], price=11.0)]
+    assert notifier.send_message(changed)
+    assert notifier.queue.flush(timeout=10)
+    texts = server.texts()[parts:]
+    assert [text.split('\n', 1)[0] for text in texts] == [f'股票筛选结果（{i}/{parts}）' for i in range(1, parts + 1)]
+
+    assert not notifier.send_message(changed)
+
+
+def test_retry_resumes_from_failed_part(webhook):
+    # 第二条消息第一次发送失败，重试时不重复发送第一条
+    server = webhook(failures=[None, 500])
+    notifier = FeishuNotifier(server.url, NotificationQueue(backoff=0.05))
+    assert notifier.send_message(stocks(600))
+    assert notifier.queue.flush(timeout=10)
+    titles = [text.split('\n', 1)[0] for text in server.texts()]
+    assert len(titles) == len(set(titles)) and titles[0].startswith('股票筛选结果（1/')
+
+
+def test_messages_keep_caller_order():
+    notifier = FeishuNotifier('http://127.0.0.1/hook', NotificationQueue())
+    selection = [dict(stock, score=score) for stock, score in zip(stocks(3), [1.0, 5.0, 3.0])]
+    text = notifier.build_messages(selection, '筛选时间: 2026-10-19 14:30:00')[0]
+    lines = [line for line in text.split('\n') if ' | 价格' in line]
+    assert [line.split(' ')[1] for line in lines] == ['600000', '600001', '600002']
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, '-q'])
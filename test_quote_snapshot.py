@@ -0,0 +1,139 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试quote_snapshot.py中的共享行情快照
+"""
+
+import threading
+import time
+
+import pandas as pd
+
+from quote_snapshot import QuoteSnapshot
+
+
+def quote(code, price):
+    return {'code': code, 'name': f'股票{code}', 'price': price, 'open': price, 'change_percent': 1.0}
+
+
+class FakeSelector:
+    """按代码返回固定行情，记录每次请求的代码"""
+
+    def __init__(self, prices, delay=0.0):
+        self.prices = prices
+        self.delay = delay
+        self.requests = []
+
+    def iter_realtime_batches(self, stock_codes, batch_size=100, token=None):
+        for i in range(0, len(stock_codes), batch_size):
+            batch = stock_codes[i:i + batch_size]
+            self.requests.append(batch)
+            time.sleep(self.delay)
+            yield [quote(code, self.prices[code]) for code in batch if code in self.prices]
+
+
+def test_only_missing_or_stale_codes_are_requested():
+    selector = FakeSelector({'600036': 40.0, '000001': 11.0, '300750': 200.0})
+    snapshot = QuoteSnapshot(selector, max_age=60)
+    snapshot.update([quote('600036', 39.0)])
+
+    quotes = snapshot.get(['600036', '000001', '300750', '688999'])
+    assert selector.requests == [['000001', '300750', '688999']]
+    assert quotes['600036']['price'] == 39.0 and quotes['300750']['price'] == 200.0
+    assert '688999' not in quotes
+
+    # 有效期内不再请求，包括没有行情的代码
+    snapshot.get(['600036', '000001', '688999'])
+    assert len(selector.requests) == 1
+
+    snapshot.max_age = 0
+    time.sleep(0.01)
+    assert snapshot.get(['600036'])['600036']['price'] == 40.0
+    assert selector.requests[-1] == ['600036']
+
+
+def test_concurrent_queries_share_one_request():
+    prices = {f'600{i:03d}': 10.0 + i for i in range(250)}
+    selector = FakeSelector(prices, delay=0.05)
+    snapshot = QuoteSnapshot(selector, max_age=60)
+    codes = list(prices)
+    results = [None] * 4
+
+    def query(index):
+        results[index] = snapshot.get(codes)
+
+    threads = [threading.Thread(target=query, args=(i,)) for i in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    # 250只股票分3批请求一次，其他查询直接使用快照
+    assert len(selector.requests) == 3
+    assert all(len(result) == 250 for result in results)
+
+
+def test_queries_for_different_codes_run_in_parallel():
+    selector = FakeSelector({'600036': 40.0, '000001': 11.0}, delay=0.3)
+    snapshot = QuoteSnapshot(selector, max_age=60)
+    results = {}
+
+    def query(code):
+        results[code] = snapshot.get([code])
+
+    threads = [threading.Thread(target=query, args=(code,)) for code in ('600036', '000001')]
+    started = time.time()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert time.time() - started < 0.5
+    assert sorted(code for batch in selector.requests for code in batch) == ['000001', '600036']
+    assert results['600036']['600036']['price'] == 40.0 and results['000001']['000001']['price'] == 11.0
+
+
+def test_frame_and_realtime_writes_agree(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    import data_fetcher
+    from stock_selector import StockSelector
+    from test_strategies import tencent_line
+
+    class Response:
+        status_code = 200
+        text = tencent_line()
+        encoding = None
+
+    monkeypatch.setattr(data_fetcher.requests, 'get', lambda url, timeout=10: Response())
+    from_frame = QuoteSnapshot(FakeSelector({}), max_age=60)
+    from_frame.update_frame(data_fetcher.DataFetcher().get_stock_data_from_tencent('sh', stock_codes=['600036']))
+    from_realtime = QuoteSnapshot(FakeSelector({}), max_age=60)
+    from_realtime.update(StockSelector()._parse_realtime_response(tencent_line()))
+
+    # 无论哪条路径最后写入，high/low/volume/amount 的含义相同
+    assert from_frame.get(['600036']) == from_realtime.get(['600036'])
+
+
+def test_full_market_frame_and_columns():
+    snapshot = QuoteSnapshot(FakeSelector({}), max_age=60)
+    snapshot.update_frame(pd.DataFrame({
+        '代码': ['600036', '600000'], '名称': ['招商银行', '停牌股'],
+        '最新价': [40.0, 0.0], '今开': [39.5, 0.0], '涨跌幅': [1.2, 0.0]
+    }))
+    assert len(snapshot) == 1
+
+    codes = ['600000', '600036']
+    columns = QuoteSnapshot.to_columns(snapshot.get(codes), codes, ['code', 'price', 'change_percent'])
+    assert columns == {
+        'fields': ['code', 'price', 'change_percent'],
+        'columns': {'code': ['600036'], 'price': [40.0], 'change_percent': [1.2]},
+        'missing': ['600000']
+    }
+
+
+if __name__ == "__main__":
+    test_only_missing_or_stale_codes_are_requested()
+    test_concurrent_queries_share_one_request()
+    test_queries_for_different_codes_run_in_parallel()
+    test_full_market_frame_and_columns()
+    print("测试完成")
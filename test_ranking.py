@@ -0,0 +1,105 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试ranking.py中的多因子Top-K排序
+"""
+
+import time
+
+import numpy as np
+
+from ranking import rank_stocks, score_stocks, CHEN_WEIGHTS
+
+
+def make_stocks(n, seed=0):
+    rng = np.random.default_rng(seed)
+    return [
+        {
+            'code': f"{600000 + i:06d}",
+            'name': f"股票{i}",
+            'price': float(rng.uniform(5, 60)),
+            'change_percent': float(rng.uniform(-8, 0)),
+            'volume_ratio': float(rng.uniform(0.2, 2)),
+            'turnover_rate': float(rng.uniform(0, 12)),
+            'order_ratio': float(rng.uniform(-50, 50))
+        }
+        for i in range(n)
+    ]
+
+
+def band_priority(stock):
+    """原有的四档优先级"""
+    priority = 0
+    if stock['volume_ratio'] < 0.5:
+        priority += 3
+    elif stock['volume_ratio'] < 0.8:
+        priority += 2
+    if 3 <= stock['turnover_rate'] <= 8:
+        priority += 2
+    if -5 <= stock['change_percent'] <= -2:
+        priority += 2
+    if stock['order_ratio'] > 0:
+        priority += 1
+    return priority
+
+
+def full_sort(stocks, weights=None):
+    scores = score_stocks(stocks, weights)
+    order = sorted(range(len(stocks)), key=lambda i: (-scores[i], stocks[i]['volume_ratio'], stocks[i]['code']))
+    return [stocks[i]['code'] for i in order]
+
+
+def test_default_weights_reproduce_band_priority():
+    stocks = make_stocks(500)
+    scores = score_stocks(stocks)
+    assert [int(round(score)) for score in scores] == [band_priority(stock) for stock in stocks]
+
+
+def test_top_k_matches_full_sort():
+    stocks = make_stocks(3000, seed=1)
+    for k in (1, 20, 100):
+        top = rank_stocks(stocks, k=k)
+        assert [stock['code'] for stock in top] == full_sort(stocks)[:k]
+
+
+def test_top_k_respects_tie_breakers():
+    stocks = [
+        {'code': '600003', 'volume_ratio': 0.4, 'turnover_rate': 5, 'change_percent': -3, 'order_ratio': 1},
+        {'code': '600001', 'volume_ratio': 0.4, 'turnover_rate': 5, 'change_percent': -3, 'order_ratio': 1},
+        {'code': '600002', 'volume_ratio': 0.3, 'turnover_rate': 5, 'change_percent': -3, 'order_ratio': 1}
+    ]
+    top = rank_stocks(stocks, k=2)
+    assert [stock['code'] for stock in top] == ['600002', '600001']
+
+    top = rank_stocks(stocks, k=2, tie_breakers=[('code', 'desc')])
+    assert [stock['code'] for stock in top] == ['600003', '600002']
+
+
+def test_custom_weights():
+    stocks = make_stocks(1000, seed=2)
+    top = rank_stocks(stocks, weights=CHEN_WEIGHTS, k=10)
+    assert [stock['code'] for stock in top] == full_sort(stocks, CHEN_WEIGHTS)[:10]
+
+    try:
+        rank_stocks(stocks, weights={'unknown': 1})
+    except ValueError:
+        return
+    assert False, "未知因子应抛出ValueError"
+
+
+def test_large_candidate_set_ranks_quickly():
+    stocks = make_stocks(50000, seed=3)
+    started = time.perf_counter()
+    top = rank_stocks(stocks, k=20)
+    elapsed = time.perf_counter() - started
+    assert len(top) == 20
+    print(f"5万只候选股票Top-20排序耗时 {elapsed * 1000:.1f}ms")
+
+
+if __name__ == "__main__":
+    test_default_weights_reproduce_band_priority()
+    test_top_k_matches_full_sort()
+    test_top_k_respects_tie_breakers()
+    test_custom_weights()
+    test_large_candidate_set_ranks_quickly()
+    print("测试完成")
@@ -0,0 +1,48 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试ring_buffer.py中的环形缓冲区和序号游标
+"""
+
+import pytest
+
+from ring_buffer import RingBuffer
+
+
+def test_cursor_returns_only_new_items():
+    buffer = RingBuffer(capacity=5)
+    assert buffer.since(0) == ([], 0, False)
+
+    for i in range(3):
+        buffer.append(f"line{i}")
+    items, cursor, reset = buffer.since(0)
+    assert items == ['line0', 'line1', 'line2'] and cursor == 3 and not reset
+
+    buffer.append('line3')
+    assert buffer.since(cursor) == (['line3'], 4, False)
+    assert buffer.since(4) == ([], 4, False)
+
+
+def test_overwritten_items_reset_cursor():
+    buffer = RingBuffer(capacity=3)
+    for i in range(10):
+        assert buffer.append(i) == i + 1
+    assert len(buffer) == 3
+
+    assert buffer.since(0) == ([7, 8, 9], 10, True)
+    assert buffer.since(8) == ([8, 9], 10, False)
+    # 读取方落后超过容量时，只能拿到仍保留的元素
+    assert buffer.since(5) == ([7, 8, 9], 10, True)
+    # 服务重启后旧游标超过最新序号
+    assert buffer.since(50) == ([7, 8, 9], 10, True)
+
+
+def test_invalid_capacity():
+    with pytest.raises(ValueError):
+        RingBuffer(capacity=0)
+
+
+if __name__ == "__main__":
+    test_cursor_returns_only_new_items()
+    test_overwritten_items_reset_cursor()
+    print("测试完成")
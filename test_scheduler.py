@@ -0,0 +1,167 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试scheduler.py中的预热任务：刷新代码表和K线缓存后，选股任务不再为获取代码下载行情（离线数据）
+"""
+
+import importlib
+
+import pandas as pd
+
+import data_fetcher
+
+LISTED = {'600036', '600519', '000001', '300750'}
+
+
+def quote_line(prefix, code):
+    fields = ['0'] * 50
+    fields[1] = f"股票{code}"
+    fields[2] = code
+    fields[3] = '10.5'
+    fields[4] = '10.0'
+    fields[5] = '10.1'
+    fields[32] = '5.0'
+    return f'v_{prefix}{code}="{"~".join(fields)}"'
+
+
+class FakeResponse:
+    status_code = 200
+
+    def __init__(self, text):
+        self.text = text
+        self.encoding = None
+
+
+def install_fake_quotes(monkeypatch, listed=LISTED):
+    urls = []
+
+    def fake_get(url, timeout=10):
+        urls.append(url)
+        symbols = url.split('q=', 1)[1].split(',')
+        return FakeResponse(';'.join(quote_line(symbol[:2], symbol[2:]) for symbol in symbols
+                                     if symbol[2:] in listed))
+
+    monkeypatch.setattr(data_fetcher.requests, 'get', fake_get)
+    return urls
+
+
+def load_scheduler(monkeypatch, tmp_path):
+    # 调度模块导入时会在当前目录创建日志文件
+    monkeypatch.chdir(tmp_path)
+    import scheduler
+    return importlib.reload(scheduler)
+
+
+def test_warm_up_builds_registry_and_kline_cache(monkeypatch, tmp_path):
+    scheduler = load_scheduler(monkeypatch, tmp_path)
+    urls = install_fake_quotes(monkeypatch)
+    warmed = []
+    monkeypatch.setattr(scheduler.KLineCacheUpdater, 'update_all_stocks_cache',
+                        lambda self, stock_codes=None, token=None: warmed.extend(stock_codes) or len(stock_codes))
+
+    scheduler.warm_up()
+    assert sorted(warmed) == sorted(LISTED)
+    # 预热时完整探测候选代码段
+    assert len(urls) > 100
+
+    # 选股任务直接读取代码表，不再请求行情
+    urls.clear()
+    assert sorted(scheduler.get_all_stock_codes()) == sorted(LISTED)
+    assert urls == []
+
+    # 之后的行情请求只查询已上市的代码
+    data = data_fetcher.DataFetcher().get_stock_data('sh')
+    assert sorted(data['代码']) == ['600036', '600519']
+    assert len(urls) == 1
+
+
+def test_job_downloads_quotes_once(monkeypatch, tmp_path):
+    scheduler = load_scheduler(monkeypatch, tmp_path)
+    urls = install_fake_quotes(monkeypatch)
+    fetcher = data_fetcher.DataFetcher()
+    for market in scheduler.MARKETS:
+        fetcher.refresh_symbol_registry(market)
+    urls.clear()
+
+    from stock_selector import KLineDataFetcher, StockSelector
+
+    def no_realtime_requests(self, stock_codes, batch_size=100, token=None):
+        raise AssertionError("不应按代码重新请求实时行情")
+
+    monkeypatch.setattr(StockSelector, 'iter_realtime_batches', no_realtime_requests)
+    monkeypatch.setattr(KLineDataFetcher, 'get_kline_data', lambda self, code, days=60: None)
+    counters = []
+    original = StockSelector._finish_selection
+
+    def finish(self, executor, selected, run_counters, started):
+        counters.append(run_counters)
+        return original(self, executor, selected, run_counters, started)
+
+    monkeypatch.setattr(StockSelector, '_finish_selection', finish)
+
+    scheduler.job()
+    # 每个市场一次行情请求，之后直接用快照选股
+    assert len(urls) == len(scheduler.MARKETS)
+    assert counters[0]['total'] == len(LISTED)
+
+
+def test_snapshot_and_code_selection_give_identical_records(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    from stock_selector import KLineDataFetcher, StockSelector
+    from test_strategies import tencent_line
+
+    lines = tencent_line('600036') + tencent_line('600519')
+
+    class Response:
+        status_code = 200
+        text = lines
+        encoding = None
+
+    monkeypatch.setattr(data_fetcher.requests, 'get', lambda url, timeout=10: Response())
+    kline = pd.DataFrame({'close': [1.0] * 30})
+    monkeypatch.setattr(KLineDataFetcher, 'get_kline_data', lambda self, code, days=60: kline)
+    for check in ('is_volume_shrink', 'is_price_near_ma10', 'is_ma10_upward', 'is_ma10_near_ma20',
+                  'has_big_yang_line_or_limit_up'):
+        monkeypatch.setattr(KLineDataFetcher, check, lambda self, kline_data, *args, **kwargs: True)
+
+    snapshot = data_fetcher.DataFetcher().get_stock_data_from_tencent('sh', stock_codes=['600036', '600519'])
+    from_snapshot = StockSelector().select_from_snapshot(snapshot)
+
+    selector = StockSelector()
+    monkeypatch.setattr(selector.session, 'get', lambda url, timeout=10: Response())
+    from_codes = selector.select_stocks(['600036', '600519'])
+
+    assert len(from_snapshot) == 2
+    assert from_snapshot == from_codes
+    assert from_codes[0]['volume'] == 500000 and from_codes[0]['order_ratio'] == 50.0
+
+
+def test_failed_refresh_keeps_previous_registry(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    install_fake_quotes(monkeypatch)
+    fetcher = data_fetcher.DataFetcher()
+    assert fetcher.refresh_symbol_registry('cyb') == ['300750']
+
+    monkeypatch.setattr(fetcher, 'get_stock_data', lambda market, token=None: pd.DataFrame())
+    assert fetcher.refresh_symbol_registry('cyb') == []
+    assert fetcher.get_symbol_registry('cyb') == ['300750']
+
+
+def test_kline_cache_updater_uses_registry(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    install_fake_quotes(monkeypatch)
+    from kline_cache_updater import KLineCacheUpdater
+
+    updater = KLineCacheUpdater()
+    for market in ('sh', 'sz', 'cyb'):
+        updater.data_fetcher.refresh_symbol_registry(market)
+    fetched = []
+    monkeypatch.setattr(updater.kline_fetcher, 'get_kline_data',
+                        lambda code, days=60: fetched.append(code) or pd.DataFrame({'close': [1.0]}))
+
+    assert updater.update_all_stocks_cache() == len(LISTED)
+    assert sorted(fetched) == sorted(LISTED)
+
+
+if __name__ == "__main__":
+    print("请使用 pytest 运行: python -m pytest -q test_scheduler.py")
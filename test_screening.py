@@ -0,0 +1,229 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试screening.py中按代价和选择性排序的条件执行器（离线数据）
+"""
+
+import numpy as np
+import pandas as pd
+
+from screening import Predicate, PredicateStats, ScreeningExecutor, STAGE_REALTIME, STAGE_KLINE
+
+
+def make_kline(days=60, big_yang=True):
+    """
+    生成一段满足"买阴不买阳"全部K线条件的模拟K线
+    """
+    close = 10 + np.arange(days) * 0.02
+    open_price = close * 0.99
+    if big_yang:
+        open_price[days - 20] = close[days - 20] / 1.08
+    volume = np.full(days, 1000.0)
+    volume[-1] = 500.0
+    return pd.DataFrame({
+        'date': pd.date_range('2026-01-01', periods=days),
+        'open': open_price,
+        'close': close,
+        'high': close * 1.01,
+        'low': open_price * 0.99,
+        'volume': volume,
+        'amount': 0
+    })
+
+
+def make_executor(stats):
+    return ScreeningExecutor([
+        Predicate('wide', '宽松条件', STAGE_REALTIME, lambda stock, kline: stock['value'] > 1),
+        Predicate('narrow', '严格条件', STAGE_REALTIME, lambda stock, kline: stock['value'] > 90),
+        Predicate('kline', 'K线条件', STAGE_KLINE, lambda stock, kline: True)
+    ], stats=stats)
+
+
+def test_executor_orders_selective_predicates_first(tmp_path):
+    stats = PredicateStats(path=str(tmp_path / 'stats.json'))
+    executor = make_executor(stats)
+    # 没有历史统计时保持默认顺序
+    assert [p.name for p in executor.ordered(STAGE_REALTIME)] == ['wide', 'narrow']
+
+    for value in range(100):
+        executor.evaluate(STAGE_REALTIME, {'value': value})
+    executor.finish_run()
+
+    # 重新加载持久化的统计后，淘汰率高的条件排在前面
+    reloaded = make_executor(PredicateStats(path=str(tmp_path / 'stats.json')))
+    assert [p.name for p in reloaded.ordered(STAGE_REALTIME)] == ['narrow', 'wide']
+    assert [p.name for p in reloaded.ordered(STAGE_KLINE)] == ['kline']
+
+
+def test_executor_funnel_counts():
+    executor = make_executor(PredicateStats(path=None))
+    results = [executor.evaluate(STAGE_REALTIME, {'value': value}) for value in range(100)]
+
+    assert sum(1 for passed, _ in results if passed) == 9
+    funnel = {item['name']: item for item in executor.funnel()}
+    assert funnel['wide']['evaluated'] == 100
+    assert funnel['wide']['passed'] == 98
+    assert funnel['narrow']['evaluated'] == 98
+    assert funnel['narrow']['passed'] == 9
+    assert funnel['kline']['evaluated'] == 0
+
+
+def test_select_stocks_records_funnel(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    from stock_selector import StockSelector
+
+    selector = StockSelector()
+    realtime_data = [
+        {'code': '600001', 'name': '阴线', 'price': 10.5, 'change_percent': -3.0, 'volume_ratio': 0.4,
+         'turnover_rate': 5.0, 'order_ratio': 10.0, 'volume': 1000, 'is_yin_line': True},
+        {'code': '600002', 'name': '阳线', 'price': 10.5, 'change_percent': 1.0, 'volume_ratio': 1.0,
+         'turnover_rate': 5.0, 'order_ratio': 10.0, 'volume': 1000, 'is_yin_line': False},
+        {'code': '600003', 'name': '无大阳', 'price': 10.5, 'change_percent': -1.0, 'volume_ratio': 1.0,
+         'turnover_rate': 5.0, 'order_ratio': 10.0, 'volume': 1000, 'is_yin_line': True}
+    ]
+    klines = {'600001': make_kline(), '600003': make_kline(big_yang=False)}
+    monkeypatch.setattr(selector, 'iter_realtime_batches', lambda codes, token=None: iter([realtime_data[:2], realtime_data[2:]]))
+    monkeypatch.setattr(selector.kline_fetcher, 'get_kline_data', lambda code, days=60: klines.get(code))
+
+    result = selector.select_stocks(['600001', '600002', '600003'])
+
+    assert [stock['code'] for stock in result] == ['600001']
+    funnel = {item['name']: item for item in selector.last_funnel}
+    assert funnel['yin_line']['evaluated'] == 3
+    assert funnel['yin_line']['passed'] == 2
+    assert funnel['big_yang']['rejected'] == 1
+
+
+def test_select_stocks_overlaps_quote_and_kline_fetching(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    import time
+    from stock_selector import StockSelector
+
+    selector = StockSelector()
+    events = []
+
+    def batches(codes, token=None):
+        for i in range(5):
+            time.sleep(0.05)
+            events.append(('batch', i, time.perf_counter()))
+            yield [{'code': f"{600000 + i * 10 + j:06d}", 'name': '', 'price': 10.0, 'change_percent': -3.0,
+                    'volume_ratio': 0.4, 'turnover_rate': 5.0, 'order_ratio': 1.0, 'volume': 100,
+                    'is_yin_line': True} for j in range(4)]
+
+    def get_kline_data(code, days=60):
+        events.append(('kline', code, time.perf_counter()))
+        time.sleep(0.05)
+        return make_kline()
+
+    monkeypatch.setattr(selector, 'iter_realtime_batches', batches)
+    monkeypatch.setattr(selector.kline_fetcher, 'get_kline_data', get_kline_data)
+
+    result = selector.select_stocks([])
+
+    assert len(result) == 20
+    first_kline = min(t for kind, _, t in events if kind == 'kline')
+    last_batch = max(t for kind, _, t in events if kind == 'batch')
+    # 第一批的K线在最后一批实时数据到达之前就已开始获取
+    assert first_kline < last_batch
+
+
+
+def test_concurrent_selections_keep_separate_counts(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    import threading
+    from stock_selector import StockSelector
+
+    selector = StockSelector(stats=PredicateStats(path=None))
+    barrier = threading.Barrier(2)
+
+    def records(count, prefix):
+        return [{'code': f"{prefix}{i:04d}", 'name': '', 'price': 10.0, 'change_percent': -3.0,
+                 'volume_ratio': 0.4, 'turnover_rate': 5.0, 'order_ratio': 1.0, 'volume': 100,
+                 'is_yin_line': True} for i in range(count)]
+
+    def get_kline_data(code, days=60):
+        # 两次选股同时处于K线阶段
+        try:
+            barrier.wait(timeout=2)
+        except threading.BrokenBarrierError:
+            pass
+        return make_kline()
+
+    monkeypatch.setattr(selector.kline_fetcher, 'get_kline_data', get_kline_data)
+    funnels = {}
+
+    def run(count, prefix):
+        selector.select_from_records(records(count, prefix))
+        funnels[prefix] = {item['name']: item['evaluated'] for item in selector.last_funnel}
+
+    threads = [threading.Thread(target=run, args=(3, '60')), threading.Thread(target=run, args=(5, '00'))]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+    # 每次运行的漏斗只统计自己的股票
+    assert funnels['60']['yin_line'] == 3 and funnels['00']['yin_line'] == 5
+    assert selector.executor.stats.stats['yin_line']['evaluated'] > 0
+
+
+def test_predicate_stats_are_replaced_atomically(tmp_path, monkeypatch):
+    path = tmp_path / 'predicate_stats.json'
+    stats = PredicateStats(path=str(path))
+    stats.merge_run({'yin_line': {'evaluated': 10, 'passed': 4, 'cost': 0.01}})
+    stats.save()
+    before = path.read_text(encoding='utf-8')
+
+    def fail_replace(src, dst):
+        raise OSError('磁盘已满')
+
+    stats.merge_run({'yin_line': {'evaluated': 10, 'passed': 4, 'cost': 0.01}})
+    monkeypatch.setattr('screening.os.replace', fail_replace)
+    stats.save()
+    # 写入失败时原文件保持完整，也不留下临时文件
+    assert path.read_text(encoding='utf-8') == before
+    assert [item.name for item in tmp_path.iterdir()] == ['predicate_stats.json']
+    assert PredicateStats(path=str(path)).stats['yin_line']['evaluated'] == 10
+
+
+def test_select_stocks_bounds_pending_kline_work(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    import threading
+    import time
+    from stock_selector import StockSelector
+
+    selector = StockSelector()
+    selector.kline_fetcher.max_workers = 2
+    release = threading.Event()
+    pulled = []
+
+    def batches(codes, token=None):
+        for i in range(100):
+            pulled.append(i)
+            yield [{'code': f"{600000 + i:06d}", 'name': '', 'price': 10.0, 'change_percent': -3.0,
+                    'volume_ratio': 0.4, 'turnover_rate': 5.0, 'order_ratio': 1.0, 'volume': 100,
+                    'is_yin_line': True}]
+
+    def get_kline_data(code, days=60):
+        release.wait(5)
+        return make_kline()
+
+    monkeypatch.setattr(selector, 'iter_realtime_batches', batches)
+    monkeypatch.setattr(selector.kline_fetcher, 'get_kline_data', get_kline_data)
+    result = []
+    worker = threading.Thread(target=lambda: result.extend(selector.select_stocks([])))
+    worker.start()
+    time.sleep(0.3)
+    # K线请求被阻塞时，只读取在途上限（并行度的2倍）和预取队列所需的几批行情，而不是全部100批
+    assert len(pulled) <= 2 * 2 + StockSelector.PREFETCH_BATCHES + 2
+    release.set()
+    worker.join(timeout=5)
+    assert len(result) == 100
+
+
+if __name__ == "__main__":
+    import tempfile
+    import pathlib
+    with tempfile.TemporaryDirectory() as tmp:
+        test_executor_orders_selective_predicates_first(pathlib.Path(tmp))
+    test_executor_funnel_counts()
+    print("测试完成")
@@ -0,0 +1,87 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试sharded_scan.py中的多进程分片扫描（合成数据）
+"""
+
+import functools
+
+import pandas as pd
+
+from screening import PredicateStats
+from sharded_scan import ShardedScanner, scan_processes, split_shards
+from stock_selector import ScheduledStockSelector, StockSelector
+from synthetic_market import (patch_synthetic_sources, synthetic_codes, synthetic_scan_record_shard,
+                              synthetic_scan_shard)
+
+
+def test_split_shards_covers_all_codes():
+    codes = [str(i) for i in range(10)]
+    shards = split_shards(codes, 3)
+    assert [len(shard) for shard in shards] == [4, 3, 3]
+    assert sum(shards, []) == codes
+    assert split_shards(codes[:2], 8) == [['0'], ['1']]
+
+
+def test_sharded_scan_matches_single_process(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    codes = synthetic_codes(600)
+
+    single = StockSelector(stats=PredicateStats(path=None))
+    patch_synthetic_sources(single)
+    expected = single.select_stocks(codes)
+
+    stats = PredicateStats(path=str(tmp_path / 'stats.json'))
+    scanner = ShardedScanner(processes=3, selector=StockSelector(stats=stats), kline_workers=2,
+                             shard_func=synthetic_scan_shard)
+    result = scanner.scan(codes)
+
+    assert expected
+    assert [stock['code'] for stock in result] == [stock['code'] for stock in expected]
+    assert scanner.selector.last_counters == single.last_counters
+    merged = {item['name']: (item['evaluated'], item['passed']) for item in scanner.selector.last_funnel}
+    assert merged == {item['name']: (item['evaluated'], item['passed']) for item in single.last_funnel}
+    assert len(scanner.last_shards) == 3
+    # 合并后的统计由主进程持久化
+    assert (tmp_path / 'stats.json').exists()
+
+
+
+def test_scheduled_selection_uses_shards_for_snapshot(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    codes = synthetic_codes(300)
+    single = StockSelector(stats=PredicateStats(path=None))
+    patch_synthetic_sources(single)
+    records = [record for batch in single.iter_realtime_batches(codes) for record in batch]
+    expected = single.select_from_records(records)
+
+    monkeypatch.setenv('SCAN_PROCESSES', '2')
+    scheduled = ScheduledStockSelector('')
+    assert scheduled.processes == 2
+    scheduled.selector = StockSelector(stats=PredicateStats(path=None))
+    # 分片入口换成合成K线；快照转换直接返回合成行情
+    monkeypatch.setattr('sharded_scan.ShardedScanner', functools.partial(
+        ShardedScanner, shard_func=synthetic_scan_shard, record_shard_func=synthetic_scan_record_shard))
+    monkeypatch.setattr('stock_selector.records_from_snapshot', lambda frame: records)
+    snapshot = pd.DataFrame({'代码': [record['code'] for record in records]})
+    result = scheduled.run_selection(snapshot=snapshot)
+
+    assert expected
+    assert [stock['code'] for stock in result] == [stock['code'] for stock in expected]
+    assert scheduled.selector.last_counters == single.last_counters
+    assert {item['name']: item['passed'] for item in scheduled.selector.last_funnel} == \
+        {item['name']: item['passed'] for item in single.last_funnel}
+
+
+def test_scan_processes_env(monkeypatch):
+    monkeypatch.delenv('SCAN_PROCESSES', raising=False)
+    assert scan_processes() == 1
+    monkeypatch.setenv('SCAN_PROCESSES', '4')
+    assert scan_processes() == 4
+    monkeypatch.setenv('SCAN_PROCESSES', 'many')
+    assert scan_processes() == 1
+
+
+if __name__ == "__main__":
+    test_split_shards_covers_all_codes()
+    print("测试完成")
@@ -0,0 +1,278 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试smart_analyzer.py中的并发批量分析，使用本地模拟的对话补全服务
+"""
+
+import json
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from cancellation import CancellationToken, OperationCancelled
+from llm_cache import LLMCache, cache_key
+from smart_analyzer import SmartAnalyzer
+
+
+def analysis_reply(prompt):
+    """单只股票的提示词返回JSON对象，批量提示词返回无法解析的文本"""
+    if 'JSON数组' in prompt:
+        return '短期看涨'
+    return json.dumps({'short_term': '看涨', 'medium_term': '看涨', 'suggestion': '建议适量买入',
+                       'risk': '市场波动风险，注意止损'}, ensure_ascii=False)
+
+
+class MockLLM:
+    """本地对话补全服务：记录请求和最大并发数，可按顺序返回预设的错误状态"""
+
+    def __init__(self, delay=0.0, failures=(), reply=None):
+        self.delay = delay
+        self.reply = reply or analysis_reply
+        self.failures = list(failures)
+        self.lock = threading.Lock()
+        self.active = 0
+        self.max_active = 0
+        self.prompts = []
+        self.request_times = []
+        mock = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_POST(self):
+                body = json.loads(self.rfile.read(int(self.headers['Content-Length'])))
+                with mock.lock:
+                    mock.active += 1
+                    mock.max_active = max(mock.max_active, mock.active)
+                    mock.request_times.append(time.time())
+                    failure = mock.failures.pop(0) if mock.failures else None
+                try:
+                    if failure == 'slow':
+                        time.sleep(1.0)
+                        failure = None
+                    time.sleep(mock.delay)
+                    if failure is not None:
+                        self.send_response(failure)
+                        if failure == 429:
+                            self.send_header('Retry-After', '0.2')
+                        self.end_headers()
+                        return
+                    prompt = body['messages'][0]['content']
+                    with mock.lock:
+                        mock.prompts.append(prompt)
+                    payload = json.dumps({'choices': [{'message': {'content': mock.reply(prompt)}}]}).encode()
+                    self.send_response(200)
+                    self.send_header('Content-Type', 'application/json')
+                    self.send_header('Content-Length', str(len(payload)))
+                    self.end_headers()
+                    self.wfile.write(payload)
+                finally:
+                    with mock.lock:
+                        mock.active -= 1
+
+            def log_message(self, *args):
+                pass
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f"http://127.0.0.1:{self.server.server_address[1]}/v1/chat/completions"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def close(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+
+@pytest.fixture
+def mock_llm(monkeypatch, tmp_path):
+    # 默认的回复缓存在当前目录下创建
+    monkeypatch.chdir(tmp_path)
+    servers = []
+
+    def start(**kwargs):
+        server = MockLLM(**kwargs)
+        servers.append(server)
+        return server
+
+    yield start
+    for server in servers:
+        server.close()
+
+
+def stocks(count):
+    return [{'code': f'600{i:03d}', 'name': f'股票{i}', 'price': 10.0, 'indicators': {'ma_bullish': True}}
+            for i in range(count)]
+
+
+def test_batch_runs_concurrently_in_input_order(mock_llm):
+    server = mock_llm(delay=0.2)
+    analyzer = SmartAnalyzer(api_url=server.url, max_concurrency=4, batch_size=1)
+
+    started = time.time()
+    result = analyzer.analyze_stocks_batch(stocks(8))
+    elapsed = time.time() - started
+
+    assert [stock['code'] for stock in result] == [f'600{i:03d}' for i in range(8)]
+    assert all(stock['analysis']['suggestion'] == '建议适量买入' for stock in result)
+    assert len(server.prompts) == 8
+    # 8次请求、每次0.2秒、4个并发：约0.4秒，而不是逐个请求的1.6秒
+    assert server.max_active == 4
+    assert elapsed < 1.0
+
+
+def test_retries_with_backoff_and_retry_after(mock_llm):
+    server = mock_llm(failures=[429, 503])
+    analyzer = SmartAnalyzer(api_url=server.url, max_concurrency=1, backoff=0.05)
+
+    analysis = analyzer.analyze_stock(stocks(1)[0])
+    assert analysis['suggestion'] == '建议适量买入'
+    times = server.request_times
+    assert len(times) == 3
+    # 429按 Retry-After 等待，503按退避时间等待
+    assert times[1] - times[0] >= 0.2
+    assert times[2] - times[1] >= 0.1
+
+
+def test_timeout_gives_default_after_retries(mock_llm):
+    server = mock_llm(failures=['slow', 'slow'])
+    analyzer = SmartAnalyzer(api_url=server.url, timeout=0.3, max_retries=1, backoff=0.01)
+
+    analysis = analyzer.analyze_stock(stocks(1)[0])
+    assert analysis['suggestion'] == '建议观望'
+    assert len(server.request_times) == 2
+
+
+def test_rate_limit_spaces_requests(mock_llm):
+    server = mock_llm()
+    analyzer = SmartAnalyzer(api_url=server.url, max_concurrency=4, rate_limit=10, batch_size=1)
+    analyzer.analyze_stocks_batch(stocks(4))
+    times = sorted(server.request_times)
+    assert times[-1] - times[0] >= 0.25
+
+
+def test_cancel_batch(mock_llm):
+    server = mock_llm(delay=0.5)
+    analyzer = SmartAnalyzer(api_url=server.url, max_concurrency=2, batch_size=1)
+    token = CancellationToken()
+    threading.Timer(0.1, token.cancel).start()
+
+    started = time.time()
+    with pytest.raises(OperationCancelled):
+        analyzer.analyze_stocks_batch(stocks(10), token=token)
+    assert time.time() - started < 1.0
+    assert len(server.request_times) == 2
+
+
+def batch_reply(skip=()):
+    """按提示词中的股票代码生成JSON数组回复，跳过 skip 中的代码"""
+    def reply(prompt):
+        if 'JSON数组' not in prompt:
+            return analysis_reply(prompt)
+        codes = re.findall(r'股票代码：(\d+)', prompt)
+        items = [{'code': code, 'short_term': '看涨', 'medium_term': '震荡',
+                  'suggestion': f'关注{code}', 'risk': '注意止损'} for code in codes if code not in skip]
+        return '```json\n' + json.dumps(items, ensure_ascii=False) + '\n```'
+    return reply
+
+
+def test_single_reply_is_parsed(mock_llm):
+    replies = ['```json\n{"short_term": "震荡", "medium_term": "看跌", "suggestion": "减仓", "risk": "破位风险"}\n```',
+               '短期看涨，建议买入']
+    server = mock_llm(reply=lambda prompt: replies.pop(0))
+    analyzer = SmartAnalyzer(api_url=server.url)
+    stock = stocks(1)[0]
+
+    assert analyzer.analyze_stock(stock) == {'short_term': '震荡', 'medium_term': '看跌', 'suggestion': '减仓',
+                                             'risk': '破位风险'}
+    # 无法解析的回复返回默认结果，且不写入缓存
+    assert analyzer.analyze_stock(dict(stock, price=11.0))['suggestion'] == '建议观望'
+    assert len(analyzer.cache) == 1
+
+
+def test_batched_prompts_parse_json_array(mock_llm):
+    server = mock_llm(reply=batch_reply())
+    analyzer = SmartAnalyzer(api_url=server.url, batch_size=10, cache=False)
+
+    result = analyzer.analyze_stocks_batch(stocks(25))
+    assert [stock['code'] for stock in result] == [f'600{i:03d}' for i in range(25)]
+    assert all(stock['analysis'] == {'short_term': '看涨', 'medium_term': '震荡', 'suggestion': f"关注{stock['code']}",
+                                     'risk': '注意止损'} for stock in result)
+    # 25只股票只需要3次请求
+    assert len(server.prompts) == 3
+
+
+def test_batched_prompts_fall_back_per_stock(mock_llm):
+    # 回复缺少一只股票：只补请求这一只
+    server = mock_llm(reply=batch_reply(skip={'600002'}))
+    analyzer = SmartAnalyzer(api_url=server.url, batch_size=5, cache=False)
+    result = analyzer.analyze_stocks_batch(stocks(5))
+    assert [stock['analysis']['suggestion'] for stock in result] == \
+        ['关注600000', '关注600001', '建议适量买入', '关注600003', '关注600004']
+    assert len(server.prompts) == 2 and '股票代码：600002\n' in server.prompts[1]
+
+    # 回复不是JSON：每只股票逐只请求，且无法解析的回复不写入缓存
+    server = mock_llm()
+    analyzer = SmartAnalyzer(api_url=server.url, batch_size=5)
+    result = analyzer.analyze_stocks_batch(stocks(3))
+    assert [stock['analysis']['suggestion'] for stock in result] == ['建议适量买入'] * 3
+    assert len(server.prompts) == 4 and len(analyzer.cache) == 3
+
+
+def test_batched_results_are_cached_per_stock(mock_llm):
+    server = mock_llm(reply=batch_reply())
+    analyzer = SmartAnalyzer(api_url=server.url, batch_size=10)
+    analyzer.analyze_stocks_batch(stocks(12))
+    assert len(server.prompts) == 2
+
+    # 新股票插在最前面、一只股票价格变化：其他股票的位置都变了，仍然命中缓存，只请求这两只
+    candidates = [{'code': '000001', 'name': '新股票', 'price': 12.0, 'indicators': {}}] + stocks(12)
+    candidates[5]['price'] = 10.5
+    result = analyzer.analyze_stocks_batch(candidates)
+    assert len(server.prompts) == 3
+    assert server.prompts[-1].count('股票代码：') == 2
+    assert '股票代码：000001' in server.prompts[-1] and '股票代码：600004' in server.prompts[-1]
+    assert [stock['analysis']['suggestion'] for stock in result] == [f"关注{stock['code']}" for stock in candidates]
+
+
+def test_unchanged_inputs_are_answered_from_cache(mock_llm, tmp_path):
+    server = mock_llm(delay=0.2)
+    cache_path = str(tmp_path / 'llm_cache.db')
+    analyzer = SmartAnalyzer(api_url=server.url, cache=LLMCache(cache_path))
+    stock = stocks(1)[0]
+
+    analyzer.analyze_stock(stock)
+    started = time.time()
+    assert analyzer.analyze_stock(dict(stock))['suggestion'] == '建议适量买入'
+    assert time.time() - started < 0.1
+    assert len(server.request_times) == 1
+
+    # 缓存保存在文件中，服务重启后仍然命中
+    restarted = SmartAnalyzer(api_url=server.url, cache=LLMCache(cache_path))
+    restarted.analyze_stock(dict(stock))
+    assert len(server.request_times) == 1 and restarted.cache.hits == 1
+
+    # 价格变化后提示词不同，重新请求
+    analyzer.analyze_stock(dict(stock, price=10.5))
+    assert len(server.request_times) == 2
+
+
+def test_cache_key_ttl_and_size(tmp_path):
+    request = {'model': 'deepseek-chat', 'temperature': 0.7, 'messages': [{'role': 'user', 'content': '代码：600036\n价格：40'}]}
+    spaced = dict(request, messages=[{'role': 'user', 'content': '  代码：600036  \n\n价格：40\n'}])
+    assert cache_key(request) == cache_key(spaced)
+    assert cache_key(request) != cache_key(dict(request, temperature=0.2))
+
+    cache = LLMCache(str(tmp_path / 'llm_cache.db'), ttl=0.2, max_entries=2)
+    cache.set('a', '回复a')
+    cache.set('b', '回复b')
+    assert cache.get('a') == '回复a'
+    # 超出容量时淘汰最久未使用的b
+    cache.set('c', '回复c')
+    assert len(cache) == 2 and cache.get('b') is None and cache.get('a') == '回复a'
+
+    time.sleep(0.25)
+    assert cache.get('c') is None
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, '-q'])
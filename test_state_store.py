@@ -0,0 +1,377 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试state_store.py中的共享状态存储
+"""
+
+import multiprocessing
+import os
+import threading
+import time
+
+import pytest
+
+from cancellation import CancellationToken
+from event_stream import EventPublisher
+from job_manager import JobManager, JOB_CANCELLED, JOB_COMPLETED
+from state_store import (CancelSignals, LeaderTask, Lease, MemoryStore, RedisStore, SQLiteStore, StateStore, StoreLog,
+                         WorkerRegistry, create_store)
+
+# 和 gunicorn 的worker一样从干净的进程启动：fork 会复制父进程已打开的SQLite连接状态，子进程之间的文件锁失效
+workers = multiprocessing.get_context('spawn')
+
+
+class FakePipeline:
+    """MULTI/EXEC 事务：命令先排队，execute 时在锁内一起执行"""
+
+    def __init__(self, client):
+        self.client = client
+        self.commands = []
+
+    def __getattr__(self, name):
+        def queue(*args, **kwargs):
+            self.commands.append((getattr(self.client, name), args, kwargs))
+            return self
+        return queue
+
+    def execute(self):
+        with self.client.lock:
+            return [command(*args, **kwargs) for command, args, kwargs in self.commands]
+
+
+class FakeRedis:
+    """只实现 RedisStore 用到的命令，代替真实的Redis服务"""
+
+    def __init__(self):
+        self.lock = threading.RLock()
+        self.data = {}
+
+    def pipeline(self, transaction=True):
+        return FakePipeline(self)
+
+    def get(self, key):
+        with self.lock:
+            return self.data.get(key)
+
+    def set(self, key, value, nx=False, px=None):
+        with self.lock:
+            if nx and key in self.data:
+                return None
+            self.data[key] = value
+            return True
+
+    def delete(self, key):
+        with self.lock:
+            self.data.pop(key, None)
+
+    def incrby(self, key, amount):
+        with self.lock:
+            self.data[key] = str(int(self.data.get(key, 0)) + amount)
+            return int(self.data[key])
+
+    def rpush(self, key, *values):
+        with self.lock:
+            self.data.setdefault(key, []).extend(values)
+            # 命令之间让出执行权，暴露非事务写入的中间状态
+            time.sleep(0)
+
+    def ltrim(self, key, start, end):
+        with self.lock:
+            items = self.data.get(key, [])
+            self.data[key] = items[start:] if end == -1 else items[start:end + 1]
+
+    def lrange(self, key, start, end):
+        with self.lock:
+            return list(self.data.get(key, []))
+
+
+@pytest.fixture(params=['memory', 'sqlite', 'redis'])
+def store(request, tmp_path):
+    if request.param == 'memory':
+        return MemoryStore()
+    if request.param == 'sqlite':
+        return SQLiteStore(str(tmp_path / 'state.db'))
+    return RedisStore(client=FakeRedis())
+
+
+def test_incomplete_backend_fails_on_creation():
+    class KeyValueOnly(StateStore):
+        def get(self, key, default=None):
+            return default
+
+        def set(self, key, value):
+            pass
+
+    with pytest.raises(TypeError):
+        KeyValueOnly()
+
+
+def test_values_and_atomic_update(store):
+    assert store.get('history', []) == []
+    store.set('history', [{'code': '600036'}])
+    assert store.get('history') == [{'code': '600036'}]
+
+    def add_one(counter):
+        return counter + 1
+
+    threads = [threading.Thread(target=lambda: [store.update('count', add_one, 0) for _ in range(20)])
+               for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert store.get('count') == 80
+
+    store.delete('history')
+    assert store.get('history') is None
+
+
+def test_log_matches_ring_buffer(store):
+    log = StoreLog(store, 'console', capacity=3)
+    assert log.since(0) == ([], 0, False)
+    for i in range(10):
+        assert log.append(f"line{i}\n") == i + 1
+
+    assert log.since(8) == (['line8\n', 'line9\n'], 10, False)
+    assert log.since(0) == (['line7\n', 'line8\n', 'line9\n'], 10, True)
+    assert log.since(50) == (['line7\n', 'line8\n', 'line9\n'], 10, True)
+    assert len(log) == 3
+
+
+def test_extend_matches_append(store):
+    log = StoreLog(store, 'console', capacity=3)
+    assert log.extend([]) == []
+    assert log.extend([f"line{i}\n" for i in range(4)]) == [1, 2, 3, 4]
+    assert log.append('line4\n') == 5
+    assert log.since(2) == (['line2\n', 'line3\n', 'line4\n'], 5, False)
+    assert log.since(0) == (['line2\n', 'line3\n', 'line4\n'], 5, True)
+
+
+def test_concurrent_readers_never_skip_records(store):
+    log = StoreLog(store, 'events', capacity=10000)
+
+    def write(worker):
+        for i in range(100):
+            log.append(f"{worker}-{i}")
+
+    writers = [threading.Thread(target=write, args=(worker,)) for worker in range(4)]
+    for thread in writers:
+        thread.start()
+    received, cursor = [], 0
+    while any(thread.is_alive() for thread in writers) or cursor < log.last_seq:
+        items, cursor, reset = log.since(cursor)
+        assert not reset
+        received.extend(items)
+    for thread in writers:
+        thread.join()
+    assert sorted(received) == sorted(f"{worker}-{i}" for worker in range(4) for i in range(100))
+
+
+def _append_lines(path, worker):
+    log = StoreLog(SQLiteStore(path), 'console', capacity=1000)
+    store = log.store
+    for i in range(25):
+        log.append(f"{worker}-{i}")
+        store.update('count', lambda count: count + 1, 0)
+
+
+def test_sqlite_shared_between_processes(tmp_path):
+    path = str(tmp_path / 'state.db')
+    SQLiteStore(path)
+    processes = [workers.Process(target=_append_lines, args=(path, worker)) for worker in range(3)]
+    for process in processes:
+        process.start()
+    for process in processes:
+        process.join(timeout=30)
+        assert process.exitcode == 0
+
+    store = SQLiteStore(path)
+    items, cursor, reset = StoreLog(store, 'console', capacity=1000).since(0)
+    assert cursor == 75 and not reset
+    assert sorted(items) == sorted(f"{worker}-{i}" for worker in range(3) for i in range(25))
+    assert store.get('count') == 75
+
+
+def test_publisher_sees_events_from_other_worker(tmp_path):
+    path = str(tmp_path / 'state.db')
+    reader = EventPublisher(buffer=StoreLog(SQLiteStore(path), 'events'), heartbeat=2, poll_interval=0.05)
+    writer = EventPublisher(buffer=StoreLog(SQLiteStore(path), 'events'))
+
+    stream = reader.stream()
+    assert next(stream) == "retry: 1000\n\n"
+    threading.Timer(0.1, lambda: writer.publish('log', {'line': '开始刷新\n'})).start()
+    message = next(stream)
+    assert message.startswith('id: 1\nevent: log\n')
+
+
+def test_one_poller_wakes_all_connections(tmp_path):
+    path = str(tmp_path / 'state.db')
+    reader = EventPublisher(buffer=StoreLog(SQLiteStore(path), 'events'), heartbeat=5, poll_interval=0.05)
+    writer = EventPublisher(buffer=StoreLog(SQLiteStore(path), 'events'))
+    received = []
+    connected = []
+    pollers = sum(thread.name == 'event-poller' for thread in threading.enumerate())
+
+    def client():
+        stream = reader.stream()
+        # 第一条消息发出前连接已读取游标，之后发布的事件都会收到
+        next(stream)
+        connected.append(True)
+        received.append(next(stream))
+        stream.close()
+
+    threads = [threading.Thread(target=client) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    deadline = time.time() + 2
+    while len(connected) < 4 and time.time() < deadline:
+        time.sleep(0.01)
+    poller = reader.poller
+    assert poller is not None
+    assert sum(thread.name == 'event-poller' for thread in threading.enumerate()) == pollers + 1
+
+    writer.publish_many([('log', {'line': '开始刷新\n'}), ('log', {'line': '刷新完成\n'})])
+    for thread in threads:
+        thread.join(timeout=3)
+    assert len(received) == 4 and all(message.startswith('id: 1\nevent: log\n') for message in received)
+    # 所有连接关闭后轮询线程退出
+    poller.join(timeout=2)
+    assert not poller.is_alive() and reader.poller is None
+
+
+def test_lease_has_one_holder(store):
+    first = Lease(store, 'scanner', ttl=0.2)
+    second = Lease(store, 'scanner', ttl=0.2)
+    assert first.acquire() and first.acquire()
+    assert not second.acquire()
+    assert second.holder() == first.owner
+    # 过期后由其他持有者获得，原持有者的释放不再生效
+    time.sleep(0.25)
+    assert second.acquire()
+    first.release()
+    assert second.holder() == second.owner
+    second.release()
+    assert first.holder() is None
+
+
+def _leader_worker(path, start):
+    store = SQLiteStore(path)
+    task = LeaderTask(store, 'continuous_scanner', lambda: True,
+                      lambda: StoreLog(store, 'leaders').append(os.getpid()), lambda: None)
+    start.wait(5)
+    for _ in range(5):
+        task.check()
+        time.sleep(0.05)
+
+
+def test_leader_task_runs_in_one_process(tmp_path):
+    path = str(tmp_path / 'state.db')
+    SQLiteStore(path)
+    start = workers.Event()
+    processes = [workers.Process(target=_leader_worker, args=(path, start)) for _ in range(2)]
+    for process in processes:
+        process.start()
+    start.set()
+    for process in processes:
+        process.join(timeout=10)
+        assert process.exitcode == 0
+    leaders, _, _ = StoreLog(SQLiteStore(path), 'leaders').since(0)
+    assert len(leaders) == 1
+
+
+def test_leader_task_fails_over_and_stops():
+    store = MemoryStore()
+    wanted = {'value': True}
+    events = []
+
+    def task(name):
+        return LeaderTask(store, 'auto_refresh', lambda: wanted['value'],
+                          lambda: events.append(('start', name)), lambda: events.append(('stop', name)), ttl=0.2)
+
+    first, second = task('first'), task('second')
+    first.check()
+    second.check()
+    assert events == [('start', 'first')]
+    # first 不再续约（进程退出），租约过期后 second 接管
+    time.sleep(0.25)
+    second.check()
+    assert events[-1] == ('start', 'second')
+    # first 恢复后发现租约已被接管，停止本进程中的任务
+    first.check()
+    assert events[-1] == ('stop', 'first')
+
+    wanted['value'] = False
+    second.check()
+    assert events[-1] == ('stop', 'second') and second.lease.holder() is None
+
+
+def test_worker_registry_reports_dead_workers():
+    store = MemoryStore()
+    store.set('workers', {'crashed': time.time() - 1})
+    dead = []
+    registry = WorkerRegistry(store, ttl=30)
+    registry.on_dead = dead.extend
+    assert registry.join()
+    assert dead == ['crashed'] and registry.alive() == [registry.id]
+    # 已有存活的worker时，新登记的worker不是第一个
+    assert not WorkerRegistry(store, ttl=30).join()
+
+
+def test_job_visible_and_cancellable_across_workers(tmp_path):
+    path = str(tmp_path / 'state.db')
+    store_a, store_b = SQLiteStore(path), SQLiteStore(path)
+    worker_a = JobManager(max_workers=1, store=store_a, signals=CancelSignals(store_a, interval=0.05))
+    worker_b = JobManager(max_workers=1, store=store_b, signals=CancelSignals(store_b, interval=0.05))
+    started = threading.Event()
+
+    def slow(job):
+        job.update(50, '执行中')
+        started.set()
+        job.token.wait(5)
+        job.check_cancelled()
+        return 'done'
+
+    job = worker_a.submit('slow', slow)
+    assert started.wait(2)
+    record = worker_b.get_record(job.id)
+    assert record['progress'] == 50 and record['message'] == '执行中'
+    assert [r['job_id'] for r in worker_b.list_records('slow')] == [job.id]
+
+    worker_b.cancel_record(job.id)
+    job.future.result(timeout=2)
+    assert job.status == JOB_CANCELLED
+    assert worker_b.get_record(job.id)['status'] == JOB_CANCELLED
+
+    quick = worker_a.submit('quick', lambda job: {'count': 1})
+    quick.future.result(timeout=2)
+    record = worker_b.get_record(quick.id)
+    assert record['status'] == JOB_COMPLETED and record['result'] == {'count': 1}
+    worker_a.shutdown()
+    worker_b.shutdown()
+
+
+def test_cancel_signal_ignores_earlier_requests():
+    store = MemoryStore()
+    signals = CancelSignals(store)
+    signals.request('manual_refresh')
+    time.sleep(0.01)
+
+    token = CancellationToken()
+    signals.register('manual_refresh', token)
+    signals.check()
+    assert not token.cancelled
+
+    store.set('cancel:manual_refresh', time.time())
+    signals.check()
+    assert token.cancelled
+
+
+def test_create_store(tmp_path):
+    assert isinstance(create_store('memory://'), MemoryStore)
+    assert isinstance(create_store(f"sqlite:///{tmp_path / 'state.db'}"), SQLiteStore)
+    with pytest.raises(ValueError):
+        create_store('ftp://localhost')
+
+
+if __name__ == "__main__":
+    pytest.main([__file__, '-q'])
@@ -0,0 +1,97 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试stock_filter.py中"平替"策略的全市场向量化筛选（离线数据）
+"""
+
+import numpy as np
+import pandas as pd
+
+from stock_filter import StockFilter, compute_substitute_flags
+
+
+def make_market_data(n, seed=0):
+    """
+    生成模拟的腾讯财经行情DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    change = rng.uniform(-10, 10, n).round(2)
+    return pd.DataFrame({
+        '代码': [f"{600000 + i:06d}" for i in range(n)],
+        '名称': [f"股票{i}" for i in range(n)],
+        '最新价': rng.uniform(2, 60, n).round(2),
+        '涨跌幅': change,
+        '成交量': rng.integers(1000, 1000000, n),
+        '量比': rng.uniform(0, 4, n).round(2),
+        '委比': rng.uniform(-100, 100, n).round(2),
+        '换手率': rng.uniform(0, 15, n).round(2),
+        '板块涨幅': (change * 0.8).round(2)
+    })
+
+
+def reference_filter(market_data):
+    """
+    逐行实现的"平替"规则，作为向量化实现的对照
+    """
+    codes = []
+    for _, row in market_data.iterrows():
+        price = row['最新价']
+        change = row['涨跌幅']
+        if price < 10 or change < -8:
+            continue
+        if (row['量比'] > 1.8 and row['委比'] > 30 and 3 <= row['换手率'] <= 10
+                and change > row['板块涨幅']):
+            codes.append(row['代码'])
+    return codes
+
+
+def make_filter():
+    stock_filter = StockFilter.__new__(StockFilter)
+    stock_filter.fetcher = None
+    return stock_filter
+
+
+def test_filter_stocks_matches_row_rules():
+    market_data = make_market_data(5000)
+    result = make_filter().filter_stocks(market_data)
+    assert [stock['code'] for stock in result] == reference_filter(market_data)
+
+
+def test_filter_stocks_has_no_cap():
+    market_data = make_market_data(400)
+    market_data['最新价'] = 20.0
+    market_data['涨跌幅'] = 3.0
+    market_data['板块涨幅'] = 2.4
+    market_data['量比'] = 2.0
+    market_data['委比'] = 50.0
+    market_data['换手率'] = 5.0
+
+    result = make_filter().filter_stocks(market_data)
+    assert len(result) == 400
+
+
+def test_filter_stocks_exposes_indicator_flags():
+    market_data = make_market_data(2000, seed=1)
+    result = make_filter().filter_stocks(market_data)
+    assert result
+    for stock in result:
+        assert set(stock['indicators']) == {
+            'volume_ratio_qualified', 'order_ratio_qualified',
+            'turnover_rate_qualified', 'sector_qualified', 'short_term_qualified'
+        }
+        assert all(value is True for value in stock['indicators'].values())
+
+
+def test_compute_substitute_flags_handles_missing_columns():
+    market_data = pd.DataFrame({'代码': ['600000'], '名称': ['浦发银行'], '最新价': ['12.5'], '涨跌幅': [None]})
+    flags = compute_substitute_flags(market_data)
+    assert not flags['selected'].iloc[0]
+    assert flags['volume_ratio'].iloc[0] == 1.0
+
+
+if __name__ == "__main__":
+    test_filter_stocks_matches_row_rules()
+    test_filter_stocks_has_no_cap()
+    test_filter_stocks_exposes_indicator_flags()
+    test_compute_substitute_flags_handles_missing_columns()
+    print("测试完成")
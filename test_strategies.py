@@ -0,0 +1,211 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试strategies.py中的多策略执行器（离线数据）
+"""
+
+import numpy as np
+import pandas as pd
+
+import data_fetcher
+from stock_filter import filter_substitute_stocks
+from stock_selector import StockSelector, records_from_snapshot
+from strategies import MultiStrategyRunner, STRATEGIES, build_indicator_panel, screen_chen_xiaoqun
+
+
+def make_market_data(market, n, seed):
+    """
+    生成模拟的腾讯财经行情DataFrame
+    """
+    rng = np.random.default_rng(seed)
+    price = rng.uniform(5, 60, n).round(2)
+    change = rng.uniform(-10, 10, n).round(2)
+    prefix = {'sh': 600000, 'sz': 1, 'cyb': 300000, 'kcb': 688000}[market]
+    return pd.DataFrame({
+        '代码': [f"{prefix + i:06d}" for i in range(n)],
+        '名称': [f"{market}股票{i}" for i in range(n)],
+        '最新价': price,
+        '开盘价': (price * rng.uniform(0.95, 1.05, n)).round(2),
+        '最高价': (price * rng.uniform(1.0, 1.05, n)).round(2),
+        '最低价': (price * rng.uniform(0.95, 1.0, n)).round(2),
+        '今开': (price * rng.uniform(0.95, 1.05, n)).round(2),
+        '昨收': (price / (1 + change / 100)).round(2),
+        '涨跌幅': change,
+        '成交量': rng.integers(1000, 1000000, n),
+        '成交额': rng.uniform(1e6, 1e9, n),
+        '量比': rng.uniform(0, 4, n).round(2),
+        '委比': rng.uniform(-100, 100, n).round(2),
+        '换手率': rng.uniform(0, 15, n).round(2),
+        '总市值': rng.uniform(10, 500, n).round(0),
+        '板块涨幅': (change * 0.8).round(2)
+    })
+
+
+class FakeFetcher:
+    def __init__(self):
+        self.calls = []
+        self.data = {market: make_market_data(market, 800, seed)
+                     for seed, market in enumerate(['sh', 'sz', 'cyb', 'kcb'])}
+
+    def get_stock_data(self, market, token=None):
+        self.calls.append(market)
+        return self.data[market]
+
+
+class FakeSelector:
+    def __init__(self):
+        self.records = None
+
+    def select_from_records(self, records, token=None):
+        self.records = records
+        return [{'code': record['code']} for record in records if record['is_yin_line']][:5]
+
+
+def reference_chen(panel):
+    """
+    逐行实现的陈小群策略，返回(通过的代码, 各阶段淘汰数)
+    """
+    codes = []
+    rejected = dict.fromkeys(['pattern1', 'pattern2', 'change', 'volume_ratio', 'turnover', 'market_cap'], 0)
+    for _, stock in panel.iterrows():
+        price = float(stock['最新价'])
+        open_price = float(stock['开盘价'])
+        if float(stock['最高价']) > open_price and price < open_price:
+            rejected['pattern1'] += 1
+            continue
+        if float(stock['最低价']) < open_price and price < open_price:
+            rejected['pattern2'] += 1
+            continue
+        if not 3 <= float(stock['涨跌幅']) <= 5:
+            rejected['change'] += 1
+            continue
+        if float(stock['量比']) < 1:
+            rejected['volume_ratio'] += 1
+            continue
+        if not 5 <= float(stock['换手率']) <= 10:
+            rejected['turnover'] += 1
+            continue
+        if not 30 <= float(stock['总市值']) <= 300:
+            rejected['market_cap'] += 1
+            continue
+        codes.append(stock['代码'])
+    return codes, rejected
+
+
+def test_runner_fetches_each_market_once():
+    fetcher = FakeFetcher()
+    selector = FakeSelector()
+    runner = MultiStrategyRunner(fetcher=fetcher, selector=selector)
+
+    results = runner.run()
+
+    assert sorted(fetcher.calls) == ['cyb', 'kcb', 'sh', 'sz']
+    assert set(results) == set(STRATEGIES)
+    # "买阴不买阳"只使用沪深和创业板的快照
+    assert {record['code'][:3] for record in selector.records} <= {'600', '000', '300'}
+
+
+def test_runner_results_match_single_strategies():
+    fetcher = FakeFetcher()
+    runner = MultiStrategyRunner(fetcher=fetcher, selector=FakeSelector())
+
+    results = runner.run(['substitute', 'chen'])
+
+    panel = build_indicator_panel(fetcher.data)
+    assert [s['code'] for s in results['substitute']] == [s['code'] for s in filter_substitute_stocks(panel)]
+    chen_panel = panel[panel['市场'].isin(['sh', 'sz', 'cyb'])]
+    assert sorted(s['code'] for s in results['chen']) == sorted(reference_chen(chen_panel)[0])
+
+
+def test_chen_stage_counts_match_row_loop():
+    panel = build_indicator_panel(FakeFetcher().data)
+    stocks, stats = screen_chen_xiaoqun(panel)
+    codes, rejected = reference_chen(panel)
+
+    assert sorted(stock['code'] for stock in stocks) == sorted(codes)
+    assert [stock['score'] for stock in stocks] == sorted((stock['score'] for stock in stocks), reverse=True)
+    assert all(stock['priority'] == int(round(stock['score'])) for stock in stocks)
+    assert len({stock['priority'] for stock in stocks}) > 1
+    assert stats['rejected'] == rejected
+    assert stats['total'] == len(panel)
+    assert stats['passed'] == len(codes)
+
+
+def test_chen_tolerates_missing_columns():
+    panel = build_indicator_panel(FakeFetcher().data)
+    stocks, _ = screen_chen_xiaoqun(panel)
+    # 没有开盘价、总市值、委比和名称列的数据源：开盘价按现价处理，其余按0/空值处理，不抛出KeyError
+    partial = panel.drop(columns=['开盘价', '最高价', '最低价', '委比', '名称'])
+    partial_stocks, partial_stats = screen_chen_xiaoqun(partial)
+    assert partial_stats['rejected']['pattern1'] == partial_stats['rejected']['pattern2'] == 0
+    assert all(stock['order_ratio'] == 0 and stock['name'] == '' for stock in partial_stocks)
+    assert len(partial_stocks) >= len(stocks)
+
+    _, stats = screen_chen_xiaoqun(panel.drop(columns=['总市值']))
+    assert stats['passed'] == 0 and stats['rejected']['market_cap'] > 0
+
+
+def tencent_line(code='600036'):
+    """一条完整的腾讯财经行情：开盘35.8、最高36.1、最低34.9、成交量50万手、成交额17.5亿（万元），
+    五档委买3000手、委卖1000手（委比50%）"""
+    fields = ['0'] * 50
+    fields[1] = '招商银行'
+    fields[2] = code
+    fields[3] = '35.0'
+    fields[4] = '35.5'
+    fields[5] = '35.8'
+    fields[6] = '500000'
+    fields[8] = '300000'
+    fields[9] = '34.99'
+    for index, volume in zip((10, 12, 14, 16, 18), ('1200', '800', '500', '300', '200')):
+        fields[index] = volume
+    for index, volume in zip((20, 22, 24, 26, 28), ('400', '300', '200', '100', '0')):
+        fields[index] = volume
+    fields[32] = '-1.41'
+    fields[33] = '36.1'
+    fields[34] = '34.9'
+    fields[35] = '35.0/500000/175000'
+    fields[37] = '175000'
+    fields[38] = '0.25'
+    fields[44] = '8800'
+    fields[49] = ''
+    return f'v_sh{code}="{"~".join(fields)}";'
+
+
+def test_snapshot_and_realtime_parse_quote_identically(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+
+    class Response:
+        status_code = 200
+        text = tencent_line()
+        encoding = None
+
+    monkeypatch.setattr(data_fetcher.requests, 'get', lambda url, timeout=10: Response())
+    snapshot = data_fetcher.DataFetcher().get_stock_data_from_tencent('sh', stock_codes=['600036'])
+
+    from_snapshot = records_from_snapshot(snapshot)
+    realtime = StockSelector()._parse_realtime_response(tencent_line())
+    assert from_snapshot == realtime
+    record = realtime[0]
+    assert (record['open'], record['high'], record['low']) == (35.8, 36.1, 34.9)
+    assert (record['volume'], record['amount'], record['volume_ratio']) == (500000, 175000, 0.0)
+    # 委比来自五档盘口，而不是字段35里的最新价
+    assert record['order_ratio'] == 50.0
+    assert snapshot['开盘价'][0] == 35.8 and snapshot['昨收'][0] == 35.5
+
+
+def test_runner_rejects_unknown_strategy():
+    runner = MultiStrategyRunner(fetcher=FakeFetcher(), selector=FakeSelector())
+    try:
+        runner.run(['unknown'])
+    except ValueError:
+        return
+    assert False, "未注册的策略应抛出ValueError"
+
+
+if __name__ == "__main__":
+    test_runner_fetches_each_market_once()
+    test_runner_results_match_single_strategies()
+    test_chen_stage_counts_match_row_loop()
+    test_runner_rejects_unknown_strategy()
+    print("测试完成")
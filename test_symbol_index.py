@@ -0,0 +1,53 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试symbol_index.py中的代码索引，以及只请求指定股票的行情获取（离线数据）
+"""
+
+import pandas as pd
+
+from data_fetcher import DataFetcher, market_of
+from symbol_index import SymbolIndex
+from test_scheduler import install_fake_quotes
+
+
+def test_index_updates_from_snapshots():
+    index = SymbolIndex()
+    index.update_frame(pd.DataFrame({
+        '代码': ['600036', '300750'], '名称': ['招商银行', '宁德时代'],
+        '最新价': [40.0, 200.0], '量比': [1.5, 0.8], '换手率': [0.6, 1.2]
+    }))
+    assert len(index) == 2 and '600036' in index
+    assert index.name('300750') == '宁德时代' and index.price('600036') == 40.0
+
+    entry = index.lookup('600036')
+    assert entry['market'] == 'sh' and entry['row']['量比'] == 1.5
+
+    # 单只股票接口的行情列较少，更新价格的同时保留快照中的其他列
+    index.update_row({'代码': '600036', '名称': '招商银行', '最新价': 41.0, '涨跌幅': 2.5})
+    entry = index.lookup('600036')
+    assert entry['row']['最新价'] == 41.0 and entry['row']['量比'] == 1.5
+
+    assert index.lookup('000001') is None and index.name('000001') is None and index.price('000001') == 0
+
+
+def test_get_stocks_data_requests_only_given_codes(monkeypatch, tmp_path):
+    monkeypatch.chdir(tmp_path)
+    urls = install_fake_quotes(monkeypatch)
+    fetcher = DataFetcher()
+    index = SymbolIndex()
+    fetcher.on_snapshot = index.update_frame
+
+    data = fetcher.get_stocks_data(['600036', '300750', '688001'])
+    assert sorted(data['代码']) == ['300750', '600036']
+    # 每个市场一次请求，不下载候选代码段
+    assert sorted(url.split('q=', 1)[1] for url in urls) == ['sh600036', 'sh688001', 'sz300750']
+    assert index.name('600036') == '股票600036' and index.price('300750') == 10.5
+
+    assert [market_of(code) for code in ['600036', '688001', '300750', '301001', '000001', '900901']] == \
+        ['sh', 'kcb', 'cyb', 'cyb', 'sz', None]
+
+
+if __name__ == "__main__":
+    test_index_updates_from_snapshots()
+    print("测试完成")
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+测试trading_calendar.py中的交易时段判断和轮询间隔
+"""
+
+import json
+import logging
+from datetime import date, datetime
+
+from trading_calendar import (BEIJING_TZ, SESSION_CALL_AUCTION, SESSION_CLOSED, SESSION_CONTINUOUS,
+                              SESSION_HOLIDAY, SESSION_LUNCH_BREAK, SESSION_PRE_OPEN, TradingCalendar)
+
+
+def at(day, hour, minute=0):
+    return datetime(2026, 10, day, hour, minute, tzinfo=BEIJING_TZ)
+
+
+def test_sessions_of_a_trading_day():
+    calendar = TradingCalendar(holidays_file=None)
+    # 2026-10-19 是周一
+    assert calendar.session(at(19, 8)) == SESSION_PRE_OPEN
+    assert calendar.session(at(19, 9, 20)) == SESSION_CALL_AUCTION
+    assert calendar.session(at(19, 10)) == SESSION_CONTINUOUS
+    assert calendar.session(at(19, 12)) == SESSION_LUNCH_BREAK
+    assert calendar.session(at(19, 14, 59)) == SESSION_CONTINUOUS
+    assert calendar.session(at(19, 15)) == SESSION_CLOSED
+    assert calendar.session(at(18, 10)) == SESSION_HOLIDAY
+    # 国庆休市
+    assert calendar.session(at(7, 10)) == SESSION_HOLIDAY
+
+
+def test_poll_delay_sleeps_until_next_session():
+    calendar = TradingCalendar(holidays_file=None)
+    assert calendar.poll_delay(300, at(19, 10)) == 300
+    # 午间休市等到13:00
+    assert calendar.poll_delay(300, at(19, 11, 40)) == 80 * 60
+    # 开盘前等到集合竞价
+    assert calendar.seconds_until_active(at(19, 9)) == 15 * 60
+    # 周五收盘后等到下周一9:15
+    assert calendar.next_active(at(16, 15, 30)) == datetime(2026, 10, 19, 9, 15, tzinfo=BEIJING_TZ)
+    # 国庆长假之前的最后一个交易日收盘后等到10月8日
+    assert calendar.next_active(datetime(2026, 9, 30, 16, tzinfo=BEIJING_TZ)).date() == date(2026, 10, 8)
+
+
+def test_last_close_skips_weekends_and_holidays():
+    calendar = TradingCalendar(holidays_file=None)
+    assert calendar.last_close(at(19, 15, 30)) == at(19, 15)
+    # 盘中和周末都回到上一个交易日的收盘
+    assert calendar.last_close(at(19, 14, 30)) == at(16, 15)
+    assert calendar.last_close(at(18, 10)) == at(16, 15)
+    # 国庆长假期间回到9月30日
+    assert calendar.last_close(at(8, 9)) == datetime(2026, 9, 30, 15, tzinfo=BEIJING_TZ)
+
+
+def test_extra_holidays_file(tmp_path):
+    holidays_file = tmp_path / 'trading_holidays.json'
+    holidays_file.write_text(json.dumps(['2026-10-19']), encoding='utf-8')
+    calendar = TradingCalendar(holidays_file=str(holidays_file))
+    assert not calendar.is_trading_day(date(2026, 10, 19))
+    assert calendar.is_trading_day(date(2026, 10, 20))
+    assert not calendar.is_trading_day(date(2026, 10, 1))
+
+
+
+def test_warns_once_for_year_without_holidays(tmp_path, caplog):
+    calendar = TradingCalendar(holidays_file=str(tmp_path / 'trading_holidays.json'))
+    with caplog.at_level(logging.WARNING, logger='trading_calendar'):
+        assert calendar.is_trading_day(date(2026, 10, 19))
+        assert not caplog.records
+        # 2027年没有休市日数据：元旦被当作交易日，并提示补充休市日文件
+        assert calendar.is_trading_day(date(2027, 1, 1))
+        calendar.is_trading_day(date(2027, 1, 4))
+    assert len(caplog.records) == 1 and 'trading_holidays.json' in caplog.records[0].getMessage()
+
+    (tmp_path / 'trading_holidays.json').write_text(json.dumps(['2027-01-01']), encoding='utf-8')
+    assert not TradingCalendar(holidays_file=str(tmp_path / 'trading_holidays.json')).is_trading_day(date(2027, 1, 1))
+
+
+if __name__ == "__main__":
+    test_sessions_of_a_trading_day()
+    test_poll_delay_sleeps_until_next_session()
+    test_last_close_skips_weekends_and_holidays()
+    print("测试完成")
@@ -0,0 +1,148 @@
+import json
+import logging
+import os
+from datetime import date, datetime, time, timedelta, timezone
+from typing import Iterable, Optional, Set
+
+logger = logging.getLogger(__name__)
+
+# 设置时区为北京时间（东八区）
+BEIJING_TZ = timezone(timedelta(hours=8))
+
+# 交易时段
+SESSION_HOLIDAY = 'holiday'            # 周末或节假日休市
+SESSION_PRE_OPEN = 'pre_open'          # 交易日 9:15 之前
+SESSION_CALL_AUCTION = 'call_auction'  # 开盘集合竞价 9:15 - 9:30
+SESSION_CONTINUOUS = 'continuous'      # 连续竞价 9:30 - 11:30、13:00 - 15:00
+SESSION_LUNCH_BREAK = 'lunch_break'    # 午间休市 11:30 - 13:00
+SESSION_CLOSED = 'closed'              # 交易日 15:00 之后
+
+# 行情会变化的时段
+ACTIVE_SESSIONS = (SESSION_CALL_AUCTION, SESSION_CONTINUOUS)
+
+CALL_AUCTION_START = time(9, 15)
+MORNING_OPEN = time(9, 30)
+MORNING_CLOSE = time(11, 30)
+AFTERNOON_OPEN = time(13, 0)
+MARKET_CLOSE = time(15, 0)
+
+# 沪深交易所休市日（不含周末），每年年底按交易所公告补充下一年，
+# 也可以写入 data_cache/trading_holidays.json（日期字符串列表）而不修改代码
+EXCHANGE_HOLIDAYS = {
+    # 2025
+    '2025-01-01', '2025-01-28', '2025-01-29', '2025-01-30', '2025-01-31', '2025-02-03', '2025-02-04',
+    '2025-04-04', '2025-05-01', '2025-05-02', '2025-05-05', '2025-06-02',
+    '2025-10-01', '2025-10-02', '2025-10-03', '2025-10-06', '2025-10-07', '2025-10-08',
+    # 2026
+    '2026-01-01', '2026-01-02', '2026-02-16', '2026-02-17', '2026-02-18', '2026-02-19', '2026-02-20',
+    '2026-02-23', '2026-04-06', '2026-05-01', '2026-05-04', '2026-05-05', '2026-06-19', '2026-09-25',
+    '2026-10-01', '2026-10-02', '2026-10-05', '2026-10-06', '2026-10-07',
+}
+
+
+class TradingCalendar:
+    def __init__(self, holidays: Optional[Iterable[str]] = None,
+                 holidays_file: Optional[str] = os.path.join('data_cache', 'trading_holidays.json')):
+        """
+        沪深交易日历：判断当前交易时段，计算距离下一个交易时段的时间，供轮询任务调整频率
+        :param holidays: 休市日列表（YYYY-MM-DD），默认使用内置的交易所休市日
+        :param holidays_file: 额外休市日文件，存在时与内置休市日合并
+        """
+        self.holidays: Set[date] = {date.fromisoformat(day) for day in (holidays or EXCHANGE_HOLIDAYS)}
+        if holidays_file and os.path.exists(holidays_file):
+            try:
+                with open(holidays_file, 'r', encoding='utf-8') as f:
+                    self.holidays.update(date.fromisoformat(day) for day in json.load(f))
+            except Exception as e:
+                logger.error(f"加载休市日文件失败: {str(e)}")
+        self.holidays_file = holidays_file
+        # 有休市日数据的年份；查询其他年份时节假日会被当作交易日，每个年份提示一次
+        self.covered_years: Set[int] = {day.year for day in self.holidays}
+        self.warned_years: Set[int] = set()
+
+    @staticmethod
+    def now() -> datetime:
+        return datetime.now(BEIJING_TZ)
+
+    def is_trading_day(self, day: Optional[date] = None) -> bool:
+        day = day or self.now().date()
+        if day.year not in self.covered_years and day.year not in self.warned_years:
+            self.warned_years.add(day.year)
+            logger.warning(f"交易日历没有 {day.year} 年的休市日数据，节假日将被当作交易日，"
+                           f"请按交易所公告写入 {self.holidays_file or 'EXCHANGE_HOLIDAYS'}")
+        return day.weekday() < 5 and day not in self.holidays
+
+    def session(self, now: Optional[datetime] = None) -> str:
+        """
+        返回当前所处的交易时段
+        :param now: 北京时间，默认为当前时间
+        """
+        now = now or self.now()
+        if not self.is_trading_day(now.date()):
+            return SESSION_HOLIDAY
+        current = now.time()
+        if current < CALL_AUCTION_START:
+            return SESSION_PRE_OPEN
+        if current < MORNING_OPEN:
+            return SESSION_CALL_AUCTION
+        if current < MORNING_CLOSE:
+            return SESSION_CONTINUOUS
+        if current < AFTERNOON_OPEN:
+            return SESSION_LUNCH_BREAK
+        if current < MARKET_CLOSE:
+            return SESSION_CONTINUOUS
+        return SESSION_CLOSED
+
+    def is_active(self, now: Optional[datetime] = None) -> bool:
+        """行情是否在变化（集合竞价或连续竞价中）"""
+        return self.session(now) in ACTIVE_SESSIONS
+
+    def next_trading_day(self, day: date) -> date:
+        """day 之后（不含当天）的第一个交易日"""
+        day += timedelta(days=1)
+        while not self.is_trading_day(day):
+            day += timedelta(days=1)
+        return day
+
+    def last_close(self, now: Optional[datetime] = None) -> datetime:
+        """
+        最近一次收盘（不晚于now的交易日15:00），此后日K线不会再变化
+        :param now: 北京时间，默认为当前时间
+        """
+        now = now or self.now()
+        day = now.date()
+        if not self.is_trading_day(day) or now.time() < MARKET_CLOSE:
+            day -= timedelta(days=1)
+            while not self.is_trading_day(day):
+                day -= timedelta(days=1)
+        return datetime.combine(day, MARKET_CLOSE, tzinfo=now.tzinfo)
+
+    def next_active(self, now: Optional[datetime] = None) -> datetime:
+        """
+        下一个行情变化时段的开始时间，当前已在该时段内时返回now
+        """
+        now = now or self.now()
+        session = self.session(now)
+        if session in ACTIVE_SESSIONS:
+            return now
+        if session == SESSION_PRE_OPEN:
+            return datetime.combine(now.date(), CALL_AUCTION_START, tzinfo=now.tzinfo)
+        if session == SESSION_LUNCH_BREAK:
+            return datetime.combine(now.date(), AFTERNOON_OPEN, tzinfo=now.tzinfo)
+        return datetime.combine(self.next_trading_day(now.date()), CALL_AUCTION_START, tzinfo=now.tzinfo)
+
+    def seconds_until_active(self, now: Optional[datetime] = None) -> float:
+        """距离下一个行情变化时段的秒数，当前行情在变化时为0"""
+        now = now or self.now()
+        return max(0.0, (self.next_active(now) - now).total_seconds())
+
+    def poll_delay(self, interval: float, now: Optional[datetime] = None) -> float:
+        """
+        轮询任务下一次执行前应等待的秒数：交易时段内按interval轮询，
+        休市时一直等到下一个交易时段开始，不再空转请求行情
+        :param interval: 交易时段内的轮询间隔（秒）
+        """
+        now = now or self.now()
+        if self.is_active(now):
+            return interval
+        return max(interval, self.seconds_until_active(now))